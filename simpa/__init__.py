@@ -23,6 +23,12 @@ from .core.simulation_modules.reconstruction_module.reconstruction_module_signed
     SignedDelayMultiplyAndSumAdapter
 from .core.simulation_modules.reconstruction_module.reconstruction_module_time_reversal_adapter import \
     TimeReversalAdapter
+from .core.simulation_modules.reconstruction_module.reconstruction_module_time_reversal_pytorch_adapter import \
+    PyTorchTimeReversalAdapter
+from .core.simulation_modules.reconstruction_module.reconstruction_module_fk_migration_adapter import \
+    FKMigrationAdapter
+from .core.simulation_modules.reconstruction_module.reconstruction_module_multi_beamformer_adapter import \
+    MultiBeamformerAdapter
 
 from .core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter import \
     reconstruct_delay_and_sum_pytorch
@@ -30,6 +36,10 @@ from .core.simulation_modules.reconstruction_module.reconstruction_module_delay_
     reconstruct_delay_multiply_and_sum_pytorch
 from .core.simulation_modules.reconstruction_module.reconstruction_module_signed_delay_multiply_and_sum_adapter import \
     reconstruct_signed_delay_multiply_and_sum_pytorch
+from .core.simulation_modules.reconstruction_module.reconstruction_module_fk_migration_adapter import \
+    reconstruct_fk_migration_pytorch
+from .core.simulation_modules.reconstruction_module.reconstruction_module_multi_beamformer_adapter import \
+    reconstruct_multiple_beamformers_pytorch
 from .core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_wave_adapter import \
     perform_k_wave_acoustic_forward_simulation
 
@@ -45,6 +55,7 @@ from simpa.core.processing_components.multispectral.linear_unmixing import Linea
 from .core.device_digital_twins import *
 
 from .core.simulation import simulate
+from .core.batch_simulation import simulate_batch
 
 from .io_handling import load_data_field, load_hdf5, save_data_field, save_hdf5
 from .io_handling.zenodo_download import download_from_zenodo
@@ -0,0 +1,237 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from simpa.utils import Tags
+from simpa.utils.settings import Settings
+from simpa.log import Logger
+from simpa.core.simulation import simulate
+from .device_digital_twins.digital_device_twin_base import DigitalDeviceTwinBase
+
+from collections import deque
+from multiprocessing.connection import wait
+import multiprocessing
+import os
+import time
+import traceback
+import torch
+
+
+class BatchJobResult:
+    """
+    The outcome of a single simulation job of a batch.
+    """
+
+    def __init__(self, job_index: int, output_path: str):
+        """
+        :param job_index: the position of the job in the batch
+        :param output_path: the path of the SIMPA output file of the job
+        """
+        self.job_index = job_index
+        self.output_path = output_path
+        self.success = False
+        self.attempts = 0
+        self.error = None
+        self.duration_seconds = 0.0
+        self.stage_times_seconds = dict()
+
+
+class BatchSimulationReport:
+    """
+    Summary of a batch of simulations, which contains the results of all jobs and throughput statistics.
+    """
+
+    def __init__(self, job_results: list, total_time_seconds: float):
+        """
+        :param job_results: a list of BatchJobResult in the order of the jobs
+        :param total_time_seconds: the wall time of the whole batch
+        """
+        self.job_results = job_results
+        self.total_time_seconds = total_time_seconds
+        self.successful_jobs = [result for result in job_results if result.success]
+        self.failed_jobs = [result for result in job_results if not result.success]
+        if total_time_seconds > 0:
+            self.jobs_per_hour = len(self.successful_jobs) * 3600 / total_time_seconds
+        else:
+            self.jobs_per_hour = 0.0
+        # Accumulated time that was spent in every stage of the pipeline by all successful jobs
+        self.stage_times_seconds = dict()
+        for result in self.successful_jobs:
+            for stage, stage_time in result.stage_times_seconds.items():
+                self.stage_times_seconds[stage] = self.stage_times_seconds.get(stage, 0.0) + stage_time
+
+    def __str__(self):
+        lines = [f"{len(self.successful_jobs)} of {len(self.job_results)} jobs succeeded in "
+                 f"{self.total_time_seconds:.1f} seconds ({self.jobs_per_hour:.1f} jobs/hour)."]
+        for stage, stage_time in self.stage_times_seconds.items():
+            lines.append(f"{stage}: {stage_time:.1f} seconds in total, "
+                         f"{stage_time / len(self.successful_jobs):.1f} seconds per job")
+        for result in self.failed_jobs:
+            lines.append(f"Job {result.job_index} failed after {result.attempts} attempts: {result.error}")
+        return "\n".join(lines)
+
+
+def simulate_batch(jobs, number_of_workers: int = None, max_retries: int = 0,
+                   timeout_seconds: float = None) -> BatchSimulationReport:
+    """
+    Runs a batch of simulations on a pool of worker processes, e.g. to generate large training data sets.
+    Every job is run in its own process, such that a failing or crashing job does not affect the other jobs.
+    Failed jobs are retried and jobs that exceed the timeout are terminated. The jobs are consumed lazily, so that
+    the iterable can be a generator of a large number of jobs.
+
+    Every job is written into its own SIMPA output file. If Tags.SIMPA_OUTPUT_NAME is not set, the output name is
+    derived from Tags.VOLUME_NAME and the position of the job in the batch. The settings of the jobs are not
+    modified, the output name is only set in the worker processes. A job that would write into the output file of
+    a previous job or into an existing file, e.g. of an earlier batch, is not run and reported as failed, unless
+    Tags.RESUME_SIMULATION is set.
+
+    :param jobs: an iterable of (settings, simulation_pipeline, digital_device_twin) tuples, i.e. the arguments of
+        simpa.core.simulation.simulate
+    :param number_of_workers: the maximum number of jobs that are run concurrently. Defaults to the number of CPUs.
+    :param max_retries: the number of times a failed job is run again
+    :param timeout_seconds: the maximum wall time of a single attempt of a job
+    :return: a BatchSimulationReport with the results of all jobs
+    """
+    logger = Logger()
+    start_time = time.time()
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+
+    # Forked workers share the logger with the parent process. CUDA cannot be used in forked processes once it has
+    # been initialised, so spawn the workers in that case.
+    if "fork" in multiprocessing.get_all_start_methods() and not torch.cuda.is_initialized():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+
+    job_iterator = enumerate(jobs)
+    retry_queue = deque()
+    running = dict()
+    job_results = []
+    output_paths = set()
+
+    def next_job():
+        if len(retry_queue) > 0:
+            return retry_queue.popleft()
+        for job_index, (settings, simulation_pipeline, digital_device_twin) in job_iterator:
+            output_name = _get_output_name(settings, job_index)
+            output_path = _get_output_path(settings, output_name)
+            job_results.append(BatchJobResult(job_index, output_path))
+            resume = Tags.RESUME_SIMULATION in settings and settings[Tags.RESUME_SIMULATION]
+            if output_path in output_paths:
+                job_results[job_index].error = f"The job would overwrite the output file {output_path} of another job."
+            elif os.path.exists(output_path) and not resume:
+                job_results[job_index].error = f"The job would overwrite the existing output file {output_path}."
+            else:
+                output_paths.add(output_path)
+                return job_index, settings, simulation_pipeline, digital_device_twin, output_name
+            logger.error(f"Job {job_index} failed: {job_results[job_index].error}")
+        return None
+
+    logger.info(f"Running batch of simulations on {number_of_workers} worker processes...")
+    try:
+        while True:
+            while len(running) < number_of_workers:
+                job = next_job()
+                if job is None:
+                    break
+                job_index, settings, simulation_pipeline, digital_device_twin, output_name = job
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_run_job, args=(sender, settings, simulation_pipeline,
+                                                                 digital_device_twin, output_name))
+                process.start()
+                sender.close()
+                job_results[job_index].attempts += 1
+                running[receiver] = (process, job, time.time())
+
+            if len(running) == 0:
+                break
+
+            wait_timeout = None
+            if timeout_seconds is not None:
+                wait_timeout = max(0.0, min(started + timeout_seconds for _, _, started in running.values()) -
+                                   time.time())
+            for receiver in wait(list(running.keys()), timeout=wait_timeout):
+                process, job, started = running.pop(receiver)
+                try:
+                    outcome = receiver.recv()
+                except EOFError:
+                    process.join()
+                    outcome = ("error", f"The worker process terminated with exit code {process.exitcode}.", None)
+                receiver.close()
+                process.join()
+                _finish_attempt(job_results[job[0]], job, outcome, time.time() - started, max_retries, retry_queue)
+
+            if timeout_seconds is not None:
+                for receiver in [receiver for receiver, (_, _, started) in running.items()
+                                 if time.time() - started > timeout_seconds]:
+                    process, job, started = running.pop(receiver)
+                    _terminate(process)
+                    receiver.close()
+                    outcome = ("error", f"The job exceeded the timeout of {timeout_seconds} seconds.", None)
+                    _finish_attempt(job_results[job[0]], job, outcome, time.time() - started, max_retries,
+                                    retry_queue)
+    finally:
+        for receiver, (process, _, _) in running.items():
+            _terminate(process)
+            receiver.close()
+
+    report = BatchSimulationReport(job_results, time.time() - start_time)
+    logger.info(f"Running batch of simulations on {number_of_workers} worker processes...[Done]\n{report}")
+    return report
+
+
+def _get_output_name(settings: Settings, job_index: int) -> str:
+    """
+    :return: the output name of the settings or, if none is set, a unique output name that is derived from the volume
+        name and the position of the job
+    """
+    if Tags.SIMPA_OUTPUT_NAME in settings:
+        return settings[Tags.SIMPA_OUTPUT_NAME]
+    return f"{settings[Tags.VOLUME_NAME]}_{job_index:06d}"
+
+
+def _get_output_path(settings: Settings, output_name: str) -> str:
+    return os.path.abspath(os.path.join(settings[Tags.SIMULATION_PATH], output_name + ".hdf5"))
+
+
+def _finish_attempt(result: BatchJobResult, job: tuple, outcome: tuple, duration_seconds: float, max_retries: int,
+                    retry_queue: deque):
+    logger = Logger()
+    status, error, stage_times_seconds = outcome
+    result.duration_seconds += duration_seconds
+    if status == "success":
+        result.success = True
+        result.error = None
+        result.stage_times_seconds = stage_times_seconds
+        logger.info(f"Job {result.job_index} finished in {duration_seconds:.1f} seconds.")
+    elif result.attempts <= max_retries:
+        logger.warning(f"Job {result.job_index} failed and is retried: {error}")
+        retry_queue.append(job)
+    else:
+        result.error = error
+        logger.error(f"Job {result.job_index} failed: {error}")
+
+
+def _terminate(process):
+    process.terminate()
+    process.join(5)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+def _run_job(sender, settings: Settings, simulation_pipeline: list, digital_device_twin: DigitalDeviceTwinBase,
+             output_name: str):
+    """
+    Runs a single job in a worker process and sends the outcome to the parent process. The output name is set in
+    the copy of the settings of the worker process, which is shared with the pipeline elements.
+    """
+    try:
+        settings[Tags.SIMPA_OUTPUT_NAME] = output_name
+        instrumentation = simulate(simulation_pipeline, settings, digital_device_twin)
+        sender.send(("success", None, instrumentation.get_stage_times()))
+    except BaseException:
+        sender.send(("error", traceback.format_exc(), None))
+    finally:
+        sender.close()
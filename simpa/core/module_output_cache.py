@@ -0,0 +1,168 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import glob
+import json
+import os
+import uuid
+
+from simpa.io_handling.io_hdf5 import save_hdf5, write_hdf5_items, load_hdf5
+from simpa.utils.hashing import compute_hash
+from simpa.log import Logger
+
+# Default upper bound of the total size of all cache entries
+DEFAULT_MODULE_OUTPUT_CACHE_SIZE_BYTES = 10 * 1024 ** 3
+
+
+class ModuleOutputCache:
+    """
+    Content-addressed cache of the outputs of pipeline elements that is shared across simulation runs, e.g. the runs
+    of a parameter sweep that only varies the reconstruction settings.
+
+    An entry is keyed by the configuration hash of a pipeline element (see
+    simpa.core.pipeline_checkpoints.PipelineCheckpoints) and the content hashes of all items the pipeline element
+    read from the SIMPA output file. As the items that are read are only known once a pipeline element has been run,
+    a manifest is kept for every configuration hash that lists the sets of items that were read by its entries.
+
+    Every entry is a separate hdf5 file in the cache directory that holds the outputs of the pipeline element and the
+    changes it made to the settings. Entries are written atomically, so that several simulations can share the cache
+    directory. Once the total size of the entries exceeds the maximum size, the least recently used entries are
+    deleted.
+    """
+
+    def __init__(self, directory: str, max_size_bytes: int = DEFAULT_MODULE_OUTPUT_CACHE_SIZE_BYTES):
+        """
+        :param directory: the cache directory. It is created if it does not exist.
+        :param max_size_bytes: the maximum total size of all cache entries
+        """
+        self.logger = Logger()
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_manifest_path(self, configuration_hash: str) -> str:
+        return os.path.join(self.directory, configuration_hash + ".json")
+
+    def _get_entry_path(self, entry_key: str) -> str:
+        return os.path.join(self.directory, entry_key + ".hdf5")
+
+    def _load_manifest(self, configuration_hash: str) -> list:
+        try:
+            with open(self._get_manifest_path(configuration_hash), "r") as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return []
+
+    def _save_manifest(self, configuration_hash: str, manifest: list):
+        temporary_path = self._get_manifest_path(configuration_hash) + "." + uuid.uuid4().hex
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temporary_path, self._get_manifest_path(configuration_hash))
+
+    def lookup(self, configuration_hash: str, get_data_hash):
+        """
+        Looks up the outputs of a pipeline element.
+
+        :param configuration_hash: the configuration hash of the pipeline element
+        :param get_data_hash: function that returns the current content hash of an item of the SIMPA output file or
+            None, if the item does not exist.
+        :return: None, if there is no matching entry. Otherwise, a dictionary with the content hashes of the items
+            the pipeline element read ("reads"), a dictionary that maps the paths of its outputs to the outputs
+            ("outputs") and the changes it made to the settings ("settings_changes") or None.
+        """
+        # Try the most recently added sets of inputs first
+        for read_paths in reversed(self._load_manifest(configuration_hash)):
+            reads = dict()
+            for path in read_paths:
+                reads[path] = get_data_hash(path)
+                if reads[path] is None:
+                    break
+            else:
+                entry = self._load_entry(compute_hash(configuration_hash, reads))
+                if entry is not None:
+                    entry["reads"] = reads
+                    return entry
+        return None
+
+    def _load_entry(self, entry_key: str):
+        entry_path = self._get_entry_path(entry_key)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            entry = load_hdf5(entry_path)
+        except (OSError, KeyError):
+            # The entry has been evicted by another simulation in the meantime
+            return None
+        # Mark the entry as recently used
+        os.utime(entry_path)
+        outputs = dict()
+        for path in json.loads(entry["output_paths"]):
+            output = entry["outputs"]
+            for key in path.strip("/").split("/"):
+                output = output[key]
+            outputs[path] = output
+        return {
+            "outputs": outputs,
+            "settings_changes": entry.get("settings_changes", None)
+        }
+
+    def store(self, configuration_hash: str, reads: dict, outputs: dict, settings_changes: dict = None):
+        """
+        Stores the outputs of a pipeline element.
+
+        :param configuration_hash: the configuration hash of the pipeline element
+        :param reads: dictionary that maps the paths of the items the pipeline element read to their content hashes
+        :param outputs: dictionary that maps the paths of the outputs of the pipeline element to the outputs
+        :param settings_changes: the changes the pipeline element made to the settings or None
+        """
+        entry_key = compute_hash(configuration_hash, reads)
+        entry_path = self._get_entry_path(entry_key)
+        temporary_path = entry_path + "." + uuid.uuid4().hex
+        entry = {"output_paths": json.dumps(sorted(outputs.keys()))}
+        if settings_changes is not None:
+            entry["settings_changes"] = settings_changes
+        try:
+            save_hdf5(entry, temporary_path, file_compression="gzip")
+            write_hdf5_items({"/outputs" + path: output for path, output in outputs.items()}, temporary_path)
+            os.replace(temporary_path, entry_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+        read_paths = sorted(reads.keys())
+        manifest = self._load_manifest(configuration_hash)
+        if read_paths in manifest:
+            manifest.remove(read_paths)
+        manifest.append(read_paths)
+        self._save_manifest(configuration_hash, manifest)
+        self._evict()
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries until the total size of the entries is below the maximum size.
+        """
+        entries = []
+        for entry_path in glob.glob(os.path.join(self.directory, "*.hdf5")):
+            try:
+                entries.append((os.path.getmtime(entry_path), os.path.getsize(entry_path), entry_path))
+            except OSError:
+                continue
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            self.logger.debug(f"Evicting {entry_path} from the module output cache.")
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """
+        Deletes all entries and manifests of the cache.
+        """
+        for path in glob.glob(os.path.join(self.directory, "*.hdf5")) + \
+                glob.glob(os.path.join(self.directory, "*.json")):
+            os.remove(path)
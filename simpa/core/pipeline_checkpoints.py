@@ -0,0 +1,404 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from contextlib import contextmanager
+import json
+
+from simpa.io_handling.simpa_output_file import SimpaOutputFile
+from simpa.core.module_output_cache import ModuleOutputCache
+from simpa.core.pipeline_instrumentation import INSTRUMENTATION_GROUP
+from simpa.utils import Tags
+from simpa.utils.hashing import compute_hash, UnhashableItemError
+from simpa.utils.settings import Settings
+from simpa.log import Logger
+from simpa.core.device_digital_twins import DigitalDeviceTwinBase
+
+CHECKPOINTS_GROUP = "simpa_checkpoints"
+
+# Settings that only control how the pipeline is executed, or that are written by simulate() and the pipeline
+# elements themselves. They are not part of the fingerprints.
+EXECUTION_SETTINGS = [Tags.WAVELENGTH, Tags.VOLUME_NAME, Tags.SIMPA_OUTPUT_PATH, Tags.SIMPA_OUTPUT_NAME,
+                      Tags.SIMULATION_PATH, Tags.K_WAVE_SPECIFIC_DT, Tags.K_WAVE_SPECIFIC_NT, Tags.DO_FILE_COMPRESSION,
+                      Tags.DO_IPASC_EXPORT, Tags.PARALLEL_WAVELENGTH_EXECUTION, Tags.NUMBER_OF_PARALLEL_WORKERS,
+                      Tags.IN_MEMORY_DATA_STORE, Tags.HDF5_CHUNK_CACHE_SIZE_BYTES, Tags.RESUME_SIMULATION,
+                      Tags.MODULE_OUTPUT_CACHE_PATH, Tags.MODULE_OUTPUT_CACHE_SIZE_BYTES]
+
+# Items that are not tracked as inputs or outputs of the pipeline elements
+UNTRACKED_PATHS = ["/" + Tags.SETTINGS, "/" + CHECKPOINTS_GROUP, "/" + INSTRUMENTATION_GROUP]
+
+
+class OutdatedCheckpointsError(Exception):
+    """
+    Raised if a pipeline element has to be run again, but the output file already contains results that were
+    computed from a later state of the pipeline, such that the simulation cannot be resumed.
+    """
+    pass
+
+
+def _normalise_path(file_dictionary_path: str) -> str:
+    return "/" + file_dictionary_path.strip("/")
+
+
+def _is_tracked(path: str) -> bool:
+    return not any(path == untracked_path or path.startswith(untracked_path + "/")
+                   for untracked_path in UNTRACKED_PATHS)
+
+
+class _AccessRecorder:
+    """
+    Records the items that a pipeline element reads from and writes to the SIMPA output file, together with the
+    content hashes of the items.
+    """
+
+    def __init__(self, checkpoints):
+        self.checkpoints = checkpoints
+        self.reads = dict()
+        self.writes = dict()
+        self.partial_writes = set()
+        # The error that occurred when an item could not be hashed, the accesses are no longer recorded then
+        self.hashing_error = None
+
+    def on_read(self, file_dictionary_path: str, item):
+        path = _normalise_path(file_dictionary_path)
+        if self.hashing_error is not None or not _is_tracked(path) or path in self.reads:
+            return
+        if path in self.writes:
+            # The item was produced by the pipeline element itself
+            return
+        try:
+            self.reads[path] = self.checkpoints.get_data_hash(path, item)
+        except UnhashableItemError as e:
+            self.hashing_error = e
+
+    def on_write(self, file_dictionary_path: str, item):
+        path = _normalise_path(file_dictionary_path)
+        if self.hashing_error is not None or not _is_tracked(path):
+            return
+        if item is None:
+            self.partial_writes.add(path)
+        elif type(item) is dict:
+            for key, value in item.items():
+                self.on_write(path + "/" + str(key), value)
+        else:
+            try:
+                self.writes[path] = compute_hash(item)
+            except UnhashableItemError as e:
+                self.hashing_error = e
+            self.partial_writes.discard(path)
+
+
+class PipelineCheckpoints:
+    """
+    Records a fingerprint for every pipeline element and wavelength in the SIMPA output file and uses them to
+    resume an interrupted simulation.
+
+    The fingerprint of a pipeline element consists of the hash of its configuration (the settings that are not
+    component settings, its own component settings, the digital device twin and the wavelength) and of the content
+    hashes of all items it read from the output file. The content hashes of the items it wrote are recorded as well.
+    When a simulation is resumed, the recorded pipeline elements are replayed in the order of execution: an element
+    is skipped if its configuration is unchanged, if the items it read have the same content as back then and if
+    its outputs are still present. The changes it made to the settings are restored in that case.
+
+    If a ModuleOutputCache is given, pipeline elements that cannot be skipped are looked up in the cache before they
+    are run, and the outputs of all pipeline elements that are run are stored in the cache.
+
+    Pipeline elements that draw random numbers from the global numpy random state change the random numbers of the
+    subsequent pipeline elements. Skipping them therefore only yields the same results, if the subsequent pipeline
+    elements do not draw random numbers or reseed the random state themselves.
+
+    If the configuration or the data of a pipeline element cannot be hashed, a warning is logged and the checkpoints
+    and the cache are disabled for the rest of the simulation, such that all subsequent pipeline elements are run.
+    """
+
+    def __init__(self, output_file: SimpaOutputFile, settings: Settings, digital_device_twin: DigitalDeviceTwinBase,
+                 resume: bool = True, record_checkpoints: bool = True, cache: ModuleOutputCache = None):
+        """
+        :param output_file: the open session of the SIMPA output file
+        :param settings: the global settings of the simulation
+        :param digital_device_twin: the digital device twin of the simulation
+        :param resume: if True, the checkpoints that are present in the output file are used to skip pipeline
+            elements. Otherwise, existing checkpoints are discarded.
+        :param record_checkpoints: if False, no checkpoints are read from or written to the output file and pipeline
+            elements can only be skipped by means of the cache.
+        :param cache: optional cache of the outputs of pipeline elements that is shared across simulation runs
+        """
+        self.logger = Logger()
+        self.output_file = output_file
+        self.settings = settings
+        self.enabled = True
+        # Content hashes of the items according to the pipeline elements that have been run or skipped so far
+        self.data_hashes = dict()
+        # Content hashes of the items that are actually in the output file
+        self.file_hashes = dict()
+        # Items whose content hash in data_hashes was taken from the checkpoint of a skipped pipeline element
+        self.skipped_paths = set()
+        self.records = dict()
+        self.component_settings_hashes = dict()
+        self.record_checkpoints = record_checkpoints
+        self.cache = cache
+        execution_settings = [key[0] for key in EXECUTION_SETTINGS]
+        try:
+            self.settings_hash = compute_hash({key: value for key, value in settings.items()
+                                               if key not in execution_settings and not isinstance(value, dict)},
+                                              digital_device_twin)
+        except UnhashableItemError as e:
+            self.disable(e)
+            return
+        if not record_checkpoints:
+            pass
+        elif resume:
+            self._load_records()
+        else:
+            self.reset()
+
+    def disable(self, error: Exception):
+        """
+        Disables the checkpoints and the cache for the rest of the simulation, because an item could not be hashed.
+        The checkpoints that are present in the output file are discarded.
+
+        :param error: the error that occurred while hashing
+        """
+        self.logger.warning(f"Checkpoints and the module output cache are disabled for this simulation: {error}")
+        self.enabled = False
+        if self.record_checkpoints:
+            self.reset()
+
+    def _load_records(self):
+        if not self.output_file.contains("/" + CHECKPOINTS_GROUP):
+            return
+        stored_records = self.output_file.load("/" + CHECKPOINTS_GROUP + "/")
+        wavelength_keys = [str(wavelength) for wavelength in self.settings[Tags.WAVELENGTHS]]
+        for wavelength_key in wavelength_keys:
+            if wavelength_key not in stored_records:
+                continue
+            for record_key, record in stored_records[wavelength_key].items():
+                if "writes" not in record:
+                    continue
+                index = int(record_key.split("_")[0])
+                self.records[(wavelength_key, index)] = {
+                    "name": record_key,
+                    "configuration": record["configuration"],
+                    "reads": json.loads(record["reads"]),
+                    "writes": json.loads(record["writes"]),
+                    "settings_changes": record.get("settings_changes", None)
+                }
+        # Replay the pipeline in the order of execution to obtain the current content of the output file
+        for key in sorted(self.records.keys(), key=lambda k: (wavelength_keys.index(k[0]), k[1])):
+            self.file_hashes.update(self.records[key]["writes"])
+        self.logger.info(f"Found {len(self.records)} checkpoints in {self.output_file.file_path}.")
+
+    def reset(self):
+        """
+        Discards all checkpoints.
+        """
+        self.records = dict()
+        self.data_hashes = dict()
+        self.file_hashes = dict()
+        self.skipped_paths = set()
+        self.output_file.delete("/" + CHECKPOINTS_GROUP + "/")
+
+    def get_data_hash(self, path: str, item=None) -> str:
+        """
+        Returns the content hash of an item of the output file.
+
+        :param path: the normalised path of the item
+        :param item: the item, if it has already been loaded
+        :return: the content hash
+        """
+        if path in self.data_hashes:
+            return self.data_hashes[path]
+        child_paths = sorted(data_path for data_path in self.data_hashes if data_path.startswith(path + "/"))
+        if len(child_paths) > 0:
+            return compute_hash({child_path: self.data_hashes[child_path] for child_path in child_paths})
+        if item is None:
+            access_log = self.output_file.access_log
+            self.output_file.access_log = None
+            try:
+                item = self.output_file.load(path)
+            finally:
+                self.output_file.access_log = access_log
+        return compute_hash(item)
+
+    def _get_configuration_hash(self, pipeline_element, wavelength) -> str:
+        # Pipeline elements may extend their component settings while they are run, e.g. by the deformation of the
+        # layers. The component settings are therefore hashed as they are before the first run.
+        if id(pipeline_element) not in self.component_settings_hashes:
+            component_settings = {key: value for key, value in pipeline_element.__dict__.items()
+                                  if isinstance(value, dict) and value is not self.settings}
+            self.component_settings_hashes[id(pipeline_element)] = compute_hash(component_settings)
+        return compute_hash(self.settings_hash, type(pipeline_element).__module__,
+                            type(pipeline_element).__qualname__,
+                            self.component_settings_hashes[id(pipeline_element)], wavelength)
+
+    @staticmethod
+    def _get_record_name(pipeline_element, index: int) -> str:
+        return f"{index}_{type(pipeline_element).__name__}"
+
+    def _get_current_data_hash(self, path: str):
+        if path not in self.data_hashes and not self.output_file.contains(path):
+            return None
+        return self.get_data_hash(path)
+
+    def try_skip(self, pipeline_element, index: int, wavelength) -> bool:
+        """
+        Checks whether the pipeline element can be skipped, because its outputs for the given wavelength are
+        present and up to date or can be restored from the cache. If so, the changes the pipeline element made to
+        the settings are restored.
+
+        :param pipeline_element: the pipeline element
+        :param index: the position of the pipeline element in the simulation pipeline
+        :param wavelength: the current wavelength
+        :return: True, if the pipeline element can be skipped
+        """
+        if not self.enabled:
+            return False
+        try:
+            if self._try_skip_with_checkpoint(pipeline_element, index, wavelength):
+                self.logger.info(f"Skipping {type(pipeline_element).__name__} for wavelength {wavelength}nm, "
+                                 f"its outputs are up to date.")
+                return True
+            if self.cache is not None and self._try_restore_from_cache(pipeline_element, index, wavelength):
+                self.logger.info(f"Restored the outputs of {type(pipeline_element).__name__} for wavelength "
+                                 f"{wavelength}nm from the module output cache.")
+                return True
+        except UnhashableItemError as e:
+            self.disable(e)
+        return False
+
+    def _try_restore_from_cache(self, pipeline_element, index: int, wavelength) -> bool:
+        entry = self.cache.lookup(self._get_configuration_hash(pipeline_element, wavelength),
+                                  self._get_current_data_hash)
+        if entry is None:
+            return False
+        with self._record(pipeline_element, index, wavelength, store_in_cache=False) as recorder:
+            for path, output in entry["outputs"].items():
+                self.output_file.save(output, path + "/")
+            if entry["settings_changes"] is not None:
+                _apply_settings_changes(self.settings, entry["settings_changes"])
+            recorder.reads.update(entry["reads"])
+        return True
+
+    def _try_skip_with_checkpoint(self, pipeline_element, index: int, wavelength) -> bool:
+        record = self.records.get((str(wavelength), index))
+        if (record is None or record["name"] != self._get_record_name(pipeline_element, index) or
+                record["configuration"] != self._get_configuration_hash(pipeline_element, wavelength)):
+            return False
+        for path, data_hash in record["reads"].items():
+            if self.get_data_hash(path) != data_hash:
+                return False
+        for path in record["writes"]:
+            if not self.output_file.contains(path):
+                return False
+
+        self.data_hashes.update(record["writes"])
+        self.skipped_paths.update(record["writes"].keys())
+        if record["settings_changes"] is not None:
+            _apply_settings_changes(self.settings, record["settings_changes"])
+        return True
+
+    def record(self, pipeline_element, index: int, wavelength):
+        """
+        Records the checkpoint of the pipeline element while it is run within the with-block and stores its outputs
+        in the cache.
+
+        :param pipeline_element: the pipeline element
+        :param index: the position of the pipeline element in the simulation pipeline
+        :param wavelength: the current wavelength
+        :raises OutdatedCheckpointsError: if the output file contains results of a later state of the pipeline
+        """
+        return self._record(pipeline_element, index, wavelength, store_in_cache=True)
+
+    @contextmanager
+    def _record(self, pipeline_element, index: int, wavelength, store_in_cache: bool):
+        if self.enabled:
+            try:
+                configuration_hash = self._get_configuration_hash(pipeline_element, wavelength)
+            except UnhashableItemError as e:
+                self.disable(e)
+        if not self.enabled:
+            yield None
+            return
+
+        for path in self.skipped_paths:
+            if self.file_hashes.get(path) != self.data_hashes[path]:
+                raise OutdatedCheckpointsError(f"The output file contains a later version of {path} than the one "
+                                               f"that {type(pipeline_element).__name__} needs for wavelength "
+                                               f"{wavelength}.")
+
+        settings_snapshot = _take_settings_snapshot(self.settings)
+        recorder = _AccessRecorder(self)
+        self.output_file.access_log = recorder
+        try:
+            yield recorder
+        finally:
+            self.output_file.access_log = None
+
+        try:
+            if recorder.hashing_error is not None:
+                raise recorder.hashing_error
+            for path in recorder.partial_writes:
+                recorder.writes[path] = compute_hash(self.output_file.load(path))
+        except UnhashableItemError as e:
+            self.disable(e)
+            return
+        self.data_hashes.update(recorder.writes)
+        self.file_hashes.update(recorder.writes)
+        self.skipped_paths.difference_update(recorder.writes.keys())
+
+        settings_changes = _get_settings_changes(settings_snapshot, self.settings)
+        if self.cache is not None and store_in_cache:
+            self.cache.store(configuration_hash, recorder.reads,
+                             {path: self.output_file.load(path) for path in recorder.writes}, settings_changes)
+        if not self.record_checkpoints:
+            return
+
+        record_path = "/" + CHECKPOINTS_GROUP + "/" + str(wavelength) + "/" + \
+                      self._get_record_name(pipeline_element, index) + "/"
+        if settings_changes is not None:
+            self.output_file.save(settings_changes, record_path + "settings_changes/")
+        # The record is complete once the writes are stored. With an in-memory data store, this happens together
+        # with the outputs of the pipeline element.
+        self.output_file.save({
+            "configuration": configuration_hash,
+            "reads": json.dumps(recorder.reads),
+            "writes": json.dumps(recorder.writes)
+        }, record_path)
+
+
+def _take_settings_snapshot(settings: Settings) -> dict:
+    return {key: (value, dict(value) if isinstance(value, dict) else None) for key, value in settings.items()}
+
+
+def _get_settings_changes(snapshot: dict, settings: Settings):
+    """
+    Determines the settings, and the entries of the component settings, that have been added or replaced since the
+    snapshot was taken.
+
+    :return: a dictionary with the changes or None, if there are none
+    """
+    changes = dict()
+    nested_changes = dict()
+    for key, value in settings.items():
+        if key == Tags.WAVELENGTH[0]:
+            continue
+        if key not in snapshot or snapshot[key][0] is not value:
+            changes[key] = value
+        elif isinstance(value, dict):
+            component_changes = {component_key: component_value
+                                 for component_key, component_value in value.items()
+                                 if component_key not in snapshot[key][1] or
+                                 snapshot[key][1][component_key] is not component_value}
+            if len(component_changes) > 0:
+                nested_changes[key] = component_changes
+    if len(changes) == 0 and len(nested_changes) == 0:
+        return None
+    return {"settings": changes, "component_settings": nested_changes}
+
+
+def _apply_settings_changes(settings: Settings, settings_changes: dict):
+    if "settings" in settings_changes:
+        dict.update(settings, settings_changes["settings"])
+    if "component_settings" in settings_changes:
+        for key, component_changes in settings_changes["component_settings"].items():
+            dict.update(settings[key], component_changes)
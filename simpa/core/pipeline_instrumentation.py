@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from contextlib import contextmanager
+import subprocess
+import sys
+import time
+
+import torch
+
+from simpa.io_handling.simpa_output_file import SimpaOutputFile
+from simpa.log import Logger
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows
+    resource = None
+
+INSTRUMENTATION_GROUP = "simpa_instrumentation"
+
+# Accumulated wall time of the external programs that have been run with run_subprocess
+_subprocess_wall_time_seconds = 0.0
+
+
+def run_subprocess(cmd: list, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Runs an external program, such as MCX or MATLAB, and accounts its wall time to the pipeline element that is
+    currently being measured.
+
+    :param cmd: the command and its arguments, see subprocess.run
+    :param kwargs: further arguments of subprocess.run
+    :return: the completed process
+    """
+    global _subprocess_wall_time_seconds
+    start_time = time.perf_counter()
+    try:
+        return subprocess.run(cmd, **kwargs)
+    finally:
+        _subprocess_wall_time_seconds += time.perf_counter() - start_time
+
+
+def _get_subprocess_cpu_time() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak resident set size of the process, which is only possible on Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _get_peak_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    # The peak since the start of the process. ru_maxrss is given in bytes on macOS and in kilobytes otherwise.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class PipelineInstrumentation:
+    """
+    Collects the resource usage of every pipeline element for every wavelength. A record is a dictionary with
+    the following entries:
+
+    - module: the class name of the pipeline element
+    - index: the position of the pipeline element in the simulation pipeline
+    - wavelength: the wavelength
+    - skipped: whether the outputs were restored from a checkpoint or the module output cache
+    - failed: whether the pipeline element raised an exception. The record then covers the time until the exception.
+    - wall_time_seconds and cpu_time_seconds: the wall time and the CPU time of the simulation process
+    - subprocess_wall_time_seconds and subprocess_cpu_time_seconds: the time of external programs, e.g. MCX or
+      MATLAB, that were run with run_subprocess
+    - peak_rss_bytes: the peak resident set size of the simulation process. It is only measured per pipeline
+      element on Linux and is the peak since the start of the process otherwise.
+    - torch_peak_allocated_bytes: the peak memory allocated by the CUDA caching allocator of torch
+    - logical_bytes_read and logical_bytes_written: the uncompressed number of bytes of the arrays that were read
+      from and written to the SIMPA output file, including the arrays that were served by or held in an in-memory
+      data store. They measure the data that the pipeline element exchanged with the file, not the disk access.
+
+    The records are stored in the SIMPA output file in the group INSTRUMENTATION_GROUP and returned by
+    simpa.core.simulation.simulate.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def measure(self, pipeline_element, index: int, wavelength, output_file: SimpaOutputFile = None):
+        """
+        Measures the resource usage of the pipeline element within the with-block. The record is yielded, such that
+        it can be amended within the block. If the block raises an exception, the record is kept and marked as
+        failed.
+
+        :param pipeline_element: the pipeline element
+        :param index: the position of the pipeline element in the simulation pipeline
+        :param wavelength: the current wavelength
+        :param output_file: the open session of the SIMPA output file. If given, the logical number of bytes that
+            were read and written is measured and the record is stored in the file.
+        """
+        record = {
+            "module": type(pipeline_element).__name__,
+            "index": index,
+            "wavelength": wavelength,
+            "skipped": False
+        }
+        use_cuda = torch.cuda.is_available() and torch.cuda.is_initialized()
+        if use_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        _reset_peak_rss()
+        start_logical_bytes_read = output_file.logical_bytes_read if output_file is not None else 0
+        start_logical_bytes_written = output_file.logical_bytes_written if output_file is not None else 0
+        start_subprocess_wall_time = _subprocess_wall_time_seconds
+        start_subprocess_cpu_time = _get_subprocess_cpu_time()
+        start_cpu_time = time.process_time()
+        start_wall_time = time.perf_counter()
+
+        failed = True
+        try:
+            yield record
+            failed = False
+        finally:
+            record["failed"] = failed
+            self._finish_record(record, index, wavelength, output_file, start_wall_time, start_cpu_time,
+                                start_subprocess_wall_time, start_subprocess_cpu_time, start_logical_bytes_read,
+                                start_logical_bytes_written)
+
+    def _finish_record(self, record: dict, index: int, wavelength, output_file: SimpaOutputFile,
+                       start_wall_time: float, start_cpu_time: float, start_subprocess_wall_time: float,
+                       start_subprocess_cpu_time: float, start_logical_bytes_read: int,
+                       start_logical_bytes_written: int):
+        record["wall_time_seconds"] = time.perf_counter() - start_wall_time
+        record["cpu_time_seconds"] = time.process_time() - start_cpu_time
+        record["subprocess_wall_time_seconds"] = _subprocess_wall_time_seconds - start_subprocess_wall_time
+        record["subprocess_cpu_time_seconds"] = _get_subprocess_cpu_time() - start_subprocess_cpu_time
+        record["peak_rss_bytes"] = _get_peak_rss_bytes()
+        # torch.cuda.is_initialized() might have changed within the block
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            record["torch_peak_allocated_bytes"] = torch.cuda.max_memory_allocated()
+        else:
+            record["torch_peak_allocated_bytes"] = 0
+        if output_file is not None:
+            record["logical_bytes_read"] = output_file.logical_bytes_read - start_logical_bytes_read
+            record["logical_bytes_written"] = output_file.logical_bytes_written - start_logical_bytes_written
+            try:
+                output_file.save(record, "/" + INSTRUMENTATION_GROUP + "/" + str(wavelength) + "/" +
+                                 f"{index}_{record['module']}" + "/")
+            except Exception as e:
+                if not record["failed"]:
+                    raise
+                # Do not hide the exception of the pipeline element
+                Logger().warning(f"Could not store the instrumentation record of {record['module']}: {e}")
+        else:
+            record["logical_bytes_read"] = 0
+            record["logical_bytes_written"] = 0
+        self.records.append(record)
+
+    def get_stage_times(self) -> dict:
+        """
+        :return: a dictionary that maps the class names of the pipeline elements to their accumulated wall time
+        """
+        stage_times_seconds = dict()
+        for record in self.records:
+            stage_times_seconds[record["module"]] = \
+                stage_times_seconds.get(record["module"], 0.0) + record["wall_time_seconds"]
+        return stage_times_seconds
+
+    def __str__(self):
+        lines = []
+        for record in self.records:
+            lines.append(f"{record['module']} ({record['wavelength']}nm): {record['wall_time_seconds']:.2f} s wall "
+                         f"time, {record['cpu_time_seconds']:.2f} s CPU time, "
+                         f"{record['subprocess_wall_time_seconds']:.2f} s in external programs, "
+                         f"{record['peak_rss_bytes'] / 1024 ** 2:.1f} MiB peak RSS"
+                         + (" (skipped)" if record["skipped"] else "")
+                         + (" (failed)" if record["failed"] else ""))
+        return "\n".join(lines)
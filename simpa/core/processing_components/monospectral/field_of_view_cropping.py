@@ -4,7 +4,8 @@
 
 from simpa.utils import Tags, Settings
 from simpa.utils.tissue_properties import TissueProperties
-from simpa.io_handling import load_data_field, save_data_field
+from simpa.io_handling import load_data_field, save_data_field, load_hdf5, LazyHDF5Dataset
+from simpa.utils.dict_path_manager import generate_dict_path
 from simpa.core.processing_components import ProcessingComponent
 from simpa.core.device_digital_twins import DigitalDeviceTwinBase, PhotoacousticDevice
 import numpy as np
@@ -65,12 +66,14 @@ class FieldOfViewCropping(ProcessingComponent):
                     and wavelength != self.global_settings[Tags.WAVELENGTHS][-1]):
                 continue
             self.logger.debug(f"Cropping data field {data_field}...")
-            data_array = load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH], data_field, wavelength)
+            # Only read the shape first, such that just the field of view has to be read from the file
+            data_array = load_hdf5(self.global_settings[Tags.SIMPA_OUTPUT_PATH],
+                                   generate_dict_path(data_field, wavelength), lazy=True)
             self.logger.debug(f"data array shape before cropping: {np.shape(data_array)}")
             self.logger.debug(f"data array shape len: {len(np.shape(data_array))}")
 
             # input validation
-            if not isinstance(data_array, np.ndarray):
+            if not isinstance(data_array, (np.ndarray, LazyHDF5Dataset)):
                 self.logger.warning(f"The data field {data_field} was not of type np.ndarray. Skipping...")
                 continue
             data_field_shape = np.shape(data_array)
@@ -81,10 +84,9 @@ class FieldOfViewCropping(ProcessingComponent):
                     self.logger.warning(f"The data field {data_field} is already cropped. Skipping...")
                     continue
 
-                # crop
-                data_array = np.squeeze(data_array[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
-                                        field_of_view_voxels[2]:field_of_view_voxels[3] + y_offset_correct,
-                                        field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct])
+                field_of_view_slice = np.s_[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
+                                            field_of_view_voxels[2]:field_of_view_voxels[3] + y_offset_correct,
+                                            field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct]
 
             elif len(data_field_shape) == 2:
                 # Assumption that the data field is already in 2D shape in the y-plane
@@ -93,9 +95,14 @@ class FieldOfViewCropping(ProcessingComponent):
                     self.logger.warning(f"The data field {data_field} is already cropped. Skipping...")
                     continue
 
-                # crop
-                data_array = np.squeeze(data_array[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
-                                        field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct])
+                field_of_view_slice = np.s_[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
+                                            field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct]
+            else:
+                continue
+
+            # crop
+            data_array = np.squeeze(load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH], data_field,
+                                                    wavelength, index=field_of_view_slice))
 
             self.logger.debug(f"data array shape after cropping: {np.shape(data_array)}")
             # save
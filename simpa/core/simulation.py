@@ -3,16 +3,28 @@
 # SPDX-License-Identifier: MIT
 
 from simpa.utils import Tags
-from simpa.io_handling.io_hdf5 import save_hdf5, load_hdf5
+from simpa.io_handling.io_hdf5 import save_hdf5, merge_hdf5_files, delete_hdf5_item, get_unused_bytes, repack_hdf5
+from simpa.io_handling.simpa_output_file import SimpaOutputFile
+from simpa.core.pipeline_checkpoints import PipelineCheckpoints, OutdatedCheckpointsError
+from simpa.core.module_output_cache import ModuleOutputCache, DEFAULT_MODULE_OUTPUT_CACHE_SIZE_BYTES
+from simpa.core.pipeline_instrumentation import PipelineInstrumentation
 from simpa.io_handling.ipasc import export_to_ipasc
+from simpa.io_handling.in_memory_data_store import in_memory_data_store, get_in_memory_data_store
 from simpa.utils.settings import Settings
 from simpa.log import Logger
 from .device_digital_twins.digital_device_twin_base import DigitalDeviceTwinBase
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+import multiprocessing
 import numpy as np
 import os
 import time
+import torch
+
+# Fraction of the output file size that has to be occupied by overwritten data for the file to be repacked
+REPACK_THRESHOLD = 0.1
 
 
 def simulate(simulation_pipeline: list, settings: Settings, digital_device_twin: DigitalDeviceTwinBase):
@@ -26,7 +38,8 @@ def simulate(simulation_pipeline: list, settings: Settings, digital_device_twin:
         class.
     :raises TypeError: if one of the given parameters is not of the correct type
     :raises AssertionError: if the digital device twin is not able to simulate the settings specification
-    :return: list with the save paths of the simulated data within the HDF5 file.
+    :return: a PipelineInstrumentation with the resource usage of every pipeline element for every wavelength,
+        which is stored in the HDF5 file as well.
     """
     start_time = time.time()
     logger = Logger()
@@ -60,38 +73,32 @@ def simulate(simulation_pipeline: list, settings: Settings, digital_device_twin:
     simpa_output[Tags.DIGITAL_DEVICE] = digital_device_twin
     simpa_output[Tags.SIMULATION_PIPELINE] = [type(x).__name__ for x in simulation_pipeline]
 
+    run_in_parallel = Tags.PARALLEL_WAVELENGTH_EXECUTION in settings and settings[Tags.PARALLEL_WAVELENGTH_EXECUTION]
+
     logger.debug("Saving settings dictionary...")
-    save_hdf5(simpa_output, settings[Tags.SIMPA_OUTPUT_PATH])
+    # In the parallel execution mode, the workers resume their own output files.
+    _save_simpa_output_header(simpa_output, settings, resume=_use_checkpoints(settings) and not run_in_parallel)
     logger.debug("Saving settings dictionary...[Done]")
 
-    for wavelength in settings[Tags.WAVELENGTHS]:
-        logger.debug(f"Running pipeline for wavelength {wavelength}nm...")
-
-        if settings[Tags.RANDOM_SEED] is not None:
-            np.random.seed(settings[Tags.RANDOM_SEED])
-        else:
-            np.random.seed(None)
-
-        settings[Tags.WAVELENGTH] = wavelength
-
-        for pipeline_element in simulation_pipeline:
-            logger.debug(f"Running {type(pipeline_element)}")
-            pipeline_element.run(digital_device_twin)
-
-        logger.debug(f"Running pipeline for wavelength {wavelength}nm... [Done]")
+    instrumentation = PipelineInstrumentation()
+    if run_in_parallel:
+        _run_pipeline_for_wavelengths_in_parallel(simulation_pipeline, settings, digital_device_twin, simpa_output,
+                                                  instrumentation)
+    else:
+        _run_pipeline_for_all_wavelengths(simulation_pipeline, settings, digital_device_twin, instrumentation)
 
     # If the dimensions of the simulation results are changed after calling the respective module
     # adapter / processing components, the amount of space on the hard drive that is allocated by the HDF5
-    # code does not dynamically change. This can be remedied by re-writing the file after the simulation
-    # terminates. As it might have a negative impact on simulation performance, it must be activated
-    # by the user manually. Active by default.
-    if not (Tags.DO_FILE_COMPRESSION in settings and
-            not settings[Tags.DO_FILE_COMPRESSION]):
-        all_data = load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH])
-        if Tags.VOLUME_CREATION_MODEL_SETTINGS in all_data[Tags.SETTINGS] and \
-                Tags.INPUT_SEGMENTATION_VOLUME in all_data[Tags.SETTINGS][Tags.VOLUME_CREATION_MODEL_SETTINGS]:
-            del all_data[Tags.SETTINGS][Tags.VOLUME_CREATION_MODEL_SETTINGS][Tags.INPUT_SEGMENTATION_VOLUME]
-        save_hdf5(all_data, settings[Tags.SIMPA_OUTPUT_PATH], file_compression="gzip")
+    # code does not dynamically change. The datasets are compressed as they are written, so the file only needs
+    # to be repacked if a considerable amount of space is occupied by overwritten data.
+    if _use_file_compression(settings):
+        delete_hdf5_item(settings[Tags.SIMPA_OUTPUT_PATH], "/" + Tags.SETTINGS + "/" +
+                         Tags.VOLUME_CREATION_MODEL_SETTINGS[0] + "/" + Tags.INPUT_SEGMENTATION_VOLUME[0])
+        if get_unused_bytes(settings[Tags.SIMPA_OUTPUT_PATH]) > \
+                REPACK_THRESHOLD * os.path.getsize(settings[Tags.SIMPA_OUTPUT_PATH]):
+            logger.debug("Repacking the output file...")
+            repack_hdf5(settings[Tags.SIMPA_OUTPUT_PATH])
+            logger.debug("Repacking the output file...[Done]")
 
     # Export simulation result to the IPASC format.
     if Tags.DO_IPASC_EXPORT in settings and settings[Tags.DO_IPASC_EXPORT]:
@@ -99,3 +106,231 @@ def simulate(simulation_pipeline: list, settings: Settings, digital_device_twin:
         export_to_ipasc(settings[Tags.SIMPA_OUTPUT_PATH], device=digital_device_twin)
 
     logger.info(f"The entire simulation pipeline required {time.time() - start_time} seconds.")
+    logger.debug(f"Resource usage of the pipeline elements:\n{instrumentation}")
+    return instrumentation
+
+
+def _use_file_compression(settings: Settings) -> bool:
+    """
+    File compression is active by default and can be deactivated with Tags.DO_FILE_COMPRESSION.
+    """
+    return not (Tags.DO_FILE_COMPRESSION in settings and not settings[Tags.DO_FILE_COMPRESSION])
+
+
+def _get_file_compression(settings: Settings):
+    """
+    :return: the compression filter for the datasets of the SIMPA output file or None
+    """
+    return "gzip" if _use_file_compression(settings) else None
+
+
+def _use_checkpoints(settings: Settings) -> bool:
+    return Tags.RESUME_SIMULATION in settings and settings[Tags.RESUME_SIMULATION]
+
+
+def _get_module_output_cache(settings: Settings):
+    """
+    :return: the ModuleOutputCache specified by Tags.MODULE_OUTPUT_CACHE_PATH or None
+    """
+    if Tags.MODULE_OUTPUT_CACHE_PATH not in settings:
+        return None
+    if Tags.MODULE_OUTPUT_CACHE_SIZE_BYTES in settings:
+        max_size_bytes = settings[Tags.MODULE_OUTPUT_CACHE_SIZE_BYTES]
+    else:
+        max_size_bytes = DEFAULT_MODULE_OUTPUT_CACHE_SIZE_BYTES
+    return ModuleOutputCache(settings[Tags.MODULE_OUTPUT_CACHE_PATH], max_size_bytes)
+
+
+def _save_simpa_output_header(simpa_output: dict, settings: Settings, resume: bool):
+    """
+    Creates the SIMPA output file with the settings, the digital device twin and the simulation pipeline.
+    If a simulation is resumed, the existing output file is kept and only these items are replaced.
+    """
+    file_path = settings[Tags.SIMPA_OUTPUT_PATH]
+    if resume and os.path.exists(file_path):
+        Logger().info(f"Resuming the simulation in {file_path}...")
+        for key, value in simpa_output.items():
+            save_hdf5(value, file_path, "/" + key + "/")
+    else:
+        save_hdf5(simpa_output, file_path, file_compression=_get_file_compression(settings))
+
+
+def _run_pipeline_for_all_wavelengths(simulation_pipeline: list, settings: Settings,
+                                      digital_device_twin: DigitalDeviceTwinBase,
+                                      instrumentation: PipelineInstrumentation):
+    """
+    Runs the simulation pipeline for all wavelengths within one session of the SIMPA output file.
+    If Tags.RESUME_SIMULATION is set, checkpoints are recorded and used to skip pipeline elements.
+    If Tags.MODULE_OUTPUT_CACHE_PATH is set, the outputs of pipeline elements are restored from the cache.
+    """
+    with _open_output_file(settings) as output_file, _open_in_memory_data_store(settings):
+        checkpoints = None
+        cache = _get_module_output_cache(settings)
+        if _use_checkpoints(settings) or cache is not None:
+            checkpoints = PipelineCheckpoints(output_file, settings, digital_device_twin,
+                                              record_checkpoints=_use_checkpoints(settings), cache=cache)
+        try:
+            for wavelength in settings[Tags.WAVELENGTHS]:
+                _run_pipeline_for_wavelength(simulation_pipeline, settings, digital_device_twin, wavelength,
+                                             output_file, instrumentation, checkpoints)
+        except OutdatedCheckpointsError as e:
+            Logger().warning(f"The simulation cannot be resumed and is run from the start: {e}")
+            checkpoints.reset()
+            for wavelength in settings[Tags.WAVELENGTHS]:
+                _run_pipeline_for_wavelength(simulation_pipeline, settings, digital_device_twin, wavelength,
+                                             output_file, instrumentation, checkpoints)
+
+
+def _run_pipeline_for_wavelength(simulation_pipeline: list, settings: Settings,
+                                 digital_device_twin: DigitalDeviceTwinBase, wavelength, output_file: SimpaOutputFile,
+                                 instrumentation: PipelineInstrumentation, checkpoints: PipelineCheckpoints = None):
+    """
+    Runs all elements of the simulation pipeline for a single wavelength.
+
+    :param simulation_pipeline: a list of callable functions
+    :param settings: settings dictionary containing the simulation instructions
+    :param digital_device_twin: a digital device twin of an imaging device
+    :param wavelength: the wavelength to simulate
+    :param output_file: the open session of the SIMPA output file
+    :param instrumentation: collects the resource usage of the pipeline elements
+    :param checkpoints: if given, pipeline elements whose outputs are up to date or cached are skipped and
+        the remaining pipeline elements are recorded.
+    """
+    logger = Logger()
+    logger.debug(f"Running pipeline for wavelength {wavelength}nm...")
+
+    if settings[Tags.RANDOM_SEED] is not None:
+        np.random.seed(settings[Tags.RANDOM_SEED])
+    else:
+        np.random.seed(None)
+
+    settings[Tags.WAVELENGTH] = wavelength
+
+    for index, pipeline_element in enumerate(simulation_pipeline):
+        with instrumentation.measure(pipeline_element, index, wavelength, output_file) as record:
+            if checkpoints is None:
+                logger.debug(f"Running {type(pipeline_element)}")
+                pipeline_element.run(digital_device_twin)
+            elif checkpoints.try_skip(pipeline_element, index, wavelength):
+                record["skipped"] = True
+            else:
+                logger.debug(f"Running {type(pipeline_element)}")
+                with checkpoints.record(pipeline_element, index, wavelength):
+                    pipeline_element.run(digital_device_twin)
+        # Allow other processes to read the output file between the pipeline elements
+        output_file.release()
+
+    data_store = get_in_memory_data_store(settings[Tags.SIMPA_OUTPUT_PATH])
+    if data_store is not None:
+        # Persist the results of this wavelength while the next wavelength is being simulated
+        data_store.flush(asynchronous=True, evict_wavelength=wavelength)
+
+    logger.debug(f"Running pipeline for wavelength {wavelength}nm... [Done]")
+
+
+def _open_output_file(settings: Settings) -> SimpaOutputFile:
+    """
+    Opens a session for the SIMPA output file that is shared by all pipeline elements. The file is released after
+    every pipeline element, such that other processes can read it while the simulation is running.
+
+    :return: the SimpaOutputFile, which has to be used as a context manager
+    """
+    chunk_cache_size_bytes = None
+    if Tags.HDF5_CHUNK_CACHE_SIZE_BYTES in settings:
+        chunk_cache_size_bytes = settings[Tags.HDF5_CHUNK_CACHE_SIZE_BYTES]
+    return SimpaOutputFile(settings[Tags.SIMPA_OUTPUT_PATH], "a", chunk_cache_size_bytes=chunk_cache_size_bytes)
+
+
+def _open_in_memory_data_store(settings: Settings):
+    """
+    Opens an in-memory data store for the SIMPA output file if Tags.IN_MEMORY_DATA_STORE is set to True.
+
+    :return: a context manager
+    """
+    if Tags.IN_MEMORY_DATA_STORE in settings and settings[Tags.IN_MEMORY_DATA_STORE]:
+        return in_memory_data_store(settings[Tags.SIMPA_OUTPUT_PATH])
+    return nullcontext()
+
+
+def _simulate_wavelength_in_worker(simulation_pipeline: list, settings: Settings,
+                                   digital_device_twin: DigitalDeviceTwinBase, simpa_output: dict,
+                                   wavelength, shard_path: str) -> tuple:
+    """
+    Entry point of a worker process in the parallel execution mode. The pipeline is run for a single wavelength
+    and all results are written into a separate shard file in the standard SIMPA file layout.
+    The worker operates on its own copy of the settings, in which the wavelengths are restricted to the
+    given wavelength. Hence, wavelength-independent properties are created and processed in every shard.
+
+    :return: the settings dictionary after the pipeline has been run and the records of the resource usage of the
+        pipeline elements
+    """
+    settings[Tags.WAVELENGTHS] = [wavelength]
+    settings[Tags.SIMPA_OUTPUT_PATH] = shard_path
+    simpa_output[Tags.SETTINGS] = settings
+    _save_simpa_output_header(simpa_output, settings, resume=_use_checkpoints(settings))
+
+    instrumentation = PipelineInstrumentation()
+    _run_pipeline_for_all_wavelengths(simulation_pipeline, settings, digital_device_twin, instrumentation)
+    return settings, instrumentation.records
+
+
+def _run_pipeline_for_wavelengths_in_parallel(simulation_pipeline: list, settings: Settings,
+                                              digital_device_twin: DigitalDeviceTwinBase, simpa_output: dict,
+                                              instrumentation: PipelineInstrumentation):
+    """
+    Fans the wavelengths out to a pool of worker processes. Every worker seeds numpy exactly like the serial
+    execution does, so that the results do not depend on the execution mode, and writes into its own shard.
+    Once all workers are done, the shards are merged into the SIMPA output file in the order of the wavelengths.
+    The first shard therefore provides the wavelength-independent properties, as in the serial execution.
+    """
+    logger = Logger()
+    wavelengths = list(settings[Tags.WAVELENGTHS])
+    simpa_output_path = settings[Tags.SIMPA_OUTPUT_PATH]
+
+    if Tags.NUMBER_OF_PARALLEL_WORKERS in settings and settings[Tags.NUMBER_OF_PARALLEL_WORKERS]:
+        number_of_workers = settings[Tags.NUMBER_OF_PARALLEL_WORKERS]
+    else:
+        number_of_workers = min(len(wavelengths), os.cpu_count() or 1)
+
+    # Forked workers share the logger with the parent process. CUDA cannot be used in forked processes once it
+    # has been initialised, so spawn the workers in that case.
+    if "fork" in multiprocessing.get_all_start_methods() and not torch.cuda.is_initialized():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+
+    shard_paths = [os.path.splitext(simpa_output_path)[0] + f"_wavelength_{wavelength}.hdf5"
+                   for wavelength in wavelengths]
+    logger.info(f"Running pipeline for {len(wavelengths)} wavelengths on {number_of_workers} worker processes...")
+    try:
+        with ProcessPoolExecutor(max_workers=number_of_workers, mp_context=context) as executor:
+            futures = [executor.submit(_simulate_wavelength_in_worker, simulation_pipeline, settings,
+                                       digital_device_twin, dict(simpa_output), wavelength, shard_path)
+                       for wavelength, shard_path in zip(wavelengths, shard_paths)]
+            worker_results = [future.result() for future in futures]
+
+        for _, worker_records in worker_results:
+            instrumentation.records.extend(worker_records)
+        # Apply the settings that were added or changed by the pipeline elements, e.g. the k-Wave time step.
+        for key, value in worker_results[-1][0].items():
+            if key not in [Tags.WAVELENGTHS[0], Tags.SIMPA_OUTPUT_PATH[0]]:
+                settings[key] = value
+
+        logger.debug("Merging the output files of the worker processes...")
+        merge_hdf5_files(simpa_output_path, shard_paths, exclude_paths=[Tags.SETTINGS])
+        save_hdf5(settings, simpa_output_path, "/" + Tags.SETTINGS + "/")
+        logger.debug("Merging the output files of the worker processes...[Done]")
+    except BaseException:
+        # Keep the output files of the workers, such that the workers can resume them
+        if not _use_checkpoints(settings):
+            _remove_files(shard_paths)
+        raise
+    _remove_files(shard_paths)
+    logger.info(f"Running pipeline for {len(wavelengths)} wavelengths on {number_of_workers} "
+                f"worker processes...[Done]")
+
+
+def _remove_files(file_paths: list):
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            os.remove(file_path)
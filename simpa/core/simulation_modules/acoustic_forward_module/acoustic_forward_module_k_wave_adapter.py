@@ -4,7 +4,6 @@
 
 import gc
 import os
-import subprocess
 
 import numpy as np
 import scipy.io as sio
@@ -14,6 +13,7 @@ from simpa.core.device_digital_twins import (CurvedArrayDetectionGeometry,
                                              DetectionGeometryBase)
 from simpa.core.simulation_modules.acoustic_forward_module import \
     AcousticForwardModelBaseAdapter
+from simpa.core.pipeline_instrumentation import run_subprocess
 from simpa.io_handling.io_hdf5 import load_data_field, save_hdf5
 from simpa.utils import Tags
 from simpa.utils.matlab import generate_matlab_cmd
@@ -82,14 +82,6 @@ class KWaveAdapter(AcousticForwardModelBaseAdapter):
 
         self.logger.debug(f"OPTICAL_PATH: {str(optical_path)}")
 
-        data_dict = {}
-        file_path = self.global_settings[Tags.SIMPA_OUTPUT_PATH]
-        data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE] = load_data_field(file_path, Tags.DATA_FIELD_INITIAL_PRESSURE,
-                                                                      wavelength=wavelength)
-        data_dict[Tags.DATA_FIELD_SPEED_OF_SOUND] = load_data_field(file_path, Tags.DATA_FIELD_SPEED_OF_SOUND)
-        data_dict[Tags.DATA_FIELD_DENSITY] = load_data_field(file_path, Tags.DATA_FIELD_DENSITY)
-        data_dict[Tags.DATA_FIELD_ALPHA_COEFF] = load_data_field(file_path, Tags.DATA_FIELD_ALPHA_COEFF)
-
         pa_device = detection_geometry
         pa_device.check_settings_prerequisites(self.global_settings)
         field_of_view_extent = pa_device.field_of_view_extent_mm
@@ -110,14 +102,22 @@ class KWaveAdapter(AcousticForwardModelBaseAdapter):
             axes = (0, 2)
             image_slice = np.s_[:]
 
-        data_dict[Tags.DATA_FIELD_SPEED_OF_SOUND] = np.rot90(data_dict[Tags.DATA_FIELD_SPEED_OF_SOUND][image_slice],
+        # Only the image slice is read from the file
+        data_dict = {}
+        file_path = self.global_settings[Tags.SIMPA_OUTPUT_PATH]
+        data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE] = load_data_field(file_path, Tags.DATA_FIELD_INITIAL_PRESSURE,
+                                                                      wavelength=wavelength, index=image_slice)
+        for data_field in [Tags.DATA_FIELD_SPEED_OF_SOUND, Tags.DATA_FIELD_DENSITY, Tags.DATA_FIELD_ALPHA_COEFF]:
+            data_dict[data_field] = load_data_field(file_path, data_field, index=image_slice)
+
+        data_dict[Tags.DATA_FIELD_SPEED_OF_SOUND] = np.rot90(data_dict[Tags.DATA_FIELD_SPEED_OF_SOUND],
                                                              3, axes=axes)
-        data_dict[Tags.DATA_FIELD_DENSITY] = np.rot90(data_dict[Tags.DATA_FIELD_DENSITY][image_slice],
+        data_dict[Tags.DATA_FIELD_DENSITY] = np.rot90(data_dict[Tags.DATA_FIELD_DENSITY],
                                                       3, axes=axes)
-        data_dict[Tags.DATA_FIELD_ALPHA_COEFF] = np.rot90(data_dict[Tags.DATA_FIELD_ALPHA_COEFF][image_slice],
+        data_dict[Tags.DATA_FIELD_ALPHA_COEFF] = np.rot90(data_dict[Tags.DATA_FIELD_ALPHA_COEFF],
                                                           3, axes=axes)
-        data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE] = np.rot90(data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE]
-                                                               [image_slice], 3, axes=axes)
+        data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE] = np.rot90(data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE],
+                                                               3, axes=axes)
 
         time_series_data, global_settings = self.k_wave_acoustic_forward_model(
             detection_geometry,
@@ -246,7 +246,7 @@ class KWaveAdapter(AcousticForwardModelBaseAdapter):
 
         cur_dir = os.getcwd()
         self.logger.info(cmd)
-        subprocess.run(cmd)
+        run_subprocess(cmd)
 
         raw_time_series_data = sio.loadmat(optical_path)[Tags.DATA_FIELD_TIME_SERIES_DATA]
 
@@ -3,7 +3,7 @@
 # SPDX-License-Identifier: MIT
 
 import numpy as np
-import subprocess
+from simpa.core.pipeline_instrumentation import run_subprocess
 from simpa.utils import Tags, Settings
 from simpa.core.simulation_modules.optical_simulation_module import OpticalForwardModuleBase
 from simpa.core.device_digital_twins.illumination_geometries.illumination_geometry_base import IlluminationGeometryBase
@@ -195,7 +195,7 @@ class MCXAdapter(OpticalForwardModuleBase):
         """
         results = None
         try:
-            results = subprocess.run(cmd)
+            results = run_subprocess(cmd)
         except:
             raise RuntimeError(f"MCX failed to run: {cmd}, results: {results}")
 
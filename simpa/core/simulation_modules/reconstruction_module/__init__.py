@@ -12,7 +12,8 @@ from simpa.utils.dict_path_manager import generate_dict_path
 from simpa.io_handling.io_hdf5 import save_hdf5
 import numpy as np
 from simpa.utils import Settings
-from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import bandpass_filter_with_settings, apply_b_mode
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import bandpass_filter_with_settings, \
+    apply_b_mode, load_reconstruction_speed_of_sound, compute_delay_and_sum_time_gate
 from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined
 
 
@@ -26,6 +27,8 @@ class ReconstructionAdapterBase(SimulationModule):
     def __init__(self, global_settings: Settings):
         super(ReconstructionAdapterBase, self).__init__(global_settings=global_settings)
         self.component_settings = global_settings.get_reconstruction_settings()
+        # The speed of sound and the speed of sound map of the current run, see get_speed_of_sound
+        self.speed_of_sound = None
 
     @abstractmethod
     def reconstruction_algorithm(self, time_series_sensor_data,
@@ -35,12 +38,40 @@ class ReconstructionAdapterBase(SimulationModule):
 
         :param time_series_sensor_data: the time series sensor data
         :param detection_geometry:
-        :return: a reconstructed photoacoustic image
+        :return: a reconstructed photoacoustic image or a dictionary that maps data fields, e.g.
+            Tags.DATA_FIELD_RECONSTRUCTED_DATA, to reconstructed images
         """
         pass
 
+    def get_time_gate(self, n_time_steps: int, detection_geometry: DetectionGeometryBase):
+        """
+        A deriving class can implement this method to crop the time series sensor data to the time steps that are
+        needed to reconstruct the image before it is filtered and reconstructed. The reconstruction_algorithm is then
+        called with the cropped time series sensor data and the index of its first time step as first_time_step.
+
+        :param n_time_steps: the number of recorded time steps
+        :param detection_geometry:
+        :return: a slice of the needed time steps or None, if all time steps are needed
+        """
+        return None
+
+    def get_speed_of_sound(self, detection_geometry: DetectionGeometryBase) -> tuple:
+        """
+        Loads the speed of sound in m/s and the speed of sound map of the reconstruction, see
+        load_reconstruction_speed_of_sound, once per run, such that get_time_gate and the reconstruction_algorithm
+        can both use them.
+
+        :param detection_geometry:
+        :return: the speed of sound in m/s and the speed of sound map or None
+        """
+        if self.speed_of_sound is None:
+            self.speed_of_sound = load_reconstruction_speed_of_sound(self.component_settings, self.global_settings,
+                                                                     detection_geometry)
+        return self.speed_of_sound
+
     def run(self, device):
         self.logger.info("Performing reconstruction...")
+        self.speed_of_sound = None
 
         time_series_sensor_data = load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH],
                                                   Tags.DATA_FIELD_TIME_SERIES_DATA, self.global_settings[Tags.WAVELENGTH])
@@ -53,6 +84,10 @@ class ReconstructionAdapterBase(SimulationModule):
         else:
             raise TypeError(f"Type {type(device)} is not supported for performing image reconstruction.")
 
+        time_gate = self.get_time_gate(time_series_sensor_data.shape[-1], _device)
+        if time_gate is not None:
+            time_series_sensor_data = time_series_sensor_data[..., time_gate]
+
         if Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING in self.component_settings and \
                 self.component_settings[Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING]:
 
@@ -68,27 +103,56 @@ class ReconstructionAdapterBase(SimulationModule):
             time_series_sensor_data = apply_b_mode(
                 time_series_sensor_data, method=self.component_settings[Tags.RECONSTRUCTION_BMODE_METHOD])
 
-        reconstruction = self.reconstruction_algorithm(time_series_sensor_data, _device)
+        if time_gate is not None:
+            reconstruction = self.reconstruction_algorithm(time_series_sensor_data, _device,
+                                                           first_time_step=time_gate.start)
+        else:
+            reconstruction = self.reconstruction_algorithm(time_series_sensor_data, _device)
 
-        # check for B-mode methods and perform envelope detection on time series data if specified
-        if Tags.RECONSTRUCTION_BMODE_AFTER_RECONSTRUCTION in self.component_settings \
-                and self.component_settings[Tags.RECONSTRUCTION_BMODE_AFTER_RECONSTRUCTION] \
-                and Tags.RECONSTRUCTION_BMODE_METHOD in self.component_settings:
-            reconstruction = apply_b_mode(
-                reconstruction, method=self.component_settings[Tags.RECONSTRUCTION_BMODE_METHOD])
+        # Adapters that reconstruct several images at once return a dictionary that maps data fields to images
+        if isinstance(reconstruction, dict):
+            reconstructions = reconstruction
+        else:
+            reconstructions = {Tags.DATA_FIELD_RECONSTRUCTED_DATA: reconstruction}
+
+        for data_field, reconstruction in reconstructions.items():
+            # check for B-mode methods and perform envelope detection on time series data if specified
+            if Tags.RECONSTRUCTION_BMODE_AFTER_RECONSTRUCTION in self.component_settings \
+                    and self.component_settings[Tags.RECONSTRUCTION_BMODE_AFTER_RECONSTRUCTION] \
+                    and Tags.RECONSTRUCTION_BMODE_METHOD in self.component_settings:
+                reconstruction = apply_b_mode(
+                    reconstruction, method=self.component_settings[Tags.RECONSTRUCTION_BMODE_METHOD])
 
-        if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
-            assert_array_well_defined(reconstruction, array_name="reconstruction")
+            if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
+                assert_array_well_defined(reconstruction, array_name=data_field)
 
-        reconstruction_output_path = generate_dict_path(
-            Tags.DATA_FIELD_RECONSTRUCTED_DATA, self.global_settings[Tags.WAVELENGTH])
+            reconstruction_output_path = generate_dict_path(data_field, self.global_settings[Tags.WAVELENGTH])
 
-        save_hdf5(reconstruction, self.global_settings[Tags.SIMPA_OUTPUT_PATH],
-                  reconstruction_output_path)
+            save_hdf5(reconstruction, self.global_settings[Tags.SIMPA_OUTPUT_PATH],
+                      reconstruction_output_path)
 
         self.logger.info("Performing reconstruction...[Done]")
 
 
+class DelayAndSumAdapterBase(ReconstructionAdapterBase):
+    """
+    Base class of the reconstruction adapters that are based on the delay and sum terms of
+    compute_delay_and_sum_sums, i.e. Delay and Sum, (signed) Delay Multiply and Sum and their combinations.
+
+    The time series sensor data is cropped to the time steps that are reachable from the field of view, see
+    compute_delay_and_sum_time_gate, and the reconstruction_algorithm is called with the index of the first
+    remaining time step as first_time_step. The reconstruction_algorithm also accepts a batch of time series sensor
+    data (3D numpy array or tensor with a leading batch dimension), e.g. of several wavelengths or frames, which is
+    reconstructed at once.
+    """
+
+    def get_time_gate(self, n_time_steps: int, detection_geometry: DetectionGeometryBase):
+        speed_of_sound_in_m_per_s, speed_of_sound_map = self.get_speed_of_sound(detection_geometry)
+        return compute_delay_and_sum_time_gate(n_time_steps, self.component_settings, self.global_settings,
+                                               detection_geometry, self.logger, speed_of_sound_in_m_per_s,
+                                               speed_of_sound_map)
+
+
 def create_reconstruction_settings(speed_of_sound_in_m_per_s: int = 1540, time_spacing_in_s: float = 2.5e-8,
                                    sensor_spacing_in_mm: float = 0.1,
                                    recon_mode: str = Tags.RECONSTRUCTION_MODE_PRESSURE,
@@ -0,0 +1,277 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from collections import OrderedDict
+import glob
+import os
+import uuid
+
+import numpy as np
+import torch
+
+from simpa.log import Logger
+
+# Default upper bound of the total size of the delay tables that are kept in memory and on disk. It is independent
+# of the memory budget of the reconstruction, such that the delay tables of typical arrays and image grids are
+# cached, e.g. 625 MiB for 256 sensor elements and 400 x 400 pixels.
+DEFAULT_DELAY_TABLE_CACHE_SIZE_BYTES = 2 * 1024 ** 3
+
+# Single precision interpolation weights are far more precise than the linear interpolation itself
+DELAY_TABLE_WEIGHT_DTYPE = torch.float32
+
+
+class DelayTable:
+    """
+    The linear interpolation of the time series data of every sensor element at the time of flight to every pixel.
+    The delayed value of sensor element j at pixel i is
+    flat_data[lower_indices[i, j]] * lower_weights[i, j] + flat_data[upper_indices[i, j]] * upper_weights[i, j],
+    where flat_data is the flattened time series data of shape (sensor elements, time steps). The weights of times
+    of flight outside of the recorded time range are 0.
+
+    If the receive aperture is limited, the table is sparse and only holds the pixel-sensor element pairs within the
+    aperture. The pairs are sorted by pixel, the indices and weights are of shape (pairs,) and the pairs of pixel i
+    are pixel_offsets[i]:pixel_offsets[i + 1].
+
+    As the tables are cached, they are stored compactly: the indices are 32 bit integers, unless the flattened time
+    series data is too large for them, and the weights are of DELAY_TABLE_WEIGHT_DTYPE.
+    """
+
+    def __init__(self, lower_indices: torch.Tensor, upper_indices: torch.Tensor, lower_weights: torch.Tensor,
+                 upper_weights: torch.Tensor, pixel_offsets: torch.Tensor = None, pixel_indices: torch.Tensor = None,
+                 sensor_indices: torch.Tensor = None):
+        """
+        :param lower_indices: flat indices of the time step before the time of flight of shape (pixels, sensors)
+        :param upper_indices: flat indices of the time step after the time of flight of shape (pixels, sensors)
+        :param lower_weights: interpolation weights of the time step before the time of flight
+        :param upper_weights: interpolation weights of the time step after the time of flight
+        :param pixel_offsets: for sparse tables, the index of the first pair of every pixel and the number of pairs
+        :param pixel_indices: for sparse tables, the pixel of every pair
+        :param sensor_indices: for sparse tables, the sensor element of every pair
+        """
+        self.lower_indices = lower_indices
+        self.upper_indices = upper_indices
+        self.lower_weights = lower_weights
+        self.upper_weights = upper_weights
+        self.pixel_offsets = pixel_offsets
+        self.pixel_indices = pixel_indices
+        self.sensor_indices = sensor_indices
+
+    @property
+    def is_sparse(self) -> bool:
+        return self.pixel_offsets is not None
+
+    @property
+    def n_pixels(self) -> int:
+        if self.is_sparse:
+            return len(self.pixel_offsets) - 1
+        return self.lower_indices.shape[0]
+
+    def _get_tensors(self) -> dict:
+        tensors = {"lower_indices": self.lower_indices, "upper_indices": self.upper_indices,
+                   "lower_weights": self.lower_weights, "upper_weights": self.upper_weights}
+        if self.is_sparse:
+            tensors.update({"pixel_offsets": self.pixel_offsets, "pixel_indices": self.pixel_indices,
+                            "sensor_indices": self.sensor_indices})
+        return tensors
+
+    @staticmethod
+    def get_index_dtype(n_flat_indices: int) -> torch.dtype:
+        """
+        :param n_flat_indices: the number of elements of the flattened time series data
+        :return: the smallest integer type that can index the flattened time series data
+        """
+        if n_flat_indices <= torch.iinfo(torch.int32).max:
+            return torch.int32
+        return torch.int64
+
+    @staticmethod
+    def get_dense_size_bytes(n_pixels: int, n_sensor_elements: int, n_time_steps: int) -> int:
+        """
+        :return: the size of a table that holds all pairs of pixels and sensor elements
+        """
+        index_size = torch.empty(0, dtype=DelayTable.get_index_dtype(n_sensor_elements * n_time_steps)).element_size()
+        weight_size = torch.empty(0, dtype=DELAY_TABLE_WEIGHT_DTYPE).element_size()
+        return n_pixels * n_sensor_elements * 2 * (index_size + weight_size)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(tensor.element_size() * tensor.nelement() for tensor in self._get_tensors().values())
+
+    def to(self, torch_device: torch.device) -> "DelayTable":
+        """
+        :param torch_device: the device the delay table should reside on
+        :return: the delay table on the given device
+        """
+        return DelayTable(**{name: tensor.to(torch_device) for name, tensor in self._get_tensors().items()})
+
+    def __getitem__(self, pixels: slice) -> "DelayTable":
+        if not self.is_sparse:
+            return DelayTable(self.lower_indices[pixels], self.upper_indices[pixels], self.lower_weights[pixels],
+                              self.upper_weights[pixels])
+        start, stop, _ = pixels.indices(self.n_pixels)
+        first_pair = int(self.pixel_offsets[start])
+        pairs = slice(first_pair, int(self.pixel_offsets[stop]))
+        return DelayTable(self.lower_indices[pairs], self.upper_indices[pairs], self.lower_weights[pairs],
+                          self.upper_weights[pairs], self.pixel_offsets[start:stop + 1] - first_pair,
+                          self.pixel_indices[pairs] - start, self.sensor_indices[pairs])
+
+    @staticmethod
+    def concatenate(tables: list) -> "DelayTable":
+        """
+        :param tables: delay tables of consecutive tiles of pixels
+        :return: the delay table of all pixels
+        """
+        concatenated = {name: torch.cat([table._get_tensors()[name] for table in tables])
+                        for name in ("lower_indices", "upper_indices", "lower_weights", "upper_weights")}
+        if not tables[0].is_sparse:
+            return DelayTable(**concatenated)
+        pixel_offsets = [tables[0].pixel_offsets[:1]]
+        pixel_indices = []
+        first_pair = 0
+        first_pixel = 0
+        for table in tables:
+            pixel_offsets.append(table.pixel_offsets[1:] + first_pair)
+            pixel_indices.append(table.pixel_indices + first_pixel)
+            first_pair += int(table.pixel_offsets[-1])
+            first_pixel += table.n_pixels
+        return DelayTable(**concatenated, pixel_offsets=torch.cat(pixel_offsets),
+                          pixel_indices=torch.cat(pixel_indices),
+                          sensor_indices=torch.cat([table.sensor_indices for table in tables]))
+
+    def interpolate(self, time_series_sensor_data: torch.Tensor, apodization: torch.Tensor = None) -> torch.Tensor:
+        """
+        :param time_series_sensor_data: time series data of shape (sensor elements, time steps) or a batch of time
+            series data of shape (batch, sensor elements, time steps)
+        :param apodization: apodization factors of the sensor elements of shape (1, sensor elements) or None
+        :return: the delayed values of shape (pixels, sensor elements) or (batch, pixels, sensor elements) or, for
+            sparse tables, of shape (pairs,) or (batch, pairs)
+        """
+        flat_data = time_series_sensor_data.reshape(time_series_sensor_data.shape[:-2] + (-1,))
+        values = flat_data[..., self.lower_indices] * self.lower_weights + \
+            flat_data[..., self.upper_indices] * self.upper_weights
+        if apodization is None:
+            return values
+        if self.is_sparse:
+            return values * apodization.reshape(-1)[self.sensor_indices]
+        return values * apodization
+
+    def sum_per_pixel(self, values: torch.Tensor) -> torch.Tensor:
+        """
+        :param values: values of the shape of the delayed values, see interpolate
+        :return: the sums of the values of the sensor elements of every pixel of shape (pixels,) or (batch, pixels)
+        """
+        if not self.is_sparse:
+            return torch.sum(values, dim=-1)
+        sums = torch.zeros(values.shape[:-1] + (self.n_pixels,), dtype=values.dtype, device=values.device)
+        return sums.index_add_(-1, self.pixel_indices, values)
+
+
+class DelayTableCache:
+    """
+    Least recently used cache of delay tables, such that repeated reconstructions with the same detection geometry,
+    image grid, speed of sound and sampling rate, e.g. of several wavelengths or frames, only need to interpolate the
+    time series data. The tables are kept in host memory and, if a directory is given, on disk, so that they can be
+    shared across processes and simulation runs. Both are limited to a maximum total size. The tables are not kept
+    on the device of the reconstruction, such that they do not take up memory of the GPU between the
+    reconstructions, and the tiles of pixels are moved to the device when they are needed.
+    """
+
+    def __init__(self, max_size_bytes: int = DEFAULT_DELAY_TABLE_CACHE_SIZE_BYTES):
+        """
+        :param max_size_bytes: the maximum total size of the delay tables in memory and on disk
+        """
+        self.logger = Logger()
+        self.max_size_bytes = max_size_bytes
+        self.tables = OrderedDict()
+
+    def _get_entry_path(self, directory: str, key: str) -> str:
+        return os.path.join(directory, key + ".npz")
+
+    def get(self, key: str, directory: str = None):
+        """
+        :param key: the key of the delay table, see simpa.utils.hashing.compute_hash
+        :param directory: the directory of the on-disk cache or None
+        :return: the delay table or None, if it is not cached
+        """
+        if key in self.tables:
+            self.tables.move_to_end(key)
+            return self.tables[key]
+        if directory is None:
+            return None
+        entry_path = self._get_entry_path(directory, key)
+        try:
+            with np.load(entry_path) as entry:
+                table = DelayTable(**{name: torch.from_numpy(entry[name]) for name in entry.files})
+            # Mark the entry as recently used
+            os.utime(entry_path)
+        except (OSError, KeyError, ValueError, TypeError):
+            return None
+        self.logger.debug(f"Loaded delay table {key} from {directory}.")
+        self._put_in_memory(key, table)
+        return table
+
+    def put(self, key: str, table: DelayTable, directory: str = None, max_size_bytes: int = None):
+        """
+        :param key: the key of the delay table, see simpa.utils.hashing.compute_hash
+        :param table: the delay table in host memory
+        :param directory: the directory of the on-disk cache or None
+        :param max_size_bytes: overrides the maximum total size of the cache or None
+        """
+        if max_size_bytes is None:
+            max_size_bytes = self.max_size_bytes
+        self._put_in_memory(key, table, max_size_bytes)
+        if directory is None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        entry_path = self._get_entry_path(directory, key)
+        temporary_path = entry_path + "." + uuid.uuid4().hex
+        try:
+            with open(temporary_path, "wb") as entry_file:
+                np.savez(entry_file, **{name: tensor.cpu().numpy() for name, tensor in table._get_tensors().items()})
+            os.replace(temporary_path, entry_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        self._evict_from_disk(directory, max_size_bytes)
+
+    def _put_in_memory(self, key: str, table: DelayTable, max_size_bytes: int = None):
+        if max_size_bytes is None:
+            max_size_bytes = self.max_size_bytes
+        self.tables[key] = table
+        self.tables.move_to_end(key)
+        total_size = sum(cached_table.nbytes for cached_table in self.tables.values())
+        while total_size > max_size_bytes and len(self.tables) > 1:
+            _, evicted_table = self.tables.popitem(last=False)
+            total_size -= evicted_table.nbytes
+
+    def _evict_from_disk(self, directory: str, max_size_bytes: int):
+        """
+        Deletes the least recently used delay tables until the total size is below the maximum size.
+        """
+        entries = []
+        for entry_path in glob.glob(os.path.join(directory, "*.npz")):
+            try:
+                entries.append((os.path.getmtime(entry_path), os.path.getsize(entry_path), entry_path))
+            except OSError:
+                continue
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= max_size_bytes:
+                break
+            self.logger.debug(f"Evicting {entry_path} from the delay table cache.")
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """
+        Removes all delay tables from memory.
+        """
+        self.tables.clear()
+
+
+# The delay tables of all reconstructions of the current process
+delay_table_cache = DelayTableCache()
@@ -3,18 +3,20 @@
 # SPDX-License-Identifier: MIT
 
 from simpa.utils import Tags
-from simpa.core.simulation_modules.reconstruction_module import ReconstructionAdapterBase
+from simpa.core.simulation_modules.reconstruction_module import DelayAndSumAdapterBase
 import numpy as np
 import torch
-from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_and_sum_values, \
-    compute_image_dimensions, preparing_reconstruction_and_obtaining_reconstruction_settings
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_and_sum_sums, \
+    compute_image_dimensions, preparing_reconstruction_and_obtaining_reconstruction_settings, \
+    DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT, squeeze_reconstructed_images, get_sensor_orientations
 from simpa.core.device_digital_twins import DetectionGeometryBase
 from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
 
 
-class DelayAndSumAdapter(ReconstructionAdapterBase):
+class DelayAndSumAdapter(DelayAndSumAdapterBase):
 
-    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase):
+    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase,
+                                 first_time_step: int = 0):
         """
         Applies the Delay and Sum beamforming algorithm [1] to the time series sensor data (2D numpy array where the
         first dimension corresponds to the sensor elements and the second to the recorded time steps) with the given
@@ -26,8 +28,10 @@ class DelayAndSumAdapter(ReconstructionAdapterBase):
         Photoacoustic Imaging", https://doi.org/10.3390/jimaging4100121
         """
 
+        speed_of_sound_in_m_per_s, speed_of_sound_map = self.get_speed_of_sound(detection_geometry)
         time_series_sensor_data, sensor_positions, speed_of_sound_in_m_per_s, spacing_in_mm, time_spacing_in_ms, torch_device = preparing_reconstruction_and_obtaining_reconstruction_settings(
-            time_series_sensor_data, self.component_settings, self.global_settings, detection_geometry, self.logger)
+            time_series_sensor_data, self.component_settings, self.global_settings, detection_geometry, self.logger,
+            first_time_step, speed_of_sound_in_m_per_s)
 
         ### ALGORITHM ITSELF ###
 
@@ -37,21 +41,21 @@ class DelayAndSumAdapter(ReconstructionAdapterBase):
         if zdim == 1:
             sensor_positions[:, 1] = 0  # Assume imaging plane
 
-        # construct output image
-        output = torch.zeros((xdim, ydim, zdim), dtype=torch.float32, device=torch_device)
-
-        values, _ = compute_delay_and_sum_values(time_series_sensor_data, sensor_positions, xdim,
-                                                 ydim, zdim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end, spacing_in_mm, speed_of_sound_in_m_per_s,
-                                                 time_spacing_in_ms, self.logger, torch_device,
-                                                 self.component_settings)
+        sensor_orientations = get_sensor_orientations(detection_geometry, torch_device)
+        sums, _ = compute_delay_and_sum_sums(time_series_sensor_data, sensor_positions, xdim,
+                                             ydim, zdim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end, spacing_in_mm, speed_of_sound_in_m_per_s,
+                                             time_spacing_in_ms, self.logger, torch_device,
+                                             self.component_settings,
+                                             terms=(DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT),
+                                             sensor_orientations=sensor_orientations,
+                                             speed_of_sound_map=speed_of_sound_map,
+                                             first_time_step=first_time_step)
 
-        _sum = torch.sum(values, dim=3)
-        counter = torch.count_nonzero(values, dim=3)
-        torch.divide(_sum, counter, out=output)
-
-        reconstructed = output.cpu().numpy()
+        # construct output image
+        output = torch.zeros(sums[DELAY_AND_SUM_TERM_SUM].shape, dtype=torch.float32, device=torch_device)
+        torch.divide(sums[DELAY_AND_SUM_TERM_SUM], sums[DELAY_AND_SUM_TERM_COUNT], out=output)
 
-        return reconstructed.squeeze()
+        return squeeze_reconstructed_images(output)
 
 
 def reconstruct_delay_and_sum_pytorch(time_series_sensor_data: np.ndarray,
@@ -64,14 +68,15 @@ def reconstruct_delay_and_sum_pytorch(time_series_sensor_data: np.ndarray,
     """
     Convenience function for reconstructing time series data using Delay and Sum algorithm implemented in PyTorch
 
-    :param time_series_sensor_data: (2D numpy array) sensor data of shape (sensor elements, time steps)
+    :param time_series_sensor_data: (2D numpy array) sensor data of shape (sensor elements, time steps) or
+        (3D numpy array) a batch of sensor data of shape (batch, sensor elements, time steps)
     :param detection_geometry: The DetectionGeometryBase that should be used to reconstruct the given time series data
     :param speed_of_sound_in_m_per_s: (int) speed of sound in medium in meters per second (default: 1540 m/s)
     :param time_spacing_in_s: (float) time between sampling points in seconds (default: 2.5e-8 s which is equal to 40 MHz)
     :param sensor_spacing_in_mm: (float) space between sensor elements in millimeters (default: 0.1 mm)
     :param recon_mode: SIMPA Tag defining the reconstruction mode - pressure default OR differential
     :param apodization: SIMPA Tag defining the apodization function (default box)
-    :return: (2D numpy array) reconstructed image as 2D numpy array
+    :return: (2D numpy array) reconstructed image as 2D numpy array or (3D numpy array) a batch of images
     """
     # create settings
     settings = create_reconstruction_settings(speed_of_sound_in_m_per_s, time_spacing_in_s, sensor_spacing_in_mm,
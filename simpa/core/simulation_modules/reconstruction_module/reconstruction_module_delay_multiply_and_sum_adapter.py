@@ -3,18 +3,20 @@
 # SPDX-License-Identifier: MIT
 
 from simpa.utils import Tags
-from simpa.core.simulation_modules.reconstruction_module import ReconstructionAdapterBase
+from simpa.core.simulation_modules.reconstruction_module import DelayAndSumAdapterBase
 from simpa.core.device_digital_twins import DetectionGeometryBase
 import numpy as np
 import torch
-from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_and_sum_values, \
-    preparing_reconstruction_and_obtaining_reconstruction_settings, compute_image_dimensions
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_and_sum_sums, \
+    preparing_reconstruction_and_obtaining_reconstruction_settings, compute_image_dimensions, \
+    DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS, squeeze_reconstructed_images, get_sensor_orientations
 from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
 
 
-class DelayMultiplyAndSumAdapter(ReconstructionAdapterBase):
+class DelayMultiplyAndSumAdapter(DelayAndSumAdapterBase):
 
-    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase):
+    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase,
+                                 first_time_step: int = 0):
         """
         Applies the Delay Multiply and Sum beamforming algorithm [1] to the time series sensor data (2D numpy array where the
         first dimension corresponds to the sensor elements and the second to the recorded time steps) with the given
@@ -26,8 +28,10 @@ class DelayMultiplyAndSumAdapter(ReconstructionAdapterBase):
         Photoacoustic Imaging", https://doi.org/10.3390/jimaging4100121
         """
 
+        speed_of_sound_in_m_per_s, speed_of_sound_map = self.get_speed_of_sound(detection_geometry)
         time_series_sensor_data, sensor_positions, speed_of_sound_in_m_per_s, spacing_in_mm, time_spacing_in_ms, torch_device = preparing_reconstruction_and_obtaining_reconstruction_settings(
-            time_series_sensor_data, self.component_settings, self.global_settings, detection_geometry, self.logger)
+            time_series_sensor_data, self.component_settings, self.global_settings, detection_geometry, self.logger,
+            first_time_step, speed_of_sound_in_m_per_s)
 
         ### ALGORITHM ITSELF ###
 
@@ -37,28 +41,22 @@ class DelayMultiplyAndSumAdapter(ReconstructionAdapterBase):
         if zdim == 1:
             sensor_positions[:, 1] = 0  # Assume imaging plane
 
-        # construct output image
-        output = torch.zeros((xdim, ydim, zdim), dtype=torch.float32, device=torch_device)
-
-        values, n_sensor_elements = compute_delay_and_sum_values(time_series_sensor_data, sensor_positions, xdim,
-                                                                 ydim, zdim, xdim_start, xdim_end, ydim_start, ydim_end,
-                                                                 zdim_start, zdim_end, spacing_in_mm, speed_of_sound_in_m_per_s,
-                                                                 time_spacing_in_ms, self.logger, torch_device,
-                                                                 self.component_settings)
-
-        for x in range(xdim):
-            yy, zz, nn, mm = torch.meshgrid(torch.arange(ydim, device=torch_device),
-                                            torch.arange(zdim, device=torch_device),
-                                            torch.arange(n_sensor_elements, device=torch_device),
-                                            torch.arange(n_sensor_elements, device=torch_device))
-            M = values[x, yy, zz, nn] * values[x, yy, zz, mm]
-            M = torch.sign(M) * torch.sqrt(torch.abs(M))
-            # only take upper triangle without diagonal and sum up along n and m axis (last two)
-            output[x] = torch.triu(M, diagonal=1).sum(dim=(-1, -2))
+        sensor_orientations = get_sensor_orientations(detection_geometry, torch_device)
+        sums, _ = compute_delay_and_sum_sums(time_series_sensor_data, sensor_positions, xdim,
+                                             ydim, zdim, xdim_start, xdim_end, ydim_start, ydim_end,
+                                             zdim_start, zdim_end, spacing_in_mm, speed_of_sound_in_m_per_s,
+                                             time_spacing_in_ms, self.logger, torch_device,
+                                             self.component_settings,
+                                             terms=(DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS,),
+                                             sensor_orientations=sensor_orientations,
+                                             speed_of_sound_map=speed_of_sound_map,
+                                             first_time_step=first_time_step)
 
-        reconstructed = output.cpu().numpy()
-
-        return reconstructed.squeeze()
+        # construct output image
+        output = torch.zeros(sums[DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS].shape, dtype=torch.float32,
+                             device=torch_device)
+        output[:] = sums[DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS]
+        return squeeze_reconstructed_images(output)
 
 
 def reconstruct_delay_multiply_and_sum_pytorch(time_series_sensor_data: np.ndarray,
@@ -71,14 +69,15 @@ def reconstruct_delay_multiply_and_sum_pytorch(time_series_sensor_data: np.ndarr
     """
     Convenience function for reconstructing time series data using Delay and Sum algorithm implemented in PyTorch
 
-    :param time_series_sensor_data: (2D numpy array) sensor data of shape (sensor elements, time steps)
+    :param time_series_sensor_data: (2D numpy array) sensor data of shape (sensor elements, time steps) or
+        (3D numpy array) a batch of sensor data of shape (batch, sensor elements, time steps)
     :param detection_geometry: The DetectioNGeometryBase to use for the reconstruction of the given time series data
     :param speed_of_sound_in_m_per_s: (int) speed of sound in medium in meters per second (default: 1540 m/s)
     :param time_spacing_in_s: (float) time between sampling points in seconds (default: 2.5e-8 s which is equal to 40 MHz)
     :param sensor_spacing_in_mm: (float) space between sensor elements in millimeters (default: 0.1 mm)
     :param recon_mode: SIMPA Tag defining the reconstruction mode - pressure default OR differential
     :param apodization: SIMPA Tag defining the apodization function (default box)
-    :return: (2D numpy array) reconstructed image as 2D numpy array
+    :return: (2D numpy array) reconstructed image as 2D numpy array or (3D numpy array) a batch of images
     """
     # create settings
     settings = create_reconstruction_settings(speed_of_sound_in_m_per_s, time_spacing_in_s, sensor_spacing_in_mm,
@@ -0,0 +1,205 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from simpa.utils import Tags
+from simpa.core.simulation_modules.reconstruction_module import ReconstructionAdapterBase
+from simpa.core.device_digital_twins import DetectionGeometryBase
+import numpy as np
+import torch
+import torch.fft
+import torch.nn.functional
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_image_dimensions, \
+    preparing_reconstruction_and_obtaining_reconstruction_settings, squeeze_reconstructed_images
+from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
+
+
+class FKMigrationAdapter(ReconstructionAdapterBase):
+    """
+    Frequency-wavenumber (f-k) migration for linear arrays, which reconstructs the image with FFTs in
+    O(N log N) instead of summing over all pixels and sensor elements [1, 2]. The time series data is transformed into
+    the frequency-wavenumber domain, the temporal frequencies are mapped onto the axial wavenumbers of the image by
+    the dispersion relation of the wave equation and the image is obtained by an inverse FFT.
+
+    The mapping interpolates the spectrum, which can be set with Tags.RECONSTRUCTION_FK_INTERPOLATION_METHOD to
+    Tags.RECONSTRUCTION_FK_INTERPOLATION_NEAREST (fast) or Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR (accurate,
+    default). The sensor elements have to be equidistant and on a line along the x-axis.
+
+    [1] K. P. Köstli et al. 2001, "Temporal backward projection of optoacoustic pressure transients using Fourier
+    transform methods", https://doi.org/10.1088/0031-9155/46/7/309
+    [2] M. Jaeger et al. 2007, "Fourier reconstruction in optoacoustic imaging using truncated regularized inverse
+    k-space interpolation", https://doi.org/10.1088/0266-5611/23/6/S05
+    """
+
+    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase):
+        """
+        Applies the f-k migration to the time series sensor data (2D numpy array where the first dimension corresponds
+        to the sensor elements and the second to the recorded time steps, or 3D with a leading batch dimension).
+        A reconstructed image (2D numpy array) or a batch of images is returned.
+        """
+
+        time_series_sensor_data, sensor_positions, speed_of_sound_in_m_per_s, spacing_in_mm, time_spacing_in_ms, \
+            torch_device = preparing_reconstruction_and_obtaining_reconstruction_settings(
+                time_series_sensor_data, self.component_settings, self.global_settings, detection_geometry,
+                self.logger)
+
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = compute_image_dimensions(
+            detection_geometry, spacing_in_mm, self.logger)
+
+        if zdim != 1:
+            raise AttributeError("The f-k migration only reconstructs 2D images of linear arrays, but the field of "
+                                 "view extends in z direction.")
+
+        if Tags.RECONSTRUCTION_FK_INTERPOLATION_METHOD in self.component_settings:
+            interpolation_method = self.component_settings[Tags.RECONSTRUCTION_FK_INTERPOLATION_METHOD]
+        else:
+            interpolation_method = Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR
+
+        sensor_positions = sensor_positions.cpu().numpy()
+        pitch_in_mm = get_sensor_pitch(sensor_positions)
+        order = np.argsort(sensor_positions[:, 0])
+        time_series_sensor_data = time_series_sensor_data[..., torch.from_numpy(order).to(torch_device), :]
+
+        # The depth that a wave travels within one time step
+        depth_spacing_in_mm = speed_of_sound_in_m_per_s * time_spacing_in_ms
+        wavefield = fk_migration(time_series_sensor_data, pitch_in_mm, depth_spacing_in_mm, interpolation_method)
+
+        # Sample the wavefield of shape (..., sensor elements, time steps) at the pixels of the image
+        x_offset = 0.5 if xdim % 2 == 0 else 0
+        x = (xdim_start + np.arange(xdim) + x_offset) * spacing_in_mm
+        y = (ydim_start + np.arange(ydim)) * spacing_in_mm
+        lateral_indices = (x - sensor_positions[order[0], 0]) / pitch_in_mm
+        axial_indices = np.abs(y - sensor_positions[0, 2]) / depth_spacing_in_mm
+        output = sample_wavefield(wavefield, lateral_indices, axial_indices).to(torch.float32)
+
+        return squeeze_reconstructed_images(output[..., None])
+
+
+def get_sensor_pitch(sensor_positions: np.ndarray) -> float:
+    """
+    :param sensor_positions: (numpy array) sensor element positions in mm
+    :return: (float) the distance between neighbouring sensor elements in mm
+    :raises AttributeError: if the sensor elements are not equidistant on a line along the x-axis
+    """
+    x_positions = np.sort(sensor_positions[:, 0])
+    distances = np.diff(x_positions)
+    if len(distances) == 0 or not np.allclose(distances, distances[0]) or distances[0] <= 0 or \
+            not np.allclose(sensor_positions[:, 1:], sensor_positions[0, 1:]):
+        raise AttributeError("The f-k migration requires equidistant sensor elements on a line along the x-axis, "
+                             "e.g. a LinearArrayDetectionGeometry.")
+    return float(distances[0])
+
+
+def fk_migration(time_series_sensor_data: torch.Tensor, pitch_in_mm: float, depth_spacing_in_mm: float,
+                 interpolation_method: str = Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR) -> torch.Tensor:
+    """
+    Reconstructs the initial pressure below a linear array by f-k migration.
+
+    :param time_series_sensor_data: (torch tensor) time series data of shape (..., sensor elements, time steps) of
+        equidistant sensor elements that are ordered along the array
+    :param pitch_in_mm: (float) distance between neighbouring sensor elements in mm
+    :param depth_spacing_in_mm: (float) distance that the wave travels within one time step in mm
+    :param interpolation_method: (str) Tags.RECONSTRUCTION_FK_INTERPOLATION_NEAREST or
+        Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR
+    :return: (torch tensor) the initial pressure of shape (..., sensor elements, time steps) below the sensor elements
+        at the depths that correspond to the time steps
+    """
+    n_sensor_elements, n_time_steps = time_series_sensor_data.shape[-2:]
+    device = time_series_sensor_data.device
+
+    # Even extension in time, such that the spectrum is symmetric, and zero padding along the array to avoid that the
+    # wavefield wraps around laterally
+    extended_data = torch.cat([time_series_sensor_data, torch.flip(time_series_sensor_data[..., 1:], dims=(-1,))],
+                              dim=-1)
+    n_lateral = 2 * n_sensor_elements
+    n_axial = extended_data.shape[-1]
+    spectrum = torch.fft.fft2(extended_data, s=(n_lateral, n_axial))
+
+    # Lateral and axial angular wavenumbers, the temporal frequencies are given as wavenumbers omega / c
+    kx = 2 * np.pi * torch.fft.fftfreq(n_lateral, d=pitch_in_mm, device=device, dtype=torch.float64)[:, None]
+    kz = 2 * np.pi * torch.fft.fftfreq(n_axial, d=depth_spacing_in_mm, device=device, dtype=torch.float64)[None, :]
+    axial_wavenumber_spacing = 2 * np.pi / (n_axial * depth_spacing_in_mm)
+
+    # Evanescent waves are not measured
+    spectrum = spectrum * (torch.abs(kz) >= torch.abs(kx))
+
+    # The temporal frequencies that are mapped onto the axial wavenumbers of the image. As the spectrum is symmetric
+    # in time, the positive frequencies suffice.
+    k = torch.sqrt(kx ** 2 + kz ** 2)
+    source_indices = k / axial_wavenumber_spacing
+    if interpolation_method == Tags.RECONSTRUCTION_FK_INTERPOLATION_NEAREST:
+        lower_indices = torch.round(source_indices)
+        upper_weights = torch.zeros_like(source_indices)
+    elif interpolation_method == Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR:
+        lower_indices = torch.floor(source_indices)
+        upper_weights = source_indices - lower_indices
+    else:
+        raise AttributeError(f"The interpolation method {interpolation_method} is not supported by the f-k "
+                             f"migration.")
+    # Frequencies beyond the Nyquist frequency are not sampled
+    valid = source_indices <= (n_axial - 1) // 2
+    lower_indices = lower_indices.long()
+
+    def gather(indices):
+        indices = torch.remainder(indices, n_axial).expand(spectrum.shape[-2:])
+        return torch.gather(spectrum, -1, indices.expand(spectrum.shape))
+
+    migrated_spectrum = gather(lower_indices) * (1 - upper_weights) + gather(lower_indices + 1) * upper_weights
+
+    # Jacobian of the change of variables, which is 1 for the constant component
+    jacobian = torch.where(k > 0, torch.abs(kz) / torch.where(k > 0, k, torch.ones_like(k)), torch.ones_like(k))
+    migrated_spectrum = migrated_spectrum * (2 * jacobian * valid)
+
+    wavefield = torch.fft.ifft2(migrated_spectrum).real
+    return wavefield[..., :n_sensor_elements, :n_time_steps]
+
+
+def sample_wavefield(wavefield: torch.Tensor, lateral_indices: np.ndarray, axial_indices: np.ndarray) -> torch.Tensor:
+    """
+    Bilinearly interpolates the wavefield at the pixels of the image. Pixels outside of the wavefield are 0.
+
+    :param wavefield: (torch tensor) wavefield of shape (..., lateral samples, axial samples)
+    :param lateral_indices: (numpy array) fractional lateral indices of the image columns
+    :param axial_indices: (numpy array) fractional axial indices of the image rows
+    :return: (torch tensor) image of shape (..., columns, rows)
+    """
+    batch_shape = wavefield.shape[:-2]
+    n_lateral, n_axial = wavefield.shape[-2:]
+    grid_x, grid_y = np.meshgrid(lateral_indices, axial_indices, indexing="ij")
+    # grid_sample expects (x, y) coordinates that are normalized to [-1, 1] and indexes the last dimension with x
+    grid = np.stack([2 * grid_y / max(n_axial - 1, 1) - 1, 2 * grid_x / max(n_lateral - 1, 1) - 1], axis=-1)
+    grid = torch.from_numpy(grid).to(device=wavefield.device, dtype=wavefield.dtype)
+    wavefield = wavefield.reshape((-1, 1, n_lateral, n_axial))
+    image = torch.nn.functional.grid_sample(wavefield, grid.expand((wavefield.shape[0],) + grid.shape),
+                                            mode="bilinear", padding_mode="zeros", align_corners=True)
+    return image.reshape(batch_shape + grid.shape[:2])
+
+
+def reconstruct_fk_migration_pytorch(time_series_sensor_data: np.ndarray,
+                                     detection_geometry: DetectionGeometryBase,
+                                     speed_of_sound_in_m_per_s: int = 1540,
+                                     time_spacing_in_s: float = 2.5e-8,
+                                     sensor_spacing_in_mm: float = 0.1,
+                                     recon_mode: str = Tags.RECONSTRUCTION_MODE_PRESSURE,
+                                     interpolation_method: str = Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR
+                                     ) -> np.ndarray:
+    """
+    Convenience function for reconstructing time series data of a linear array using f-k migration implemented in
+    PyTorch
+
+    :param time_series_sensor_data: (2D numpy array) sensor data of shape (sensor elements, time steps) or
+        (3D numpy array) a batch of sensor data of shape (batch, sensor elements, time steps)
+    :param detection_geometry: The linear DetectionGeometryBase to use for the reconstruction
+    :param speed_of_sound_in_m_per_s: (int) speed of sound in medium in meters per second (default: 1540 m/s)
+    :param time_spacing_in_s: (float) time between sampling points in seconds (default: 2.5e-8 s which is equal to 40 MHz)
+    :param sensor_spacing_in_mm: (float) space between pixels of the reconstructed image in millimeters (default: 0.1 mm)
+    :param recon_mode: SIMPA Tag defining the reconstruction mode - pressure default OR differential
+    :param interpolation_method: SIMPA Tag defining the interpolation of the spectrum (default linear)
+    :return: (2D numpy array) reconstructed image as 2D numpy array or (3D numpy array) a batch of images
+    """
+    # create settings
+    settings = create_reconstruction_settings(speed_of_sound_in_m_per_s, time_spacing_in_s, sensor_spacing_in_mm,
+                                              recon_mode)
+    settings.get_reconstruction_settings()[Tags.RECONSTRUCTION_FK_INTERPOLATION_METHOD] = interpolation_method
+    adapter = FKMigrationAdapter(settings)
+    return adapter.reconstruction_algorithm(time_series_sensor_data, detection_geometry)
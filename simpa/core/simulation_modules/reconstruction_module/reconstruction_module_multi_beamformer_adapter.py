@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from simpa.utils import Tags
+from simpa.core.simulation_modules.reconstruction_module import DelayAndSumAdapterBase
+from simpa.core.device_digital_twins import DetectionGeometryBase
+import numpy as np
+import torch
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_and_sum_sums, \
+    preparing_reconstruction_and_obtaining_reconstruction_settings, compute_image_dimensions, \
+    DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT, DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS, \
+    DELAY_AND_SUM_TERM_SQUARED_SUM, squeeze_reconstructed_images, get_sensor_orientations
+from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
+
+# The images that can be reconstructed by the MultiBeamformerAdapter and the terms they are computed from
+BEAMFORMER_TERMS = {
+    Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS: (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT),
+    Tags.DATA_FIELD_RECONSTRUCTED_DATA_DMAS: (DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS,),
+    Tags.DATA_FIELD_RECONSTRUCTED_DATA_SDMAS: (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS),
+    Tags.DATA_FIELD_COHERENCE_FACTOR: (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT,
+                                       DELAY_AND_SUM_TERM_SQUARED_SUM),
+    Tags.DATA_FIELD_RECONSTRUCTED_DATA_CF_DAS: (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT,
+                                                DELAY_AND_SUM_TERM_SQUARED_SUM)
+}
+
+
+class MultiBeamformerAdapter(DelayAndSumAdapterBase):
+    """
+    Reconstructs several delay and sum based images from a single pass over the delayed time series data, such that
+    the delays are computed and the time series data is interpolated only once. The images are given by
+    Tags.RECONSTRUCTION_BEAMFORMERS and stored under their own data fields:
+
+    - Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS: Delay and Sum, as the DelayAndSumAdapter
+    - Tags.DATA_FIELD_RECONSTRUCTED_DATA_DMAS: Delay Multiply and Sum, as the DelayMultiplyAndSumAdapter
+    - Tags.DATA_FIELD_RECONSTRUCTED_DATA_SDMAS: signed Delay Multiply and Sum, as the
+      SignedDelayMultiplyAndSumAdapter
+    - Tags.DATA_FIELD_COHERENCE_FACTOR: the coherence factor [1] (sum s_i)^2 / (N * sum s_i^2) of the N non-zero
+      delayed values s_i of every pixel
+    - Tags.DATA_FIELD_RECONSTRUCTED_DATA_CF_DAS: Delay and Sum weighted by the coherence factor
+
+    The first image is also stored as Tags.DATA_FIELD_RECONSTRUCTED_DATA.
+
+    [1] K. W. Hollman et al. 1999, "Coherence factor of speckle from a multi-row probe",
+    https://doi.org/10.1109/ULTSYM.1999.849285
+    """
+
+    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase,
+                                 first_time_step: int = 0) -> dict:
+        """
+        Applies the beamformers given by Tags.RECONSTRUCTION_BEAMFORMERS to the time series sensor data (2D numpy
+        array where the first dimension corresponds to the sensor elements and the second to the recorded time steps)
+        with the given beamforming settings (dictionary).
+        A dictionary that maps the data fields to the reconstructed images (2D numpy arrays) is returned.
+        This implementation uses PyTorch Tensors to perform computations and is able to run on GPUs.
+        """
+        if Tags.RECONSTRUCTION_BEAMFORMERS in self.component_settings and \
+                self.component_settings[Tags.RECONSTRUCTION_BEAMFORMERS]:
+            beamformers = list(self.component_settings[Tags.RECONSTRUCTION_BEAMFORMERS])
+        else:
+            beamformers = list(BEAMFORMER_TERMS.keys())
+        for beamformer in beamformers:
+            if beamformer not in BEAMFORMER_TERMS:
+                raise ValueError(f"The beamformer {beamformer} is not supported. Please choose from "
+                                 f"{list(BEAMFORMER_TERMS.keys())}.")
+        terms = tuple(dict.fromkeys(term for beamformer in beamformers for term in BEAMFORMER_TERMS[beamformer]))
+
+        speed_of_sound_in_m_per_s, speed_of_sound_map = self.get_speed_of_sound(detection_geometry)
+        time_series_sensor_data, sensor_positions, speed_of_sound_in_m_per_s, spacing_in_mm, time_spacing_in_ms, torch_device = preparing_reconstruction_and_obtaining_reconstruction_settings(
+            time_series_sensor_data, self.component_settings, self.global_settings, detection_geometry, self.logger,
+            first_time_step, speed_of_sound_in_m_per_s)
+
+        ### ALGORITHM ITSELF ###
+
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = compute_image_dimensions(
+            detection_geometry, spacing_in_mm, self.logger)
+
+        if zdim == 1:
+            sensor_positions[:, 1] = 0  # Assume imaging plane
+
+        sensor_orientations = get_sensor_orientations(detection_geometry, torch_device)
+        sums, _ = compute_delay_and_sum_sums(time_series_sensor_data, sensor_positions, xdim,
+                                             ydim, zdim, xdim_start, xdim_end, ydim_start, ydim_end,
+                                             zdim_start, zdim_end, spacing_in_mm, speed_of_sound_in_m_per_s,
+                                             time_spacing_in_ms, self.logger, torch_device,
+                                             self.component_settings, terms=terms,
+                                             sensor_orientations=sensor_orientations,
+                                             speed_of_sound_map=speed_of_sound_map,
+                                             first_time_step=first_time_step)
+
+        # construct output images
+        images = dict()
+        for beamformer in beamformers:
+            output = torch.zeros(sums[terms[0]].shape, dtype=torch.float32, device=torch_device)
+            if beamformer == Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS:
+                torch.divide(sums[DELAY_AND_SUM_TERM_SUM], sums[DELAY_AND_SUM_TERM_COUNT], out=output)
+            elif beamformer == Tags.DATA_FIELD_RECONSTRUCTED_DATA_DMAS:
+                output[:] = sums[DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS]
+            elif beamformer == Tags.DATA_FIELD_RECONSTRUCTED_DATA_SDMAS:
+                output[:] = torch.sign(sums[DELAY_AND_SUM_TERM_SUM]) * sums[DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS]
+            else:
+                coherence_factor = compute_coherence_factor(sums[DELAY_AND_SUM_TERM_SUM],
+                                                            sums[DELAY_AND_SUM_TERM_SQUARED_SUM],
+                                                            sums[DELAY_AND_SUM_TERM_COUNT])
+                if beamformer == Tags.DATA_FIELD_COHERENCE_FACTOR:
+                    output[:] = coherence_factor
+                else:
+                    output[:] = coherence_factor * sums[DELAY_AND_SUM_TERM_SUM] / sums[DELAY_AND_SUM_TERM_COUNT]
+            images[beamformer] = squeeze_reconstructed_images(output)
+
+        images[Tags.DATA_FIELD_RECONSTRUCTED_DATA] = images[beamformers[0]]
+        return images
+
+
+def compute_coherence_factor(sum_of_values: torch.tensor, sum_of_squared_values: torch.tensor,
+                             count: torch.tensor) -> torch.tensor:
+    """
+    Computes the coherence factor (sum s_i)^2 / (N * sum s_i^2) of the N non-zero delayed values s_i of every pixel.
+    Pixels without any non-zero delayed values have a coherence factor of 0.
+
+    :param sum_of_values: the sums of the delayed values
+    :param sum_of_squared_values: the sums of the squared delayed values
+    :param count: the numbers of non-zero delayed values
+    :return: the coherence factor between 0 and 1 of every pixel
+    """
+    incoherent_sum = count * sum_of_squared_values
+    coherence_factor = sum_of_values ** 2 / torch.where(incoherent_sum > 0, incoherent_sum,
+                                                        torch.ones_like(incoherent_sum))
+    return torch.where(incoherent_sum > 0, coherence_factor, torch.zeros_like(coherence_factor))
+
+
+def reconstruct_multiple_beamformers_pytorch(time_series_sensor_data: np.ndarray,
+                                             detection_geometry: DetectionGeometryBase,
+                                             speed_of_sound_in_m_per_s: int = 1540,
+                                             time_spacing_in_s: float = 2.5e-8,
+                                             sensor_spacing_in_mm: float = 0.1,
+                                             recon_mode: str = Tags.RECONSTRUCTION_MODE_PRESSURE,
+                                             apodization: str = Tags.RECONSTRUCTION_APODIZATION_BOX,
+                                             beamformers: list = None) -> dict:
+    """
+    Convenience function for reconstructing time series data with several delay and sum based beamformers in a
+    single pass implemented in PyTorch
+
+    :param time_series_sensor_data: (2D numpy array) sensor data of shape (sensor elements, time steps) or
+        (3D numpy array) a batch of sensor data of shape (batch, sensor elements, time steps)
+    :param detection_geometry: The DetectionGeometryBase that should be used to reconstruct the given time series data
+    :param speed_of_sound_in_m_per_s: (int) speed of sound in medium in meters per second (default: 1540 m/s)
+    :param time_spacing_in_s: (float) time between sampling points in seconds (default: 2.5e-8 s which is equal to 40 MHz)
+    :param sensor_spacing_in_mm: (float) space between sensor elements in millimeters (default: 0.1 mm)
+    :param recon_mode: SIMPA Tag defining the reconstruction mode - pressure default OR differential
+    :param apodization: SIMPA Tag defining the apodization function (default box)
+    :param beamformers: (list) data fields of the images that are reconstructed (default: all)
+    :return: (dict) the reconstructed images (2D numpy arrays) or batches of images (3D numpy arrays) by data field
+    """
+    # create settings
+    settings = create_reconstruction_settings(speed_of_sound_in_m_per_s, time_spacing_in_s, sensor_spacing_in_mm,
+                                              recon_mode, apodization)
+    if beamformers is not None:
+        settings.get_reconstruction_settings()[Tags.RECONSTRUCTION_BEAMFORMERS] = beamformers
+    adapter = MultiBeamformerAdapter(settings)
+    return adapter.reconstruction_algorithm(time_series_sensor_data, detection_geometry)
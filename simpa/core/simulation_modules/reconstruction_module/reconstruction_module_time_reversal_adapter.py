@@ -2,6 +2,7 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+from simpa.core.pipeline_instrumentation import run_subprocess
 from simpa.utils import Tags
 from simpa.utils.matlab import generate_matlab_cmd
 from simpa.utils.settings import Settings
@@ -9,7 +10,6 @@ from simpa.core.simulation_modules.reconstruction_module import ReconstructionAd
 from simpa.core.device_digital_twins import LinearArrayDetectionGeometry
 import numpy as np
 import scipy.io as sio
-import subprocess
 import os
 
 
@@ -37,23 +37,47 @@ class TimeReversalAdapter(ReconstructionAdapterBase):
         :param detection_geometry: PA device that is used for reconstruction
         """
 
-        if Tags.ACOUSTIC_SIMULATION_3D not in self.component_settings or not \
-                self.component_settings[Tags.ACOUSTIC_SIMULATION_3D]:
-            axes = (0, 1)
-        else:
-            axes = (0, 2)
+        spacing_in_mm = self.get_spacing_in_mm()
+        sensor_map, _ = self.create_sensor_map(detection_geometry, spacing_in_mm)
 
-        pa_device = detection_geometry
-        pa_device.check_settings_prerequisites(self.global_settings)
+        # TODO: Include possibility to
+        possible_acoustic_properties = [Tags.DATA_FIELD_SPEED_OF_SOUND,
+                                        Tags.DATA_FIELD_DENSITY,
+                                        Tags.DATA_FIELD_ALPHA_COEFF
+                                        ]
+        input_data[Tags.KWAVE_PROPERTY_SENSOR_MASK] = sensor_map
+
+        for acoustic_property in possible_acoustic_properties:
+            if acoustic_property in self.component_settings:
+                try:
+                    input_data[acoustic_property] = self.component_settings[acoustic_property]
+                except ValueError or KeyError:
+                    self.logger.error("{} not specified.".format(acoustic_property))
+
+        return input_data, spacing_in_mm
 
-        # spacing
+    def get_spacing_in_mm(self) -> float:
+        """
+        :return: the spacing of the grid of the time reversal in mm
+        """
         if Tags.SPACING_MM in self.component_settings and self.component_settings[Tags.SPACING_MM]:
-            spacing_in_mm = self.component_settings[Tags.SPACING_MM]
+            return self.component_settings[Tags.SPACING_MM]
         elif Tags.SPACING_MM in self.global_settings and self.global_settings[Tags.SPACING_MM]:
-            spacing_in_mm = self.global_settings[Tags.SPACING_MM]
+            return self.global_settings[Tags.SPACING_MM]
         else:
             raise AttributeError("Please specify a value for SPACING_MM")
 
+    def create_sensor_map(self, detection_geometry, spacing_in_mm: float):
+        """
+        Creates the binary sensor mask of the time reversal on a grid that covers the simulated volume.
+
+        :param detection_geometry: PA device that is used for reconstruction
+        :param spacing_in_mm: the spacing of the grid in mm
+        :return: the sensor mask of shape (z, x) or, for 3D simulations, (z, y, x) and a tuple with the indices of
+            the grid voxels of the detector elements in the order of the detector elements
+        """
+        detection_geometry.check_settings_prerequisites(self.global_settings)
+
         detector_positions = detection_geometry.get_detector_element_positions_accounting_for_device_position_mm()
         detector_positions_voxels = np.round(detector_positions / spacing_in_mm).astype(int)
 
@@ -66,38 +90,48 @@ class TimeReversalAdapter(ReconstructionAdapterBase):
         if Tags.ACOUSTIC_SIMULATION_3D not in self.component_settings or not \
                 self.component_settings[Tags.ACOUSTIC_SIMULATION_3D]:
             sizes = (volume_z_dim, volume_x_dim)
-            sensor_map = np.zeros(sizes)
-            sensor_map[detector_positions_voxels[:, 2]+1, detector_positions_voxels[:, 0]+1] = 1
+            sensor_indices = (detector_positions_voxels[:, 2]+1, detector_positions_voxels[:, 0]+1)
         else:
             sizes = (volume_z_dim, volume_y_dim, volume_x_dim)
-            sensor_map = np.zeros(sizes)
-            sensor_map[detector_positions_voxels[:, 2]+1,
-                       detector_positions_voxels[:, 1]+1,
-                       detector_positions_voxels[:, 0]+1] = 1
+            sensor_indices = (detector_positions_voxels[:, 2]+1,
+                              detector_positions_voxels[:, 1]+1,
+                              detector_positions_voxels[:, 0]+1)
+        sensor_map = np.zeros(sizes)
+        sensor_map[sensor_indices] = 1
 
         # check that the spacing is large enough for all detector elements to be on the sensor map
         det_elements_sensor_map = np.count_nonzero(sensor_map)
-        if det_elements_sensor_map != pa_device.number_detector_elements:
+        if det_elements_sensor_map != detection_geometry.number_detector_elements:
             raise AttributeError("The spacing is too large to fit every detector element on the sensor map."
                                  "Please increase it! "
-                                 f"Expected {pa_device.number_detector_elements} elements but it "
+                                 f"Expected {detection_geometry.number_detector_elements} elements but it "
                                  f"were {det_elements_sensor_map}.")
+        return sensor_map, sensor_indices
 
-        # TODO: Include possibility to
-        possible_acoustic_properties = [Tags.DATA_FIELD_SPEED_OF_SOUND,
-                                        Tags.DATA_FIELD_DENSITY,
-                                        Tags.DATA_FIELD_ALPHA_COEFF
-                                        ]
-        input_data[Tags.KWAVE_PROPERTY_SENSOR_MASK] = sensor_map
-
-        for acoustic_property in possible_acoustic_properties:
-            if acoustic_property in self.component_settings:
-                try:
-                    input_data[acoustic_property] = self.component_settings[acoustic_property]
-                except ValueError or KeyError:
-                    self.logger.error("{} not specified.".format(acoustic_property))
+    def crop_to_field_of_view(self, reconstructed_data: np.ndarray, detection_geometry,
+                              spacing_in_mm: float) -> np.ndarray:
+        """
+        Crops the reconstructed data of shape (x, z) or (x, y, z) to the field of view of the detection geometry.
+        """
+        field_of_view_mm = detection_geometry.get_field_of_view_mm()
+        field_of_view_voxels = (field_of_view_mm / spacing_in_mm).astype(np.int32)
+        self.logger.debug(f"FOV (voxels): {field_of_view_voxels}")
+        # In case it should be cropped from A to A, then crop from A to A+1
+        x_offset_correct = 1 if (field_of_view_voxels[1] - field_of_view_voxels[0]) < 1 else 0
+        y_offset_correct = 1 if (field_of_view_voxels[3] - field_of_view_voxels[2]) < 1 else 0
+        z_offset_correct = 1 if (field_of_view_voxels[5] - field_of_view_voxels[4]) < 1 else 0
 
-        return input_data, spacing_in_mm
+        if len(np.shape(reconstructed_data)) == 2:
+            reconstructed_data = np.squeeze(reconstructed_data[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
+                                                               field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct])
+        elif len(np.shape(reconstructed_data)) == 3:
+            reconstructed_data = np.squeeze(reconstructed_data[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
+                                                               field_of_view_voxels[2]:field_of_view_voxels[3] + y_offset_correct,
+                                                               field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct])
+        else:
+            self.logger.critical("Unexpected number of dimensions in reconstructed image. "
+                                 f"Expected 2 or 3 but was {len(np.shape(reconstructed_data))}")
+        return reconstructed_data
 
     def reorder_time_series_data(self, time_series_sensor_data, detection_geometry):
         """
@@ -174,30 +208,13 @@ class TimeReversalAdapter(ReconstructionAdapterBase):
         cur_dir = os.getcwd()
         os.chdir(self.global_settings[Tags.SIMULATION_PATH])
         self.logger.info(cmd)
-        subprocess.run(cmd)
+        run_subprocess(cmd)
 
         reconstructed_data = sio.loadmat(acoustic_path + "tr.mat")[Tags.DATA_FIELD_RECONSTRUCTED_DATA]
 
         reconstructed_data = np.flipud(np.rot90(reconstructed_data, 1, axes))
 
-        field_of_view_mm = detection_geometry.get_field_of_view_mm()
-        field_of_view_voxels = (field_of_view_mm / spacing_in_mm).astype(np.int32)
-        self.logger.debug(f"FOV (voxels): {field_of_view_voxels}")
-        # In case it should be cropped from A to A, then crop from A to A+1
-        x_offset_correct = 1 if (field_of_view_voxels[1] - field_of_view_voxels[0]) < 1 else 0
-        y_offset_correct = 1 if (field_of_view_voxels[3] - field_of_view_voxels[2]) < 1 else 0
-        z_offset_correct = 1 if (field_of_view_voxels[5] - field_of_view_voxels[4]) < 1 else 0
-
-        if len(np.shape(reconstructed_data)) == 2:
-            reconstructed_data = np.squeeze(reconstructed_data[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
-                                                               field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct])
-        elif len(np.shape(reconstructed_data)) == 3:
-            reconstructed_data = np.squeeze(reconstructed_data[field_of_view_voxels[0]:field_of_view_voxels[1] + x_offset_correct,
-                                                               field_of_view_voxels[2]:field_of_view_voxels[3] + y_offset_correct,
-                                                               field_of_view_voxels[4]:field_of_view_voxels[5] + z_offset_correct])
-        else:
-            self.logger.critical("Unexpected number of dimensions in reconstructed image. "
-                                 f"Expected 2 or 3 but was {len(np.shape(reconstructed_data))}")
+        reconstructed_data = self.crop_to_field_of_view(reconstructed_data, detection_geometry, spacing_in_mm)
 
         os.chdir(cur_dir)
         os.remove(acoustic_path)
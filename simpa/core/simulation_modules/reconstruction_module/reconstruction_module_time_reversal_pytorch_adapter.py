@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from simpa.utils import Tags
+from simpa.utils.processing_device import get_processing_device
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_time_reversal_adapter import \
+    TimeReversalAdapter
+import numpy as np
+import torch
+import torch.fft
+
+# Default number of grid points of the perfectly matched layer around the grid
+DEFAULT_PML_SIZE = 20
+
+# Default absorption of the perfectly matched layer in nepers per grid point
+DEFAULT_PML_ALPHA = 2.0
+
+
+class PyTorchTimeReversalAdapter(TimeReversalAdapter):
+    """
+    Time reversal reconstruction with a k-space pseudospectral solver of the first-order acoustic equations that is
+    implemented in PyTorch, such that neither MATLAB nor k-Wave are needed. It uses the same grid and sensor mask as
+    the TimeReversalAdapter and runs multithreaded on the CPU or on the GPU, if Tags.GPU is set.
+
+    The recorded time series data is enforced as a Dirichlet boundary condition at the sensor mask in time reversed
+    order and the pressure at the end of the simulation is the reconstructed initial pressure::
+
+        Treeby, Bradley E., Edward Z. Zhang, and Benjamin T. Cox.
+        "Photoacoustic tomography in absorbing acoustic media using
+        time reversal." Inverse Problems 26.11 (2010): 115003.
+
+    The medium is lossless, i.e. Tags.DATA_FIELD_ALPHA_COEFF is not taken into account. The grid is surrounded by a
+    perfectly matched layer of Tags.KWAVE_PROPERTY_PMLSize grid points with the absorption
+    Tags.KWAVE_PROPERTY_PMLAlpha.
+    """
+
+    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry):
+        spacing_in_mm = self.get_spacing_in_mm()
+        sensor_map, sensor_indices = self.create_sensor_map(detection_geometry, spacing_in_mm)
+
+        if Tags.K_WAVE_SPECIFIC_DT in self.global_settings and self.global_settings[Tags.K_WAVE_SPECIFIC_DT]:
+            time_spacing_in_s = self.global_settings[Tags.K_WAVE_SPECIFIC_DT]
+        else:
+            time_spacing_in_s = 1 / (self.component_settings[Tags.SENSOR_SAMPLING_RATE_MHZ] * 1000000)
+
+        if Tags.DATA_FIELD_SPEED_OF_SOUND in self.component_settings:
+            sound_speed = self.component_settings[Tags.DATA_FIELD_SPEED_OF_SOUND]
+        else:
+            sound_speed = 1540
+        if Tags.DATA_FIELD_DENSITY in self.component_settings:
+            density = self.component_settings[Tags.DATA_FIELD_DENSITY]
+        else:
+            density = 1000
+
+        pml_size = DEFAULT_PML_SIZE
+        if Tags.KWAVE_PROPERTY_PMLSize in self.component_settings:
+            pml_size = int(np.max(self.component_settings[Tags.KWAVE_PROPERTY_PMLSize]))
+        pml_alpha = DEFAULT_PML_ALPHA
+        if Tags.KWAVE_PROPERTY_PMLAlpha in self.component_settings:
+            pml_alpha = self.component_settings[Tags.KWAVE_PROPERTY_PMLAlpha]
+
+        reconstructed_data, _ = simulate_kspace_first_order(
+            sensor_map.shape, spacing_in_mm / 1000, time_spacing_in_s, np.shape(time_series_sensor_data)[1],
+            sensor_indices, sound_speed, density, time_reversal_boundary_data=time_series_sensor_data,
+            pml_size=pml_size, pml_alpha=pml_alpha, torch_device=get_processing_device(self.global_settings))
+
+        # The grid is ordered (z, x) or (z, y, x)
+        reconstructed_data = np.transpose(reconstructed_data)
+        return self.crop_to_field_of_view(reconstructed_data, detection_geometry, spacing_in_mm)
+
+
+def _get_pml(n_grid_points: int, pml_size: int, pml_alpha: float, sound_speed: float, spacing_in_m: float,
+             time_spacing_in_s: float, staggered: bool) -> np.ndarray:
+    """
+    :return: the attenuation per half time step of the perfectly matched layer along one axis of the padded grid
+    """
+    positions = np.arange(n_grid_points, dtype=np.float64) + (0.5 if staggered else 0)
+    depth = np.maximum(np.maximum(pml_size - positions, positions - (n_grid_points - 1 - pml_size)), 0)
+    absorption = pml_alpha * sound_speed / spacing_in_m * (depth / max(pml_size, 1)) ** 4
+    return np.exp(-absorption * time_spacing_in_s / 2)
+
+
+def simulate_kspace_first_order(grid_shape: tuple, spacing_in_m: float, time_spacing_in_s: float,
+                                n_time_steps: int, sensor_indices: tuple, sound_speed=1540, density=1000,
+                                initial_pressure: np.ndarray = None, time_reversal_boundary_data: np.ndarray = None,
+                                pml_size: int = DEFAULT_PML_SIZE, pml_alpha: float = DEFAULT_PML_ALPHA,
+                                torch_device: torch.device = torch.device("cpu")):
+    """
+    Simulates the propagation of a pressure field with a k-space pseudospectral solver of the linear, lossless
+    first-order acoustic equations on a staggered grid, as in k-Wave.
+
+    :param grid_shape: (tuple) shape of the 2D or 3D grid
+    :param spacing_in_m: (float) isotropic spacing of the grid in m
+    :param time_spacing_in_s: (float) time step in s
+    :param n_time_steps: (int) number of time steps
+    :param sensor_indices: (tuple) one array per dimension with the grid indices of the sensor points
+    :param sound_speed: speed of sound in m/s, a number or an array of the grid shape
+    :param density: density in kg/m^3, a number or an array of the grid shape
+    :param initial_pressure: (numpy array) initial pressure of the grid shape or None
+    :param time_reversal_boundary_data: (numpy array) time series data of shape (sensor points, time steps) that is
+        enforced at the sensor points in time reversed order or None
+    :param pml_size: (int) number of grid points of the perfectly matched layer that is added around the grid
+    :param pml_alpha: (float) absorption of the perfectly matched layer in nepers per grid point
+    :param torch_device: (torch device) device on which the simulation is run
+    :return: the pressure of the grid shape after the last time step and the pressure of shape
+        (sensor points, time steps) that was recorded at the sensor points at the beginning of every time step
+    """
+    n_dimensions = len(grid_shape)
+    padded_shape = tuple(n + 2 * pml_size for n in grid_shape)
+    grid = tuple(slice(pml_size, pml_size + n) for n in grid_shape)
+    dtype = torch.float32
+
+    def pad(values) -> torch.Tensor:
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), grid_shape)
+        return torch.from_numpy(np.pad(values, pml_size, mode="edge")).to(device=torch_device, dtype=dtype)
+
+    sound_speed = pad(sound_speed)
+    density = pad(density)
+    reference_sound_speed = float(sound_speed.max())
+
+    # Wavenumbers of the real-valued FFT, which halves the last dimension
+    wavenumbers = []
+    for dimension, n in enumerate(padded_shape):
+        if dimension == n_dimensions - 1:
+            k = 2 * np.pi * np.fft.rfftfreq(n, d=spacing_in_m)
+        else:
+            k = 2 * np.pi * np.fft.fftfreq(n, d=spacing_in_m)
+        shape = [1] * n_dimensions
+        shape[dimension] = len(k)
+        wavenumbers.append(k.reshape(shape))
+    k = np.sqrt(sum(wavenumber ** 2 for wavenumber in wavenumbers))
+    # k-space correction of the finite difference in time
+    kappa = np.sinc(reference_sound_speed * k * time_spacing_in_s / (2 * np.pi))
+
+    def to_tensor(values: np.ndarray) -> torch.Tensor:
+        return torch.from_numpy(values).to(device=torch_device, dtype=torch.complex64)
+
+    # Spectral derivatives from the regular to the staggered grid and back
+    derivatives_to_staggered = [to_tensor(1j * wavenumber * np.exp(1j * wavenumber * spacing_in_m / 2) * kappa)
+                                for wavenumber in wavenumbers]
+    derivatives_from_staggered = [to_tensor(1j * wavenumber * np.exp(-1j * wavenumber * spacing_in_m / 2) * kappa)
+                                  for wavenumber in wavenumbers]
+
+    pml = []
+    pml_staggered = []
+    for dimension, n in enumerate(padded_shape):
+        shape = [1] * n_dimensions
+        shape[dimension] = n
+        for staggered, pmls in [(False, pml), (True, pml_staggered)]:
+            pmls.append(torch.from_numpy(_get_pml(n, pml_size, pml_alpha, reference_sound_speed, spacing_in_m,
+                                                  time_spacing_in_s, staggered).reshape(shape)).to(
+                device=torch_device, dtype=dtype))
+
+    sensor_indices = tuple(torch.as_tensor(np.asarray(indices) + pml_size, device=torch_device)
+                           for indices in sensor_indices)
+    squared_sound_speed = sound_speed ** 2
+
+    pressure = torch.zeros(padded_shape, device=torch_device, dtype=dtype)
+    if initial_pressure is not None:
+        pressure[grid] = torch.as_tensor(initial_pressure, device=torch_device, dtype=dtype)
+    particle_velocities = [torch.zeros_like(pressure) for _ in range(n_dimensions)]
+    densities = [pressure / (n_dimensions * squared_sound_speed) for _ in range(n_dimensions)]
+    if time_reversal_boundary_data is not None:
+        time_reversal_boundary_data = torch.as_tensor(np.ascontiguousarray(time_reversal_boundary_data),
+                                                      device=torch_device, dtype=dtype)
+
+    sensor_data = torch.zeros((len(sensor_indices[0]), n_time_steps), device=torch_device, dtype=dtype)
+    dimensions = tuple(range(n_dimensions))
+    for time_step in range(n_time_steps):
+        sensor_data[:, time_step] = pressure[sensor_indices]
+        pressure_spectrum = torch.fft.rfftn(pressure, dim=dimensions)
+        for dimension in dimensions:
+            gradient = torch.fft.irfftn(derivatives_to_staggered[dimension] * pressure_spectrum, s=padded_shape,
+                                        dim=dimensions)
+            particle_velocities[dimension] = pml_staggered[dimension] * (
+                pml_staggered[dimension] * particle_velocities[dimension] - time_spacing_in_s / density * gradient)
+        for dimension in dimensions:
+            divergence = torch.fft.irfftn(derivatives_from_staggered[dimension] *
+                                          torch.fft.rfftn(particle_velocities[dimension], dim=dimensions),
+                                          s=padded_shape, dim=dimensions)
+            densities[dimension] = pml[dimension] * (
+                pml[dimension] * densities[dimension] - time_spacing_in_s * density * divergence)
+
+        if time_reversal_boundary_data is not None:
+            boundary_pressure = time_reversal_boundary_data[:, n_time_steps - 1 - time_step]
+            boundary_density = boundary_pressure / (n_dimensions * squared_sound_speed[sensor_indices])
+            for dimension in dimensions:
+                densities[dimension][sensor_indices] = boundary_density
+
+        pressure = squared_sound_speed * sum(densities)
+
+    return pressure[grid].cpu().numpy(), sensor_data.cpu().numpy()
@@ -9,6 +9,11 @@ from simpa.utils.processing_device import get_processing_device
 from simpa.utils.settings import Settings
 from simpa.io_handling.io_hdf5 import load_data_field
 from simpa.utils import Tags
+from simpa.utils.hashing import compute_hash
+from simpa.core.simulation_modules.reconstruction_module.delay_table_cache import DelayTable, delay_table_cache, \
+    DELAY_TABLE_WEIGHT_DTYPE
+from simpa.core.simulation_modules.reconstruction_module.travel_time_maps import SpeedOfSoundMap, TravelTimeMaps, \
+    get_speed_of_sound_map
 import torch
 import torch.fft
 from torch import Tensor
@@ -320,23 +325,29 @@ def apply_b_mode(data: np.ndarray = None, method: str = None) -> np.ndarray:
 
 
 def reconstruction_mode_transformation(time_series_sensor_data: torch.tensor = None,
-                                       mode: str = Tags.RECONSTRUCTION_MODE_PRESSURE) -> torch.tensor:
+                                       mode: str = Tags.RECONSTRUCTION_MODE_PRESSURE,
+                                       first_time_step: int = 0) -> torch.tensor:
     """
     Transformes `time_series_sensor_data` for other modes, for example `Tags.RECONSTRUCTION_MODE_DIFFERENTIAL`.
     Default mode is `Tags.RECONSTRUCTION_MODE_PRESSURE`.
 
-    :param time_series_sensor_data: (torch tensor) Time series data to be transformed
+    :param time_series_sensor_data: (torch tensor) Time series data to be transformed, the last dimension of which is
+                                     the time
     :param mode: (str) reconstruction mode: Tags.RECONSTRUCTION_MODE_PRESSURE (default)
                 or Tags.RECONSTRUCTION_MODE_DIFFERENTIAL
+    :param first_time_step: (int) index of the first time step of time series data that has been cropped to a time
+                            gate, which offsets the time of the differential mode
     :return: (torch tensor) potentially transformed tensor
     """
 
     # depending on mode use pressure data or its derivative
     if mode == Tags.RECONSTRUCTION_MODE_DIFFERENTIAL:
-        zeros = torch.zeros([time_series_sensor_data.shape[0], 1], names=None).to(time_series_sensor_data.device)
-        time_vector = torch.arange(1, time_series_sensor_data.shape[1]+1).to(time_series_sensor_data.device)
-        time_derivative_pressure = time_series_sensor_data[:, 1:] - time_series_sensor_data[:, 0:-1]
-        time_derivative_pressure = torch.cat([time_derivative_pressure, zeros], dim=1)
+        zeros = torch.zeros(time_series_sensor_data.shape[:-1] + (1,), dtype=time_series_sensor_data.dtype,
+                            device=time_series_sensor_data.device)
+        time_vector = torch.arange(first_time_step + 1, first_time_step + time_series_sensor_data.shape[-1] + 1).to(
+            time_series_sensor_data.device)
+        time_derivative_pressure = time_series_sensor_data[..., 1:] - time_series_sensor_data[..., 0:-1]
+        time_derivative_pressure = torch.cat([time_derivative_pressure, zeros], dim=-1)
         time_derivative_pressure = torch.mul(time_derivative_pressure, time_vector)
         output = time_derivative_pressure  # use time derivative pressure
     elif mode == Tags.RECONSTRUCTION_MODE_PRESSURE:
@@ -347,13 +358,84 @@ def reconstruction_mode_transformation(time_series_sensor_data: torch.tensor = N
     return output
 
 
+def get_reconstruction_speed_of_sound(component_settings: Settings, global_settings: Settings) -> float:
+    """
+    :param component_settings: (Settings) settings for the reconstruction module
+    :param global_settings: (Settings) the settings of the simulation
+    :return: (float) the given speed of sound in m/s or the average of the simulated speed of sound
+    """
+    if Tags.DATA_FIELD_SPEED_OF_SOUND in component_settings and component_settings[Tags.DATA_FIELD_SPEED_OF_SOUND]:
+        return component_settings[Tags.DATA_FIELD_SPEED_OF_SOUND]
+    elif Tags.WAVELENGTH in global_settings and global_settings[Tags.WAVELENGTH]:
+        sound_speed_m = load_data_field(global_settings[Tags.SIMPA_OUTPUT_PATH], Tags.DATA_FIELD_SPEED_OF_SOUND)
+        return np.mean(sound_speed_m)
+    else:
+        raise AttributeError("Please specify a value for DATA_FIELD_SPEED_OF_SOUND "
+                             "or WAVELENGTH to obtain the average speed of sound")
+
+
+def load_reconstruction_speed_of_sound(component_settings: Settings, global_settings: Settings,
+                                       detection_geometry: DetectionGeometryBase) -> Tuple[float, SpeedOfSoundMap]:
+    """
+    Loads the speed of sound of the reconstruction, see get_reconstruction_speed_of_sound, and the speed of sound map,
+    see get_speed_of_sound_map, such that the simulated speed of sound is loaded at most once. If the map is loaded,
+    the average speed of sound is computed from it.
+
+    :param component_settings: (Settings) settings for the reconstruction module
+    :param global_settings: (Settings) the settings of the simulation
+    :param detection_geometry: (DetectionGeometryBase) the detection geometry
+    :return: (float) the speed of sound in m/s and (SpeedOfSoundMap) the speed of sound map or None
+    """
+    speed_of_sound_map = get_speed_of_sound_map(component_settings, global_settings, detection_geometry)
+    if speed_of_sound_map is not None and not (Tags.DATA_FIELD_SPEED_OF_SOUND in component_settings and
+                                               component_settings[Tags.DATA_FIELD_SPEED_OF_SOUND]):
+        return float(np.mean(speed_of_sound_map.speed_of_sound_in_m_per_s)), speed_of_sound_map
+    return get_reconstruction_speed_of_sound(component_settings, global_settings), speed_of_sound_map
+
+
+def get_reconstruction_time_spacing_in_ms(global_settings: Settings,
+                                          detection_geometry: DetectionGeometryBase) -> float:
+    """
+    :param global_settings: (Settings) the settings of the simulation
+    :param detection_geometry: (DetectionGeometryBase) the detection geometry
+    :return: (float) the k-Wave specific time step or the inverse of the sampling rate of the device in ms
+    """
+    if Tags.K_WAVE_SPECIFIC_DT in global_settings and global_settings[Tags.K_WAVE_SPECIFIC_DT]:
+        return global_settings[Tags.K_WAVE_SPECIFIC_DT] * 1000
+    elif detection_geometry.sampling_frequency_MHz is not None:
+        return 1.0 / (detection_geometry.sampling_frequency_MHz * 1000)
+    else:
+        raise AttributeError("Please specify a value for SENSOR_SAMPLING_RATE_MHZ or K_WAVE_SPECIFIC_DT")
+
+
+def get_reconstruction_spacing_in_mm(component_settings: Settings, global_settings: Settings,
+                                     logger: Logger) -> float:
+    """
+    :param component_settings: (Settings) settings for the reconstruction module
+    :param global_settings: (Settings) the settings of the simulation
+    :param logger: (Logger) logger for debugging purposes
+    :return: (float) the spacing of the reconstructed image from the component settings or the global settings in mm
+    """
+    if Tags.SPACING_MM in component_settings and component_settings[Tags.SPACING_MM]:
+        spacing_in_mm = component_settings[Tags.SPACING_MM]
+        logger.debug(f"Reconstructing with spacing from component_settings: {spacing_in_mm}")
+    elif Tags.SPACING_MM in global_settings and global_settings[Tags.SPACING_MM]:
+        spacing_in_mm = global_settings[Tags.SPACING_MM]
+        logger.debug(f"Reconstructing with spacing from global_settings: {spacing_in_mm}")
+    else:
+        raise AttributeError("Please specify a value for SPACING_MM in either the component_settings or"
+                             "the global_settings.")
+    return spacing_in_mm
+
+
 def preparing_reconstruction_and_obtaining_reconstruction_settings(
         time_series_sensor_data: np.ndarray, component_settings: Settings, global_settings: Settings,
-        detection_geometry: DetectionGeometryBase, logger: Logger) -> Tuple[torch.tensor, torch.tensor,
-                                                                            float, float, float,
-                                                                            torch.device]:
+        detection_geometry: DetectionGeometryBase, logger: Logger, first_time_step: int = 0,
+        speed_of_sound_in_m_per_s: float = None) -> Tuple[torch.tensor, torch.tensor, float, float, float,
+                                                          torch.device]:
     """
-    Performs all preparation steps that need to be done before reconstructing an image:
+    Performs all preparation steps that need to be done before reconstructing an image or a batch of images, e.g. of
+    several wavelengths or frames:
     - performs envelope detection of time series data if specified
     - obtains speed of sound value from settings
     - obtains time spacing value from settings or PA device
@@ -364,9 +446,14 @@ def preparing_reconstruction_and_obtaining_reconstruction_settings(
     - computed differential mode if specified
     - perform bandpass filtering if specified
 
+    If the time series data has been cropped to a time gate, see compute_delay_and_sum_time_gate, first_time_step is
+    the index of its first time step in the recorded time series data. If the speed_of_sound_in_m_per_s has already
+    been loaded, e.g. by load_reconstruction_speed_of_sound, it is not loaded again.
+
     Returns:
 
-    time_series_sensor_data: (torch tensor) potentially preprocessed time series data
+    time_series_sensor_data: (torch tensor) potentially preprocessed time series data of shape (sensor elements,
+    time steps) or (batch, sensor elements, time steps)
     sensor_positions: (torch tensor) sensor element positions of PA device
     speed_of_sound_in_m_per_s: (float) speed of sound in m/s
     spacing_in_mm: (float) spacing of voxels in reconstructed image in mm
@@ -378,35 +465,16 @@ def preparing_reconstruction_and_obtaining_reconstruction_settings(
     # check settings dictionary for elements and read them in
 
     # speed of sound: use given speed of sound, otherwise use average from simulation if specified
-    if Tags.DATA_FIELD_SPEED_OF_SOUND in component_settings and component_settings[Tags.DATA_FIELD_SPEED_OF_SOUND]:
-        speed_of_sound_in_m_per_s = component_settings[Tags.DATA_FIELD_SPEED_OF_SOUND]
-    elif Tags.WAVELENGTH in global_settings and global_settings[Tags.WAVELENGTH]:
-        sound_speed_m = load_data_field(global_settings[Tags.SIMPA_OUTPUT_PATH], Tags.DATA_FIELD_SPEED_OF_SOUND)
-        speed_of_sound_in_m_per_s = np.mean(sound_speed_m)
-    else:
-        raise AttributeError("Please specify a value for DATA_FIELD_SPEED_OF_SOUND "
-                             "or WAVELENGTH to obtain the average speed of sound")
+    if speed_of_sound_in_m_per_s is None:
+        speed_of_sound_in_m_per_s = get_reconstruction_speed_of_sound(component_settings, global_settings)
 
     # time spacing: use kWave specific dt from simulation if set, otherwise sampling rate if specified,
-    if Tags.K_WAVE_SPECIFIC_DT in global_settings and global_settings[Tags.K_WAVE_SPECIFIC_DT]:
-        time_spacing_in_ms = global_settings[Tags.K_WAVE_SPECIFIC_DT] * 1000
-    elif detection_geometry.sampling_frequency_MHz is not None:
-        time_spacing_in_ms = 1.0 / (detection_geometry.sampling_frequency_MHz * 1000)
-    else:
-        raise AttributeError("Please specify a value for SENSOR_SAMPLING_RATE_MHZ or K_WAVE_SPECIFIC_DT")
+    time_spacing_in_ms = get_reconstruction_time_spacing_in_ms(global_settings, detection_geometry)
 
     logger.debug(f"Using a time_spacing of {time_spacing_in_ms}")
 
     # spacing
-    if Tags.SPACING_MM in component_settings and component_settings[Tags.SPACING_MM]:
-        spacing_in_mm = component_settings[Tags.SPACING_MM]
-        logger.debug(f"Reconstructing with spacing from component_settings: {spacing_in_mm}")
-    elif Tags.SPACING_MM in global_settings and global_settings[Tags.SPACING_MM]:
-        spacing_in_mm = global_settings[Tags.SPACING_MM]
-        logger.debug(f"Reconstructing with spacing from global_settings: {spacing_in_mm}")
-    else:
-        raise AttributeError("Please specify a value for SPACING_MM in either the component_settings or"
-                             "the global_settings.")
+    spacing_in_mm = get_reconstruction_spacing_in_mm(component_settings, global_settings, logger)
 
     # get device specific sensor positions
     sensor_positions = detection_geometry.get_detector_element_positions_base_mm()
@@ -429,17 +497,19 @@ def preparing_reconstruction_and_obtaining_reconstruction_settings(
     time_series_sensor_data = time_series_sensor_data.to(torch_device)
 
     # array must be of correct dimension
-    assert time_series_sensor_data.ndim == 2, 'Time series data must have exactly 2 dimensions' \
-                                              ', one for the sensor elements and one for time. ' \
-                                              'Stack images and sensor positions for 3D reconstruction' \
-                                              'Apply beamforming per wavelength if you have a 3D array. '
+    assert time_series_sensor_data.ndim in (2, 3), 'Time series data must have 2 dimensions' \
+                                                   ', one for the sensor elements and one for time, or 3 dimensions ' \
+                                                   'with an additional leading batch dimension, e.g. for several ' \
+                                                   'wavelengths or frames. ' \
+                                                   'Stack images and sensor positions for 3D reconstruction.'
 
     # check reconstruction mode - pressure by default
     if Tags.RECONSTRUCTION_MODE in component_settings:
         mode = component_settings[Tags.RECONSTRUCTION_MODE]
     else:
         mode = Tags.RECONSTRUCTION_MODE_PRESSURE
-    time_series_sensor_data = reconstruction_mode_transformation(time_series_sensor_data, mode=mode)
+    time_series_sensor_data = reconstruction_mode_transformation(time_series_sensor_data, mode=mode,
+                                                                 first_time_step=first_time_step)
 
     return (time_series_sensor_data, sensor_positions, speed_of_sound_in_m_per_s, spacing_in_mm,
             time_spacing_in_ms, torch_device)
@@ -507,28 +577,413 @@ def compute_image_dimensions(detection_geometry: DetectionGeometryBase, spacing_
     return xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end
 
 
-def compute_delay_and_sum_values(time_series_sensor_data: Tensor, sensor_positions: torch.tensor, xdim: int,
-                                 ydim: int, zdim: int, xdim_start: int, xdim_end: int, ydim_start: int, ydim_end: int,
-                                 zdim_start: int, zdim_end: int, spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
-                                 time_spacing_in_ms: float, logger: Logger, torch_device: torch.device,
-                                 component_settings: Settings) -> Tuple[torch.tensor, int]:
+# Default upper bound of the memory that is used for the intermediate values of the delay and sum computation
+DEFAULT_RECONSTRUCTION_MEMORY_BUDGET_BYTES = 256 * 1024 ** 2
+
+# Terms that can be accumulated by compute_delay_and_sum_sums
+DELAY_AND_SUM_TERM_SUM = "sum"
+DELAY_AND_SUM_TERM_COUNT = "count"
+DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS = "pairwise_products"
+DELAY_AND_SUM_TERM_SQUARED_SUM = "squared_sum"
+
+
+def get_memory_budget_in_bytes(component_settings: Settings) -> int:
     """
-    Perform the core computation of Delay and Sum, without summing up the delay dependend values.
+    :param component_settings: (Settings) settings for the reconstruction module
+    :return: (int) the memory budget given by Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES or the default budget
+    """
+    if Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES in component_settings and \
+            component_settings[Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES]:
+        return component_settings[Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES]
+    return DEFAULT_RECONSTRUCTION_MEMORY_BUDGET_BYTES
 
-    Returns
-    - values (torch tensor) of the time series data corrected for delay and sensor positioning, ready to be summed up
-    - and n_sensor_elements (int) which might be used for later computations
+
+def compute_delay_and_sum_tile_size(n_sensor_elements: int, terms: tuple, component_settings: Settings,
+                                    batch_size: int = 1) -> int:
     """
+    Computes the number of pixels that are processed at once, such that the intermediate values of the delay and
+    sum computation fit into the memory budget given by Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES.
 
-    if time_series_sensor_data.shape[0] < sensor_positions.shape[0]:
-        logger.warning("Warning: The time series data has less sensor element entries than the given sensor positions. "
-                       "This might be due to a low simulated resolution, please increase it.")
+    :param n_sensor_elements: (int) number of sensor elements
+    :param terms: (tuple) the terms that are accumulated, see compute_delay_and_sum_sums
+    :param component_settings: (Settings) settings for the reconstruction module
+    :param batch_size: (int) number of images that are reconstructed at once
+    :return: (int) number of pixels per tile
+    """
+    memory_budget_in_bytes = get_memory_budget_in_bytes(component_settings)
+    # delays, interpolation indices and weights per sensor element and pixel, which are shared by the batch
+    bytes_per_pixel = 48 * n_sensor_elements
+    # interpolated values and temporary results per sensor element and pixel of every image
+    bytes_per_pixel += 48 * n_sensor_elements * batch_size
+    if DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS in terms:
+        # the signed square roots of the values in double precision
+        bytes_per_pixel += 16 * n_sensor_elements * batch_size
+    if DELAY_AND_SUM_TERM_SQUARED_SUM in terms:
+        # the squared values
+        bytes_per_pixel += 8 * n_sensor_elements * batch_size
+    return max(1, int(memory_budget_in_bytes // bytes_per_pixel))
+
+
+def get_receive_aperture_angle(component_settings: Settings):
+    """
+    Obtains the maximum angle between the normal of a sensor element and the direction to a pixel, up to which the
+    sensor element contributes to the pixel. It is given by Tags.RECONSTRUCTION_F_NUMBER, which corresponds to an
+    angle of arctan(1 / (2 * f-number)), and Tags.RECONSTRUCTION_MAX_ACCEPTANCE_ANGLE_DEG. If both are given, the
+    smaller angle is used. Angles of 90 degrees or more do not limit the aperture.
+
+    :param component_settings: (Settings) settings for the reconstruction module
+    :return: (float) the maximum angle in radians or None, if the receive aperture is not limited
+    """
+    angles = []
+    if Tags.RECONSTRUCTION_F_NUMBER in component_settings and component_settings[Tags.RECONSTRUCTION_F_NUMBER]:
+        angles.append(float(np.arctan(1 / (2 * component_settings[Tags.RECONSTRUCTION_F_NUMBER]))))
+    if Tags.RECONSTRUCTION_MAX_ACCEPTANCE_ANGLE_DEG in component_settings and \
+            component_settings[Tags.RECONSTRUCTION_MAX_ACCEPTANCE_ANGLE_DEG] is not None:
+        angles.append(float(np.deg2rad(component_settings[Tags.RECONSTRUCTION_MAX_ACCEPTANCE_ANGLE_DEG])))
+    if len(angles) == 0 or min(angles) >= np.pi / 2:
+        return None
+    return min(angles)
+
+
+def get_sensor_orientations(detection_geometry: DetectionGeometryBase, torch_device: torch.device) -> torch.tensor:
+    """
+    :param detection_geometry: (DetectionGeometryBase) the detection geometry
+    :param torch_device: (torch device) device of the returned tensor
+    :return: (torch tensor) the normalised orientation vectors of the sensor elements of shape (sensor elements, 3)
+    """
+    return torch.from_numpy(np.asarray(detection_geometry.get_detector_element_orientations(),
+                                       dtype=np.float64)).to(torch_device)
 
-    n_sensor_elements = time_series_sensor_data.shape[0]
 
-    logger.debug(f'Number of pixels in X dimension: {xdim}, Y dimension: {ydim}, Z dimension: {zdim} '
-                 f',number of sensor elements: {n_sensor_elements}')
+# Default number of additional time steps before and after the time gate
+DEFAULT_TIME_GATE_MARGIN_TIME_STEPS = 16
+
 
+def compute_time_gate(sensor_positions: np.ndarray, pixel_bounds_in_mm: np.ndarray, min_speed_of_sound: float,
+                      max_speed_of_sound: float, time_spacing_in_ms: float, n_time_steps: int,
+                      margin_time_steps: int = DEFAULT_TIME_GATE_MARGIN_TIME_STEPS) -> slice:
+    """
+    Computes the time steps that can contribute to the pixels within the given bounds, which are bounded by the
+    minimum and maximum distance between the pixels and the sensor elements.
+
+    :param sensor_positions: (numpy array) sensor element positions in mm of shape (sensor elements, 3)
+    :param pixel_bounds_in_mm: (numpy array) the lower and upper bounds of the pixel positions in mm of shape (2, 3)
+        in the axes of the sensor positions
+    :param min_speed_of_sound: (float) minimum speed of sound in m/s
+    :param max_speed_of_sound: (float) maximum speed of sound in m/s
+    :param time_spacing_in_ms: (float) temporal spacing of the time series data in ms
+    :param n_time_steps: (int) number of recorded time steps
+    :param margin_time_steps: (int) number of additional time steps before and after the reachable time steps
+    :return: (slice) the time steps of the time gate
+    """
+    sensor_positions = np.asarray(sensor_positions, dtype=np.float64)
+    closest_pixels = np.clip(sensor_positions, pixel_bounds_in_mm[0], pixel_bounds_in_mm[1])
+    min_distance = np.min(np.linalg.norm(closest_pixels - sensor_positions, axis=1))
+    farthest_offsets = np.maximum(np.abs(sensor_positions - pixel_bounds_in_mm[0]),
+                                  np.abs(sensor_positions - pixel_bounds_in_mm[1]))
+    max_distance = np.max(np.linalg.norm(farthest_offsets, axis=1))
+    first_time_step = int(np.floor(min_distance / (max_speed_of_sound * time_spacing_in_ms))) - margin_time_steps
+    # the delays are interpolated between the time step before and after the time of flight
+    stop_time_step = int(np.ceil(max_distance / (min_speed_of_sound * time_spacing_in_ms))) + 2 + margin_time_steps
+    first_time_step = min(max(first_time_step, 0), n_time_steps - 1)
+    return slice(first_time_step, max(min(stop_time_step, n_time_steps), first_time_step + 1))
+
+
+def compute_delay_and_sum_time_gate(n_time_steps: int, component_settings: Settings, global_settings: Settings,
+                                    detection_geometry: DetectionGeometryBase, logger: Logger,
+                                    speed_of_sound_in_m_per_s: float, speed_of_sound_map: SpeedOfSoundMap = None):
+    """
+    Computes the time gate of the delay and sum based beamformers, see compute_time_gate, for the field of view of
+    the detection geometry. The time series data can be cropped to it before it is filtered and reconstructed,
+    unless Tags.RECONSTRUCTION_TIME_GATING is False. If bandpass filtering is performed, the margin includes one
+    period of the highpass cutoff frequency, such that the edge effects of the filters do not reach the gated time
+    steps. The margin can be set by Tags.RECONSTRUCTION_TIME_GATE_MARGIN_TIME_STEPS.
+
+    :param n_time_steps: (int) number of recorded time steps
+    :param component_settings: (Settings) settings for the reconstruction module
+    :param global_settings: (Settings) the settings of the simulation
+    :param detection_geometry: (DetectionGeometryBase) the detection geometry
+    :param logger: (Logger) logger for debugging purposes
+    :param speed_of_sound_in_m_per_s: (float) the speed of sound of the reconstruction in m/s
+    :param speed_of_sound_map: (SpeedOfSoundMap) the heterogeneous speed of sound or None, see
+        load_reconstruction_speed_of_sound
+    :return: (slice) the time steps of the time gate or None, if all time steps are needed
+    """
+    if Tags.RECONSTRUCTION_TIME_GATING in component_settings and \
+            not component_settings[Tags.RECONSTRUCTION_TIME_GATING]:
+        return None
+    spacing_in_mm = get_reconstruction_spacing_in_mm(component_settings, global_settings, logger)
+    time_spacing_in_ms = get_reconstruction_time_spacing_in_ms(global_settings, detection_geometry)
+    if speed_of_sound_map is None:
+        min_speed_of_sound = max_speed_of_sound = speed_of_sound_in_m_per_s
+    else:
+        min_speed_of_sound = np.min(speed_of_sound_map.speed_of_sound_in_m_per_s)
+        max_speed_of_sound = np.max(speed_of_sound_map.speed_of_sound_in_m_per_s)
+
+    if Tags.RECONSTRUCTION_TIME_GATE_MARGIN_TIME_STEPS in component_settings:
+        margin_time_steps = component_settings[Tags.RECONSTRUCTION_TIME_GATE_MARGIN_TIME_STEPS]
+    else:
+        margin_time_steps = DEFAULT_TIME_GATE_MARGIN_TIME_STEPS
+        if Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING in component_settings and \
+                component_settings[Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING]:
+            cutoff_highpass_in_Hz = component_settings[Tags.BANDPASS_CUTOFF_HIGHPASS_IN_HZ] \
+                if Tags.BANDPASS_CUTOFF_HIGHPASS_IN_HZ in component_settings else int(0.1e6)
+            margin_time_steps += int(np.ceil(1000 / (cutoff_highpass_in_Hz * time_spacing_in_ms)))
+
+    xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = compute_image_dimensions(
+        detection_geometry, spacing_in_mm, logger)
+    x, y, z = _get_pixel_coordinates(xdim, ydim, zdim, xdim_start, ydim_start, zdim_start, torch.device("cpu"))
+    sensor_positions = np.array(detection_geometry.get_detector_element_positions_base_mm(), dtype=np.float64)
+    if zdim == 1:
+        sensor_positions[:, 1] = 0  # Assume imaging plane
+    # the y axis of the image corresponds to the z axis of the sensor positions and vice versa
+    pixel_bounds_in_mm = np.array([[float(x[0]), float(z[0]), float(y[0])],
+                                   [float(x[-1]), float(z[-1]), float(y[-1])]]) * spacing_in_mm
+    time_gate = compute_time_gate(sensor_positions, pixel_bounds_in_mm, min_speed_of_sound, max_speed_of_sound,
+                                  time_spacing_in_ms, n_time_steps, margin_time_steps)
+    if time_gate.start == 0 and time_gate.stop == n_time_steps:
+        return None
+    logger.debug(f"Cropping the time series data to the time steps {time_gate.start} to {time_gate.stop} of "
+                 f"{n_time_steps}.")
+    return time_gate
+
+
+def _get_tile_coordinates(x: torch.tensor, y: torch.tensor, z: torch.tensor,
+                          pixel_indices: torch.tensor) -> Tuple[torch.tensor, torch.tensor, torch.tensor]:
+    xx = x[pixel_indices // (len(y) * len(z))][:, None]
+    yy = y[(pixel_indices // len(z)) % len(y)][:, None]
+    zz = z[pixel_indices % len(z)][:, None]
+    return xx, yy, zz
+
+
+def compute_receive_aperture_for_tile(sensor_positions: torch.tensor, sensor_orientations: torch.tensor,
+                                      x: torch.tensor, y: torch.tensor, z: torch.tensor, pixel_indices: torch.tensor,
+                                      spacing_in_mm: float,
+                                      max_aperture_angle: float) -> Tuple[torch.tensor, torch.tensor]:
+    """
+    Computes which sensor elements see the pixels of a tile within the maximum angle to the axis of their normal.
+
+    :param sensor_positions: (torch tensor) sensor element positions in mm
+    :param sensor_orientations: (torch tensor) normalised orientation vectors of the sensor elements
+    :param x: (torch tensor) x coordinates of the pixels of the image in units of the spacing
+    :param y: (torch tensor) y coordinates of the pixels of the image in units of the spacing
+    :param z: (torch tensor) z coordinates of the pixels of the image in units of the spacing
+    :param pixel_indices: (torch tensor) flat indices of the pixels of the tile in the (x, y, z) image
+    :param spacing_in_mm: (float) spacing of the pixels in mm
+    :param max_aperture_angle: (float) maximum angle in radians, see get_receive_aperture_angle
+    :return: (torch tensor) boolean mask of shape (pixels, sensor elements) and (torch tensor) the distances in mm
+        between the pixels and the sensor elements of the same shape
+    """
+    xx, yy, zz = _get_tile_coordinates(x, y, z, pixel_indices)
+    # the y axis of the image corresponds to the z axis of the sensor positions and vice versa
+    x_distances = xx * spacing_in_mm - sensor_positions[:, 0][None, :]
+    y_distances = zz * spacing_in_mm - sensor_positions[:, 1][None, :]
+    z_distances = yy * spacing_in_mm - sensor_positions[:, 2][None, :]
+    projections = torch.abs(x_distances * sensor_orientations[:, 0][None, :] +
+                            y_distances * sensor_orientations[:, 1][None, :] +
+                            z_distances * sensor_orientations[:, 2][None, :])
+    distances = torch.sqrt(x_distances ** 2 + y_distances ** 2 + z_distances ** 2)
+    return projections >= np.cos(max_aperture_angle) * distances, distances
+
+
+def compute_delay_table_for_tile(sensor_positions: torch.tensor, n_time_steps: int, x: torch.tensor,
+                                 y: torch.tensor, z: torch.tensor, pixel_indices: torch.tensor, spacing_in_mm: float,
+                                 speed_of_sound_in_m_per_s: float, time_spacing_in_ms: float,
+                                 sensor_orientations: torch.tensor = None, max_aperture_angle: float = None,
+                                 travel_times: torch.tensor = None, first_time_step: int = 0) -> DelayTable:
+    """
+    Computes the time of flight from every pixel of a tile to every sensor element and the indices and weights that
+    linearly interpolate the time series data at these times. If the receive aperture is limited, only the pairs of
+    pixels and sensor elements within the aperture are computed and a sparse delay table is returned. The times of
+    flight are the distances divided by the speed of sound, unless the travel times through a heterogeneous speed
+    of sound are given.
+
+    :param sensor_positions: (torch tensor) sensor element positions in mm
+    :param n_time_steps: (int) number of recorded time steps
+    :param x: (torch tensor) x coordinates of the pixels of the image in units of the spacing
+    :param y: (torch tensor) y coordinates of the pixels of the image in units of the spacing
+    :param z: (torch tensor) z coordinates of the pixels of the image in units of the spacing
+    :param pixel_indices: (torch tensor) flat indices of the pixels of the tile in the (x, y, z) image
+    :param spacing_in_mm: (float) spacing of the pixels in mm
+    :param speed_of_sound_in_m_per_s: (float) speed of sound in m/s
+    :param time_spacing_in_ms: (float) temporal spacing of the time series data in ms
+    :param sensor_orientations: (torch tensor) normalised orientation vectors of the sensor elements or None
+    :param max_aperture_angle: (float) maximum angle in radians, see get_receive_aperture_angle, or None
+    :param travel_times: (torch tensor) travel times in ms from every pixel of the image to every sensor element of
+        shape (pixels, sensor elements), see TravelTimeMaps, or None
+    :param first_time_step: (int) index of the first recorded time step of time series data that has been cropped
+        to a time gate, see compute_delay_and_sum_time_gate
+    :return: (DelayTable) delay table of shape (pixels, sensor elements)
+    """
+    if max_aperture_angle is None:
+        sensor_indices = torch.arange(sensor_positions.shape[0], device=pixel_indices.device)[None, :]
+        if travel_times is None:
+            xx, yy, zz = _get_tile_coordinates(x, y, z, pixel_indices)
+            delays = torch.sqrt((yy * spacing_in_mm - sensor_positions[:, 2][None, :]) ** 2 +
+                                (xx * spacing_in_mm - sensor_positions[:, 0][None, :]) ** 2 +
+                                (zz * spacing_in_mm - sensor_positions[:, 1][None, :]) ** 2) \
+                / (speed_of_sound_in_m_per_s * time_spacing_in_ms)
+        else:
+            delays = travel_times[pixel_indices].double() / time_spacing_in_ms
+    else:
+        mask, distances = compute_receive_aperture_for_tile(sensor_positions, sensor_orientations, x, y, z,
+                                                            pixel_indices, spacing_in_mm, max_aperture_angle)
+        pair_pixel_indices, sensor_indices = torch.nonzero(mask, as_tuple=True)
+        pixel_offsets = torch.zeros(len(pixel_indices) + 1, dtype=torch.int64, device=pixel_indices.device)
+        torch.cumsum(torch.count_nonzero(mask, dim=1), dim=0, out=pixel_offsets[1:])
+        if travel_times is None:
+            delays = distances[mask] / (speed_of_sound_in_m_per_s * time_spacing_in_ms)
+        else:
+            delays = travel_times[pixel_indices][mask].double() / time_spacing_in_ms
+    if first_time_step:
+        delays = delays - first_time_step
+
+    # perform index validation
+    invalid_indices = torch.logical_or(delays < 0, delays >= float(n_time_steps))
+    torch.clip_(delays, min=0, max=n_time_steps - 1)
+
+    # interpolation of delays
+    lower_delays = (torch.floor(delays)).long()
+    upper_delays = lower_delays + 1
+    torch.clip_(upper_delays, min=0, max=n_time_steps - 1)
+    lower_weights = upper_delays - delays
+    upper_weights = delays - lower_delays
+
+    # set weights of invalid indices to 0 so that they don't influence the result
+    lower_weights[invalid_indices] = 0
+    upper_weights[invalid_indices] = 0
+
+    # indices into the flattened time series data
+    offsets = sensor_indices * n_time_steps
+    index_dtype = DelayTable.get_index_dtype(sensor_positions.shape[0] * n_time_steps)
+    lower_indices = (lower_delays + offsets).to(index_dtype)
+    upper_indices = (upper_delays + offsets).to(index_dtype)
+    lower_weights = lower_weights.to(DELAY_TABLE_WEIGHT_DTYPE)
+    upper_weights = upper_weights.to(DELAY_TABLE_WEIGHT_DTYPE)
+    if max_aperture_angle is None:
+        return DelayTable(lower_indices, upper_indices, lower_weights, upper_weights)
+    return DelayTable(lower_indices, upper_indices, lower_weights, upper_weights, pixel_offsets,
+                      pair_pixel_indices.int(), sensor_indices.int())
+
+
+def compute_delayed_values_for_tile(time_series_sensor_data: Tensor, sensor_positions: torch.tensor,
+                                    x: torch.tensor, y: torch.tensor, z: torch.tensor, pixel_indices: torch.tensor,
+                                    spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
+                                    time_spacing_in_ms: float, apodization: torch.tensor) -> torch.tensor:
+    """
+    Computes the delayed and interpolated time series values of all sensor elements for a tile of pixels.
+
+    :param time_series_sensor_data: (torch tensor) time series data of shape (sensor elements, time steps) or
+        (batch, sensor elements, time steps)
+    :param sensor_positions: (torch tensor) sensor element positions in mm
+    :param x: (torch tensor) x coordinates of the pixels of the image in units of the spacing
+    :param y: (torch tensor) y coordinates of the pixels of the image in units of the spacing
+    :param z: (torch tensor) z coordinates of the pixels of the image in units of the spacing
+    :param pixel_indices: (torch tensor) flat indices of the pixels of the tile in the (x, y, z) image
+    :param spacing_in_mm: (float) spacing of the pixels in mm
+    :param speed_of_sound_in_m_per_s: (float) speed of sound in m/s
+    :param time_spacing_in_ms: (float) temporal spacing of the time series data in ms
+    :param apodization: (torch tensor) apodization factors of the sensor elements of shape (1, sensor elements)
+    :return: (torch tensor) values of shape (pixels, sensor elements) or (batch, pixels, sensor elements), which are
+        0 for delays outside of the recorded time range
+    """
+    delay_table = compute_delay_table_for_tile(sensor_positions, time_series_sensor_data.shape[-1], x, y, z,
+                                               pixel_indices, spacing_in_mm, speed_of_sound_in_m_per_s,
+                                               time_spacing_in_ms)
+    return delay_table.interpolate(time_series_sensor_data) * apodization
+
+
+def get_delay_table(sensor_positions: torch.tensor, n_time_steps: int, x: torch.tensor, y: torch.tensor,
+                    z: torch.tensor, spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
+                    time_spacing_in_ms: float, tile_size: int, logger: Logger, torch_device: torch.device,
+                    component_settings: Settings, sensor_orientations: torch.tensor = None,
+                    max_aperture_angle: float = None, travel_time_maps: TravelTimeMaps = None,
+                    first_time_step: int = 0):
+    """
+    Returns the delay table of the whole image from the delay table cache or computes and caches it. The table only
+    depends on the sensor positions, the image grid, the speed of sound, the sampling and the receive aperture, such
+    that it is reused by the reconstructions of all wavelengths and frames. With a heterogeneous speed of sound, the
+    key contains the sampled speed of sound of the travel_time_maps, such that the travel times are only solved for
+    the first reconstruction of every geometry and medium. The cache is limited by
+    Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES, which defaults to DEFAULT_DELAY_TABLE_CACHE_SIZE_BYTES, and
+    persisted on disk if Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_PATH is set. The tiles are computed on the
+    torch_device, but the table is kept in host memory, such that the tiles have to be moved to the torch_device.
+
+    :return: (DelayTable) the delay table of shape (pixels, sensor elements) in host memory or None, if it is larger
+        than the cache. In that case, the delays have to be computed for every tile.
+    """
+    if Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES in component_settings:
+        max_size_bytes = component_settings[Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES]
+    else:
+        max_size_bytes = delay_table_cache.max_size_bytes
+    if Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_PATH in component_settings:
+        directory = component_settings[Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_PATH]
+    else:
+        directory = None
+
+    n_pixels = len(x) * len(y) * len(z)
+    n_sensor_elements = sensor_positions.shape[0]
+    # The size of sparse tables is only known once they are computed
+    if max_aperture_angle is None and \
+            DelayTable.get_dense_size_bytes(n_pixels, n_sensor_elements, n_time_steps) > max_size_bytes:
+        logger.debug("The delay table exceeds the size of the delay table cache and is computed for every tile.")
+        return None
+
+    key_items = [sensor_positions, n_time_steps, x, y, z, spacing_in_mm, speed_of_sound_in_m_per_s,
+                 time_spacing_in_ms]
+    if max_aperture_angle is not None:
+        key_items += [sensor_orientations, max_aperture_angle]
+    if travel_time_maps is not None:
+        key_items += [travel_time_maps.slowness, travel_time_maps.grid_origin]
+    if first_time_step:
+        key_items.append(first_time_step)
+    key = compute_hash(*key_items)
+    delay_table = delay_table_cache.get(key, directory)
+    if delay_table is not None:
+        logger.debug(f"Reusing cached delay table {key}.")
+        return delay_table
+
+    travel_times = None if travel_time_maps is None else travel_time_maps.get_travel_times()
+    tiles = []
+    size_bytes = 0
+    for tile_start in range(0, n_pixels, tile_size):
+        pixel_indices = torch.arange(tile_start, min(tile_start + tile_size, n_pixels), device=torch_device)
+        tiles.append(compute_delay_table_for_tile(sensor_positions, n_time_steps, x, y, z, pixel_indices,
+                                                  spacing_in_mm, speed_of_sound_in_m_per_s, time_spacing_in_ms,
+                                                  sensor_orientations, max_aperture_angle, travel_times,
+                                                  first_time_step).to(torch.device("cpu")))
+        size_bytes += tiles[-1].nbytes
+        if size_bytes > max_size_bytes:
+            logger.debug("The delay table exceeds the size of the delay table cache and is computed for every tile.")
+            return None
+    delay_table = DelayTable.concatenate(tiles)
+    delay_table_cache.put(key, delay_table, directory, max_size_bytes)
+    return delay_table
+
+
+def compute_sum_of_pairwise_products(values: torch.tensor, sum_per_pixel=None) -> torch.tensor:
+    """
+    Computes the sum of sign(s_i * s_j) * sqrt(abs(s_i * s_j)) over all pairs i < j of the values s of every pixel.
+    Every summand factors into t_i * t_j with t = sign(s) * sqrt(abs(s)), such that the sum over the upper triangle
+    of the pairs equals ((sum of t) ** 2 - sum of t ** 2) / 2. This takes linear instead of quadratic time and
+    memory in the number of sensor elements. The sums are accumulated in double precision to avoid cancellation.
+
+    :param values: (torch tensor) delayed values of shape (..., pixels, sensor elements)
+    :param sum_per_pixel: function that sums values of the shape of the delayed values over the sensor elements of
+        every pixel, e.g. DelayTable.sum_per_pixel for the values of sparse delay tables. Sums over the last
+        dimension by default.
+    :return: (torch tensor) sums of the pairwise products of shape (..., pixels) in the dtype of the values
+    """
+    if sum_per_pixel is None:
+        def sum_per_pixel(terms):
+            return torch.sum(terms, dim=-1)
+    signed_roots = torch.sign(values).double() * torch.sqrt(torch.abs(values).double())
+    sum_of_products = (sum_per_pixel(signed_roots) ** 2 - sum_per_pixel(signed_roots ** 2)) / 2
+    return sum_of_products.to(values.dtype)
+
+
+def _get_pixel_coordinates(xdim: int, ydim: int, zdim: int, xdim_start: float, ydim_start: float, zdim_start: float,
+                           torch_device: torch.device) -> Tuple[torch.tensor, torch.tensor, torch.tensor]:
     x_offset = 0.5 if xdim % 2 == 0 else 0  # to ensure pixels are symmetrically arranged around the 0 like the
     # sensor positions, add an offset of 0.5 pixels if the dimension is even
 
@@ -538,38 +993,162 @@ def compute_delay_and_sum_values(time_series_sensor_data: Tensor, sensor_positio
         z = torch.arange(zdim, device=torch_device, dtype=torch.float32)
     else:
         z = zdim_start + torch.arange(zdim, device=torch_device, dtype=torch.float32)
-    j = torch.arange(n_sensor_elements, device=torch_device, dtype=torch.float32)
+    return x, y, z
 
-    xx, yy, zz, jj = torch.meshgrid(x, y, z, j)
-    jj = jj.long()
 
-    delays = torch.sqrt((yy * spacing_in_mm - sensor_positions[:, 2][jj]) ** 2 +
-                        (xx * spacing_in_mm - sensor_positions[:, 0][jj]) ** 2 +
-                        (zz * spacing_in_mm - sensor_positions[:, 1][jj]) ** 2) \
-        / (speed_of_sound_in_m_per_s * time_spacing_in_ms)
+def _get_sensor_apodization(component_settings: Settings, n_sensor_elements: int,
+                            torch_device: torch.device) -> torch.tensor:
+    if Tags.RECONSTRUCTION_APODIZATION_METHOD in component_settings:
+        apodization_method = component_settings[Tags.RECONSTRUCTION_APODIZATION_METHOD]
+    else:
+        apodization_method = Tags.RECONSTRUCTION_APODIZATION_BOX
+    return get_apodization_factor(apodization_method=apodization_method, dimensions=(1,),
+                                  n_sensor_elements=n_sensor_elements, device=torch_device)
+
+
+def compute_delay_and_sum_sums(time_series_sensor_data: Tensor, sensor_positions: torch.tensor, xdim: int,
+                               ydim: int, zdim: int, xdim_start: int, xdim_end: int, ydim_start: int, ydim_end: int,
+                               zdim_start: int, zdim_end: int, spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
+                               time_spacing_in_ms: float, logger: Logger, torch_device: torch.device,
+                               component_settings: Settings,
+                               terms: tuple = (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT),
+                               sensor_orientations: torch.tensor = None,
+                               speed_of_sound_map: SpeedOfSoundMap = None,
+                               first_time_step: int = 0) -> Tuple[dict, int]:
+    """
+    Performs the core computation of Delay and Sum and accumulates the delayed values of all sensor elements per
+    pixel. The image is processed in tiles of pixels, such that the peak memory is bounded by
+    Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES and does not depend on the size of the image.
 
-    # perform index validation
-    invalid_indices = torch.where(torch.logical_or(delays < 0, delays >= float(time_series_sensor_data.shape[1])))
-    torch.clip_(delays, min=0, max=time_series_sensor_data.shape[1] - 1)
+    The time series data is either of shape (sensor elements, time steps) or a batch of shape (batch, sensor
+    elements, time steps), e.g. of several wavelengths or frames. The delays are computed once for the whole batch.
 
-    # interpolation of delays
-    lower_delays = (torch.floor(delays)).long()
-    upper_delays = lower_delays + 1
-    torch.clip_(upper_delays, min=0, max=time_series_sensor_data.shape[1] - 1)
-    lower_values = time_series_sensor_data[jj, lower_delays]
-    upper_values = time_series_sensor_data[jj, upper_delays]
-    values = lower_values * (upper_delays - delays) + upper_values * (delays - lower_delays)
+    If the receive aperture is limited by Tags.RECONSTRUCTION_F_NUMBER or Tags.RECONSTRUCTION_MAX_ACCEPTANCE_ANGLE_DEG,
+    only the sensor elements that see a pixel within the aperture contribute to it. The pairs of pixels and sensor
+    elements within the aperture are precomputed as a sparse delay table, such that the pairs outside of the aperture
+    are neither interpolated nor accumulated. This needs the sensor_orientations, see get_sensor_orientations.
 
-    # perform apodization if specified
-    if Tags.RECONSTRUCTION_APODIZATION_METHOD in component_settings:
-        apodization = get_apodization_factor(apodization_method=component_settings[Tags.RECONSTRUCTION_APODIZATION_METHOD],
-                                             dimensions=(xdim, ydim, zdim), n_sensor_elements=n_sensor_elements,
-                                             device=torch_device)
-        values = values * apodization
+    If a speed_of_sound_map is given, see get_speed_of_sound_map, the delays are the travel times through the
+    heterogeneous speed of sound instead of the straight distances divided by speed_of_sound_in_m_per_s. The travel
+    times are solved with an eikonal solver, see TravelTimeMaps, which is only supported for 2D images.
+
+    If the time series data has been cropped to a time gate, see compute_delay_and_sum_time_gate, first_time_step is
+    the index of its first time step in the recorded time series data.
+
+    The following terms can be accumulated:
+    - DELAY_AND_SUM_TERM_SUM: the sum of the delayed values
+    - DELAY_AND_SUM_TERM_COUNT: the number of non-zero delayed values
+    - DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS: the sum of sign(s_i * s_j) * sqrt(abs(s_i * s_j)) over all pairs i < j
+      of delayed values, as needed by (signed) Delay Multiply and Sum
+    - DELAY_AND_SUM_TERM_SQUARED_SUM: the sum of the squared delayed values, as needed by the coherence factor
+
+    Returns
+    - sums (dict) that maps the terms to torch tensors of shape (xdim, ydim, zdim) or (batch, xdim, ydim, zdim)
+    - and n_sensor_elements (int) which might be used for later computations
+    """
+
+    if time_series_sensor_data.shape[-2] < sensor_positions.shape[0]:
+        logger.warning("Warning: The time series data has less sensor element entries than the given sensor positions. "
+                       "This might be due to a low simulated resolution, please increase it.")
+
+    n_sensor_elements = time_series_sensor_data.shape[-2]
+    batch_shape = time_series_sensor_data.shape[:-2]
+    n_pixels = xdim * ydim * zdim
+    tile_size = compute_delay_and_sum_tile_size(n_sensor_elements, terms, component_settings,
+                                                batch_size=int(np.prod(batch_shape)))
 
-    # set values of invalid indices to 0 so that they don't influence the result
-    values[invalid_indices] = 0
+    logger.debug(f'Number of pixels in X dimension: {xdim}, Y dimension: {ydim}, Z dimension: {zdim} '
+                 f',number of sensor elements: {n_sensor_elements}, number of pixels per tile: {tile_size}')
+
+    x, y, z = _get_pixel_coordinates(xdim, ydim, zdim, xdim_start, ydim_start, zdim_start, torch_device)
+    apodization = _get_sensor_apodization(component_settings, n_sensor_elements, torch_device)
+    max_aperture_angle = get_receive_aperture_angle(component_settings)
+    if max_aperture_angle is not None:
+        if sensor_orientations is None:
+            raise ValueError("The sensor orientations are needed to limit the receive aperture.")
+        logger.debug(f"Limiting the receive aperture to {np.rad2deg(max_aperture_angle)} degrees.")
+    travel_time_maps = None
+    if speed_of_sound_map is not None:
+        logger.debug("Computing the delays from the travel times through the heterogeneous speed of sound.")
+        # a twentieth of a time step is far below the error of the linear interpolation of the time series data
+        travel_time_maps = TravelTimeMaps(speed_of_sound_map, sensor_positions, x, y, z, spacing_in_mm,
+                                          time_spacing_in_ms / 20, get_memory_budget_in_bytes(component_settings))
+
+    delay_table = get_delay_table(sensor_positions, time_series_sensor_data.shape[-1], x, y, z, spacing_in_mm,
+                                  speed_of_sound_in_m_per_s, time_spacing_in_ms, tile_size, logger, torch_device,
+                                  component_settings, sensor_orientations, max_aperture_angle, travel_time_maps,
+                                  first_time_step)
+    travel_times = None
+    if delay_table is None and travel_time_maps is not None:
+        travel_times = travel_time_maps.get_travel_times()
+
+    sums = dict()
+    for tile_start in range(0, n_pixels, tile_size):
+        tile = slice(tile_start, min(tile_start + tile_size, n_pixels))
+        if delay_table is not None:
+            tile_delay_table = delay_table[tile].to(torch_device)
+        else:
+            pixel_indices = torch.arange(tile.start, tile.stop, device=torch_device)
+            tile_delay_table = compute_delay_table_for_tile(sensor_positions, time_series_sensor_data.shape[-1],
+                                                            x, y, z, pixel_indices, spacing_in_mm,
+                                                            speed_of_sound_in_m_per_s, time_spacing_in_ms,
+                                                            sensor_orientations, max_aperture_angle, travel_times,
+                                                            first_time_step)
+        values = tile_delay_table.interpolate(time_series_sensor_data, apodization)
+        if len(sums) == 0:
+            for term in terms:
+                sums[term] = torch.zeros(batch_shape + (n_pixels,), dtype=torch.int64
+                                         if term == DELAY_AND_SUM_TERM_COUNT else values.dtype, device=torch_device)
+        if DELAY_AND_SUM_TERM_SUM in terms:
+            sums[DELAY_AND_SUM_TERM_SUM][..., tile] = tile_delay_table.sum_per_pixel(values)
+        if DELAY_AND_SUM_TERM_COUNT in terms:
+            sums[DELAY_AND_SUM_TERM_COUNT][..., tile] = tile_delay_table.sum_per_pixel((values != 0).long())
+        if DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS in terms:
+            sums[DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS][..., tile] = compute_sum_of_pairwise_products(
+                values, tile_delay_table.sum_per_pixel)
+        if DELAY_AND_SUM_TERM_SQUARED_SUM in terms:
+            sums[DELAY_AND_SUM_TERM_SQUARED_SUM][..., tile] = tile_delay_table.sum_per_pixel(values ** 2)
+        del values
+
+    return {term: sums[term].reshape(batch_shape + (xdim, ydim, zdim)) for term in terms}, n_sensor_elements
 
-    del delays  # free memory of delays
 
-    return values, n_sensor_elements
+def compute_delay_and_sum_values(time_series_sensor_data: Tensor, sensor_positions: torch.tensor, xdim: int,
+                                 ydim: int, zdim: int, xdim_start: int, xdim_end: int, ydim_start: int, ydim_end: int,
+                                 zdim_start: int, zdim_end: int, spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
+                                 time_spacing_in_ms: float, logger: Logger, torch_device: torch.device,
+                                 component_settings: Settings) -> Tuple[torch.tensor, int]:
+    """
+    Perform the core computation of Delay and Sum, without summing up the delay dependend values.
+    The returned values grow with the size of the image times the number of sensor elements. Use
+    compute_delay_and_sum_sums to accumulate the values with bounded memory instead.
+
+    Returns
+    - values (torch tensor) of the time series data corrected for delay and sensor positioning, ready to be summed up,
+      of shape (xdim, ydim, zdim, sensor elements) or (batch, xdim, ydim, zdim, sensor elements)
+    - and n_sensor_elements (int) which might be used for later computations
+    """
+    n_sensor_elements = time_series_sensor_data.shape[-2]
+    x, y, z = _get_pixel_coordinates(xdim, ydim, zdim, xdim_start, ydim_start, zdim_start, torch_device)
+    apodization = _get_sensor_apodization(component_settings, n_sensor_elements, torch_device)
+    pixel_indices = torch.arange(xdim * ydim * zdim, device=torch_device)
+    values = compute_delayed_values_for_tile(time_series_sensor_data, sensor_positions, x, y, z, pixel_indices,
+                                             spacing_in_mm, speed_of_sound_in_m_per_s, time_spacing_in_ms,
+                                             apodization)
+    return values.reshape(time_series_sensor_data.shape[:-2] + (xdim, ydim, zdim, n_sensor_elements)), \
+        n_sensor_elements
+
+
+def squeeze_reconstructed_images(reconstructed_images: torch.tensor) -> np.ndarray:
+    """
+    Removes the singleton image dimensions, e.g. the z dimension of a 2D image, and keeps the batch dimension.
+
+    :param reconstructed_images: (torch tensor) image of shape (xdim, ydim, zdim) or a batch of images of shape
+        (batch, xdim, ydim, zdim)
+    :return: (numpy array) the squeezed image or batch of images
+    """
+    reconstructed_images = reconstructed_images.cpu().numpy()
+    if reconstructed_images.ndim == 3:
+        return reconstructed_images.squeeze()
+    image_shape = tuple(dimension for dimension in reconstructed_images.shape[1:] if dimension != 1)
+    return reconstructed_images.reshape(reconstructed_images.shape[:1] + image_shape)
@@ -0,0 +1,255 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import numpy as np
+import torch
+from scipy.ndimage import map_coordinates
+
+from simpa.core.device_digital_twins import DetectionGeometryBase
+from simpa.io_handling.io_hdf5 import load_data_field
+from simpa.utils import Tags
+from simpa.utils.settings import Settings
+
+# Default maximum number of iterations of the fast sweeping method, each of which sweeps the grid in four directions
+DEFAULT_MAX_SWEEP_ITERATIONS = 20
+
+
+class SpeedOfSoundMap:
+    """
+    The speed of sound of the simulated volume in the frame of reference of a detection geometry, in which the sensor
+    positions and the field of view are given. A position p in mm relative to the device corresponds to the voxel
+    index (p + device position) / spacing, as in the sensor maps of the acoustic forward models.
+    """
+
+    def __init__(self, speed_of_sound_in_m_per_s: np.ndarray, spacing_in_mm: float, device_position_mm: np.ndarray):
+        """
+        :param speed_of_sound_in_m_per_s: (numpy array) speed of sound of the volume of shape (x, y, z) in m/s
+        :param spacing_in_mm: (float) spacing of the voxels of the volume in mm
+        :param device_position_mm: (numpy array) position of the device in the volume in mm
+        """
+        self.speed_of_sound_in_m_per_s = np.asarray(speed_of_sound_in_m_per_s, dtype=np.float64)
+        self.spacing_in_mm = spacing_in_mm
+        self.device_position_mm = np.asarray(device_position_mm, dtype=np.float64)
+
+    def sample(self, x_in_mm: np.ndarray, y_in_mm: np.ndarray, z_in_mm: np.ndarray) -> np.ndarray:
+        """
+        Linearly interpolates the speed of sound at the given positions relative to the device. Positions outside of
+        the volume get the speed of sound of the closest voxel.
+
+        :param x_in_mm: (numpy array) x coordinates in mm
+        :param y_in_mm: (numpy array) y coordinates in mm
+        :param z_in_mm: (numpy array) z coordinates (depth) in mm
+        :return: (numpy array) the speed of sound in m/s of the broadcast shape of the coordinates
+        """
+        coordinates = np.broadcast_arrays(*[(np.asarray(coordinate, dtype=np.float64) + self.device_position_mm[axis])
+                                            / self.spacing_in_mm
+                                            for axis, coordinate in enumerate((x_in_mm, y_in_mm, z_in_mm))])
+        return map_coordinates(self.speed_of_sound_in_m_per_s, np.stack(coordinates), order=1, mode="nearest")
+
+
+def get_speed_of_sound_map(component_settings: Settings, global_settings: Settings,
+                           detection_geometry: DetectionGeometryBase):
+    """
+    Loads the simulated Tags.DATA_FIELD_SPEED_OF_SOUND if Tags.RECONSTRUCTION_HETEROGENEOUS_SPEED_OF_SOUND is set.
+
+    :param component_settings: (Settings) settings for the reconstruction module
+    :param global_settings: (Settings) the settings of the simulation
+    :param detection_geometry: (DetectionGeometryBase) the detection geometry
+    :return: (SpeedOfSoundMap) the speed of sound map or None, if a homogeneous speed of sound is assumed
+    """
+    if Tags.RECONSTRUCTION_HETEROGENEOUS_SPEED_OF_SOUND not in component_settings or \
+            not component_settings[Tags.RECONSTRUCTION_HETEROGENEOUS_SPEED_OF_SOUND]:
+        return None
+    if Tags.SIMPA_OUTPUT_PATH not in global_settings or Tags.SPACING_MM not in global_settings:
+        raise AttributeError("Reconstructing with a heterogeneous speed of sound needs the simulated "
+                             "DATA_FIELD_SPEED_OF_SOUND, please specify SIMPA_OUTPUT_PATH and SPACING_MM.")
+    speed_of_sound = load_data_field(global_settings[Tags.SIMPA_OUTPUT_PATH], Tags.DATA_FIELD_SPEED_OF_SOUND)
+    return SpeedOfSoundMap(speed_of_sound, global_settings[Tags.SPACING_MM], detection_geometry.device_position_mm)
+
+
+def compute_travel_times(slowness: torch.Tensor, spacing_in_mm: float, source_coordinates: torch.Tensor,
+                         tolerance: float, max_iterations: int = DEFAULT_MAX_SWEEP_ITERATIONS) -> torch.Tensor:
+    """
+    Solves the eikonal equation |grad T| = slowness for the first arrival times T of point sources on a 2D grid.
+
+    The travel times are factored into T = T0 * tau, where T0 is the distance to the source, such that tau is
+    constant in homogeneous media and the first-order upwind discretisation of the factored equation is exact there
+    and does not suffer from the singularity at the source. It is solved with the fast sweeping method, i.e.
+    Gauss-Seidel iterations that sweep the grid in the four diagonal directions, until the travel times change by
+    less than the tolerance::
+
+        Fomel, Sergey, Songting Luo, and Hongkai Zhao. "Fast sweeping method
+        for the factored eikonal equation." Journal of Computational Physics
+        228.17 (2009): 6440-6455.
+
+    Within a sweep, the cells of one anti-diagonal only depend on the previous anti-diagonal, so they are updated at
+    once for all sources.
+
+    :param slowness: (torch tensor) slowness of shape (x, z), e.g. in ms/mm, which is the inverse of m/s
+    :param spacing_in_mm: (float) spacing of the grid in mm
+    :param source_coordinates: (torch tensor) coordinates of the sources in units of grid cells of shape (sources, 2),
+        which must lie within the grid
+    :param tolerance: (float) the iterations stop once the travel times change by less than the tolerance
+    :param max_iterations: (int) maximum number of iterations of the four sweeps
+    :return: (torch tensor) the travel times of shape (sources, x, z) in units of the slowness times mm
+    """
+    n_sources = source_coordinates.shape[0]
+    n_x, n_z = slowness.shape
+    dtype = slowness.dtype
+    device = slowness.device
+    source_coordinates = source_coordinates.to(dtype)
+
+    # The grid is padded by one cell of unknown travel times, such that the neighbours of every cell exist
+    row_length = n_z + 2
+    grid_x = torch.arange(-1, n_x + 1, dtype=dtype, device=device)[:, None].expand(n_x + 2, n_z + 2).reshape(-1)
+    grid_z = torch.arange(-1, n_z + 1, dtype=dtype, device=device)[None, :].expand(n_x + 2, n_z + 2).reshape(-1)
+    padded_slowness = torch.nn.functional.pad(slowness[None, None], (1, 1, 1, 1), mode="replicate").reshape(-1)
+
+    # The tensors of all cells and sources are of shape (cells, sources), such that the cells are gathered at once.
+    # The distances to the sources are in units of the spacing and their gradients are the unit vectors from the
+    # sources to the cells.
+    x_gradients = grid_x[:, None] - source_coordinates[:, 0][None, :]
+    z_gradients = grid_z[:, None] - source_coordinates[:, 1][None, :]
+    scaled_distances = torch.sqrt(x_gradients ** 2 + z_gradients ** 2)
+    x_gradients /= torch.clamp(scaled_distances, min=torch.finfo(dtype).tiny)
+    z_gradients /= torch.clamp(scaled_distances, min=torch.finfo(dtype).tiny)
+
+    # The cells around the sources are initialised with the slowness at the sources and kept fixed. The factors of
+    # the other cells are large instead of infinite, such that updates from unknown neighbours are large as well and
+    # never selected without checking for infinite values.
+    source_indices = torch.round(source_coordinates).long()
+    source_indices[:, 0].clamp_(0, n_x - 1)
+    source_indices[:, 1].clamp_(0, n_z - 1)
+    source_slowness = slowness[source_indices[:, 0], source_indices[:, 1]][None, :]
+    fixed = scaled_distances <= 1
+    unknown = torch.finfo(dtype).max ** 0.125
+    tau = torch.where(fixed, source_slowness.expand_as(scaled_distances), torch.full_like(scaled_distances, unknown))
+
+    anti_diagonals = []
+    for diagonal in range(n_x + n_z - 1):
+        x_indices = torch.arange(max(0, diagonal - n_z + 1), min(n_x, diagonal + 1), device=device)
+        anti_diagonals.append((x_indices, diagonal - x_indices))
+    sweeps = []
+    for x_direction, z_direction in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+        sweep = []
+        for x_indices, z_indices in anti_diagonals:
+            if x_direction < 0:
+                x_indices = n_x - 1 - x_indices
+            if z_direction < 0:
+                z_indices = n_z - 1 - z_indices
+            sweep.append((x_indices + 1) * row_length + z_indices + 1)
+        sweeps.append(sweep)
+
+    def get_upwind_terms(cells: torch.Tensor, step: int, cell_distances: torch.Tensor, gradients: torch.Tensor):
+        """
+        The factored upwind difference along one axis times the spacing is alpha * tau - beta, using the neighbour
+        of the smaller travel time.
+        """
+        lower_tau = tau[cells - step]
+        upper_tau = tau[cells + step]
+        use_lower = scaled_distances[cells - step] * lower_tau <= scaled_distances[cells + step] * upper_tau
+        cell_gradients = gradients[cells]
+        alpha = cell_distances + torch.where(use_lower, cell_gradients, -cell_gradients)
+        beta = cell_distances * torch.where(use_lower, lower_tau, upper_tau)
+        return alpha, beta
+
+    for _ in range(max_iterations):
+        previous_tau = tau.clone()
+        for sweep in sweeps:
+            for cells in sweep:
+                cell_slowness = padded_slowness[cells][:, None]
+                cell_distances = scaled_distances[cells]
+                alpha_x, beta_x = get_upwind_terms(cells, row_length, cell_distances, x_gradients)
+                alpha_z, beta_z = get_upwind_terms(cells, 1, cell_distances, z_gradients)
+                # updates from one axis, alpha is positive outside of the fixed cells
+                candidates = torch.minimum((beta_x + cell_slowness) / alpha_x, (beta_z + cell_slowness) / alpha_z)
+                # update from both axes, which is valid if it exists and both differences are upwind
+                a = alpha_x ** 2 + alpha_z ** 2
+                b = alpha_x * beta_x + alpha_z * beta_z
+                solution = (b + torch.sqrt(b ** 2 - a * (beta_x ** 2 + beta_z ** 2 - cell_slowness ** 2))) / a
+                valid = (alpha_x * solution >= beta_x) & (alpha_z * solution >= beta_z)
+                candidates = torch.where(valid, torch.minimum(candidates, solution), candidates)
+                cell_tau = tau[cells]
+                tau[cells] = torch.where(fixed[cells], cell_tau, torch.minimum(cell_tau, candidates))
+        change = torch.max(scaled_distances * (previous_tau - tau)) * spacing_in_mm
+        if change < tolerance:
+            break
+
+    travel_times = (scaled_distances * tau * spacing_in_mm).T.reshape(n_sources, n_x + 2, n_z + 2)
+    return travel_times[:, 1:-1, 1:-1]
+
+
+class TravelTimeMaps:
+    """
+    The travel times from every pixel of a 2D image to every sensor element through a heterogeneous speed of sound.
+    The speed of sound is sampled on a grid that is aligned with the pixels and extended by whole pixels to contain
+    all sensor elements, such that the travel times at the pixels are the solution of the eikonal equation at the
+    grid points, see compute_travel_times.
+    """
+
+    def __init__(self, speed_of_sound_map: SpeedOfSoundMap, sensor_positions: torch.Tensor, x: torch.Tensor,
+                 y: torch.Tensor, z: torch.Tensor, spacing_in_mm: float, tolerance_in_ms: float,
+                 memory_budget_in_bytes: int):
+        """
+        :param speed_of_sound_map: (SpeedOfSoundMap) the speed of sound relative to the device
+        :param sensor_positions: (torch tensor) sensor element positions in mm
+        :param x: (torch tensor) x coordinates of the pixels of the image in units of the spacing
+        :param y: (torch tensor) y coordinates (depth) of the pixels of the image in units of the spacing
+        :param z: (torch tensor) z coordinate (elevation) of the image plane in units of the spacing
+        :param spacing_in_mm: (float) spacing of the pixels in mm
+        :param tolerance_in_ms: (float) tolerance of the travel times in ms, see compute_travel_times
+        :param memory_budget_in_bytes: (int) upper bound of the memory of the sources that are solved at once
+        """
+        if len(z) != 1:
+            raise AttributeError("Reconstructing with a heterogeneous speed of sound is only supported for 2D images.")
+        self.sensor_positions = sensor_positions
+        self.spacing_in_mm = spacing_in_mm
+        self.tolerance_in_ms = tolerance_in_ms
+        self.memory_budget_in_bytes = memory_budget_in_bytes
+        self.image_shape = (len(x), len(y))
+        self._travel_times = None
+
+        # The image y axis corresponds to the z axis of the sensor positions
+        sensor_x = sensor_positions[:, 0].cpu().numpy() / spacing_in_mm
+        sensor_depth = sensor_positions[:, 2].cpu().numpy() / spacing_in_mm
+        x_start, x_end = float(x[0]), float(x[-1])
+        y_start, y_end = float(y[0]), float(y[-1])
+        # one additional cell around the sensor elements, such that their neighbourhood is within the grid
+        self.pixel_offsets = (max(0, int(np.ceil(x_start - np.min(sensor_x)))) + 1,
+                              max(0, int(np.ceil(y_start - np.min(sensor_depth)))) + 1)
+        grid_shape = (self.pixel_offsets[0] + len(x) + max(0, int(np.ceil(np.max(sensor_x) - x_end))) + 1,
+                      self.pixel_offsets[1] + len(y) + max(0, int(np.ceil(np.max(sensor_depth) - y_end))) + 1)
+        self.grid_origin = (x_start - self.pixel_offsets[0], y_start - self.pixel_offsets[1])
+
+        grid_x = (self.grid_origin[0] + np.arange(grid_shape[0]))[:, None] * spacing_in_mm
+        grid_depth = (self.grid_origin[1] + np.arange(grid_shape[1]))[None, :] * spacing_in_mm
+        speed_of_sound = speed_of_sound_map.sample(grid_x, float(z[0]) * spacing_in_mm, grid_depth)
+        # A speed of sound in m/s equals one in mm/ms, such that the travel times are in ms
+        self.slowness = torch.from_numpy(1 / speed_of_sound).to(sensor_positions.device)
+
+    def get_travel_times(self) -> torch.Tensor:
+        """
+        Solves the eikonal equation for all sensor elements on the first call.
+
+        :return: (torch tensor) the travel times in ms of shape (pixels, sensor elements) in the flat pixel order of
+            the image
+        """
+        if self._travel_times is not None:
+            return self._travel_times
+        source_coordinates = torch.stack([self.sensor_positions[:, 0] / self.spacing_in_mm - self.grid_origin[0],
+                                          self.sensor_positions[:, 2] / self.spacing_in_mm - self.grid_origin[1]],
+                                         dim=1).to(self.slowness.dtype)
+        # distances, gradients, factors and previous factors of every cell in double precision
+        sources_per_chunk = max(1, int(self.memory_budget_in_bytes // (48 * (self.slowness.shape[0] + 2) *
+                                                                       (self.slowness.shape[1] + 2))))
+        pixels = (slice(None), slice(self.pixel_offsets[0], self.pixel_offsets[0] + self.image_shape[0]),
+                  slice(self.pixel_offsets[1], self.pixel_offsets[1] + self.image_shape[1]))
+        travel_times = []
+        for chunk_start in range(0, len(source_coordinates), sources_per_chunk):
+            chunk_travel_times = compute_travel_times(self.slowness, self.spacing_in_mm,
+                                                      source_coordinates[chunk_start:chunk_start + sources_per_chunk],
+                                                      self.tolerance_in_ms)
+            travel_times.append(chunk_travel_times[pixels].reshape(chunk_travel_times.shape[0], -1).float())
+        self._travel_times = torch.cat(travel_times).T.contiguous()
+        return self._travel_times
@@ -7,6 +7,9 @@ from simpa.utils.libraries.structure_library import priority_sorted_structures
 from simpa.utils import Tags
 import numpy as np
 from simpa.utils import create_deformation_settings
+from simpa.utils.hashing import compute_hash
+from simpa.utils.libraries.molecule_library import MolecularComposition
+from simpa.utils.tissue_properties import TissueProperties
 import torch
 
 
@@ -42,9 +45,25 @@ class ModelBasedVolumeCreationAdapter(VolumeCreatorModuleBase):
 
         simulate(simulation_settings)
 
-
+    The volume is created in two steps. A wavelength-independent geometry pass rasterizes the structures and
+    combines their volume fractions according to their priorities, which yields the voxels and volume fractions that
+    every structure contributes to the volume (see StructureFractions). It is run only once per simulation.
+    For every wavelength, the properties are then given as the sum of the volume fractions weighted with the
+    properties of the structures, which are precomputed for all wavelengths in a structure x wavelength table.
+    Structures with random geometries draw from the global numpy random state. The geometry is therefore only reused
+    if the random state before the geometry pass equals the one of the pass that created it, and the random state
+    after the pass is restored, such that subsequent pipeline elements draw the same random numbers as if the
+    geometry pass had been run.
     """
 
+    def __init__(self, global_settings):
+        super(ModelBasedVolumeCreationAdapter, self).__init__(global_settings)
+        self.structure_fractions = None
+        self.geometry_hash = None
+        # the global numpy random state before and after the geometry pass of the structure_fractions
+        self.random_state_before_geometry_pass = None
+        self.random_state_after_geometry_pass = None
+
     def create_simulation_volume(self) -> dict:
 
         if Tags.SIMULATE_DEFORMED_LAYERS in self.component_settings \
@@ -60,47 +79,161 @@ class ModelBasedVolumeCreationAdapter(VolumeCreatorModuleBase):
                     cosine_scaling_factor=1)
 
         volumes, x_dim_px, y_dim_px, z_dim_px = self.create_empty_volumes()
-        global_volume_fractions = torch.zeros((x_dim_px, y_dim_px, z_dim_px),
-                                              dtype=torch.float, device=self.torch_device)
-        max_added_fractions = torch.zeros((x_dim_px, y_dim_px, z_dim_px), dtype=torch.float, device=self.torch_device)
         wavelength = self.global_settings[Tags.WAVELENGTH]
 
-        for structure in priority_sorted_structures(self.global_settings, self.component_settings):
-            self.logger.debug(type(structure))
-
-            structure_properties = structure.properties_for_wavelength(wavelength)
-
-            structure_volume_fractions = torch.as_tensor(
-                structure.geometrical_volume, dtype=torch.float, device=self.torch_device)
-            structure_indexes_mask = structure_volume_fractions > 0
-            global_volume_fractions_mask = global_volume_fractions < 1
-            mask = structure_indexes_mask & global_volume_fractions_mask
-            added_volume_fraction = (global_volume_fractions + structure_volume_fractions)
-
-            added_volume_fraction[added_volume_fraction <= 1 & mask] = structure_volume_fractions[
-                added_volume_fraction <= 1 & mask]
-
-            selector_more_than_1 = added_volume_fraction > 1
-            if torch.any(selector_more_than_1):
-                remaining_volume_fraction_to_fill = 1 - global_volume_fractions[selector_more_than_1]
-                fraction_to_be_filled = structure_volume_fractions[selector_more_than_1]
-                added_volume_fraction[selector_more_than_1] = torch.min(torch.stack((remaining_volume_fraction_to_fill,
-                                                                                     fraction_to_be_filled)), 0).values
+        # The geometry pass is repeated for the first wavelength of every simulation, such that structures with
+        # random geometries are not reused across simulations without a random seed.
+        random_state = np.random.get_state()
+        if (self.structure_fractions is None or self.get_geometry_hash() != self.geometry_hash or
+                wavelength == self.global_settings[Tags.WAVELENGTHS][0] or
+                not _random_states_equal(random_state, self.random_state_before_geometry_pass)):
+            self.structure_fractions = self.create_structure_fractions((x_dim_px, y_dim_px, z_dim_px))
+            # the structures may complete their settings, e.g. the background sets its priority
+            self.geometry_hash = self.get_geometry_hash()
+            self.random_state_before_geometry_pass = random_state
+            self.random_state_after_geometry_pass = np.random.get_state()
+        else:
+            self.logger.debug("Reusing the volume fractions of the structures of the previous wavelength")
+            np.random.set_state(self.random_state_after_geometry_pass)
+
+        structure_properties = self.structure_fractions.get_properties_for_wavelength(wavelength)
+        for index, (voxel_indices, volume_fractions, segmentation_voxel_indices) in enumerate(
+                zip(self.structure_fractions.voxel_indices, self.structure_fractions.volume_fractions,
+                    self.structure_fractions.segmentation_voxel_indices)):
             for key in volumes.keys():
-                if structure_properties[key] is None:
+                if structure_properties[index][key] is None:
                     continue
                 if key == Tags.DATA_FIELD_SEGMENTATION:
-                    added_fraction_greater_than_any_added_fraction = added_volume_fraction > max_added_fractions
-                    volumes[key][added_fraction_greater_than_any_added_fraction & mask] = structure_properties[key]
-                    max_added_fractions[added_fraction_greater_than_any_added_fraction & mask] = \
-                        added_volume_fraction[added_fraction_greater_than_any_added_fraction & mask]
+                    volumes[key].view(-1)[segmentation_voxel_indices] = structure_properties[index][key]
                 else:
-                    volumes[key][mask] += added_volume_fraction[mask] * structure_properties[key]
-
-            global_volume_fractions[mask] += added_volume_fraction[mask]
+                    volumes[key].view(-1)[voxel_indices] += volume_fractions * structure_properties[index][key]
 
         # convert volumes back to CPU
         for key in volumes.keys():
             volumes[key] = volumes[key].cpu().numpy().astype(np.float64, copy=False)
 
         return volumes
+
+    def get_geometry_hash(self) -> str:
+        """
+        :return: a content hash of the settings that determine the geometry of the structures
+        """
+        return compute_hash(_without_internal_properties(self.component_settings),
+                            self.global_settings[Tags.SPACING_MM], self.global_settings[Tags.DIM_VOLUME_X_MM],
+                            self.global_settings[Tags.DIM_VOLUME_Y_MM], self.global_settings[Tags.DIM_VOLUME_Z_MM],
+                            self.global_settings[Tags.RANDOM_SEED])
+
+    def create_structure_fractions(self, volume_dimensions_voxels: tuple) -> "StructureFractions":
+        """
+        Rasterizes the structures in descending order of their priority and combines their volume fractions, such
+        that the volume fractions of every voxel add up to at most 1. Every voxel of the segmentation is assigned to
+        the structure that adds the largest volume fraction to it.
+
+        :param volume_dimensions_voxels: the dimensions of the simulation volume in voxels
+        :return: the voxels and volume fractions of every structure
+        """
+        number_of_voxels = int(np.prod(volume_dimensions_voxels))
+        global_volume_fractions = torch.zeros(number_of_voxels, dtype=torch.float, device=self.torch_device)
+        max_added_fractions = torch.zeros(number_of_voxels, dtype=torch.float, device=self.torch_device)
+        molecule_compositions = []
+        voxel_indices = []
+        volume_fractions = []
+        segmentation_voxel_indices = []
+
+        # only the voxels that are occupied by a structure are evaluated for it
+        for structure in priority_sorted_structures(self.global_settings, self.component_settings):
+            self.logger.debug(type(structure))
+
+            structure_voxel_indices = torch.as_tensor(structure.voxel_indices, device=self.torch_device)
+            structure_volume_fractions = torch.as_tensor(structure.volume_fractions, dtype=torch.float,
+                                                         device=self.torch_device)
+            previous_volume_fractions = global_volume_fractions[structure_voxel_indices]
+            mask = previous_volume_fractions < 1
+            structure_voxel_indices = structure_voxel_indices[mask]
+            structure_volume_fractions = structure_volume_fractions[mask]
+            previous_volume_fractions = previous_volume_fractions[mask]
+
+            # the structure fills at most the remaining volume fraction of every voxel
+            added_volume_fraction = torch.where(previous_volume_fractions + structure_volume_fractions <= 1,
+                                                structure_volume_fractions,
+                                                torch.minimum(1 - previous_volume_fractions,
+                                                              structure_volume_fractions))
+
+            if structure.molecule_composition.segmentation_type is not None:
+                segmentation_mask = added_volume_fraction > max_added_fractions[structure_voxel_indices]
+                max_added_fractions[structure_voxel_indices[segmentation_mask]] = \
+                    added_volume_fraction[segmentation_mask]
+                segmentation_voxel_indices.append(structure_voxel_indices[segmentation_mask])
+            else:
+                segmentation_voxel_indices.append(torch.zeros(0, dtype=torch.long, device=self.torch_device))
+
+            molecule_compositions.append(structure.molecule_composition)
+            voxel_indices.append(structure_voxel_indices)
+            volume_fractions.append(added_volume_fraction)
+            global_volume_fractions[structure_voxel_indices] += added_volume_fraction
+
+        return StructureFractions(molecule_compositions, voxel_indices, volume_fractions, segmentation_voxel_indices,
+                                  self.global_settings[Tags.WAVELENGTHS])
+
+
+def _random_states_equal(first_state: tuple, second_state: tuple) -> bool:
+    """
+    :return: True, if the given states of np.random.get_state are equal
+    """
+    if first_state is None or second_state is None:
+        return False
+    return all(np.array_equal(first, second) for first, second in zip(first_state, second_state))
+
+
+def _without_internal_properties(item):
+    """
+    Replaces the MolecularCompositions within the given settings by their segmentation type and molecules, because
+    their internal properties change with the wavelength they have been evaluated for last.
+    """
+    if isinstance(item, MolecularComposition):
+        return item.segmentation_type, list(item)
+    if isinstance(item, dict):
+        return {key: _without_internal_properties(value) for key, value in item.items()}
+    return item
+
+
+class StructureFractions:
+    """
+    The wavelength-independent result of the geometry pass of the ModelBasedVolumeCreationAdapter. For every
+    structure, it holds the flat indices of the voxels that the structure contributes to, the volume fractions it adds
+    to them and the flat indices of the voxels that are assigned to it in the segmentation. The properties of the
+    structures are precomputed for the given wavelengths in a structure x wavelength property table.
+    """
+
+    def __init__(self, molecule_compositions: list, voxel_indices: list, volume_fractions: list,
+                 segmentation_voxel_indices: list, wavelengths: list):
+        """
+        :param molecule_compositions: the MolecularComposition of every structure
+        :param voxel_indices: the flat indices of the voxels of every structure
+        :param volume_fractions: the volume fractions that every structure adds to its voxels
+        :param segmentation_voxel_indices: the flat indices of the voxels that are assigned to every structure in the
+            segmentation
+        :param wavelengths: the wavelengths of the property table
+        """
+        self.molecule_compositions = molecule_compositions
+        self.voxel_indices = voxel_indices
+        self.volume_fractions = volume_fractions
+        self.segmentation_voxel_indices = segmentation_voxel_indices
+        self.property_table = dict()
+        for wavelength in wavelengths:
+            self.get_properties_for_wavelength(wavelength)
+
+    def get_properties_for_wavelength(self, wavelength) -> list:
+        """
+        :param wavelength: the wavelength of the queried properties
+        :return: the TissueProperties of every structure at the given wavelength
+        """
+        if wavelength not in self.property_table:
+            structure_properties = []
+            for molecule_composition in self.molecule_compositions:
+                # the molecular composition returns the same TissueProperties instance for every wavelength
+                properties = TissueProperties()
+                properties.update(molecule_composition.get_properties_for_wavelength(wavelength))
+                structure_properties.append(properties)
+            self.property_table[wavelength] = structure_properties
+        return self.property_table[wavelength]
@@ -6,3 +6,11 @@ from simpa.io_handling.io_hdf5 import load_hdf5
 from simpa.io_handling.io_hdf5 import save_hdf5
 from simpa.io_handling.io_hdf5 import load_data_field
 from simpa.io_handling.io_hdf5 import save_data_field
+from simpa.io_handling.io_hdf5 import merge_hdf5_files
+from simpa.io_handling.io_hdf5 import write_hdf5_items
+from simpa.io_handling.in_memory_data_store import in_memory_data_store
+from simpa.io_handling.in_memory_data_store import InMemoryDataStore
+from simpa.io_handling.io_hdf5 import delete_hdf5_item
+from simpa.io_handling.io_hdf5 import repack_hdf5
+from simpa.io_handling.io_hdf5 import LazyHDF5Dataset
+from simpa.io_handling.simpa_output_file import SimpaOutputFile
@@ -0,0 +1,273 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from numbers import Number
+import os
+import threading
+
+import numpy as np
+import torch
+
+from simpa.log import Logger
+from simpa.utils import Tags
+
+_IN_MEMORY_DATA_STORES = dict()
+
+
+class InMemoryDataStore:
+    """
+    Pipeline-scoped in-memory store for the data that is written to and read from a SIMPA output file.
+    Entries are keyed by their path in the hdf5 file, i.e. in the format of
+    simpa.utils.dict_path_manager.generate_dict_path.
+
+    While a data store is open for a file, save_hdf5 and load_hdf5 (and therefore also save_data_field and
+    load_data_field) read and write the store first. Written entries are only persisted to the hdf5 file if the
+    store is flushed, which can happen asynchronously in a background thread, so that every array is written to
+    disk only once. Arrays that had to be read from disk are kept in memory for subsequent reads.
+
+    Only arrays and scalar values are held in memory. Other items, such as settings dictionaries or digital device
+    twins, are written to the hdf5 file directly.
+    """
+
+    def __init__(self, file_path: str, writer):
+        """
+        :param file_path: Path of the hdf5 file that is backed by this data store.
+        :param writer: Function that persists a dictionary mapping hdf5 paths to items into the file at file_path.
+        """
+        self.logger = Logger()
+        self.file_path = file_path
+        self._writer = writer
+        self._entries = dict()
+        self._dirty_keys = set()
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_flush = None
+
+    @staticmethod
+    def normalise_path(file_dictionary_path: str) -> str:
+        """
+        Normalises a path within the hdf5 file, such that paths with and without trailing slashes are identical.
+
+        :param file_dictionary_path: path within the hdf5 file
+        :return: the normalised path
+        """
+        return "/" + file_dictionary_path.strip("/")
+
+    @staticmethod
+    def _flatten(item, path: str, leaves: dict) -> bool:
+        """
+        Recursively collects all leaves of the given item that can be held in memory.
+
+        :return: True, if all leaves of the item can be held in memory.
+        """
+        if isinstance(item, torch.Tensor):
+            item = item.cpu().numpy()
+        if isinstance(item, np.ndarray):
+            leaves[path] = np.array(item, copy=True)
+        elif isinstance(item, (bytes, str, bool, np.bool_, Number)):
+            leaves[path] = item
+        elif type(item) is dict:
+            for key, value in item.items():
+                if not InMemoryDataStore._flatten(value, path + "/" + str(key), leaves):
+                    return False
+        else:
+            return False
+        return True
+
+    def put(self, item, file_dictionary_path: str) -> bool:
+        """
+        Stores the item at the given path if all of its leaves can be held in memory.
+
+        :param item: the item to store. This can be an array, a scalar value or a (nested) dictionary of these.
+        :param file_dictionary_path: path of the item within the hdf5 file
+        :return: True, if the item was stored, False if it needs to be written to the hdf5 file directly.
+        """
+        leaves = dict()
+        if not self._flatten(item, self.normalise_path(file_dictionary_path).rstrip("/"), leaves):
+            return False
+        with self._lock:
+            for key, value in leaves.items():
+                self._entries[key] = value
+                self._dirty_keys.add(key)
+        return True
+
+    def put_clean(self, item, file_dictionary_path: str):
+        """
+        Keeps an item that has been read from the hdf5 file in memory without marking it for writing.
+
+        :param item: the item that was read from the hdf5 file
+        :param file_dictionary_path: path of the item within the hdf5 file
+        """
+        if isinstance(item, np.ndarray):
+            with self._lock:
+                self._entries[self.normalise_path(file_dictionary_path)] = np.array(item, copy=True)
+
+    def get(self, file_dictionary_path: str, index=None, copy: bool = True):
+        """
+        Looks up the item at the given path.
+
+        :param file_dictionary_path: path of the item within the hdf5 file
+        :param index: optional index or slice of the array that should be returned, e.g. np.s_[:, 10, :]
+        :param copy: if False, arrays are returned as read-only views of the data held in memory.
+        :return: a tuple (found, item). Arrays are returned as copies by default, so that they can be modified by
+            the caller.
+        """
+        key = self.normalise_path(file_dictionary_path)
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            item = self._entries[key]
+        if isinstance(item, np.ndarray):
+            if index is not None:
+                item = item[index]
+            if copy:
+                item = np.array(item, copy=True)
+            else:
+                item = item.view()
+                item.flags.writeable = False
+        elif isinstance(item, bytes):
+            item = item.decode("utf-8")
+        elif isinstance(item, np.bool_):
+            item = bool(item)
+        return True, item
+
+    def update(self, item, file_dictionary_path: str, index) -> bool:
+        """
+        Overwrites a part of an array that is held in memory.
+
+        :param item: the new values
+        :param file_dictionary_path: path of the array within the hdf5 file
+        :param index: index or slice of the array that should be overwritten
+        :return: True, if the array was held in memory and has been updated.
+        """
+        key = self.normalise_path(file_dictionary_path)
+        with self._lock:
+            if not isinstance(self._entries.get(key), np.ndarray):
+                return False
+            # Never modify an array in place that might currently be written by a background flush
+            array = np.array(self._entries[key], copy=True)
+            array[index] = item
+            self._entries[key] = array
+            self._dirty_keys.add(key)
+        return True
+
+    def discard(self, file_dictionary_path: str):
+        """
+        Removes all entries at or below the given path without writing them, e.g. because the hdf5 file content
+        at that path is replaced directly.
+
+        :param file_dictionary_path: path within the hdf5 file
+        """
+        prefix = self.normalise_path(file_dictionary_path).rstrip("/")
+        with self._lock:
+            for key in [key for key in self._entries if key == prefix or key.startswith(prefix + "/")]:
+                del self._entries[key]
+                self._dirty_keys.discard(key)
+
+    def flush(self, file_dictionary_path: str = "/", asynchronous: bool = False, evict_wavelength=None):
+        """
+        Writes all entries at or below the given path, which have not been written yet, into the hdf5 file.
+
+        :param file_dictionary_path: only entries at or below this path are written. Defaults to all entries.
+        :param asynchronous: if True, the entries are written in a background thread.
+        :param evict_wavelength: if given, all entries that belong to this wavelength are removed from memory once
+            they have been written to the hdf5 file.
+        """
+        prefix = self.normalise_path(file_dictionary_path).rstrip("/")
+        with self._lock:
+            snapshot = {key: self._entries[key] for key in self._dirty_keys
+                        if key == prefix or key.startswith(prefix + "/")}
+        self.wait()
+
+        def write():
+            if len(snapshot) > 0:
+                self._writer(snapshot, self.file_path)
+            with self._lock:
+                for key, value in snapshot.items():
+                    # The entry might have been overwritten while it was being written
+                    if self._entries.get(key) is value:
+                        self._dirty_keys.discard(key)
+                if evict_wavelength is not None:
+                    self.evict_wavelength(evict_wavelength)
+
+        if asynchronous:
+            self._pending_flush = self._executor.submit(write)
+        else:
+            write()
+
+    def evict_wavelength(self, wavelength):
+        """
+        Removes all entries that belong to the given wavelength from memory, if they have already been written to
+        the hdf5 file. These are the data fields below Tags.SIMULATIONS whose path ends with the wavelength, see
+        simpa.utils.dict_path_manager.generate_dict_path.
+
+        :param wavelength: the wavelength whose entries should be removed
+        """
+        simulations_prefix = "/" + Tags.SIMULATIONS + "/"
+        wavelength_suffix = "/" + str(wavelength)
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key.startswith(simulations_prefix) and key.endswith(wavelength_suffix)]:
+                if key not in self._dirty_keys:
+                    del self._entries[key]
+
+    def wait(self):
+        """
+        Blocks until a pending asynchronous flush has finished. Must be called before the hdf5 file is accessed
+        directly.
+        """
+        if self._pending_flush is not None:
+            pending_flush = self._pending_flush
+            self._pending_flush = None
+            pending_flush.result()
+
+    def close(self):
+        """
+        Writes all remaining entries into the hdf5 file and releases the memory of the data store.
+        """
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+            with self._lock:
+                self._entries.clear()
+                self._dirty_keys.clear()
+
+
+def get_in_memory_data_store(file_path: str):
+    """
+    Returns the in-memory data store that is currently open for the given file.
+
+    :param file_path: path of the hdf5 file
+    :return: the InMemoryDataStore or None, if no data store is open for this file
+    """
+    if len(_IN_MEMORY_DATA_STORES) == 0:
+        return None
+    return _IN_MEMORY_DATA_STORES.get(os.path.abspath(file_path))
+
+
+@contextmanager
+def in_memory_data_store(file_path: str):
+    """
+    Opens an in-memory data store for the given hdf5 file for the duration of the with-block.
+    All data that is still held in memory is written into the file when the block is left. Usage::
+
+        with in_memory_data_store(settings[Tags.SIMPA_OUTPUT_PATH]):
+            # run simulation modules
+
+    :param file_path: path of the hdf5 file
+    """
+    from simpa.io_handling.io_hdf5 import write_hdf5_items
+    key = os.path.abspath(file_path)
+    if key in _IN_MEMORY_DATA_STORES:
+        raise RuntimeError(f"An in-memory data store is already open for {file_path}.")
+    data_store = InMemoryDataStore(file_path, write_hdf5_items)
+    _IN_MEMORY_DATA_STORES[key] = data_store
+    try:
+        yield data_store
+    finally:
+        del _IN_MEMORY_DATA_STORES[key]
+        data_store.close()
@@ -3,183 +3,150 @@
 # SPDX-License-Identifier: MIT
 
 import h5py
-from simpa.io_handling.serialization import SERIALIZATION_MAP
-from simpa.utils.dict_path_manager import generate_dict_path
-import numpy as np
-from simpa.log import Logger
-from simpa.utils.serializer import SerializableSIMPAClass
-
-logger = Logger()
+import os
+from simpa.io_handling.simpa_output_file import SimpaOutputFile, LazyHDF5Dataset, get_open_simpa_output_file, \
+    _simpa_output_file, UNUSED_BYTES_ATTRIBUTE
 
 
 def save_hdf5(save_item, file_path: str, file_dictionary_path: str = "/", file_compression: str = None):
     """
     Saves a dictionary with arbitrary content or an item of any kind to an hdf5-file with given filepath.
+    If an in-memory data store is open for the file (see simpa.io_handling.in_memory_data_store), arrays and scalar
+    values are stored in memory and only written into the file once the data store is flushed.
 
     :param save_item: Dictionary to save.
     :param file_path: Path of the file to save the dictionary in.
     :param file_dictionary_path: Path in dictionary structure of existing hdf5 file to store the dictionary in.
+    :param file_compression: possible file compression for the hdf5 output file. Values are: gzip, lzf and szip.
+        If a new file is created, all datasets that are added to the file later on are compressed in the same way.
+    :returns: :mod:`Null`
+    """
+    with _simpa_output_file(file_path, "w" if file_dictionary_path == "/" else "a") as output_file:
+        output_file.save(save_item, file_dictionary_path, file_compression)
+
+
+def write_hdf5_items(items: dict, file_path: str, file_compression: str = None):
+    """
+    Writes several items into an existing hdf5 file, opening the file only once.
+
+    :param items: Dictionary that maps the paths of the items in the hdf5 file (e.g. "/simulations/sos") to the items.
+    :param file_path: Path of the file to save the items in.
     :param file_compression: possible file compression for the hdf5 output file. Values are: gzip, lzf and szip.
     :returns: :mod:`Null`
     """
+    with _simpa_output_file(file_path, "a") as output_file:
+        output_file.write_items(items, file_compression)
 
-    def data_grabber(file, path, data_dictionary, compression: str = None):
-        """
-        Helper function which recursively grabs data from dictionaries in order to store them into hdf5 groups.
-
-        :param file: hdf5 file instance to store the data in.
-        :param path: Current group path in hdf5 file group structure.
-        :param data_dictionary: Dictionary to save.
-        :param compression: possible file compression for the corresponding dataset. Values are: gzip, lzf and szip.
-        """
-
-        for key, item in data_dictionary.items():
-            key = str(key)
-
-            try:
-                item = item.cpu()
-            except:
-                pass
-
-            if isinstance(item, SerializableSIMPAClass):
-                serialized_item = item.serialize()
-
-                data_grabber(file, path + key + "/", serialized_item, file_compression)
-            elif not isinstance(item, (list, dict, type(None))):
-
-                if isinstance(item, (bytes, int, np.int64, float, str, bool, np.bool_)):
-                    try:
-                        h5file[path + key] = item
-                    except (OSError, RuntimeError, ValueError):
-                        del h5file[path + key]
-                        h5file[path + key] = item
-                else:
-                    c = None
-                    if isinstance(item, np.ndarray):
-                        c = compression
-
-                    try:
-                        h5file.create_dataset(path + key, data=item, compression=c)
-                    except (OSError, RuntimeError, ValueError):
-                        del h5file[path + key]
-                        try:
-                            h5file.create_dataset(path + key, data=item, compression=c)
-                        except RuntimeError as e:
-                            logger.critical("item " + str(item) + " of type " + str(type(item)) +
-                                            " was not serializable! Full exception: " + str(e))
-                            raise e
-                    except TypeError as e:
-                        logger.critical("The key " + str(key) + " was not of the correct typing for HDF5 handling."
-                                        "Make sure this key is not a tuple. " + str(item) + " " + str(type(item)))
-                        raise e
-            elif item is None:
-                try:
-                    h5file[path + key] = "None"
-                except (OSError, RuntimeError, ValueError):
-                    del h5file[path + key]
-                    h5file[path + key] = "None"
-            elif isinstance(item, list):
-                list_dict = dict()
-                for i, list_item in enumerate(item):
-                    list_dict[str(i)] = list_item
-                try:
-                    data_grabber(file, path + key + "/list/", list_dict, file_compression)
-                except TypeError as e:
-                    logger.critical("The key " + str(key) + " was not of the correct typing for HDF5 handling."
-                                    "Make sure this key is not a tuple.")
-                    raise e
-            else:
-                data_grabber(file, path + key + "/", item, file_compression)
-
-    if file_dictionary_path == "/":
-        writing_mode = "w"
-    else:
-        writing_mode = "a"
-
-    if isinstance(save_item, SerializableSIMPAClass):
-        save_item = save_item.serialize()
-    if isinstance(save_item, dict):
-        with h5py.File(file_path, writing_mode) as h5file:
-            data_grabber(h5file, file_dictionary_path, save_item, file_compression)
-    else:
-        save_key = file_dictionary_path.split("/")[-2]
-        dictionary = {save_key: save_item}
-        file_dictionary_path = "/".join(file_dictionary_path.split("/")[:-2]) + "/"
-        with h5py.File(file_path, writing_mode) as h5file:
-            data_grabber(h5file, file_dictionary_path, dictionary, file_compression)
-
-
-def load_hdf5(file_path, file_dictionary_path="/"):
+
+def load_hdf5(file_path, file_dictionary_path="/", lazy: bool = False):
     """
     Loads a dictionary from an hdf5 file.
 
     :param file_path: Path of the file to load the dictionary from.
     :param file_dictionary_path: Path in dictionary structure of hdf5 file to lo the dictionary in.
+    :param lazy: If True, only the structure of the file and scalar values are loaded. Arrays are represented by
+        LazyHDF5Dataset proxies that read the data from the file once they are indexed, which makes it possible to
+        look at parts of large files without loading them into memory. Arrays that are held in an in-memory data
+        store are returned as read-only arrays.
     :returns: Dictionary
     :rtype: dict
     """
+    with _simpa_output_file(file_path, "r") as output_file:
+        return output_file.load(file_dictionary_path, lazy)
+
+
+def load_data_field(file_path, data_field, wavelength=None, index=None):
+    """
+    Loads a data field from a SIMPA output file.
+
+    :param file_path: Path of the hdf5 file.
+    :param data_field: Data field to load.
+    :param wavelength: Wavelength of the data field, if it is wavelength-dependent.
+    :param index: Optional index or slice of the data field, e.g. np.s_[:, 10, :]. Only the corresponding
+        hyperslab is read from the file.
+    :returns: the data field or the requested part of it
+    """
+    with _simpa_output_file(file_path, "r") as output_file:
+        return output_file.load_data_field(data_field, wavelength, index)
+
+
+def save_data_field(data, file_path, data_field, wavelength=None, index=None):
+    """
+    Saves a data field into a SIMPA output file.
+
+    :param data: the data to save.
+    :param file_path: Path of the hdf5 file.
+    :param data_field: Data field to save.
+    :param wavelength: Wavelength of the data field, if it is wavelength-dependent.
+    :param index: Optional index or slice, e.g. np.s_[:, 10, :]. If given, only the corresponding hyperslab of
+        the existing data field is overwritten with the data.
+    :returns: :mod:`Null`
+    """
+    with _simpa_output_file(file_path, "a") as output_file:
+        output_file.save_data_field(data, data_field, wavelength, index)
+
+
+def merge_hdf5_files(file_path: str, source_file_paths: list, exclude_paths: list = None):
+    """
+    Merges the content of several hdf5 files into the hdf5 file with the given file path.
+    Groups are merged recursively. If a dataset is present in more than one file, the first occurrence is kept,
+    so the order of source_file_paths determines which values take precedence.
+    The data is copied within the HDF5 library without being loaded into memory.
+
+    :param file_path: Path of the file that the source files are merged into.
+    :param source_file_paths: List of paths of the files that should be merged into the target file.
+    :param exclude_paths: List of group or dataset paths (e.g. "/settings") that should not be copied.
+    :returns: :mod:`Null`
+    """
+    with _simpa_output_file(file_path, "a") as output_file:
+        output_file.merge(source_file_paths, exclude_paths)
+
+
+def delete_hdf5_item(file_path: str, file_dictionary_path: str):
+    """
+    Deletes an item from an hdf5 file if it exists. Groups of serialized SIMPA classes (e.g. Settings) on the way
+    are resolved transparently, i.e. the path has the same format as for load_hdf5.
+
+    :param file_path: Path of the hdf5 file.
+    :param file_dictionary_path: Path of the item in dictionary structure of the hdf5 file.
+    :returns: True, if the item existed and was deleted.
+    """
+    with _simpa_output_file(file_path, "a") as output_file:
+        return output_file.delete(file_dictionary_path)
+
 
-    def data_grabber(file, path):
-        """
-        Helper function which recursively loads data from the hdf5 group structure to a dictionary.
-
-        :param file: hdf5 file instance to load the data from.
-        :param path: Current group path in hdf5 file group structure.
-        :returns: Dictionary or np.array
-        """
-
-        if isinstance(h5file[path], h5py._hl.dataset.Dataset):
-            return h5file[path][()]
-
-        dictionary = {}
-        for key, item in h5file[path].items():
-            if isinstance(item, h5py._hl.dataset.Dataset):
-                item = item[()]
-                if item is not None:
-                    dictionary[key] = item
-                    if isinstance(dictionary[key], bytes):
-                        dictionary[key] = dictionary[key].decode("utf-8")
-                    elif isinstance(dictionary[key], np.bool_):
-                        dictionary[key] = bool(dictionary[key])
-                else:
-                    dictionary[key] = None
-            elif isinstance(item, h5py._hl.group.Group):
-                if key in SERIALIZATION_MAP.keys():
-                    serialized_dict = data_grabber(file, path + key + "/")
-                    serialized_class = SERIALIZATION_MAP[key]
-                    deserialized_class = serialized_class.deserialize(serialized_dict)
-                    dictionary = deserialized_class
-                elif key == "list":
-                    dictionary_list = [None for x in item.keys()]
-                    for listkey in sorted(item.keys()):
-                        if isinstance(item[listkey], h5py._hl.dataset.Dataset):
-                            listkey_item = item[listkey][()]
-                            if listkey_item is not None:
-                                list_item = listkey_item
-                                if isinstance(list_item, bytes):
-                                    list_item = list_item.decode("utf-8")
-                                elif isinstance(list_item, np.bool_):
-                                    list_item = bool(list_item)
-                            else:
-                                list_item = None
-                            dictionary_list[int(listkey)] = list_item
-                        elif isinstance(item[listkey], h5py._hl.group.Group):
-                            dictionary_list[int(listkey)] = data_grabber(file, path + key + "/" + listkey + "/")
-                    dictionary = dictionary_list
-                else:
-                    dictionary[key] = data_grabber(file, path + key + "/")
-        return dictionary
-
-    with h5py.File(file_path, "r") as h5file:
-        return data_grabber(h5file, file_dictionary_path)
-
-
-def load_data_field(file_path, data_field, wavelength=None):
-    path = generate_dict_path(data_field, wavelength=wavelength)
-    data = load_hdf5(file_path, path)
-    return data
-
-
-def save_data_field(data, file_path, data_field, wavelength=None):
-    dict_path = generate_dict_path(data_field, wavelength=wavelength)
-    save_hdf5(data, file_path, dict_path)
+def get_unused_bytes(file_path: str) -> int:
+    """
+    Returns the number of bytes of the given hdf5 file that are occupied by deleted or overwritten items.
+
+    :param file_path: Path of the hdf5 file.
+    :returns: the number of unused bytes.
+    """
+    with _simpa_output_file(file_path, "r") as output_file:
+        return output_file.get_unused_bytes()
+
+
+def repack_hdf5(file_path: str):
+    """
+    Reclaims the storage of deleted or overwritten items of an hdf5 file, e.g. of data fields that were resized.
+    The file content is copied into a temporary file one item at a time within the HDF5 library, keeping the
+    compression and chunking of all datasets, and the temporary file then replaces the original file.
+
+    :param file_path: Path of the hdf5 file.
+    :raises RuntimeError: if a SimpaOutputFile session is open for the file
+    :returns: :mod:`Null`
+    """
+    if get_open_simpa_output_file(file_path) is not None:
+        raise RuntimeError(f"The file {file_path} cannot be repacked while a session is open for it.")
+    repacked_file_path = file_path + ".repack"
+    try:
+        with h5py.File(file_path, "r") as source_file, h5py.File(repacked_file_path, "w") as target_file:
+            for key, value in source_file.attrs.items():
+                if key != UNUSED_BYTES_ATTRIBUTE:
+                    target_file.attrs[key] = value
+            for key in source_file.keys():
+                source_file.copy(source_file[key], target_file, name=key)
+        os.replace(repacked_file_path, file_path)
+    finally:
+        if os.path.exists(repacked_file_path):
+            os.remove(repacked_file_path)
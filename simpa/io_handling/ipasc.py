@@ -39,7 +39,7 @@ class IpascSimpaAdapter(BaseAdapter):
 
         # checking SIMPA settings dictionary
         if settings is None:
-            settings = load_hdf5(hdf5_file_path)
+            settings = load_hdf5(hdf5_file_path, lazy=True)
             if Tags.SETTINGS not in settings:
                 self.logger.error("Unable to recover settings dictionary. Please supply a valid settings dictionary for a "
                                   "successful export.")
@@ -0,0 +1,644 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from contextlib import contextmanager
+import os
+import threading
+
+import h5py
+import numpy as np
+
+from simpa.io_handling.serialization import SERIALIZATION_MAP
+from simpa.io_handling.in_memory_data_store import get_in_memory_data_store
+from simpa.utils.dict_path_manager import generate_dict_path
+from simpa.utils.serializer import SerializableSIMPAClass
+from simpa.log import Logger
+
+logger = Logger()
+
+FILE_COMPRESSION_ATTRIBUTE = "simpa_file_compression"
+UNUSED_BYTES_ATTRIBUTE = "simpa_unused_bytes"
+
+_OPEN_SIMPA_OUTPUT_FILES = dict()
+
+
+def _get_file_compression(h5file, file_compression: str = None):
+    """
+    Returns the compression that is used for new datasets in the given file. If no compression is given explicitly,
+    the compression the file was created with is used.
+
+    :param h5file: hdf5 file instance.
+    :param file_compression: explicitly requested compression or None.
+    :returns: the compression filter or None
+    """
+    if file_compression is not None:
+        return file_compression
+    file_compression = h5file.attrs.get(FILE_COMPRESSION_ATTRIBUTE)
+    if isinstance(file_compression, bytes):
+        file_compression = file_compression.decode("utf-8")
+    return file_compression
+
+
+def _get_number_of_bytes(item) -> int:
+    """
+    :return: the number of bytes of all arrays within the item
+    """
+    if isinstance(item, (np.ndarray, np.generic)):
+        return item.nbytes
+    if isinstance(item, dict):
+        return sum(_get_number_of_bytes(value) for value in item.values())
+    return 0
+
+
+def _delete_item(h5file, path: str):
+    """
+    Deletes a dataset or group from the hdf5 file. HDF5 does not return the storage of deleted objects to the
+    file system, so the number of bytes that are no longer in use is tracked in a file attribute.
+    See also repack_hdf5.
+
+    :param h5file: hdf5 file instance.
+    :param path: path of the dataset or group to delete.
+    """
+    unused_bytes = 0
+
+    def add_storage_size(_, item):
+        nonlocal unused_bytes
+        if isinstance(item, h5py.Dataset):
+            unused_bytes += item.id.get_storage_size()
+
+    item = h5file[path]
+    if isinstance(item, h5py.Dataset):
+        add_storage_size(path, item)
+    else:
+        item.visititems(add_storage_size)
+    del h5file[path]
+    h5file.attrs[UNUSED_BYTES_ATTRIBUTE] = int(h5file.attrs.get(UNUSED_BYTES_ATTRIBUTE, 0)) + unused_bytes
+
+
+def _save_items_to_group(h5file, path, data_dictionary, compression: str = None):
+    """
+    Helper function which recursively grabs data from dictionaries in order to store them into hdf5 groups.
+
+    :param h5file: hdf5 file instance to store the data in.
+    :param path: Current group path in hdf5 file group structure.
+    :param data_dictionary: Dictionary to save.
+    :param compression: possible file compression for the corresponding dataset. Values are: gzip, lzf and szip.
+    """
+
+    for key, item in data_dictionary.items():
+        key = str(key)
+
+        try:
+            item = item.cpu()
+        except:
+            pass
+
+        if isinstance(item, SerializableSIMPAClass):
+            serialized_item = item.serialize()
+
+            _save_items_to_group(h5file, path + key + "/", serialized_item, compression)
+        elif not isinstance(item, (list, dict, type(None))):
+
+            if isinstance(item, (bytes, int, np.int64, float, str, bool, np.bool_)):
+                try:
+                    h5file[path + key] = item
+                except (OSError, RuntimeError, ValueError):
+                    _delete_item(h5file, path + key)
+                    h5file[path + key] = item
+            else:
+                # Arrays are written as chunked datasets, such that they can be compressed as they are written.
+                c = None
+                if isinstance(item, np.ndarray) and item.ndim > 0 and item.size > 0:
+                    c = compression
+                    existing_item = h5file.get(path + key)
+                    if c is None and isinstance(existing_item, h5py.Dataset) and existing_item.chunks is None and \
+                            existing_item.shape == item.shape and existing_item.dtype == item.dtype:
+                        # Overwrite in place, so that the storage of the dataset is reused. Compressed datasets are
+                        # deleted and recreated instead, as their chunks can grow and would be moved within the
+                        # file without the old storage being accounted for as unused bytes.
+                        existing_item[...] = item
+                        continue
+
+                try:
+                    h5file.create_dataset(path + key, data=item, compression=c, chunks=True if c else None)
+                except (OSError, RuntimeError, ValueError):
+                    _delete_item(h5file, path + key)
+                    try:
+                        h5file.create_dataset(path + key, data=item, compression=c, chunks=True if c else None)
+                    except RuntimeError as e:
+                        logger.critical("item " + str(item) + " of type " + str(type(item)) +
+                                        " was not serializable! Full exception: " + str(e))
+                        raise e
+                except TypeError as e:
+                    logger.critical("The key " + str(key) + " was not of the correct typing for HDF5 handling."
+                                    "Make sure this key is not a tuple. " + str(item) + " " + str(type(item)))
+                    raise e
+        elif item is None:
+            try:
+                h5file[path + key] = "None"
+            except (OSError, RuntimeError, ValueError):
+                _delete_item(h5file, path + key)
+                h5file[path + key] = "None"
+        elif isinstance(item, list):
+            list_dict = dict()
+            for i, list_item in enumerate(item):
+                list_dict[str(i)] = list_item
+            try:
+                _save_items_to_group(h5file, path + key + "/list/", list_dict, compression)
+            except TypeError as e:
+                logger.critical("The key " + str(key) + " was not of the correct typing for HDF5 handling."
+                                "Make sure this key is not a tuple.")
+                raise e
+        else:
+            _save_items_to_group(h5file, path + key + "/", item, compression)
+
+
+class SimpaOutputFile:
+    """
+    Session for reading and writing a SIMPA output file. The hdf5 file is opened once and stays open until the
+    session is closed, so that the file metadata and the chunk cache are kept in memory between accesses.
+
+    While a session is open, the functional API (save_hdf5, load_hdf5, save_data_field, load_data_field, ...)
+    uses it for all accesses to the same file, i.e. simulation modules automatically benefit from a session that
+    is opened by simpa.core.simulation.simulate. HDF5 locks the file while it is open for writing, so a session can
+    release the file (see release), which is reopened on the next access. simulate releases the file after every
+    pipeline element, such that other processes can read it in between. Usage::
+
+        with SimpaOutputFile(file_path) as output_file:
+            sos = output_file.load_data_field(Tags.DATA_FIELD_SPEED_OF_SOUND)
+            output_file.save_data_field(sos * 2, Tags.DATA_FIELD_SPEED_OF_SOUND)
+    """
+
+    def __init__(self, file_path: str, mode: str = "a", chunk_cache_size_bytes: int = None, swmr: bool = False):
+        """
+        :param file_path: Path of the hdf5 file.
+        :param mode: The h5py file mode: "r" (read only), "r+" (read and write), "a" (read and write, create the
+            file if it does not exist) or "w" (create a new file).
+        :param chunk_cache_size_bytes: Size of the raw data chunk cache of every dataset in bytes. Defaults to the
+            HDF5 default of 1 MB. Larger caches help if the same chunks of compressed datasets are accessed
+            repeatedly, e.g. when reading slices of a volume.
+        :param swmr: If True, the file is opened in single-writer-multiple-reader mode, such that it can be read
+            while another process writes into it in SWMR mode. This is only supported for reading, as SWMR writers
+            cannot create new datasets. simulate does not write in SWMR mode, as the pipeline elements create new
+            datasets.
+        :raises ValueError: if SWMR mode is requested for a writing session
+        """
+        if swmr and mode != "r":
+            raise ValueError("The SWMR mode is only supported for reading sessions (mode 'r').")
+        self.file_path = file_path
+        self.mode = mode
+        self.chunk_cache_size_bytes = chunk_cache_size_bytes
+        self.swmr = swmr
+        self._h5file = None
+        self._is_open = False
+        self._reopen_lock = threading.Lock()
+        self._registered = False
+        # Optional observer that is notified about all items that are read from or written to the file through
+        # this session. It has to provide the methods on_read(file_dictionary_path, item) and
+        # on_write(file_dictionary_path, item), where item is None for partial writes.
+        self.access_log = None
+        # Logical number of bytes of the arrays that have been read from and written to the file through this
+        # session, i.e. their uncompressed size, including the arrays that were served by or held in an in-memory
+        # data store. They do not measure the disk access.
+        self.logical_bytes_read = 0
+        self.logical_bytes_written = 0
+
+    def _open(self):
+        if self._is_open:
+            raise RuntimeError(f"The output file {self.file_path} is already open.")
+        self._is_open = True
+        try:
+            self._open_h5file()
+        except BaseException:
+            self._is_open = False
+            raise
+
+    def _open_h5file(self):
+        kwargs = dict()
+        if self.chunk_cache_size_bytes is not None:
+            kwargs["rdcc_nbytes"] = self.chunk_cache_size_bytes
+        if self.swmr:
+            kwargs["swmr"] = True
+        self._h5file = h5py.File(self.file_path, self.mode, **kwargs)
+        if self.mode == "w":
+            # A released file must not be truncated when it is reopened
+            self.mode = "r+"
+
+    @property
+    def h5file(self) -> h5py.File:
+        """
+        The h5py file of the session. A released file is reopened on access.
+        """
+        if self._h5file is None and self._is_open:
+            with self._reopen_lock:
+                if self._h5file is None:
+                    self._open_h5file()
+        return self._h5file
+
+    def open(self):
+        """
+        Opens the hdf5 file and registers the session, such that it is used by the functional API.
+
+        :raises RuntimeError: if a session is already open for the file
+        """
+        key = os.path.abspath(self.file_path)
+        if key in _OPEN_SIMPA_OUTPUT_FILES:
+            raise RuntimeError(f"A session is already open for the output file {self.file_path}.")
+        self._open()
+        _OPEN_SIMPA_OUTPUT_FILES[key] = self
+        self._registered = True
+        return self
+
+    def close(self):
+        """
+        Closes the hdf5 file. All data is written to disk.
+        """
+        if self._registered:
+            del _OPEN_SIMPA_OUTPUT_FILES[os.path.abspath(self.file_path)]
+            self._registered = False
+        self._is_open = False
+        if self._h5file is not None:
+            self._h5file.close()
+            self._h5file = None
+
+    def release(self):
+        """
+        Closes the hdf5 file, such that other processes can open it, while the session stays open. The file is
+        reopened on the next access through the session. A pending asynchronous flush of an in-memory data store is
+        completed first.
+        """
+        self._wait_for_data_store()
+        with self._reopen_lock:
+            if self._h5file is not None:
+                self._h5file.close()
+                self._h5file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def save(self, save_item, file_dictionary_path: str = "/", file_compression: str = None):
+        """
+        Saves a dictionary with arbitrary content or an item of any kind into the file.
+        If an in-memory data store is open for the file (see simpa.io_handling.in_memory_data_store), arrays and
+        scalar values are stored in memory and only written into the file once the data store is flushed.
+
+        :param save_item: Dictionary to save.
+        :param file_dictionary_path: Path in dictionary structure of the hdf5 file to store the dictionary in.
+            If the path is "/", the whole content of the file is replaced.
+        :param file_compression: possible file compression for the datasets. Values are: gzip, lzf and szip.
+            If the whole file content is replaced, all datasets that are added to the file later on are compressed
+            in the same way.
+        :returns: :mod:`Null`
+        """
+        if self.access_log is not None:
+            self.access_log.on_write(file_dictionary_path, save_item)
+        self.logical_bytes_written += _get_number_of_bytes(save_item)
+
+        data_store = get_in_memory_data_store(self.file_path)
+        if data_store is not None:
+            if file_dictionary_path != "/" and data_store.put(save_item, file_dictionary_path):
+                return
+            # The item is written directly and replaces everything that is held in memory at this path.
+            data_store.wait()
+            data_store.discard(file_dictionary_path)
+
+        if file_dictionary_path == "/":
+            self._clear()
+            if file_compression is not None:
+                self.h5file.attrs[FILE_COMPRESSION_ATTRIBUTE] = file_compression
+
+        if isinstance(save_item, SerializableSIMPAClass):
+            save_item = save_item.serialize()
+        if not isinstance(save_item, dict):
+            save_key = file_dictionary_path.split("/")[-2]
+            save_item = {save_key: save_item}
+            file_dictionary_path = "/".join(file_dictionary_path.split("/")[:-2]) + "/"
+        _save_items_to_group(self.h5file, file_dictionary_path, save_item,
+                             _get_file_compression(self.h5file, file_compression))
+
+    def _clear(self):
+        """
+        Removes all content from the file.
+        """
+        for key in list(self.h5file.keys()):
+            _delete_item(self.h5file, "/" + key)
+        for key in list(self.h5file.attrs.keys()):
+            if key != UNUSED_BYTES_ATTRIBUTE:
+                del self.h5file.attrs[key]
+
+    def write_items(self, items: dict, file_compression: str = None):
+        """
+        Writes several items into the file. The in-memory data store is bypassed.
+
+        :param items: Dictionary that maps the paths of the items in the hdf5 file (e.g. "/simulations/sos") to the
+            items.
+        :param file_compression: possible file compression for the datasets. Values are: gzip, lzf and szip.
+        :returns: :mod:`Null`
+        """
+        file_compression = _get_file_compression(self.h5file, file_compression)
+        for item_path, item in items.items():
+            group_path, key = item_path.rstrip("/").rsplit("/", 1)
+            _save_items_to_group(self.h5file, group_path + "/", {key: item}, file_compression)
+
+    def load(self, file_dictionary_path: str = "/", lazy: bool = False):
+        """
+        Loads a dictionary from the file.
+
+        :param file_dictionary_path: Path in dictionary structure of hdf5 file to load the dictionary from.
+        :param lazy: If True, only the structure of the file and scalar values are loaded. Arrays are represented
+            by LazyHDF5Dataset proxies that read the data from the file once they are indexed, which makes it
+            possible to look at parts of large files without loading them into memory. Arrays that are held in an
+            in-memory data store are returned as read-only arrays.
+        :returns: Dictionary
+        :rtype: dict
+        """
+        data_store = get_in_memory_data_store(self.file_path)
+        found = False
+        if data_store is not None:
+            found, data = data_store.get(file_dictionary_path, copy=not lazy)
+            if not found:
+                # Make sure that the file is up to date for everything below the requested path
+                data_store.flush(file_dictionary_path)
+
+        if not found:
+            data = _load_items_from_group(self.h5file, file_dictionary_path, lazy)
+            if data_store is not None and not lazy:
+                data_store.put_clean(data, file_dictionary_path)
+
+        if self.access_log is not None:
+            self.access_log.on_read(file_dictionary_path, None if lazy else data)
+        self.logical_bytes_read += _get_number_of_bytes(data)
+        return data
+
+    def load_data_field(self, data_field, wavelength=None, index=None):
+        """
+        Loads a data field from the file.
+
+        :param data_field: Data field to load.
+        :param wavelength: Wavelength of the data field, if it is wavelength-dependent.
+        :param index: Optional index or slice of the data field, e.g. np.s_[:, 10, :]. Only the corresponding
+            hyperslab is read from the file.
+        :returns: the data field or the requested part of it
+        """
+        path = generate_dict_path(data_field, wavelength=wavelength)
+        if index is None:
+            return self.load(path)
+
+        if self.access_log is not None:
+            self.access_log.on_read(path, None)
+
+        data_store = get_in_memory_data_store(self.file_path)
+        found = False
+        if data_store is not None:
+            found, item = data_store.get(path, index)
+            if not found:
+                data_store.flush(path)
+        if not found:
+            item = self.h5file[path][index]
+        self.logical_bytes_read += _get_number_of_bytes(item)
+        return item
+
+    def save_data_field(self, data, data_field, wavelength=None, index=None):
+        """
+        Saves a data field into the file.
+
+        :param data: the data to save.
+        :param data_field: Data field to save.
+        :param wavelength: Wavelength of the data field, if it is wavelength-dependent.
+        :param index: Optional index or slice, e.g. np.s_[:, 10, :]. If given, only the corresponding hyperslab of
+            the existing data field is overwritten with the data.
+        :returns: :mod:`Null`
+        """
+        path = generate_dict_path(data_field, wavelength=wavelength)
+        if index is None:
+            self.save(data, path)
+            return
+
+        if self.access_log is not None:
+            self.access_log.on_write(path, None)
+        self.logical_bytes_written += _get_number_of_bytes(np.asarray(data))
+
+        data_store = get_in_memory_data_store(self.file_path)
+        if data_store is not None:
+            if data_store.update(data, path, index):
+                return
+            data_store.flush(path)
+
+        self.h5file[path][index] = data
+
+    def merge(self, source_file_paths: list, exclude_paths: list = None):
+        """
+        Merges the content of several hdf5 files into the file.
+        Groups are merged recursively. If a dataset is present in more than one file, the first occurrence is kept,
+        so the order of source_file_paths determines which values take precedence.
+        The data is copied within the HDF5 library without being loaded into memory.
+
+        :param source_file_paths: List of paths of the files that should be merged into the file.
+        :param exclude_paths: List of group or dataset paths (e.g. "/settings") that should not be copied.
+        :returns: :mod:`Null`
+        """
+        if exclude_paths is None:
+            exclude_paths = []
+        exclude_paths = ["/" + path.strip("/") for path in exclude_paths]
+        self._wait_for_data_store()
+
+        def merge_group(source_group, target_group):
+            for key, item in source_group.items():
+                if item.name in exclude_paths:
+                    continue
+                if key not in target_group:
+                    source_group.copy(item, target_group, name=key)
+                elif isinstance(item, h5py.Group) and isinstance(target_group[key], h5py.Group):
+                    merge_group(item, target_group[key])
+
+        for source_file_path in source_file_paths:
+            with h5py.File(source_file_path, "r") as source_file:
+                merge_group(source_file, self.h5file)
+
+    def delete(self, file_dictionary_path: str) -> bool:
+        """
+        Deletes an item from the file if it exists. Groups of serialized SIMPA classes (e.g. Settings) on the way
+        are resolved transparently, i.e. the path has the same format as for load.
+
+        :param file_dictionary_path: Path of the item in dictionary structure of the hdf5 file.
+        :returns: True, if the item existed and was deleted.
+        """
+        data_store = get_in_memory_data_store(self.file_path)
+        if data_store is not None:
+            data_store.wait()
+            data_store.discard(file_dictionary_path)
+
+        group = self.h5file
+        keys = file_dictionary_path.strip("/").split("/")
+        for index, key in enumerate(keys):
+            serialization_keys = [serialization_key for serialization_key in SERIALIZATION_MAP
+                                  if isinstance(group, h5py.Group) and serialization_key in group]
+            if len(serialization_keys) > 0:
+                group = group[serialization_keys[0]]
+            if not isinstance(group, h5py.Group) or key not in group:
+                return False
+            if index == len(keys) - 1:
+                _delete_item(self.h5file, group[key].name)
+                return True
+            group = group[key]
+
+    def contains(self, file_dictionary_path: str) -> bool:
+        """
+        :param file_dictionary_path: Path of an item in dictionary structure of the hdf5 file.
+        :returns: True, if the item exists in the file or in the in-memory data store.
+        """
+        data_store = get_in_memory_data_store(self.file_path)
+        if data_store is not None and data_store.get(file_dictionary_path, copy=False)[0]:
+            return True
+        self._wait_for_data_store()
+        return self.h5file.get("/" + file_dictionary_path.strip("/")) is not None
+
+    def get_unused_bytes(self) -> int:
+        """
+        :returns: the number of bytes of the file that are occupied by deleted or overwritten items.
+        """
+        self._wait_for_data_store()
+        return int(self.h5file.attrs.get(UNUSED_BYTES_ATTRIBUTE, 0))
+
+    def _wait_for_data_store(self):
+        """
+        Completes a pending asynchronous flush of an in-memory data store, before the file is accessed directly.
+        """
+        data_store = get_in_memory_data_store(self.file_path)
+        if data_store is not None:
+            data_store.wait()
+
+
+def get_open_simpa_output_file(file_path: str):
+    """
+    Returns the session that is currently open for the given file.
+
+    :param file_path: Path of the hdf5 file.
+    :returns: the SimpaOutputFile or None, if no session is open for this file
+    """
+    if len(_OPEN_SIMPA_OUTPUT_FILES) == 0:
+        return None
+    return _OPEN_SIMPA_OUTPUT_FILES.get(os.path.abspath(file_path))
+
+
+@contextmanager
+def _simpa_output_file(file_path: str, mode: str):
+    """
+    Provides the open session for the given file or, if there is none, a temporary session with the given mode
+    that is only used by the caller.
+    """
+    output_file = get_open_simpa_output_file(file_path)
+    if output_file is not None:
+        yield output_file
+        return
+    output_file = SimpaOutputFile(file_path, mode)
+    output_file._open()
+    try:
+        yield output_file
+    finally:
+        output_file.close()
+
+
+class LazyHDF5Dataset:
+    """
+    Proxy for a dataset in an hdf5 file as returned by load_hdf5 in lazy mode.
+    The data is only read from the file when the proxy is indexed (e.g. dataset[:, 10, :] or dataset[()] for
+    the full array) or converted into a numpy array, and only the requested part of the dataset is read.
+    """
+
+    def __init__(self, file_path: str, dataset_path: str, shape: tuple, dtype):
+        """
+        :param file_path: Path of the hdf5 file.
+        :param dataset_path: Path of the dataset within the hdf5 file.
+        :param shape: Shape of the dataset.
+        :param dtype: Data type of the dataset.
+        """
+        self.file_path = file_path
+        self.dataset_path = dataset_path
+        self.shape = shape
+        self.dtype = dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        with _simpa_output_file(self.file_path, "r") as output_file:
+            return output_file.h5file[self.dataset_path][index]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[()]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __repr__(self):
+        return f"LazyHDF5Dataset({self.file_path}:{self.dataset_path}, shape={self.shape}, dtype={self.dtype})"
+
+
+def _read_dataset(dataset, lazy: bool = False):
+    """
+    Helper function that reads a dataset from an hdf5 file.
+
+    :param dataset: the h5py dataset.
+    :param lazy: If True, arrays are not read but a LazyHDF5Dataset proxy is returned. Scalars are always read.
+    :returns: the item stored in the dataset
+    """
+    if lazy and dataset.shape is not None and dataset.shape != ():
+        return LazyHDF5Dataset(dataset.file.filename, dataset.name, dataset.shape, dataset.dtype)
+    item = dataset[()]
+    if isinstance(item, bytes):
+        item = item.decode("utf-8")
+    elif isinstance(item, np.bool_):
+        item = bool(item)
+    return item
+
+
+def _load_items_from_group(h5file, path, lazy: bool = False):
+    """
+    Helper function which recursively loads data from the hdf5 group structure to a dictionary.
+    Serialized SIMPA classes and lists are always loaded completely.
+
+    :param h5file: hdf5 file instance to load the data from.
+    :param path: Current group path in hdf5 file group structure.
+    :param lazy: If True, arrays are returned as LazyHDF5Dataset proxies.
+    :returns: Dictionary or np.array
+    """
+
+    if isinstance(h5file[path], h5py._hl.dataset.Dataset):
+        if lazy:
+            return _read_dataset(h5file[path], lazy)
+        return h5file[path][()]
+
+    dictionary = {}
+    for key, item in h5file[path].items():
+        if isinstance(item, h5py._hl.dataset.Dataset):
+            dictionary[key] = _read_dataset(item, lazy)
+        elif isinstance(item, h5py._hl.group.Group):
+            if key in SERIALIZATION_MAP.keys():
+                serialized_dict = _load_items_from_group(h5file, path + key + "/")
+                serialized_class = SERIALIZATION_MAP[key]
+                deserialized_class = serialized_class.deserialize(serialized_dict)
+                dictionary = deserialized_class
+            elif key == "list":
+                dictionary_list = [None for x in item.keys()]
+                for listkey in sorted(item.keys()):
+                    if isinstance(item[listkey], h5py._hl.dataset.Dataset):
+                        dictionary_list[int(listkey)] = _read_dataset(item[listkey])
+                    elif isinstance(item[listkey], h5py._hl.group.Group):
+                        dictionary_list[int(listkey)] = _load_items_from_group(h5file, path + key + "/" + listkey + "/")
+                dictionary = dictionary_list
+            else:
+                dictionary[key] = _load_items_from_group(h5file, path + key + "/", lazy)
+    return dictionary
@@ -35,6 +35,11 @@ def generate_dict_path(data_field, wavelength: (int, float) = None) -> str:
                          Tags.OPTICAL_MODEL_UNITS,
                          Tags.DATA_FIELD_TIME_SERIES_DATA,
                          Tags.DATA_FIELD_RECONSTRUCTED_DATA,
+                         Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS,
+                         Tags.DATA_FIELD_RECONSTRUCTED_DATA_DMAS,
+                         Tags.DATA_FIELD_RECONSTRUCTED_DATA_SDMAS,
+                         Tags.DATA_FIELD_COHERENCE_FACTOR,
+                         Tags.DATA_FIELD_RECONSTRUCTED_DATA_CF_DAS,
                          Tags.DATA_FIELD_DIFFUSE_REFLECTANCE,
                          Tags.DATA_FIELD_DIFFUSE_REFLECTANCE_POS,
                          Tags.DATA_FIELD_PHOTON_EXIT_POS,
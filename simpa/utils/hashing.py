@@ -0,0 +1,118 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import functools
+import hashlib
+from numbers import Number
+import pickle
+import types
+
+import numpy as np
+import torch
+
+from simpa.utils.serializer import SerializableSIMPAClass
+
+
+class UnhashableItemError(TypeError):
+    """
+    Raised if an item can neither be hashed by its content nor pickled.
+    """
+    pass
+
+
+def compute_hash(*items) -> str:
+    """
+    Computes a content hash of the given items, e.g. of settings dictionaries, digital device twins or arrays.
+    The hash only depends on the content of the items: dictionaries are hashed independently of the order of their
+    keys and numbers are hashed independently of their numpy or python type. SIMPA classes are hashed by their
+    serialization, functions by their name, code, default arguments and closure and other objects by the content of
+    their attributes or, if they have none, by their pickled representation.
+
+    :param items: the items to hash
+    :raises UnhashableItemError: if an item can neither be hashed by its content nor pickled or refers to itself
+    :return: the hexadecimal sha256 digest
+    """
+    hasher = hashlib.sha256()
+    for item in items:
+        _update_hash(hasher, item)
+    return hasher.hexdigest()
+
+
+def _update_hash(hasher, item, parent_ids: frozenset = frozenset()):
+    """
+    Recursively feeds the content of the item into the hasher.
+
+    :param parent_ids: the ids of the objects that contain the item, to detect objects that refer to themselves
+    """
+    if isinstance(item, torch.Tensor):
+        item = item.detach().cpu().numpy()
+
+    if isinstance(item, SerializableSIMPAClass):
+        hasher.update(type(item).__name__.encode("utf-8"))
+        _update_hash(hasher, item.serialize(), parent_ids)
+    elif isinstance(item, dict):
+        hasher.update(b"dict" + str(len(item)).encode("utf-8"))
+        for key in sorted(item.keys(), key=str):
+            _update_hash(hasher, str(key), parent_ids)
+            _update_hash(hasher, item[key], parent_ids)
+    elif isinstance(item, (list, tuple)):
+        hasher.update(b"list" + str(len(item)).encode("utf-8"))
+        for list_item in item:
+            _update_hash(hasher, list_item, parent_ids)
+    elif isinstance(item, np.ndarray):
+        hasher.update(b"ndarray" + str(item.shape).encode("utf-8"))
+        if item.dtype == object:
+            for array_item in item.flat:
+                _update_hash(hasher, array_item, parent_ids)
+        else:
+            hasher.update(item.dtype.str.encode("utf-8"))
+            hasher.update(np.ascontiguousarray(item).data)
+    elif isinstance(item, (bool, np.bool_)):
+        hasher.update(b"bool" + str(bool(item)).encode("utf-8"))
+    elif isinstance(item, (Number, np.number)):
+        if isinstance(item, np.number):
+            item = item.item()
+        hasher.update(b"number" + repr(item).encode("utf-8"))
+    elif isinstance(item, str):
+        item = item.encode("utf-8")
+        hasher.update(b"str" + str(len(item)).encode("utf-8") + b":" + item)
+    elif isinstance(item, bytes):
+        hasher.update(b"bytes" + str(len(item)).encode("utf-8") + b":" + item)
+    elif item is None:
+        hasher.update(b"None")
+    elif isinstance(item, types.CodeType):
+        hasher.update(b"code" + item.co_code)
+        _update_hash(hasher, [item.co_consts, item.co_names], parent_ids)
+    elif isinstance(item, (types.FunctionType, types.MethodType, functools.partial)) or \
+            isinstance(getattr(item, "__dict__", None), dict):
+        if id(item) in parent_ids:
+            raise UnhashableItemError(f"Cannot hash the {type(item).__qualname__} object, as it refers to itself.")
+        parent_ids = parent_ids | {id(item)}
+        if isinstance(item, types.FunctionType):
+            hasher.update(b"function" + str(item.__module__).encode("utf-8") + item.__qualname__.encode("utf-8"))
+            closure = [_get_cell_contents(cell) for cell in item.__closure__ or ()]
+            _update_hash(hasher, [item.__code__, item.__defaults__, item.__kwdefaults__, closure], parent_ids)
+        elif isinstance(item, types.MethodType):
+            hasher.update(b"method")
+            _update_hash(hasher, [item.__func__, item.__self__], parent_ids)
+        elif isinstance(item, functools.partial):
+            hasher.update(b"partial")
+            _update_hash(hasher, [item.func, item.args, item.keywords], parent_ids)
+        else:
+            hasher.update(b"object" + type(item).__module__.encode("utf-8") +
+                          type(item).__qualname__.encode("utf-8"))
+            _update_hash(hasher, vars(item), parent_ids)
+    else:
+        try:
+            hasher.update(b"pickle" + pickle.dumps(item))
+        except Exception as e:
+            raise UnhashableItemError(f"Cannot hash the {type(item).__qualname__} object.") from e
+
+
+def _get_cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        # The variable of the closure has not been assigned yet
+        return None
@@ -46,6 +46,16 @@ class CircularTubularStructure(GeometricalStructure):
         settings[Tags.STRUCTURE_RADIUS_MM] = self.params[2]
         return settings
 
+    def get_bounding_box_voxels(self):
+        start_mm, end_mm, radius_mm, partial_volume = self.params
+        start_voxels = np.asarray(start_mm, dtype=np.float64) / self.voxel_spacing
+        end_voxels = np.asarray(end_mm, dtype=np.float64) / self.voxel_spacing
+        # the tube extends infinitely along its axis and its partial volume border reaches up to 1.5 voxels beyond
+        # the radius
+        radius_voxels = radius_mm / self.voxel_spacing + 2 + self.get_maximum_deformation_voxels()
+        # the coordinates of the voxels are given by their centers
+        return self.get_bounding_box_of_line(start_voxels - 0.5, end_voxels - start_voxels, radius_voxels)
+
     def get_enclosed_indices(self):
         start_mm, end_mm, radius_mm, partial_volume = self.params
         start_mm = torch.tensor(start_mm, dtype=torch.float, device=self.torch_device)
@@ -55,12 +65,8 @@ class CircularTubularStructure(GeometricalStructure):
         end_voxels = end_mm / self.voxel_spacing
         radius_voxels = radius_mm / self.voxel_spacing
 
-        target_vector = torch.stack(torch.meshgrid(torch.arange(start=0.5, end=self.volume_dimensions_voxels[0], dtype=torch.float, device=self.torch_device),
-                                                   torch.arange(
-                                                       start=0.5, end=self.volume_dimensions_voxels[1], dtype=torch.float, device=self.torch_device),
-                                                   torch.arange(
-                                                       start=0.5, end=self.volume_dimensions_voxels[2], dtype=torch.float, device=self.torch_device),
-                                                   indexing='ij'), dim=-1)
+        bounding_box = self.get_bounding_box_voxels()
+        target_vector = self.get_voxel_coordinates(bounding_box, offset=0.5)
         target_vector -= start_voxels
 
         if partial_volume:
@@ -70,14 +76,13 @@ class CircularTubularStructure(GeometricalStructure):
 
         if self.do_deformation:
             # the deformation functional needs mm as inputs and returns the result in reverse indexing order...
-            deformation_values_mm = self.deformation_functional_mm(torch.arange(self.volume_dimensions_voxels[0]) *
+            deformation_values_mm = self.deformation_functional_mm(torch.arange(*bounding_box[:, 0]) *
                                                                    self.voxel_spacing,
-                                                                   torch.arange(self.volume_dimensions_voxels[1]) *
+                                                                   torch.arange(*bounding_box[:, 1]) *
                                                                    self.voxel_spacing).T
-            deformation_values_mm = deformation_values_mm.reshape(self.volume_dimensions_voxels[0],
-                                                                  self.volume_dimensions_voxels[1], 1, 1)
+            deformation_values_mm = deformation_values_mm.reshape(target_vector.shape[0], target_vector.shape[1], 1, 1)
             deformation_values_mm = torch.tile(torch.as_tensor(
-                deformation_values_mm, dtype=torch.float, device=self.torch_device), (1, 1, self.volume_dimensions_voxels[2], 3))
+                deformation_values_mm, dtype=torch.float, device=self.torch_device), (1, 1, target_vector.shape[2], 3))
             deformation_values_mm /= self.voxel_spacing
             target_vector += deformation_values_mm
             del deformation_values_mm
@@ -88,8 +93,7 @@ class CircularTubularStructure(GeometricalStructure):
                          (torch.linalg.norm(target_vector, axis=-1) * torch.linalg.norm(cylinder_vector))))
         del target_vector
 
-        volume_fractions = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                       dtype=torch.float, device=self.torch_device)
+        volume_fractions = torch.zeros(target_radius.shape, dtype=torch.float, device=self.torch_device)
 
         filled_mask = target_radius <= radius_voxels - 1 + radius_margin
         border_mask = (target_radius > radius_voxels - 1 + radius_margin) & \
@@ -105,7 +109,7 @@ class CircularTubularStructure(GeometricalStructure):
         else:
             mask = filled_mask
 
-        return mask.cpu().numpy(), volume_fractions[mask].cpu().numpy()
+        return self.get_indices_in_volume(bounding_box, mask), volume_fractions[mask].cpu().numpy()
 
 
 def define_circular_tubular_structure_settings(tube_start_mm: list,
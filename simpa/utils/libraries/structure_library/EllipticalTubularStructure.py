@@ -2,6 +2,7 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+import numpy as np
 import torch
 
 from simpa.utils import Tags
@@ -51,6 +52,17 @@ class EllipticalTubularStructure(GeometricalStructure):
         settings[Tags.CONSIDER_PARTIAL_VOLUME] = self.params[4]
         return settings
 
+    def get_bounding_box_voxels(self):
+        start_mm, end_mm, radius_mm, eccentricity, partial_volume = self.params
+        start_voxels = np.asarray(start_mm, dtype=np.float64) / self.voxel_spacing
+        end_voxels = np.asarray(end_mm, dtype=np.float64) / self.voxel_spacing
+        # the tube extends infinitely along its axis and its partial volume border reaches up to 1.5 voxels beyond
+        # the radius, which is scaled to the main axis of the ellipse
+        radius_voxels = ((radius_mm / self.voxel_spacing + 1.5) / (1 - eccentricity ** 2) ** 0.25 + 1 +
+                         self.get_maximum_deformation_voxels())
+        # the coordinates of the voxels are given by their centers
+        return self.get_bounding_box_of_line(start_voxels - 0.5, end_voxels - start_voxels, radius_voxels)
+
     def get_enclosed_indices(self):
         start_mm, end_mm, radius_mm, eccentricity, partial_volume = self.params
         start_mm = torch.tensor(start_mm, dtype=torch.float, device=self.torch_device)
@@ -62,12 +74,8 @@ class EllipticalTubularStructure(GeometricalStructure):
         end_voxels = end_mm / self.voxel_spacing
         radius_voxels = radius_mm / self.voxel_spacing
 
-        target_vector = torch.stack(torch.meshgrid(torch.arange(start=0.5, end=self.volume_dimensions_voxels[0], device=self.torch_device),
-                                                   torch.arange(
-                                                       start=0.5, end=self.volume_dimensions_voxels[1], device=self.torch_device),
-                                                   torch.arange(
-                                                       start=0.5, end=self.volume_dimensions_voxels[2], device=self.torch_device),
-                                                   indexing='ij'), dim=-1)
+        bounding_box = self.get_bounding_box_voxels()
+        target_vector = self.get_voxel_coordinates(bounding_box, offset=0.5)
         target_vector -= start_voxels
 
         if partial_volume:
@@ -77,14 +85,13 @@ class EllipticalTubularStructure(GeometricalStructure):
 
         if self.do_deformation:
             # the deformation functional needs mm as inputs and returns the result in reverse indexing order...
-            deformation_values_mm = self.deformation_functional_mm(torch.arange(self.volume_dimensions_voxels[0]) *
+            deformation_values_mm = self.deformation_functional_mm(torch.arange(*bounding_box[:, 0]) *
                                                                    self.voxel_spacing,
-                                                                   torch.arange(self.volume_dimensions_voxels[1]) *
+                                                                   torch.arange(*bounding_box[:, 1]) *
                                                                    self.voxel_spacing).T
-            deformation_values_mm = deformation_values_mm.reshape(self.volume_dimensions_voxels[0],
-                                                                  self.volume_dimensions_voxels[1], 1, 1)
+            deformation_values_mm = deformation_values_mm.reshape(target_vector.shape[0], target_vector.shape[1], 1, 1)
             deformation_values_mm = torch.tile(torch.as_tensor(
-                deformation_values_mm, device=self.torch_device), (1, 1, self.volume_dimensions_voxels[2], 3))
+                deformation_values_mm, device=self.torch_device), (1, 1, target_vector.shape[2], 3))
             deformation_values_mm /= self.voxel_spacing
             target_vector += deformation_values_mm
             del deformation_values_mm
@@ -112,8 +119,7 @@ class EllipticalTubularStructure(GeometricalStructure):
                                  radius_voxels**2)
         del main_projection
         del minor_projection
-        volume_fractions = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                       dtype=torch.float, device=self.torch_device)
+        volume_fractions = torch.zeros(radius_crit.shape, dtype=torch.float, device=self.torch_device)
         filled_mask = radius_crit <= radius_voxels - 1 + radius_margin
         border_mask = (radius_crit > radius_voxels - 1 + radius_margin) & \
                       (radius_crit < radius_voxels + 2 * radius_margin)
@@ -129,7 +135,7 @@ class EllipticalTubularStructure(GeometricalStructure):
         else:
             mask = filled_mask
 
-        return mask.cpu().numpy(), volume_fractions[mask].cpu().numpy()
+        return self.get_indices_in_volume(bounding_box, mask), volume_fractions[mask].cpu().numpy()
 
 
 def define_elliptical_tubular_structure_settings(tube_start_mm: list,
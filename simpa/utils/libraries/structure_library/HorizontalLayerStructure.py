@@ -2,6 +2,7 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+import numpy as np
 import torch
 
 from simpa.utils import Tags
@@ -40,6 +41,16 @@ class HorizontalLayerStructure(GeometricalStructure):
         settings[Tags.STRUCTURE_END_MM] = self.params[1]
         return settings
 
+    def get_bounding_box_voxels(self):
+        start_voxels = np.asarray(self.params[0], dtype=np.float64) / self.voxel_spacing
+        end_voxels = np.asarray(self.params[1], dtype=np.float64) / self.voxel_spacing
+        # the layer covers the entire x-y-plane and its partial volume border reaches up to one voxel beyond it
+        margin_voxels = 1 + self.get_maximum_deformation_voxels()
+        lower_voxels = np.asarray([0, 0, min(start_voxels[2], end_voxels[2]) - margin_voxels])
+        upper_voxels = np.asarray([*self.volume_dimensions_voxels[:2], max(start_voxels[2], end_voxels[2]) +
+                                   margin_voxels])
+        return self.get_bounding_box_from_extent(lower_voxels, upper_voxels)
+
     def get_enclosed_indices(self):
         start_mm = torch.tensor(self.params[0], dtype=torch.float).to(self.torch_device)
         end_mm = torch.tensor(self.params[1], dtype=torch.float).to(self.torch_device)
@@ -51,27 +62,25 @@ class HorizontalLayerStructure(GeometricalStructure):
         if direction_mm[0] != 0 or direction_mm[1] != 0 or direction_mm[2] == 0:
             raise ValueError("Horizontal Layer structure needs a start and end vector in the form of [0, 0, n].")
 
-        target_vector_voxels = torch.stack(torch.meshgrid(torch.arange(self.volume_dimensions_voxels[0], dtype=torch.float, device=self.torch_device),
-                                                          torch.arange(
-                                                              self.volume_dimensions_voxels[1], dtype=torch.float, device=self.torch_device),
-                                                          torch.arange(
-                                                              self.volume_dimensions_voxels[2], dtype=torch.float, device=self.torch_device),
-                                                          indexing='ij'), dim=-1)
+        bounding_box = self.get_bounding_box_voxels()
+        if np.any(bounding_box[1] <= bounding_box[0]):
+            no_indices = np.zeros(0, dtype=int)
+            return (no_indices, no_indices, no_indices), np.zeros(0, dtype=np.float32)
+        target_vector_voxels = self.get_voxel_coordinates(bounding_box)
 
         target_vector_voxels -= start_voxels
         target_vector_voxels = target_vector_voxels[:, :, :, 2]
         if self.do_deformation:
             # the deformation functional needs mm as inputs and returns the result in reverse indexing order...
-            deformation_values_mm = self.deformation_functional_mm(torch.arange(self.volume_dimensions_voxels[0], dtype=torch.float) *
+            deformation_values_mm = self.deformation_functional_mm(torch.arange(*bounding_box[:, 0], dtype=torch.float) *
                                                                    self.voxel_spacing,
-                                                                   torch.arange(self.volume_dimensions_voxels[1], dtype=torch.float) *
+                                                                   torch.arange(*bounding_box[:, 1], dtype=torch.float) *
                                                                    self.voxel_spacing).T
             target_vector_voxels = (target_vector_voxels + torch.from_numpy(deformation_values_mm.reshape(
-                self.volume_dimensions_voxels[0],
-                self.volume_dimensions_voxels[1], 1)).to(self.torch_device) / self.voxel_spacing).float()
+                target_vector_voxels.shape[0],
+                target_vector_voxels.shape[1], 1)).to(self.torch_device) / self.voxel_spacing).float()
 
-        volume_fractions = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                       dtype=torch.float, device=self.torch_device)
+        volume_fractions = torch.zeros(target_vector_voxels.shape, dtype=torch.float, device=self.torch_device)
 
         if partial_volume:
             bools_first_layer = ((target_vector_voxels >= -1) & (target_vector_voxels < 0))
@@ -99,7 +108,8 @@ class HorizontalLayerStructure(GeometricalStructure):
 
         volume_fractions[bools_fully_filled_layers] = 1
 
-        return bools_all_layers.cpu().numpy(), volume_fractions[bools_all_layers].cpu().numpy()
+        return self.get_indices_in_volume(bounding_box, bools_all_layers), \
+            volume_fractions[bools_all_layers].cpu().numpy()
 
 
 def define_horizontal_layer_structure_settings(molecular_composition: MolecularComposition,
@@ -2,6 +2,8 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+import itertools
+import numpy as np
 import torch
 
 from simpa.utils import Tags
@@ -43,6 +45,14 @@ class ParallelepipedStructure(GeometricalStructure):
         settings[Tags.STRUCTURE_THIRD_EDGE_MM] = self.params[3]
         return settings
 
+    def get_bounding_box_voxels(self):
+        start_mm, x_edge_mm, y_edge_mm, z_edge_mm = self.params
+        edges_mm = np.asarray([x_edge_mm, y_edge_mm, z_edge_mm], dtype=np.float64)
+        corners_mm = np.asarray(start_mm, dtype=np.float64) + np.asarray(
+            [np.dot(selection, edges_mm) for selection in itertools.product([0, 1], repeat=3)])
+        return self.get_bounding_box_from_extent(np.min(corners_mm, axis=0) / self.voxel_spacing,
+                                                 np.max(corners_mm, axis=0) / self.voxel_spacing)
+
     def get_enclosed_indices(self):
         start_mm, x_edge_mm, y_edge_mm, z_edge_mm = self.params
         start_mm = torch.tensor(start_mm, dtype=torch.float, device=self.torch_device)
@@ -55,12 +65,8 @@ class ParallelepipedStructure(GeometricalStructure):
         y_edge_voxels = y_edge_mm / self.voxel_spacing
         z_edge_voxels = z_edge_mm / self.voxel_spacing
 
-        target_vector = torch.stack(torch.meshgrid(torch.arange(self.volume_dimensions_voxels[0], dtype=torch.float, device=self.torch_device),
-                                                   torch.arange(
-                                                       self.volume_dimensions_voxels[1], dtype=torch.float, device=self.torch_device),
-                                                   torch.arange(
-                                                       self.volume_dimensions_voxels[2], dtype=torch.float, device=self.torch_device),
-                                                   indexing='ij'), dim=-1)
+        bounding_box = self.get_bounding_box_voxels()
+        target_vector = self.get_voxel_coordinates(bounding_box)
         target_vector -= start_voxels
 
         matrix = torch.stack((x_edge_voxels, y_edge_voxels, z_edge_voxels))
@@ -74,13 +80,12 @@ class ParallelepipedStructure(GeometricalStructure):
 
         filled_mask_bool = (0 <= result) & (result <= 1 - norm_vector)
 
-        volume_fractions = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                       dtype=torch.float, device=self.torch_device)
+        volume_fractions = torch.zeros(result.shape[:-1], dtype=torch.float, device=self.torch_device)
         filled_mask = torch.all(filled_mask_bool, dim=-1)
 
         volume_fractions[filled_mask] = 1
 
-        return filled_mask.cpu().numpy(), volume_fractions[filled_mask].cpu().numpy()
+        return self.get_indices_in_volume(bounding_box, filled_mask), volume_fractions[filled_mask].cpu().numpy()
 
 
 def define_parallelepiped_structure_settings(start_mm: list, edge_a_mm: list, edge_b_mm: list, edge_c_mm: list,
@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: MIT
 
 from typing import Union
+import numpy as np
 import torch
 
 from simpa.utils import Tags
@@ -50,6 +51,14 @@ class RectangularCuboidStructure(GeometricalStructure):
         settings[Tags.CONSIDER_PARTIAL_VOLUME] = self.params[4]
         return settings
 
+    def get_bounding_box_voxels(self):
+        start_mm, x_edge_mm, y_edge_mm, z_edge_mm, partial_volume = self.params
+        start_voxels = np.asarray(start_mm, dtype=np.float64) / self.voxel_spacing
+        end_voxels = start_voxels + np.asarray([x_edge_mm, y_edge_mm, z_edge_mm], dtype=np.float64) / self.voxel_spacing
+        # the partial volume border reaches up to one voxel beyond the cuboid
+        return self.get_bounding_box_from_extent(np.minimum(start_voxels, end_voxels) - 1,
+                                                 np.maximum(start_voxels, end_voxels) + 1)
+
     def get_enclosed_indices(self):
         start_mm, x_edge_mm, y_edge_mm, z_edge_mm, partial_volume = self.params
         start_mm = torch.tensor(start_mm, dtype=torch.float, device=self.torch_device)
@@ -65,12 +74,8 @@ class RectangularCuboidStructure(GeometricalStructure):
         z_edge_voxels = torch.tensor([0, 0, z_edge_mm / self.voxel_spacing],
                                      dtype=torch.float, device=self.torch_device)
 
-        target_vector = torch.stack(torch.meshgrid(torch.arange(self.volume_dimensions_voxels[0], dtype=torch.float, device=self.torch_device),
-                                                   torch.arange(
-                                                       self.volume_dimensions_voxels[1], dtype=torch.float, device=self.torch_device),
-                                                   torch.arange(
-                                                       self.volume_dimensions_voxels[2], dtype=torch.float, device=self.torch_device),
-                                                   indexing='ij'), dim=-1)
+        bounding_box = self.get_bounding_box_voxels()
+        target_vector = self.get_voxel_coordinates(bounding_box)
 
         target_vector -= start_voxels
 
@@ -88,8 +93,7 @@ class RectangularCuboidStructure(GeometricalStructure):
         filled_mask_bool = (0 <= result) & (result <= 1 - norm_vector)
         border_bool = (0 - norm_vector < result) & (result <= 1)
 
-        volume_fractions = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                       dtype=torch.float, device=self.torch_device)
+        volume_fractions = torch.zeros(result.shape[:-1], dtype=torch.float, device=self.torch_device)
         filled_mask = torch.all(filled_mask_bool, dim=-1)
 
         border_mask = torch.all(border_bool, dim=-1)
@@ -119,7 +123,7 @@ class RectangularCuboidStructure(GeometricalStructure):
         else:
             mask = filled_mask
 
-        return mask.cpu().numpy(), volume_fractions[mask].cpu().numpy()
+        return self.get_indices_in_volume(bounding_box, mask), volume_fractions[mask].cpu().numpy()
 
 
 def define_rectangular_cuboid_structure_settings(start_mm: list, extent_mm: Union[int, list],
@@ -2,6 +2,7 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+import numpy as np
 import torch
 
 from simpa.utils import Tags
@@ -42,6 +43,14 @@ class SphericalStructure(GeometricalStructure):
         settings[Tags.STRUCTURE_RADIUS_MM] = self.params[1]
         return settings
 
+    def get_bounding_box_voxels(self):
+        start_mm, radius_mm, partial_volume = self.params
+        # the coordinates of the voxels are given by their centers
+        start_voxels = np.asarray(start_mm, dtype=np.float64) / self.voxel_spacing - 0.5
+        # the partial volume border reaches up to 1.5 voxels beyond the radius
+        radius_voxels = radius_mm / self.voxel_spacing + 2
+        return self.get_bounding_box_from_extent(start_voxels - radius_voxels, start_voxels + radius_voxels)
+
     def get_enclosed_indices(self):
         start_mm, radius_mm, partial_volume = self.params
         start_mm = torch.tensor(start_mm, dtype=torch.float, device=self.torch_device)
@@ -50,12 +59,8 @@ class SphericalStructure(GeometricalStructure):
         start_voxels = start_mm / self.voxel_spacing
         radius_voxels = radius_mm / self.voxel_spacing
 
-        target_vector = torch.stack(torch.meshgrid(torch.arange(start=0.5, end=self.volume_dimensions_voxels[0], device=self.torch_device),
-                                                   torch.arange(
-                                                       start=0.5, end=self.volume_dimensions_voxels[1], device=self.torch_device),
-                                                   torch.arange(
-                                                       start=0.5, end=self.volume_dimensions_voxels[2], device=self.torch_device),
-                                                   indexing='ij'), dim=-1)
+        bounding_box = self.get_bounding_box_voxels()
+        target_vector = self.get_voxel_coordinates(bounding_box, offset=0.5)
         target_vector -= start_voxels
 
         if partial_volume:
@@ -66,8 +71,7 @@ class SphericalStructure(GeometricalStructure):
         target_radius = torch.linalg.norm(target_vector, axis=-1)
         del target_vector
 
-        volume_fractions = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                       dtype=torch.float, device=self.torch_device)
+        volume_fractions = torch.zeros(target_radius.shape, dtype=torch.float, device=self.torch_device)
         filled_mask = target_radius <= radius_voxels - 1 + radius_margin
         border_mask = (target_radius > radius_voxels - 1 + radius_margin) & \
                       (target_radius < radius_voxels + 2 * radius_margin)
@@ -81,7 +85,7 @@ class SphericalStructure(GeometricalStructure):
         else:
             mask = filled_mask
 
-        return mask.cpu().numpy(), volume_fractions[mask].cpu().numpy()
+        return self.get_indices_in_volume(bounding_box, mask), volume_fractions[mask].cpu().numpy()
 
 
 def define_spherical_structure_settings(start_mm: list, molecular_composition: MolecularComposition,
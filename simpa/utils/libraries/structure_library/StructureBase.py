@@ -5,6 +5,7 @@
 from abc import abstractmethod
 
 import numpy as np
+import torch
 
 from simpa.log import Logger
 from simpa.utils import Settings, Tags, get_functional_from_deformation_settings
@@ -21,6 +22,9 @@ class GeometricalStructure:
     Most of the GeometricalStructures implement a partial volume effect. So if a voxel has the value 1, it is completely
     enclosed by the GeometricalStructure. If a voxel has a value between 0 and 1, that fraction of the volume is
     occupied by the GeometricalStructure. If a voxel has the value 0, it is outside of the GeometricalStructure.
+    The geometry is stored sparsely by the flat indices of the occupied voxels (self.voxel_indices) and their volume
+    fractions (self.volume_fractions), such that the memory of a GeometricalStructure scales with the number of
+    voxels it occupies. self.geometrical_volume creates a dense copy from them on every access.
     """
 
     def __init__(self, global_settings: Settings,
@@ -69,25 +73,136 @@ class GeometricalStructure:
         self.molecule_composition = single_structure_settings[Tags.MOLECULE_COMPOSITION]
         self.molecule_composition.update_internal_properties()
 
-        self.geometrical_volume = np.zeros(self.volume_dimensions_voxels, dtype=np.float32)
         self.params = self.get_params_from_settings(single_structure_settings)
         self.fill_internal_volume()
 
     def fill_internal_volume(self):
         """
-        Fills self.geometrical_volume of the GeometricalStructure.
+        Fills self.voxel_indices and self.volume_fractions of the GeometricalStructure.
         """
         indices, values = self.get_enclosed_indices()
-        self.geometrical_volume[indices] = values
+        if isinstance(indices, tuple):
+            voxel_indices = np.ravel_multi_index(tuple(np.asarray(axis_indices, dtype=np.int64)
+                                                       for axis_indices in indices), self.volume_dimensions_voxels)
+        else:
+            voxel_indices = np.flatnonzero(indices)
+        volume_fractions = np.broadcast_to(np.asarray(values, dtype=np.float32), voxel_indices.shape)
+        occupied = volume_fractions > 0
+        self.voxel_indices = voxel_indices[occupied]
+        self.volume_fractions = volume_fractions[occupied]
+
+    @property
+    def geometrical_volume(self) -> np.ndarray:
+        """
+        Creates a dense view of the GeometricalStructure for debugging and visualisation. Every access allocates an
+        array of the size of the simulation volume, which is not cached, such that it should be stored in a variable
+        if it is used repeatedly. The volume creation only uses the sparse self.voxel_indices and
+        self.volume_fractions.
+
+        :return: the volume fractions of the GeometricalStructure in every voxel of the simulation volume
+        """
+        geometrical_volume = np.zeros(self.volume_dimensions_voxels, dtype=np.float32)
+        geometrical_volume.reshape(-1)[self.voxel_indices] = self.volume_fractions
+        return geometrical_volume
 
     @abstractmethod
     def get_enclosed_indices(self):
         """
         Gets indices of the voxels that are either entirely or partially occupied by the GeometricalStructure.
-        :return: mask for a numpy array
+        Implementations should only evaluate the voxels within get_bounding_box_voxels and convert the resulting mask
+        with get_indices_in_volume.
+        :return: mask or tuple of index arrays for a numpy array and the volume fractions of the indexed voxels
         """
         pass
 
+    def get_bounding_box_voxels(self) -> np.ndarray:
+        """
+        Gets an axis-aligned bounding box of the voxels that the GeometricalStructure can intersect, including the
+        voxels of its partial volume border. The default bounding box is the entire simulation volume, deriving
+        GeometricalStructures override it with an analytic bounding box.
+        :return: array of shape (2, 3) with the first voxel index and the end voxel index (exclusive) along every axis
+        """
+        return np.asarray([[0, 0, 0], self.volume_dimensions_voxels])
+
+    def get_bounding_box_from_extent(self, lower_voxels, upper_voxels, margin_voxels: int = 1) -> np.ndarray:
+        """
+        Converts the extent of a GeometricalStructure in continuous voxel coordinates into a bounding box of voxel
+        indices, which is enlarged by the given margin and clipped to the simulation volume.
+        :param lower_voxels: the lower corner of the extent in voxels
+        :param upper_voxels: the upper corner of the extent in voxels
+        :param margin_voxels: the number of voxels that are added on every side
+        :return: array of shape (2, 3) with the first voxel index and the end voxel index (exclusive) along every axis
+        """
+        lower_voxels = np.floor(np.asarray(lower_voxels, dtype=np.float64)) - margin_voxels
+        upper_voxels = np.ceil(np.asarray(upper_voxels, dtype=np.float64)) + 1 + margin_voxels
+        bounding_box = np.clip(np.stack([lower_voxels, upper_voxels]), 0, self.volume_dimensions_voxels).astype(int)
+        bounding_box[1] = np.maximum(bounding_box[0], bounding_box[1])
+        return bounding_box
+
+    def get_bounding_box_of_line(self, start_voxels, direction_voxels, radius_voxels: float) -> np.ndarray:
+        """
+        Gets the bounding box of the voxels within the given distance to an infinite line through the simulation
+        volume, e.g. of a tube.
+        :param start_voxels: a point on the line in voxels
+        :param direction_voxels: the direction of the line in voxels
+        :param radius_voxels: the maximum distance to the line in voxels
+        :return: array of shape (2, 3) with the first voxel index and the end voxel index (exclusive) along every axis
+        """
+        start_voxels = np.asarray(start_voxels, dtype=np.float64)
+        direction_voxels = np.asarray(direction_voxels, dtype=np.float64)
+        # clip the line to the simulation volume that is enlarged by the radius
+        lower_corner = -radius_voxels - 1.0
+        upper_corner = self.volume_dimensions_voxels + radius_voxels + 1.0
+        line_start, line_end = -np.inf, np.inf
+        for axis in range(3):
+            if direction_voxels[axis] == 0:
+                if not lower_corner <= start_voxels[axis] <= upper_corner[axis]:
+                    return np.zeros((2, 3), dtype=int)
+                continue
+            parameters = np.sort([(lower_corner - start_voxels[axis]) / direction_voxels[axis],
+                                  (upper_corner[axis] - start_voxels[axis]) / direction_voxels[axis]])
+            line_start, line_end = max(line_start, parameters[0]), min(line_end, parameters[1])
+        if line_start > line_end or not np.isfinite(line_start) or not np.isfinite(line_end):
+            return np.zeros((2, 3), dtype=int)
+        line_points = np.stack([start_voxels + line_start * direction_voxels,
+                                start_voxels + line_end * direction_voxels])
+        return self.get_bounding_box_from_extent(np.min(line_points, axis=0) - radius_voxels,
+                                                 np.max(line_points, axis=0) + radius_voxels)
+
+    def get_maximum_deformation_voxels(self) -> float:
+        """
+        :return: the maximum absolute elevation of the deformation within the simulation volume in voxels or 0 if
+            the GeometricalStructure does not adhere to a deformation
+        """
+        if not self.do_deformation or self.deformation_functional_mm is None:
+            return 0
+        deformation_values_mm = self.deformation_functional_mm(np.arange(self.volume_dimensions_voxels[0]) *
+                                                               self.voxel_spacing,
+                                                               np.arange(self.volume_dimensions_voxels[1]) *
+                                                               self.voxel_spacing)
+        return float(np.max(np.abs(deformation_values_mm))) / self.voxel_spacing
+
+    def get_voxel_coordinates(self, bounding_box: np.ndarray, offset: float = 0) -> torch.Tensor:
+        """
+        :param bounding_box: the bounding box of the voxels, see get_bounding_box_voxels
+        :param offset: the offset of the coordinates within the voxels, e.g. 0.5 for the centers of the voxels
+        :return: the coordinates of the voxels within the bounding box in voxels of shape (x, y, z, 3)
+        """
+        coordinates = [torch.arange(bounding_box[0, axis], bounding_box[1, axis], dtype=torch.float,
+                                    device=self.torch_device) + offset for axis in range(3)]
+        return torch.stack(torch.meshgrid(*coordinates, indexing='ij'), dim=-1)
+
+    @staticmethod
+    def get_indices_in_volume(bounding_box: np.ndarray, mask) -> tuple:
+        """
+        :param bounding_box: the bounding box of the voxels, see get_bounding_box_voxels
+        :param mask: mask of the voxels within the bounding box
+        :return: the indices of the masked voxels within the simulation volume in the order of the mask
+        """
+        if isinstance(mask, torch.Tensor):
+            mask = mask.cpu().numpy()
+        return tuple(indices + bounding_box[0, axis] for axis, indices in enumerate(np.nonzero(mask)))
+
     @abstractmethod
     def get_params_from_settings(self, single_structure_settings):
         """
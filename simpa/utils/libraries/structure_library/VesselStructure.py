@@ -4,13 +4,15 @@
 
 import numpy as np
 import torch
-import math
 
 from simpa.utils import Tags
 from simpa.utils.calculate import rotation
 from simpa.utils.libraries.molecule_library import MolecularComposition
 from simpa.utils.libraries.structure_library.StructureBase import GeometricalStructure
 
+# The maximum number of voxels that are evaluated at once when the capsules of a vessel tree are rasterized
+MAXIMUM_VOXELS_PER_CHUNK = 2 ** 22
+
 
 class VesselStructure(GeometricalStructure):
     """
@@ -58,119 +60,215 @@ class VesselStructure(GeometricalStructure):
         settings[Tags.CONSIDER_PARTIAL_VOLUME] = self.params[6]
         return settings
 
-    def fill_internal_volume(self):
-        self.geometrical_volume = self.get_enclosed_indices()
-
-    def calculate_vessel_samples(self, position, direction, bifurcation_length, radius, radius_variation,
-                                 volume_dimensions, curvature_factor):
-        position_array = [position]
-        radius_array = [radius]
-        samples = 0
-
-        while torch.all(position < torch.tensor(volume_dimensions).to(self.torch_device)) and torch.all(0 <= position):
-            if samples >= bifurcation_length:
-                vessel_branch_positions1 = position
-                vessel_branch_positions2 = position
-                angles = np.random.normal(np.pi / 16, np.pi / 8, 3)
-
-                dir = direction.to(self.torch_device)
-                rota = torch.tensor(rotation(angles)).to(self.torch_device)
-                vessel_step_1 = torch.matmul(rota, dir)
-                vessel_step_2 = torch.tensor(vessel_step_1)
-                vessel_branch_directions1 = vessel_step_2.to(self.torch_device)
-
-                dir2 = direction.to(self.torch_device)
-                rota2 = torch.tensor(rotation(-angles)).to(self.torch_device)
-                vessel2_step_1 = torch.matmul(rota2, dir2)
-                vessel2_step_2 = torch.tensor(vessel2_step_1)
-                vessel_branch_directions2 = vessel2_step_2.to(self.torch_device)
-
-                vessel_branch_radius1 = 1 / math.sqrt(2) * radius
-                vessel_branch_radius2 = 1 / math.sqrt(2) * radius
-                vessel_branch_radius_variation1 = 1 / math.sqrt(2) * radius_variation
-                vessel_branch_radius_variation2 = 1 / math.sqrt(2) * radius_variation
-
-                if vessel_branch_radius1 >= 0.5:
-                    vessel1_pos, vessel1_rad = self.calculate_vessel_samples(vessel_branch_positions1,
-                                                                             vessel_branch_directions1,
-                                                                             bifurcation_length,
-                                                                             vessel_branch_radius1,
-                                                                             vessel_branch_radius_variation1,
-                                                                             volume_dimensions, curvature_factor)
-                    position_array += vessel1_pos
-                    radius_array += vessel1_rad
-
-                if vessel_branch_radius2 >= 0.5:
-                    vessel2_pos, vessel2_rad = self.calculate_vessel_samples(vessel_branch_positions2,
-                                                                             vessel_branch_directions2,
-                                                                             bifurcation_length,
-                                                                             vessel_branch_radius2,
-                                                                             vessel_branch_radius_variation2,
-                                                                             volume_dimensions, curvature_factor)
-                    position_array += vessel2_pos
-                    radius_array += vessel2_rad
-                break
-
-            position = torch.add(position, direction)
-            position_array.append(position)
-            radius_array.append(np.random.uniform(-1, 1) * radius_variation + radius)
-
-            step_vector = torch.from_numpy(np.random.uniform(-1, 1, 3)).to(self.torch_device)
-            step_vector = direction + curvature_factor * step_vector
-            direction = step_vector / torch.linalg.norm(step_vector)
-            samples += 1
-
-        return position_array, radius_array
-
     def get_enclosed_indices(self):
         start_mm, radius_mm, direction_mm, bifurcation_length_mm, curvature_factor, \
             radius_variation_factor, partial_volume = self.params
-        start_mm = torch.tensor(start_mm, dtype=torch.float, device=self.torch_device)
-        direction_mm = torch.tensor(direction_mm, dtype=torch.float, device=self.torch_device)
 
-        start_voxels = start_mm / self.voxel_spacing
+        start_voxels = np.asarray(start_mm, dtype=np.float64) / self.voxel_spacing
         radius_voxels = radius_mm / self.voxel_spacing
-        direction_voxels = direction_mm / self.voxel_spacing
-        direction_vector_voxels = direction_voxels / torch.linalg.norm(direction_voxels)
+        direction_voxels = np.asarray(direction_mm, dtype=np.float64) / self.voxel_spacing
         bifurcation_length_voxels = bifurcation_length_mm / self.voxel_spacing
 
-        position_array, radius_array = self.calculate_vessel_samples(start_voxels, direction_vector_voxels,
-                                                                     bifurcation_length_voxels, radius_voxels,
-                                                                     radius_variation_factor,
-                                                                     self.volume_dimensions_voxels,
-                                                                     curvature_factor)
-
-        # creates open grid like np.ogrid
-        x = torch.arange(self.volume_dimensions_voxels[0], device=self.torch_device)[:, None, None]
-        y = torch.arange(self.volume_dimensions_voxels[1], device=self.torch_device)[None, :, None]
-        z = torch.arange(self.volume_dimensions_voxels[2], device=self.torch_device)[None, None, :]
-
-        volume_fractions = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                       dtype=torch.float, device=self.torch_device)
+        # the generator is seeded from the global random state, which is seeded with Tags.RANDOM_SEED
+        random_generator = np.random.default_rng(np.random.randint(np.iinfo(np.int32).max))
+        positions, radii, segments = generate_vessel_tree(start_voxels, direction_voxels, radius_voxels,
+                                                          radius_variation_factor, bifurcation_length_voxels,
+                                                          curvature_factor, self.volume_dimensions_voxels,
+                                                          random_generator)
+        segment_starts, segment_ends, start_radii, end_radii = self.get_vessel_segments(positions, radii, segments)
 
         if partial_volume:
             radius_margin = 0.5
         else:
             radius_margin = 0.7071
 
-        for position, radius in zip(position_array, radius_array):
-            target_radius = torch.zeros(tuple(self.volume_dimensions_voxels),
-                                        dtype=torch.float, device=self.torch_device)
-            target_radius += (x - position[0]) ** 2
-            target_radius += (y - position[1]) ** 2
-            target_radius += (z - position[2]) ** 2
-            target_radius = target_radius.sqrt_()
-            filled_mask = target_radius <= radius - 1 + radius_margin
-            border_mask = (target_radius > radius - 1 + radius_margin) & \
-                          (target_radius < radius + 2 * radius_margin)
-
-            volume_fractions[filled_mask] = 1
-            old_border_values = volume_fractions[border_mask]
-            new_border_values = 1 - (target_radius[border_mask] - (radius - radius_margin))
-            volume_fractions[border_mask] = torch.maximum(old_border_values, new_border_values).float()
-            del target_radius
-
-        return volume_fractions.cpu().numpy()
+        bounding_box, volume_fractions = self.rasterize_capsules(segment_starts, segment_ends, start_radii, end_radii,
+                                                                 radius_margin)
+        mask = volume_fractions > 0
+
+        return self.get_indices_in_volume(bounding_box, mask), volume_fractions[mask].cpu().numpy()
+
+    def get_vessel_segments(self, positions: np.ndarray, radii: np.ndarray, segments: np.ndarray) -> tuple:
+        """
+        Represents the vessel tree by capsules between the connected samples of generate_vessel_tree. Samples that
+        are not connected to any other sample are represented by capsules of length 0, i.e. spheres.
+
+        :param positions: the positions of the samples in voxels of shape (N, 3)
+        :param radii: the radii of the samples in voxels of shape (N,)
+        :param segments: the indices of the connected samples of shape (M, 2)
+        :return: the start and end positions of shape (K, 3) and the start and end radii of shape (K,) of the
+            capsules
+        """
+        isolated = np.ones(len(positions), dtype=bool)
+        isolated[segments.reshape(-1)] = False
+        starts = torch.as_tensor(np.concatenate([segments[:, 0], np.flatnonzero(isolated)]), device=self.torch_device)
+        ends = torch.as_tensor(np.concatenate([segments[:, 1], np.flatnonzero(isolated)]), device=self.torch_device)
+
+        positions = torch.as_tensor(positions, dtype=torch.float, device=self.torch_device)
+        radii = torch.as_tensor(radii, dtype=torch.float, device=self.torch_device)
+        return positions[starts], positions[ends], radii[starts], radii[ends]
+
+    def rasterize_capsules(self, segment_starts: torch.Tensor, segment_ends: torch.Tensor,
+                           start_radii: torch.Tensor, end_radii: torch.Tensor, radius_margin: float) -> tuple:
+        """
+        Rasterizes capsules whose radius changes linearly from the start to the end of their segment, i.e. the union of
+        the spheres around all points of the segment. The volume fraction of a sphere with radius r at the distance d
+        of a voxel is 1 if d <= r - 1 + radius_margin and 1 - (d - (r - radius_margin)) otherwise, clipped to 0. A
+        capsule yields the maximum over its spheres, such that a capsule of length 0 yields a single sphere. Every
+        voxel is assigned the maximum volume fraction of all capsules. Only the voxels within the bounding boxes of
+        the capsules are evaluated, in chunks of capsules with similar bounding box sizes, and the volume fractions
+        are only held for the bounding box of all capsules rather than for the simulation volume.
+
+        :param segment_starts: the start positions of the segments in voxels of shape (N, 3)
+        :param segment_ends: the end positions of the segments in voxels of shape (N, 3)
+        :param start_radii: the radii at the start of the segments in voxels of shape (N,)
+        :param end_radii: the radii at the end of the segments in voxels of shape (N,)
+        :param radius_margin: the width of the partial volume border inside of the radius
+        :return: the bounding box of the capsules, see get_bounding_box_voxels, and the volume fractions of the
+            voxels within it
+        """
+        volume_dimensions = tuple(int(dimension) for dimension in self.volume_dimensions_voxels)
+
+        # voxels that are further away from a segment than its radius + 1 - radius_margin have a volume fraction of 0
+        reach = torch.maximum(start_radii, end_radii)[:, None] + 1 - radius_margin
+        lower = torch.floor(torch.minimum(segment_starts, segment_ends) - reach).long()
+        upper = torch.ceil(torch.maximum(segment_starts, segment_ends) + reach).long()
+        lower = torch.clamp(lower, min=0)
+        upper = torch.minimum(upper, torch.tensor(volume_dimensions, device=self.torch_device) - 1)
+        extents = upper - lower + 1
+        inside = torch.all(extents > 0, dim=1) & (reach[:, 0] > 0)
+
+        order = torch.argsort(torch.prod(extents[inside], dim=1))
+        segment_indices = torch.nonzero(inside)[:, 0][order]
+        sorted_extents = extents[segment_indices].cpu().numpy()
+
+        bounding_box = np.zeros((2, 3), dtype=int)
+        if len(segment_indices) > 0:
+            bounding_box[0] = torch.min(lower[segment_indices], dim=0).values.cpu().numpy()
+            bounding_box[1] = torch.max(upper[segment_indices], dim=0).values.cpu().numpy() + 1
+        box_dimensions = tuple(int(dimension) for dimension in bounding_box[1] - bounding_box[0])
+        box_start = torch.as_tensor(bounding_box[0], device=self.torch_device)
+        volume_fractions = torch.zeros(int(np.prod(box_dimensions)), dtype=torch.float, device=self.torch_device)
+
+        first = 0
+        while first < len(segment_indices):
+            # extends the chunk as long as the padded bounding boxes of its capsules fit into the chunk size
+            padded_extents = np.maximum.accumulate(sorted_extents[first:], axis=0)
+            chunk_sizes = np.prod(padded_extents, axis=1) * np.arange(1, len(padded_extents) + 1)
+            last = first + max(1, int(np.searchsorted(chunk_sizes, MAXIMUM_VOXELS_PER_CHUNK, side="right")))
+            chunk = segment_indices[first:last]
+            chunk_extent = padded_extents[last - first - 1]
+
+            offsets = torch.stack(torch.meshgrid(*[torch.arange(extent, device=self.torch_device)
+                                                   for extent in chunk_extent], indexing="ij"), dim=-1).view(-1, 3)
+            voxels = lower[chunk][:, None, :] + offsets[None, :, :]
+            valid = torch.all(voxels <= upper[chunk][:, None, :], dim=-1)
+
+            points = voxels.float() - segment_starts[chunk][:, None, :]
+            segments = (segment_ends[chunk] - segment_starts[chunk])[:, None, :]
+            lengths = torch.linalg.norm(segments, dim=-1)
+            lengths = torch.where(lengths > 0, lengths, torch.ones_like(lengths))
+            axial_distances = torch.sum(points * segments, dim=-1) / lengths
+            radial_distances = torch.sqrt(torch.clamp(torch.sum(points ** 2, dim=-1) - axial_distances ** 2, min=0))
+            # the position along the segment that maximises the radius minus the distance to the voxel
+            slopes = (end_radii[chunk] - start_radii[chunk])[:, None] / lengths
+            projections = axial_distances + slopes * radial_distances / torch.sqrt(torch.clamp(1 - slopes ** 2,
+                                                                                               min=1e-12))
+            projections = torch.clamp(projections / lengths, 0, 1)
+            distances = torch.linalg.norm(points - projections[..., None] * segments, dim=-1)
+            radii = start_radii[chunk][:, None] + projections * (end_radii[chunk] - start_radii[chunk])[:, None]
+            values = torch.where(distances <= radii - 1 + radius_margin, torch.ones_like(distances),
+                                 1 - (distances - (radii - radius_margin)))
+
+            valid &= values > 0
+            box_voxels = voxels - box_start
+            flat_indices = (box_voxels[..., 0] * box_dimensions[1] + box_voxels[..., 1]) * box_dimensions[2] + \
+                box_voxels[..., 2]
+            volume_fractions.scatter_reduce_(0, flat_indices[valid], values[valid], reduce="amax")
+            first = last
+
+        return bounding_box, volume_fractions.view(box_dimensions)
+
+
+def generate_vessel_tree(start_voxels: np.ndarray, direction_voxels: np.ndarray, radius_voxels: float,
+                         radius_variation: float, bifurcation_length_voxels: float, curvature_factor: float,
+                         volume_dimensions_voxels, random_generator: np.random.Generator) -> tuple:
+    """
+    Generates the centerline samples of a vessel tree. The vessel starts with the given radius and advances by steps
+    of one voxel in its direction, which is randomly perturbed by the curvature factor at every step. The radii of
+    the samples deviate randomly by up to the radius variation. After the bifurcation length, a branch bifurcates into
+    two branches whose radius and radius variation are smaller by a factor of sqrt(2), unless their radius is smaller
+    than 0.5 voxels. A branch ends when it leaves the simulation volume.
+    All growing branches are held in a frontier and advanced at once, such that the number of iterations is given by
+    the depth of the tree rather than by the number of samples. The tree is determined by the state of the random
+    generator.
+
+    :param start_voxels: the start position of the vessel in voxels
+    :param direction_voxels: the initial direction of the vessel
+    :param radius_voxels: the initial radius of the vessel in voxels
+    :param radius_variation: the maximum random deviation of the radii of the samples in voxels
+    :param bifurcation_length_voxels: the number of steps of a branch before it bifurcates
+    :param curvature_factor: the magnitude of the random perturbation of the direction at every step
+    :param volume_dimensions_voxels: the dimensions of the simulation volume in voxels
+    :param random_generator: the random number generator
+    :return: the positions of the samples in voxels of shape (N, 3), their radii of shape (N,) and the indices of
+        the samples that are connected by the segments of the vessel tree of shape (M, 2)
+    """
+    volume_dimensions = np.asarray(volume_dimensions_voxels, dtype=np.float64)
+    positions = [np.asarray(start_voxels, dtype=np.float64).reshape(1, 3)]
+    radii = [np.array([radius_voxels], dtype=np.float64)]
+    segments = [np.zeros((0, 2), dtype=np.int64)]
+    number_of_samples = 1
+
+    # the state of the growing branches and the index of their last sample
+    frontier_positions = positions[0]
+    frontier_directions = np.asarray(direction_voxels, dtype=np.float64).reshape(1, 3)
+    frontier_directions = frontier_directions / np.linalg.norm(frontier_directions)
+    frontier_radii = np.array([radius_voxels], dtype=np.float64)
+    frontier_radius_variations = np.array([radius_variation], dtype=np.float64)
+    frontier_steps = np.zeros(1, dtype=np.int64)
+    frontier_samples = np.zeros(1, dtype=np.int64)
+
+    while len(frontier_positions) > 0:
+        inside = np.all((0 <= frontier_positions) & (frontier_positions < volume_dimensions), axis=1)
+        growing = np.flatnonzero(inside & (frontier_steps < bifurcation_length_voxels))
+        bifurcating = np.flatnonzero(inside & (frontier_steps >= bifurcation_length_voxels))
+        bifurcating = bifurcating[frontier_radii[bifurcating] / np.sqrt(2) >= 0.5]
+
+        # both branches of a bifurcation start at the last position of their parent branch
+        angles = random_generator.normal(np.pi / 16, np.pi / 8, (len(bifurcating), 3))
+        rotations = np.reshape([rotation(angle) for angle in angles] + [rotation(-angle) for angle in angles],
+                               (-1, 3, 3))
+        branch_positions = np.concatenate([frontier_positions[bifurcating]] * 2)
+        branch_directions = np.einsum("nij,nj->ni", rotations, np.concatenate([frontier_directions[bifurcating]] * 2))
+        branch_radii = np.concatenate([frontier_radii[bifurcating]] * 2) / np.sqrt(2)
+        branch_radius_variations = np.concatenate([frontier_radius_variations[bifurcating]] * 2) / np.sqrt(2)
+        branch_samples = number_of_samples + np.arange(len(branch_positions))
+        positions.append(branch_positions)
+        radii.append(branch_radii)
+        number_of_samples += len(branch_positions)
+
+        step_positions = frontier_positions[growing] + frontier_directions[growing]
+        step_radii = random_generator.uniform(-1, 1, len(growing)) * frontier_radius_variations[growing] + \
+            frontier_radii[growing]
+        step_samples = number_of_samples + np.arange(len(growing))
+        positions.append(step_positions)
+        radii.append(step_radii)
+        segments.append(np.stack([frontier_samples[growing], step_samples], axis=1))
+        number_of_samples += len(growing)
+
+        step_vectors = frontier_directions[growing] + \
+            curvature_factor * random_generator.uniform(-1, 1, (len(growing), 3))
+        step_directions = step_vectors / np.linalg.norm(step_vectors, axis=1, keepdims=True)
+
+        frontier_positions = np.concatenate([step_positions, branch_positions])
+        frontier_directions = np.concatenate([step_directions, branch_directions])
+        frontier_radii = np.concatenate([frontier_radii[growing], branch_radii])
+        frontier_radius_variations = np.concatenate([frontier_radius_variations[growing], branch_radius_variations])
+        frontier_steps = np.concatenate([frontier_steps[growing] + 1, np.zeros(len(branch_positions), np.int64)])
+        frontier_samples = np.concatenate([step_samples, branch_samples])
+
+    return np.concatenate(positions), np.concatenate(radii), np.concatenate(segments)
 
 
 def define_vessel_structure_settings(vessel_start_mm: list,
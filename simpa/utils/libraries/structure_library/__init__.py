@@ -22,7 +22,7 @@ from simpa.utils.libraries.structure_library.RectangularCuboidStructure import R
 from simpa.utils.libraries.structure_library.SphericalStructure import SphericalStructure, \
     define_spherical_structure_settings
 from simpa.utils.libraries.structure_library.VesselStructure import VesselStructure, \
-    define_vessel_structure_settings
+    define_vessel_structure_settings, generate_vessel_tree
 
 
 def priority_sorted_structures(settings: Settings, volume_creator_settings: dict):
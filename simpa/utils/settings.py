@@ -60,6 +60,12 @@ class Settings(dict, SerializableSIMPAClass):
                 key = item[0] if isinstance(item, tuple) else item
                 raise KeyError("The key '{}' is not in the Settings dictionary".format(key)) from None
 
+    def __reduce__(self):
+        # dict subclasses are unpickled by calling __setitem__ before the instance attributes are restored.
+        # Re-create the instance through the constructor instead so that pickling (e.g. for sending the settings
+        # to worker processes) works.
+        return self.__class__, (dict(self), False), self.__dict__
+
     def __delitem__(self, key):
         if super().__contains__(key) is True:
             return super().__delitem__(key)
@@ -84,10 +84,69 @@ class Tags:
 
     DO_FILE_COMPRESSION = ("minimize_file_size", (bool, np.bool_))
     """
-    If not set to False, the HDF5 file will be optimised after the simulations are done.
+    If not set to False, all arrays in the HDF5 file are written as chunked, gzip compressed datasets and the file
+    is repacked after the simulations are done if overwritten data occupies a considerable amount of space.\n
     Usage: simpa.core.simulation.simulate
     """
 
+    PARALLEL_WAVELENGTH_EXECUTION = ("parallel_wavelength_execution", (bool, np.bool_))
+    """
+    If True, the simulation pipeline is run for all wavelengths in parallel using a pool of worker processes.
+    Every worker writes into its own output file that is merged into the SIMPA output file afterwards.
+    False by default.\n
+    Usage: simpa.core.simulation.simulate
+    """
+
+    NUMBER_OF_PARALLEL_WORKERS = ("number_of_parallel_workers", (int, np.integer))
+    """
+    Maximum number of worker processes used if Tags.PARALLEL_WAVELENGTH_EXECUTION is True.
+    Defaults to the number of wavelengths or the number of available CPUs, whichever is smaller.\n
+    Usage: simpa.core.simulation.simulate
+    """
+
+    IN_MEMORY_DATA_STORE = ("in_memory_data_store", (bool, np.bool_))
+    """
+    If True, the data that is passed between the simulation modules is held in memory and written into the SIMPA
+    output file in a background thread after every wavelength, instead of being written and read back by every
+    module. False by default.\n
+    Usage: simpa.core.simulation.simulate, simpa.io_handling.in_memory_data_store
+    """
+
+    RESUME_SIMULATION = ("resume_simulation", (bool, np.bool_))
+    """
+    If True, a fingerprint of the settings and of the data every pipeline element read and wrote is recorded for
+    every wavelength in the SIMPA output file. If the output file already exists, e.g. because a previous run of the
+    same simulation was interrupted, the simulation is resumed and all pipeline elements whose outputs are present
+    and up to date are skipped. In the parallel execution mode, every worker resumes its own output file, which is
+    kept if the simulation fails. False by default.\n
+    Usage: simpa.core.simulation.simulate, simpa.core.pipeline_checkpoints
+    """
+
+    MODULE_OUTPUT_CACHE_PATH = ("module_output_cache_path", str)
+    """
+    Directory of a cache of the outputs of the pipeline elements that is shared across simulation runs. Pipeline
+    elements whose component settings, relevant global settings, digital device twin and input data are identical to
+    those of an earlier run are not run again, but their outputs are copied from the cache. The global settings that
+    only control the execution of the pipeline, such as the volume name or the simulation path, are not taken into
+    account. Settings that are given as dictionaries are only taken into account as the component settings of the
+    pipeline elements they belong to.\n
+    Usage: simpa.core.simulation.simulate, simpa.core.module_output_cache
+    """
+
+    MODULE_OUTPUT_CACHE_SIZE_BYTES = ("module_output_cache_size_bytes", (int, np.integer))
+    """
+    Maximum total size of the entries of the module output cache in bytes. Once it is exceeded, the least recently
+    used entries are deleted. 10 GiB by default.\n
+    Usage: simpa.core.simulation.simulate, simpa.core.module_output_cache
+    """
+
+    HDF5_CHUNK_CACHE_SIZE_BYTES = ("hdf5_chunk_cache_size_bytes", (int, np.integer))
+    """
+    Size of the raw data chunk cache in bytes that is used for every dataset of the SIMPA output file while the
+    simulation pipeline is running. Defaults to the HDF5 default of 1 MB.\n
+    Usage: simpa.core.simulation.simulate, simpa.io_handling.simpa_output_file
+    """
+
     """
     Volume Creation Settings
     """
@@ -673,6 +732,25 @@ class Tags:
     Usage: module reconstruction_module, naming convention
     """
 
+    RECONSTRUCTION_ALGORITHM_TIME_REVERSAL_PYTORCH = "time_reversal_pytorch"
+    """
+    Corresponds to the reconstruction algorithm Time Reversal with PyTorchTimeReversalAdapter.\n
+    Usage: module reconstruction_module, naming convention
+    """
+
+    RECONSTRUCTION_ALGORITHM_MULTI_BEAMFORMER = "multi_beamformer"
+    """
+    Corresponds to the reconstruction of several delay and sum based images in a single pass with the
+    MultiBeamformerAdapter.\n
+    Usage: module reconstruction_module, naming convention
+    """
+
+    RECONSTRUCTION_ALGORITHM_FK_MIGRATION = "fk_migration"
+    """
+    Corresponds to the reconstruction algorithm f-k migration with the FKMigrationAdapter.\n
+    Usage: module reconstruction_module, naming convention
+    """
+
     RECONSTRUCTION_ALGORITHM_TEST = "TEST"
     """
     Corresponds to an adapter for testing purposes only.\n
@@ -766,6 +844,116 @@ class Tags:
     Usage: adapter reconstruction_utils
     """
 
+    RECONSTRUCTION_MEMORY_BUDGET_BYTES = ("reconstruction_memory_budget_bytes", (int, np.integer))
+    """
+    Upper bound of the memory in bytes that is used for the intermediate values of the delay and sum based
+    beamformers. The image is reconstructed in tiles of pixels that fit into this budget. Default is 256 MiB.\n
+    Usage: adapter DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter,
+    reconstruction_utils
+    """
+
+    RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES = ("reconstruction_delay_table_cache_size_bytes", (int, np.integer))
+    """
+    Maximum total size in bytes of the delay tables of the delay and sum based beamformers that are kept in memory
+    and on disk. A delay table holds the interpolation indices and weights of all pixels and sensor elements for a
+    detection geometry, image grid, speed of sound and sampling rate and is reused across wavelengths and frames.
+    Delay tables that exceed the size are not cached. The tables are kept in host memory, not on the GPU, and take
+    16 bytes per pixel and sensor element (32 bit indices and single precision weights), e.g. 625 MiB for 256
+    sensor elements and 400 x 400 pixels, which is held until the tables are evicted or the process ends. The size
+    is independent of Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES. Default is 2 GiB, 0 disables the cache.\n
+    Usage: adapter DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter,
+    reconstruction_utils
+    """
+
+    RECONSTRUCTION_DELAY_TABLE_CACHE_PATH = ("reconstruction_delay_table_cache_path", str)
+    """
+    Directory in which the delay tables of the delay and sum based beamformers are persisted, such that they can be
+    reused across processes and simulation runs. By default, the delay tables are only kept in memory.\n
+    Usage: adapter DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter,
+    reconstruction_utils
+    """
+
+    RECONSTRUCTION_F_NUMBER = ("reconstruction_f_number", Number)
+    """
+    Receive f-number of the delay and sum based beamformers. A sensor element only contributes to a pixel if the
+    angle between its normal and the direction to the pixel is at most arctan(1 / (2 * f-number)), i.e. if the
+    lateral distance is at most the depth divided by twice the f-number. The pairs of pixels and sensor elements
+    outside of this aperture are skipped. By default, the aperture is not limited.\n
+    Usage: adapter DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter,
+    MultiBeamformerAdapter, reconstruction_utils
+    """
+
+    RECONSTRUCTION_MAX_ACCEPTANCE_ANGLE_DEG = ("reconstruction_max_acceptance_angle_deg", Number)
+    """
+    Maximum angle in degrees between the normal of a sensor element and the direction to a pixel, up to which the
+    sensor element contributes to the pixel in the delay and sum based beamformers, e.g. the angle at which the
+    directivity of the elements falls off. If Tags.RECONSTRUCTION_F_NUMBER is also given, the smaller aperture is
+    used. By default, the aperture is not limited.\n
+    Usage: adapter DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter,
+    MultiBeamformerAdapter, reconstruction_utils
+    """
+
+    RECONSTRUCTION_HETEROGENEOUS_SPEED_OF_SOUND = ("reconstruction_heterogeneous_speed_of_sound", bool)
+    """
+    If True, the delay and sum based beamformers use the travel times through the simulated
+    Tags.DATA_FIELD_SPEED_OF_SOUND instead of a single speed of sound. The travel times from every sensor element
+    to every pixel are solved with an eikonal solver in the image plane and cached as delay tables, such that only the
+    first reconstruction of every geometry and medium is slow. Only supported for 2D images. Default is False.\n
+    Usage: adapter DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter,
+    MultiBeamformerAdapter, reconstruction_utils
+    """
+
+    RECONSTRUCTION_TIME_GATING = ("reconstruction_time_gating", bool)
+    """
+    If True, the time series data is cropped to the time steps that are reachable from the field of view before it is
+    filtered and reconstructed by the delay and sum based beamformers. The reachable time steps are given by the
+    minimum and maximum distance between the pixels and the sensor elements. Default is True.
+    As the bandpass filter and the envelope detection are applied to the cropped time series data, the result can
+    differ from the one without time gating: the Butterworth filter yields the same result up to rounding errors, as
+    the margin of the time gate covers its transient response, whereas the cutoff frequencies of the Tukey filter are
+    rounded to the coarser frequency resolution of the cropped data, which changes the result by a few percent. Set
+    this tag to False to reproduce the results of previous versions.\n
+    Usage: adapter DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter,
+    MultiBeamformerAdapter, reconstruction_utils
+    """
+
+    RECONSTRUCTION_TIME_GATE_MARGIN_TIME_STEPS = ("reconstruction_time_gate_margin_time_steps", (int, np.integer))
+    """
+    Number of additional time steps before and after the reachable time steps that are kept by the time gating.
+    Default is 16 time steps plus one period of Tags.BANDPASS_CUTOFF_HIGHPASS_IN_HZ if bandpass filtering is
+    performed.\n
+    Usage: reconstruction_utils
+    """
+
+    RECONSTRUCTION_BEAMFORMERS = ("reconstruction_beamformers", (list, tuple))
+    """
+    The images that are reconstructed by the MultiBeamformerAdapter, given as a list of the data fields
+    Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS, Tags.DATA_FIELD_RECONSTRUCTED_DATA_DMAS,
+    Tags.DATA_FIELD_RECONSTRUCTED_DATA_SDMAS, Tags.DATA_FIELD_COHERENCE_FACTOR and
+    Tags.DATA_FIELD_RECONSTRUCTED_DATA_CF_DAS. The first image is also stored as Tags.DATA_FIELD_RECONSTRUCTED_DATA.
+    All of them by default.\n
+    Usage: adapter MultiBeamformerAdapter
+    """
+
+    RECONSTRUCTION_FK_INTERPOLATION_METHOD = ("reconstruction_fk_interpolation_method", str)
+    """
+    Interpolation method that maps the temporal frequencies onto the axial wavenumbers in the f-k migration.
+    Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR by default.\n
+    Usage: adapter FKMigrationAdapter
+    """
+
+    RECONSTRUCTION_FK_INTERPOLATION_NEAREST = "nearest"
+    """
+    Nearest neighbour interpolation of the spectrum in the f-k migration, which is the fastest.\n
+    Usage: adapter FKMigrationAdapter
+    """
+
+    RECONSTRUCTION_FK_INTERPOLATION_LINEAR = "linear"
+    """
+    Linear interpolation of the spectrum in the f-k migration, which is more accurate.\n
+    Usage: adapter FKMigrationAdapter
+    """
+
     BANDPASS_FILTER_METHOD = ("bandpass_filtering_method", str)
     """
     Choice of the bandpass filtering method used, i.e. tukey or butterworth filter .\n
@@ -816,6 +1004,41 @@ class Tags:
     Usage: naming convention
     """
 
+    DATA_FIELD_RECONSTRUCTED_DATA_DAS = "reconstructed_data_das"
+    """
+    Name of the data field of the Delay and Sum image of the MultiBeamformerAdapter in the SIMPA output file.\n
+    Usage: adapter MultiBeamformerAdapter, naming convention
+    """
+
+    DATA_FIELD_RECONSTRUCTED_DATA_DMAS = "reconstructed_data_dmas"
+    """
+    Name of the data field of the Delay Multiply and Sum image of the MultiBeamformerAdapter in the SIMPA output
+    file.\n
+    Usage: adapter MultiBeamformerAdapter, naming convention
+    """
+
+    DATA_FIELD_RECONSTRUCTED_DATA_SDMAS = "reconstructed_data_sdmas"
+    """
+    Name of the data field of the signed Delay Multiply and Sum image of the MultiBeamformerAdapter in the SIMPA
+    output file.\n
+    Usage: adapter MultiBeamformerAdapter, naming convention
+    """
+
+    DATA_FIELD_COHERENCE_FACTOR = "coherence_factor"
+    """
+    Name of the data field of the coherence factor of the MultiBeamformerAdapter in the SIMPA output file. The
+    coherence factor is the ratio of the coherent and the incoherent energy of the delayed values of a pixel and lies
+    between 0 and 1.\n
+    Usage: adapter MultiBeamformerAdapter, naming convention
+    """
+
+    DATA_FIELD_RECONSTRUCTED_DATA_CF_DAS = "reconstructed_data_cf_das"
+    """
+    Name of the data field of the Delay and Sum image that is weighted by the coherence factor of the
+    MultiBeamformerAdapter in the SIMPA output file.\n
+    Usage: adapter MultiBeamformerAdapter, naming convention
+    """
+
     RECONSTRUCTION_MODE = ("reconstruction_mode", str)
     """
     Choice of the reconstruction mode used in the Backprojection.\n
@@ -48,7 +48,8 @@ def visualise_data(wavelength: int = None,
         path_to_hdf5_file = path_manager.get_hdf5_file_save_path() + "/" + settings[Tags.VOLUME_NAME] + ".hdf5"
 
     logger = Logger()
-    file = load_hdf5(path_to_hdf5_file)
+    # Only the slices that are shown are read from the file
+    file = load_hdf5(path_to_hdf5_file, lazy=True)
 
     fluence = None
     initial_pressure = None
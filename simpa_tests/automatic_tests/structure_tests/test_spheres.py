@@ -92,3 +92,25 @@ class TestSpheres(unittest.TestCase):
         assert 0 < ss.geometrical_volume[0, 1, 1] < 1
         assert 0 < ss.geometrical_volume[1, 1, 0] < 1
         assert ss.geometrical_volume[1, 1, 1] == 0
+
+    def test_spherical_structure_bounding_box_contains_sphere(self):
+        self.global_settings[Tags.DIM_VOLUME_X_MM] = 30
+        self.global_settings[Tags.DIM_VOLUME_Y_MM] = 30
+        self.global_settings[Tags.DIM_VOLUME_Z_MM] = 30
+        self.sphere_settings[Tags.STRUCTURE_START_MM] = [10.3, 20, 29]
+        self.sphere_settings[Tags.STRUCTURE_RADIUS_MM] = 2.5
+        ss = SphericalStructure(self.global_settings, self.sphere_settings)
+        bounding_box = ss.get_bounding_box_voxels()
+        np.testing.assert_array_less(bounding_box[1] - bounding_box[0], 15)
+        self.assertEqual(bounding_box[1, 2], 30)
+        geometrical_volume = ss.geometrical_volume.copy()
+        geometrical_volume[tuple(slice(*bounds) for bounds in bounding_box.T)] = 0
+        self.assertFalse(np.any(geometrical_volume))
+
+    def test_spherical_structure_stores_only_occupied_voxels(self):
+        self.sphere_settings[Tags.STRUCTURE_START_MM] = [2.5, 2.5, 2.5]
+        ss = SphericalStructure(self.global_settings, self.sphere_settings)
+        geometrical_volume = ss.geometrical_volume
+        np.testing.assert_array_equal(ss.voxel_indices, np.flatnonzero(geometrical_volume))
+        np.testing.assert_array_equal(ss.volume_fractions, geometrical_volume[geometrical_volume > 0])
+        self.assertLess(len(ss.voxel_indices), geometrical_volume.size)
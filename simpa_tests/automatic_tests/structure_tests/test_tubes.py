@@ -102,3 +102,19 @@ class TestTubes(unittest.TestCase):
         assert 0 < ts.geometrical_volume[1, 2, 2] < 1
         assert 0 < ts.geometrical_volume[1, 2, 3] < 1
         assert ts.geometrical_volume[4, 4, 4] == 1
+
+    def test_tube_structure_bounding_box_contains_tube(self):
+        self.global_settings[Tags.DIM_VOLUME_X_MM] = 30
+        self.global_settings[Tags.DIM_VOLUME_Y_MM] = 30
+        self.global_settings[Tags.DIM_VOLUME_Z_MM] = 30
+        self.tube_settings[Tags.STRUCTURE_START_MM] = [10, 10, 10]
+        self.tube_settings[Tags.STRUCTURE_END_MM] = [11, 13, 10.5]
+        self.tube_settings[Tags.STRUCTURE_RADIUS_MM] = 1.5
+        ts = CircularTubularStructure(self.global_settings, self.tube_settings)
+        bounding_box = ts.get_bounding_box_voxels()
+        self.assertLess(bounding_box[1, 2] - bounding_box[0, 2], 20)
+        # the tube extends beyond its start and end point
+        assert ts.geometrical_volume[7, 1, 8] == 1
+        geometrical_volume = ts.geometrical_volume.copy()
+        geometrical_volume[tuple(slice(*bounds) for bounds in bounding_box.T)] = 0
+        self.assertFalse(np.any(geometrical_volume))
@@ -4,10 +4,11 @@
 
 import unittest
 import numpy as np
+import torch
 from simpa.utils.libraries.tissue_library import TISSUE_LIBRARY
 from simpa.utils import Tags
 from simpa.utils.settings import Settings
-from simpa.utils.libraries.structure_library import VesselStructure
+from simpa.utils.libraries.structure_library import VesselStructure, generate_vessel_tree
 
 
 class TestVesselTree(unittest.TestCase):
@@ -43,3 +44,77 @@ class TestVesselTree(unittest.TestCase):
             assert 0 <= value <= 1
 
         self.assertTrue(np.sum(ts.geometrical_volume) > 0)
+
+    @staticmethod
+    def rasterize_capsules_in_volume(ts, starts, ends, start_radii, end_radii):
+        bounding_box, box_fractions = ts.rasterize_capsules(starts, ends, start_radii, end_radii, 0.5)
+        volume_fractions = np.zeros(ts.volume_dimensions_voxels, dtype=np.float32)
+        volume_fractions[tuple(slice(*bounds) for bounds in bounding_box.T)] = box_fractions.numpy()
+        return volume_fractions
+
+    def test_vessel_capsules_are_rasterized_within_their_bounding_box(self):
+        ts = VesselStructure(self.global_settings, self.vesseltree_settings)
+        bounding_box, volume_fractions = ts.rasterize_capsules(torch.tensor([[1.0, 1.0, 1.0]]),
+                                                               torch.tensor([[1.0, 2.0, 1.0]]),
+                                                               torch.tensor([0.5]), torch.tensor([0.5]), 0.5)
+        np.testing.assert_array_equal(bounding_box, [[0, 0, 0], [3, 4, 3]])
+        self.assertEqual(volume_fractions.shape, (3, 4, 3))
+        self.assertEqual(volume_fractions[1, 1, 1], 1)
+        self.assertEqual(volume_fractions[1, 2, 1], 1)
+
+        bounding_box, volume_fractions = ts.rasterize_capsules(torch.tensor([[10.0, 10.0, 10.0]]),
+                                                               torch.tensor([[12.0, 10.0, 10.0]]),
+                                                               torch.tensor([1.0]), torch.tensor([1.0]), 0.5)
+        self.assertEqual(volume_fractions.numel(), 0)
+
+    def test_vessel_capsules_contain_the_spheres_of_their_samples(self):
+        ts = VesselStructure(self.global_settings, self.vesseltree_settings)
+        starts = torch.tensor([[1.0, 1.0, 2.0], [3.5, 1.5, 2.0]])
+        ends = torch.tensor([[4.0, 2.0, 2.0], [3.5, 1.5, 2.0]])
+        start_radii = torch.tensor([1.5, 1.0])
+        end_radii = torch.tensor([0.8, 1.0])
+        volume_fractions = self.rasterize_capsules_in_volume(ts, starts, ends, start_radii, end_radii)
+
+        x, y, z = np.meshgrid(*[np.arange(5)] * 3, indexing="ij")
+        for position, radius in zip(torch.cat([starts, ends]).numpy(), torch.cat([start_radii, end_radii]).numpy()):
+            distances = np.sqrt((x - position[0]) ** 2 + (y - position[1]) ** 2 + (z - position[2]) ** 2)
+            sphere = np.clip(1 - (distances - (radius - 0.5)), 0, 1)
+            self.assertTrue(np.all(volume_fractions >= sphere - 1e-6))
+
+        # the capsule of length 0 is a sphere
+        sphere_fractions = self.rasterize_capsules_in_volume(ts, starts[1:], ends[1:], start_radii[1:], end_radii[1:])
+        distances = np.sqrt((x - 3.5) ** 2 + (y - 1.5) ** 2 + (z - 2) ** 2)
+        np.testing.assert_allclose(sphere_fractions, np.clip(1 - (distances - 0.5), 0, 1), atol=1e-6)
+
+        # the volume between the samples is filled
+        self.assertEqual(volume_fractions[2, 1, 2], 1)
+
+    def test_isolated_vessel_samples_are_spheres(self):
+        ts = VesselStructure(self.global_settings, self.vesseltree_settings)
+        positions = np.asarray([[0, 0, 0], [0, 1, 0], [0, 2, 0], [0, 2, 3]])
+        starts, ends, start_radii, end_radii = ts.get_vessel_segments(positions, np.asarray([1, 2, 3, 4]),
+                                                                      np.asarray([[0, 1], [1, 2]]))
+        np.testing.assert_array_equal(starts.numpy(), [[0, 0, 0], [0, 1, 0], [0, 2, 3]])
+        np.testing.assert_array_equal(ends.numpy(), [[0, 1, 0], [0, 2, 0], [0, 2, 3]])
+        np.testing.assert_array_equal(start_radii.numpy(), [1, 2, 4])
+        np.testing.assert_array_equal(end_radii.numpy(), [2, 3, 4])
+
+    def test_vessel_tree_generation_is_reproducible(self):
+        def generate(seed):
+            return generate_vessel_tree(np.asarray([25, 0, 25]), np.asarray([0, 1, 0]), 4, 0.5, 10, 0.1, [50, 50, 50],
+                                        np.random.default_rng(seed))
+
+        positions, radii, segments = generate(4711)
+        for expected, actual in zip((positions, radii, segments), generate(4711)):
+            np.testing.assert_array_equal(expected, actual)
+        self.assertFalse(np.array_equal(positions, generate(4712)[0]))
+
+        # the branches start with radii that are smaller by factors of sqrt(2) and at least 0.5 voxels
+        branch_radii = radii[np.isin(np.arange(len(radii)), segments[:, 1], invert=True)]
+        self.assertGreater(len(branch_radii), 1)
+        generations = np.log(4 / branch_radii) / np.log(np.sqrt(2))
+        np.testing.assert_allclose(generations, np.round(generations), atol=1e-9)
+        self.assertTrue(np.all(branch_radii >= 0.5))
+        self.assertEqual(len(segments), len(np.unique(segments[:, 1])))
+        step_lengths = np.linalg.norm(positions[segments[:, 1]] - positions[segments[:, 0]], axis=1)
+        self.assertTrue(np.all(step_lengths <= 1 + 1e-9))
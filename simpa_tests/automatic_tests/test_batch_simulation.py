@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import unittest
+import shutil
+import tempfile
+import time
+from simpa.utils import Tags
+from simpa.utils.settings import Settings
+from simpa.core.batch_simulation import simulate_batch
+from simpa.core import SimulationModule
+from simpa_tests.test_utils import create_test_structure_parameters
+from simpa import ModelBasedVolumeCreationAdapter
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_test_adapter import \
+    OpticalForwardModelTestAdapter
+from simpa.core.device_digital_twins import RSOMExplorerP50
+from simpa.io_handling import load_data_field
+
+
+class FailingSimulationModule(SimulationModule):
+
+    def run(self, digital_device_twin):
+        raise RuntimeError("Simulation failed")
+
+
+class SleepingSimulationModule(SimulationModule):
+
+    def run(self, digital_device_twin):
+        time.sleep(600)
+
+
+class TestBatchSimulation(unittest.TestCase):
+
+    def setUp(self):
+        self.simulation_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.simulation_path)
+
+    def create_settings(self, volume_name: str) -> Settings:
+        settings = Settings({
+            Tags.RANDOM_SEED: 4711,
+            Tags.VOLUME_NAME: volume_name,
+            Tags.SIMULATION_PATH: self.simulation_path,
+            Tags.SPACING_MM: 0.25,
+            Tags.DIM_VOLUME_Z_MM: 3,
+            Tags.DIM_VOLUME_X_MM: 4,
+            Tags.DIM_VOLUME_Y_MM: 4,
+            Tags.WAVELENGTHS: [800]
+        })
+        settings.set_volume_creation_settings({
+            Tags.STRUCTURES: create_test_structure_parameters()
+        })
+        settings.set_optical_settings({
+            Tags.OPTICAL_MODEL: Tags.OPTICAL_MODEL_TEST,
+            Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE: 50
+        })
+        return settings
+
+    def create_jobs(self, volume_names: list, failing_job_index: int = None):
+        for job_index, volume_name in enumerate(volume_names):
+            settings = self.create_settings(volume_name)
+            simulation_pipeline = [
+                ModelBasedVolumeCreationAdapter(settings),
+                OpticalForwardModelTestAdapter(settings)
+            ]
+            if job_index == failing_job_index:
+                simulation_pipeline.append(FailingSimulationModule(settings))
+            yield settings, simulation_pipeline, RSOMExplorerP50(0.1, 1, 1)
+
+    def test_batch_simulation(self):
+        report = simulate_batch(self.create_jobs(["Phantom", "Phantom", "Phantom"], failing_job_index=1),
+                                number_of_workers=2, max_retries=1)
+
+        self.assertEqual([result.success for result in report.job_results], [True, False, True])
+        self.assertEqual([result.attempts for result in report.job_results], [1, 2, 1])
+        self.assertIn("Simulation failed", report.job_results[1].error)
+        self.assertEqual(len(report.successful_jobs), 2)
+        self.assertGreater(report.jobs_per_hour, 0)
+        self.assertEqual(set(report.stage_times_seconds.keys()),
+                         {"ModelBasedVolumeCreationAdapter", "OpticalForwardModelTestAdapter"})
+
+        # The jobs share the volume name, but are written into different files
+        output_paths = [result.output_path for result in report.job_results]
+        self.assertEqual(len(set(output_paths)), 3)
+        for result in report.successful_jobs:
+            self.assertIsNotNone(load_data_field(result.output_path, Tags.DATA_FIELD_INITIAL_PRESSURE, 800))
+
+    def test_batch_simulation_with_conflicting_output_names(self):
+        jobs = list(self.create_jobs(["Phantom", "Phantom", "Other"]))
+        for job_settings, _, _ in jobs[:2]:
+            job_settings[Tags.SIMPA_OUTPUT_NAME] = "Phantom"
+        report = simulate_batch(jobs, number_of_workers=2)
+
+        # The conflicting job in the middle of the batch fails without affecting the other jobs
+        self.assertEqual([result.success for result in report.job_results], [True, False, True])
+        self.assertEqual([result.attempts for result in report.job_results], [1, 0, 1])
+        self.assertIn("overwrite", report.job_results[1].error)
+        self.assertEqual(report.job_results[0].output_path, report.job_results[1].output_path)
+        for result in report.successful_jobs:
+            self.assertIsNotNone(load_data_field(result.output_path, Tags.DATA_FIELD_INITIAL_PRESSURE, 800))
+
+    def test_batch_simulation_does_not_modify_settings_or_overwrite_existing_files(self):
+        jobs = list(self.create_jobs(["Phantom"]))
+        report = simulate_batch(jobs, number_of_workers=1)
+        self.assertTrue(report.job_results[0].success)
+        self.assertNotIn(Tags.SIMPA_OUTPUT_NAME, jobs[0][0])
+        self.assertNotIn(Tags.SIMPA_OUTPUT_PATH, jobs[0][0])
+
+        # A second batch with the same volume names would write into the output file of the first batch
+        report = simulate_batch(self.create_jobs(["Phantom", "Other"]), number_of_workers=1)
+        self.assertEqual([result.success for result in report.job_results], [False, True])
+        self.assertEqual([result.attempts for result in report.job_results], [0, 1])
+        self.assertIn("existing output file", report.job_results[0].error)
+
+    def test_batch_simulation_timeout(self):
+        settings = self.create_settings("Phantom")
+        start_time = time.time()
+        report = simulate_batch([(settings, [SleepingSimulationModule(settings)], RSOMExplorerP50(0.1, 1, 1))],
+                                number_of_workers=1, timeout_seconds=1)
+        self.assertLess(time.time() - start_time, 60)
+        self.assertFalse(report.job_results[0].success)
+        self.assertIn("timeout", report.job_results[0].error)
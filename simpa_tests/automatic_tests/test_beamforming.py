@@ -0,0 +1,501 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_and_sum_sums, \
+    compute_delay_and_sum_values, compute_image_dimensions, compute_sum_of_pairwise_products, \
+    DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT, DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS, \
+    DELAY_AND_SUM_TERM_SQUARED_SUM, get_sensor_orientations, compute_receive_aperture_for_tile, \
+    compute_delay_table_for_tile, compute_time_gate, compute_delay_and_sum_time_gate
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_multi_beamformer_adapter import \
+    compute_coherence_factor
+from simpa.core.simulation_modules.reconstruction_module.delay_table_cache import DelayTable, \
+    DelayTableCache, delay_table_cache, DEFAULT_DELAY_TABLE_CACHE_SIZE_BYTES
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter import \
+    DelayAndSumAdapter
+from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
+from simpa.core.simulation_modules.reconstruction_module.travel_time_maps import SpeedOfSoundMap, TravelTimeMaps
+from simpa.core.device_digital_twins import LinearArrayDetectionGeometry
+from simpa import reconstruct_delay_and_sum_pytorch, reconstruct_delay_multiply_and_sum_pytorch, \
+    reconstruct_signed_delay_multiply_and_sum_pytorch, reconstruct_fk_migration_pytorch, PyTorchTimeReversalAdapter, \
+    reconstruct_multiple_beamformers_pytorch
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_time_reversal_pytorch_adapter import \
+    simulate_kspace_first_order
+from simpa.core.device_digital_twins import CurvedArrayDetectionGeometry
+from simpa.io_handling import save_data_field, load_data_field
+from simpa.utils.settings import Settings
+from simpa.utils.tags import Tags
+from simpa.log import Logger
+import unittest
+from unittest import mock
+import os
+import shutil
+import tempfile
+import numpy as np
+import torch
+
+
+def compute_sum_of_pairwise_products_quadratic(values: torch.tensor) -> torch.tensor:
+    """
+    The former O(N^2) implementation of the (signed) Delay Multiply and Sum term, which serves as reference.
+    """
+    products = values[..., :, None] * values[..., None, :]
+    products = torch.sign(products) * torch.sqrt(torch.abs(products))
+    return torch.triu(products, diagonal=1).sum(dim=(-1, -2))
+
+
+class TestBeamforming(unittest.TestCase):
+
+    def setUp(self):
+        self.detection_geometry = LinearArrayDetectionGeometry(
+            pitch_mm=0.3, number_detector_elements=16, device_position_mm=np.array([0, 0, 0]),
+            field_of_view_extent_mm=np.array([-2.4, 2.4, 0, 0, 0, 5]))
+        self.spacing_in_mm = 0.2
+        self.speed_of_sound_in_m_per_s = 1540
+        self.time_spacing_in_ms = 2.5e-5
+        rng = np.random.default_rng(4711)
+        self.time_series_sensor_data = torch.from_numpy(rng.normal(size=(16, 300)).astype(np.float32))
+        self.sensor_positions = torch.from_numpy(self.detection_geometry.get_detector_element_positions_base_mm())
+        self.sensor_positions[:, 1] = 0
+        self.image_dimensions = compute_image_dimensions(self.detection_geometry, self.spacing_in_mm, Logger())
+
+    def compute_sums(self, component_settings: Settings, terms: tuple, sensor_orientations: torch.tensor = None,
+                     speed_of_sound_map: SpeedOfSoundMap = None) -> dict:
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = self.image_dimensions
+        sums, _ = compute_delay_and_sum_sums(self.time_series_sensor_data, self.sensor_positions, xdim, ydim, zdim,
+                                             xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end,
+                                             self.spacing_in_mm, self.speed_of_sound_in_m_per_s,
+                                             self.time_spacing_in_ms, Logger(), torch.device("cpu"),
+                                             component_settings, terms, sensor_orientations, speed_of_sound_map)
+        return sums
+
+    def test_tiled_delay_and_sum_yields_same_sums_as_full_computation(self):
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = self.image_dimensions
+        component_settings = Settings({Tags.RECONSTRUCTION_APODIZATION_METHOD: Tags.RECONSTRUCTION_APODIZATION_HANN})
+        values, _ = compute_delay_and_sum_values(self.time_series_sensor_data, self.sensor_positions, xdim, ydim,
+                                                 zdim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start,
+                                                 zdim_end, self.spacing_in_mm, self.speed_of_sound_in_m_per_s,
+                                                 self.time_spacing_in_ms, Logger(), torch.device("cpu"),
+                                                 component_settings)
+
+        # A memory budget that is far smaller than the image enforces tiles of a few pixels
+        component_settings[Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES] = 50000
+        sums = self.compute_sums(component_settings, (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT))
+
+        self.assertEqual(sums[DELAY_AND_SUM_TERM_SUM].shape, (xdim, ydim, zdim))
+        torch.testing.assert_close(sums[DELAY_AND_SUM_TERM_SUM], torch.sum(values, dim=3))
+        torch.testing.assert_close(sums[DELAY_AND_SUM_TERM_COUNT], torch.count_nonzero(values, dim=3))
+
+    def test_delay_and_sum_sums_do_not_depend_on_memory_budget(self):
+        terms = (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT, DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS)
+        sums = self.compute_sums(Settings(), terms)
+        tiled_sums = self.compute_sums(Settings({Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES: 100000}), terms)
+        for term in terms:
+            torch.testing.assert_close(tiled_sums[term], sums[term])
+
+    def test_sum_of_pairwise_products_matches_quadratic_implementation(self):
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = self.image_dimensions
+        values, n_sensor_elements = compute_delay_and_sum_values(
+            self.time_series_sensor_data, self.sensor_positions, xdim, ydim, zdim, xdim_start, xdim_end, ydim_start,
+            ydim_end, zdim_start, zdim_end, self.spacing_in_mm, self.speed_of_sound_in_m_per_s,
+            self.time_spacing_in_ms, Logger(), torch.device("cpu"), Settings())
+        values = values.reshape(-1, n_sensor_elements)
+        expected = compute_sum_of_pairwise_products_quadratic(values.double())
+
+        sums = compute_sum_of_pairwise_products(values)
+        self.assertEqual(sums.dtype, values.dtype)
+        torch.testing.assert_close(sums.double(), expected, rtol=1e-5, atol=1e-5)
+
+        pairwise_sums = self.compute_sums(Settings(), (DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS,))
+        torch.testing.assert_close(pairwise_sums[DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS].double(),
+                                   expected.reshape(xdim, ydim, zdim), rtol=1e-5, atol=1e-5)
+
+    def test_delay_table_is_cached(self):
+        terms = (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT)
+        delay_table_cache.clear()
+        uncached_sums = self.compute_sums(Settings({Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES: 0}), terms)
+        self.assertEqual(len(delay_table_cache.tables), 0)
+
+        # The size of the cache is independent of the memory budget of the reconstruction
+        self.compute_sums(Settings({Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES: 50000}), terms)
+        self.assertEqual(len(delay_table_cache.tables), 1)
+        delay_table_cache.clear()
+        # and large enough for the dense delay table of typical arrays and image grids
+        self.assertLessEqual(DelayTable.get_dense_size_bytes(400 * 400, 256, 4096),
+                             DEFAULT_DELAY_TABLE_CACHE_SIZE_BYTES)
+
+        cache_directory = tempfile.mkdtemp()
+        try:
+            component_settings = Settings({
+                Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES: 10 ** 8,
+                Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_PATH: cache_directory
+            })
+            sums = self.compute_sums(component_settings, terms)
+            self.assertEqual(len(delay_table_cache.tables), 1)
+            delay_table = list(delay_table_cache.tables.values())[0]
+            self.assertGreater(delay_table.nbytes, 50000)
+            self.assertEqual(delay_table.nbytes, DelayTable.get_dense_size_bytes(
+                delay_table.lower_indices.shape[0], *self.time_series_sensor_data.shape))
+            self.assertEqual(delay_table.lower_indices.dtype, torch.int32)
+            self.assertEqual(delay_table.lower_weights.dtype, torch.float32)
+            self.assertEqual(delay_table.lower_weights.device, torch.device("cpu"))
+
+            # Other time series data with the same geometry and sampling reuse the delay table
+            self.time_series_sensor_data = self.time_series_sensor_data * 2
+            doubled_sums = self.compute_sums(component_settings, terms)
+            self.assertEqual(len(delay_table_cache.tables), 1)
+            self.assertIs(list(delay_table_cache.tables.values())[0], delay_table)
+            torch.testing.assert_close(doubled_sums[DELAY_AND_SUM_TERM_SUM], 2 * sums[DELAY_AND_SUM_TERM_SUM])
+
+            # The delay table is persisted on disk
+            key = list(delay_table_cache.tables.keys())[0]
+            loaded_delay_table = DelayTableCache().get(key, cache_directory)
+            torch.testing.assert_close(loaded_delay_table.lower_weights, delay_table.lower_weights)
+            torch.testing.assert_close(loaded_delay_table.upper_indices, delay_table.upper_indices)
+        finally:
+            shutil.rmtree(cache_directory)
+            delay_table_cache.clear()
+
+        for term in terms:
+            torch.testing.assert_close(sums[term], uncached_sums[term], rtol=0, atol=0)
+
+    def test_receive_aperture_skips_pairs_outside_of_aperture(self):
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = self.image_dimensions
+        terms = (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT, DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS,
+                 DELAY_AND_SUM_TERM_SQUARED_SUM)
+        sensor_orientations = get_sensor_orientations(self.detection_geometry, torch.device("cpu"))
+        component_settings = Settings({Tags.RECONSTRUCTION_F_NUMBER: 1.0,
+                                       Tags.RECONSTRUCTION_APODIZATION_METHOD: Tags.RECONSTRUCTION_APODIZATION_HANN})
+        self.assertRaises(ValueError, self.compute_sums, component_settings, terms)
+
+        # The sums equal the sums of the delayed values of all pairs that are masked by the aperture
+        values, n_sensor_elements = compute_delay_and_sum_values(
+            self.time_series_sensor_data, self.sensor_positions, xdim, ydim, zdim, xdim_start, xdim_end, ydim_start,
+            ydim_end, zdim_start, zdim_end, self.spacing_in_mm, self.speed_of_sound_in_m_per_s,
+            self.time_spacing_in_ms, Logger(), torch.device("cpu"), component_settings)
+        x = xdim_start + torch.arange(xdim, dtype=torch.float32) + (0.5 if xdim % 2 == 0 else 0)
+        y = ydim_start + torch.arange(ydim, dtype=torch.float32)
+        z = torch.arange(zdim, dtype=torch.float32)
+        mask, _ = compute_receive_aperture_for_tile(self.sensor_positions, sensor_orientations, x, y, z,
+                                                    torch.arange(xdim * ydim * zdim), self.spacing_in_mm,
+                                                    np.arctan(0.5))
+        self.assertGreater(torch.count_nonzero(~mask), mask.numel() // 4)
+        values = values * mask.reshape(values.shape)
+        expected_sums = {DELAY_AND_SUM_TERM_SUM: torch.sum(values, dim=-1),
+                         DELAY_AND_SUM_TERM_COUNT: torch.count_nonzero(values, dim=-1),
+                         DELAY_AND_SUM_TERM_PAIRWISE_PRODUCTS: compute_sum_of_pairwise_products(values),
+                         DELAY_AND_SUM_TERM_SQUARED_SUM: torch.sum(values ** 2, dim=-1)}
+
+        delay_table_cache.clear()
+        cache_directory = tempfile.mkdtemp()
+        try:
+            component_settings[Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_PATH] = cache_directory
+            cached_sums = self.compute_sums(component_settings, terms, sensor_orientations)
+            delay_table = list(delay_table_cache.tables.values())[0]
+            self.assertTrue(delay_table.is_sparse)
+            self.assertEqual(len(delay_table.lower_indices), torch.count_nonzero(mask))
+
+            # The sparse delay table is persisted on disk
+            key = list(delay_table_cache.tables.keys())[0]
+            loaded_delay_table = DelayTableCache().get(key, cache_directory)
+            torch.testing.assert_close(loaded_delay_table.pixel_offsets, delay_table.pixel_offsets)
+            torch.testing.assert_close(loaded_delay_table.sensor_indices, delay_table.sensor_indices)
+        finally:
+            shutil.rmtree(cache_directory)
+            delay_table_cache.clear()
+
+        component_settings = Settings({Tags.RECONSTRUCTION_F_NUMBER: 1.0,
+                                       Tags.RECONSTRUCTION_APODIZATION_METHOD: Tags.RECONSTRUCTION_APODIZATION_HANN,
+                                       Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES: 0,
+                                       Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES: 50000})
+        tiled_sums = self.compute_sums(component_settings, terms, sensor_orientations)
+        for term in terms:
+            torch.testing.assert_close(cached_sums[term], expected_sums[term])
+            torch.testing.assert_close(tiled_sums[term], expected_sums[term])
+
+        # An acceptance angle of 90 degrees does not limit the aperture
+        delay_table_cache.clear()
+        sums = self.compute_sums(Settings(), terms)
+        unlimited_sums = self.compute_sums(Settings({Tags.RECONSTRUCTION_MAX_ACCEPTANCE_ANGLE_DEG: 90}), terms,
+                                           sensor_orientations)
+        self.assertFalse(list(delay_table_cache.tables.values())[0].is_sparse)
+        delay_table_cache.clear()
+        for term in terms:
+            torch.testing.assert_close(unlimited_sums[term], sums[term])
+
+    def test_batched_reconstruction_matches_reconstruction_of_every_frame(self):
+        frames = np.random.default_rng(1234).normal(size=(3, 16, 300)).astype(np.float32)
+        for reconstruct in [reconstruct_delay_and_sum_pytorch, reconstruct_delay_multiply_and_sum_pytorch,
+                            reconstruct_signed_delay_multiply_and_sum_pytorch]:
+            for mode in [Tags.RECONSTRUCTION_MODE_PRESSURE, Tags.RECONSTRUCTION_MODE_DIFFERENTIAL]:
+                images = reconstruct(frames, self.detection_geometry, self.speed_of_sound_in_m_per_s, 2.5e-8,
+                                     self.spacing_in_mm, mode)
+                for frame, image in zip(frames, images):
+                    expected_image = reconstruct(frame, self.detection_geometry, self.speed_of_sound_in_m_per_s,
+                                                 2.5e-8, self.spacing_in_mm, mode)
+                    self.assertEqual(image.shape, expected_image.shape)
+                    np.testing.assert_allclose(image, expected_image, rtol=1e-5, atol=1e-6)
+
+        # A batch with a single frame keeps its batch dimension
+        images = reconstruct_delay_and_sum_pytorch(frames[:1], self.detection_geometry,
+                                                   self.speed_of_sound_in_m_per_s, 2.5e-8, self.spacing_in_mm)
+        self.assertEqual(images.shape[0], 1)
+        self.assertEqual(images.ndim, 3)
+
+    def test_fk_migration_reconstructs_point_sources(self):
+        detection_geometry = LinearArrayDetectionGeometry(
+            pitch_mm=0.3, number_detector_elements=64, device_position_mm=np.array([0, 0, 0]),
+            field_of_view_extent_mm=np.array([-9.6, 9.6, 0, 0, 0, 12]))
+        sensor_positions = detection_geometry.get_detector_element_positions_base_mm()
+        time_in_ms = np.arange(600) * 2.5e-5
+        sources_mm = [(2.0, 8.0), (-4.0, 5.0)]
+        time_series_sensor_data = np.zeros((64, 600))
+        for source_x, source_depth in sources_mm:
+            time_of_flight_in_ms = np.sqrt((sensor_positions[:, 0] - source_x) ** 2 + source_depth ** 2) / 1540
+            pulse = np.exp(-((time_in_ms[None, :] - time_of_flight_in_ms[:, None]) / 2e-5) ** 2 / 2)
+            time_series_sensor_data -= np.gradient(pulse, axis=1)
+
+        for interpolation_method in [Tags.RECONSTRUCTION_FK_INTERPOLATION_NEAREST,
+                                     Tags.RECONSTRUCTION_FK_INTERPOLATION_LINEAR]:
+            image = reconstruct_fk_migration_pytorch(time_series_sensor_data, detection_geometry, 1540, 2.5e-8, 0.1,
+                                                     interpolation_method=interpolation_method)
+            self.assertEqual(image.shape, (191, 120))
+            for source_x, source_depth in sources_mm:
+                x_index = int(round((source_x + 9.6) / 0.1 - 0.5))
+                depth_index = int(round(source_depth / 0.1))
+                neighbourhood = np.abs(image[x_index - 2:x_index + 3, depth_index - 2:depth_index + 3])
+                self.assertGreater(neighbourhood.max(), 0.5 * np.abs(image).max())
+
+        images = reconstruct_fk_migration_pytorch(np.stack([time_series_sensor_data, -time_series_sensor_data]),
+                                                  detection_geometry, 1540, 2.5e-8, 0.1)
+        np.testing.assert_allclose(images[0], image, rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(images[1], -image, rtol=1e-5, atol=1e-5)
+
+        curved_array = CurvedArrayDetectionGeometry(number_detector_elements=64)
+        self.assertRaises(AttributeError, reconstruct_fk_migration_pytorch, time_series_sensor_data, curved_array)
+
+    def test_pytorch_time_reversal_reconstructs_initial_pressure(self):
+        settings = Settings({
+            Tags.SPACING_MM: 0.1,
+            Tags.DIM_VOLUME_X_MM: 16,
+            Tags.DIM_VOLUME_Y_MM: 4,
+            Tags.DIM_VOLUME_Z_MM: 10,
+            Tags.GPU: False
+        })
+        settings.set_reconstruction_settings({
+            Tags.SENSOR_SAMPLING_RATE_MHZ: 40,
+            Tags.DATA_FIELD_SPEED_OF_SOUND: 1540,
+            Tags.KWAVE_PROPERTY_PMLSize: [10, 10]
+        })
+        detection_geometry = LinearArrayDetectionGeometry(
+            pitch_mm=0.2, number_detector_elements=64, device_position_mm=np.array([8, 2, 0]),
+            field_of_view_extent_mm=np.array([-6, 6, 0, 0, 0, 10]))
+        adapter = PyTorchTimeReversalAdapter(settings)
+        sensor_map, sensor_indices = adapter.create_sensor_map(detection_geometry, 0.1)
+        self.assertEqual(sensor_map.shape, (101, 161))
+        self.assertEqual(np.count_nonzero(sensor_map), 64)
+
+        # A disk at a depth of 6 mm and a lateral position of 9 mm on the (z, x) grid
+        z, x = np.meshgrid(np.arange(101), np.arange(161), indexing="ij")
+        initial_pressure = ((z - 61) ** 2 + (x - 91) ** 2 <= 9).astype(float)
+        _, time_series_sensor_data = simulate_kspace_first_order(sensor_map.shape, 1e-4, 2.5e-8, 600, sensor_indices,
+                                                                 initial_pressure=initial_pressure, pml_size=10)
+        self.assertGreater(np.abs(time_series_sensor_data).max(), 0)
+
+        image = adapter.reconstruction_algorithm(time_series_sensor_data, detection_geometry)
+        self.assertEqual(image.shape, (120, 100))
+        x_index, depth_index = np.unravel_index(np.argmax(image), image.shape)
+        self.assertLessEqual(abs(x_index - 71), 3)
+        self.assertLessEqual(abs(depth_index - 61), 5)
+
+    def test_multi_beamformer_matches_single_beamformers(self):
+        time_series_sensor_data = self.time_series_sensor_data.numpy()
+        images = reconstruct_multiple_beamformers_pytorch(time_series_sensor_data, self.detection_geometry,
+                                                          self.speed_of_sound_in_m_per_s, 2.5e-8,
+                                                          self.spacing_in_mm)
+        for data_field, reconstruct in [(Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS, reconstruct_delay_and_sum_pytorch),
+                                        (Tags.DATA_FIELD_RECONSTRUCTED_DATA_DMAS,
+                                         reconstruct_delay_multiply_and_sum_pytorch),
+                                        (Tags.DATA_FIELD_RECONSTRUCTED_DATA_SDMAS,
+                                         reconstruct_signed_delay_multiply_and_sum_pytorch)]:
+            expected_image = reconstruct(time_series_sensor_data, self.detection_geometry,
+                                         self.speed_of_sound_in_m_per_s, 2.5e-8, self.spacing_in_mm)
+            np.testing.assert_array_equal(images[data_field], expected_image)
+        np.testing.assert_array_equal(images[Tags.DATA_FIELD_RECONSTRUCTED_DATA],
+                                      images[Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS])
+
+        coherence_factor = images[Tags.DATA_FIELD_COHERENCE_FACTOR]
+        self.assertTrue(np.all(coherence_factor >= 0))
+        self.assertTrue(np.all(coherence_factor <= 1 + 1e-6))
+        np.testing.assert_allclose(images[Tags.DATA_FIELD_RECONSTRUCTED_DATA_CF_DAS],
+                                   coherence_factor * images[Tags.DATA_FIELD_RECONSTRUCTED_DATA_DAS],
+                                   rtol=1e-5, atol=1e-7)
+
+        sums = self.compute_sums(Settings(), (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT,
+                                              DELAY_AND_SUM_TERM_SQUARED_SUM))
+        coherence_factor = compute_coherence_factor(sums[DELAY_AND_SUM_TERM_SUM],
+                                                    sums[DELAY_AND_SUM_TERM_SQUARED_SUM],
+                                                    sums[DELAY_AND_SUM_TERM_COUNT])
+        self.assertTrue(torch.all(coherence_factor <= 1 + 1e-6))
+        # Pixels without contributions have a coherence factor of 0 and identical values a coherence factor of 1
+        self.assertEqual(float(compute_coherence_factor(torch.tensor([0.0]), torch.tensor([0.0]),
+                                                        torch.tensor([0]))), 0)
+        self.assertAlmostEqual(float(compute_coherence_factor(torch.tensor([4.0]), torch.tensor([4.0]),
+                                                              torch.tensor([4]))), 1)
+
+        images = reconstruct_multiple_beamformers_pytorch(
+            time_series_sensor_data, self.detection_geometry, self.speed_of_sound_in_m_per_s, 2.5e-8,
+            self.spacing_in_mm, beamformers=[Tags.DATA_FIELD_COHERENCE_FACTOR])
+        self.assertEqual(set(images.keys()), {Tags.DATA_FIELD_COHERENCE_FACTOR, Tags.DATA_FIELD_RECONSTRUCTED_DATA})
+        self.assertRaises(ValueError, reconstruct_multiple_beamformers_pytorch, time_series_sensor_data,
+                          self.detection_geometry, beamformers=["unknown"])
+
+    def test_travel_times_through_homogeneous_speed_of_sound_match_distances(self):
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = self.image_dimensions
+        x = xdim_start + torch.arange(xdim, dtype=torch.float32) + (0.5 if xdim % 2 == 0 else 0)
+        y = ydim_start + torch.arange(ydim, dtype=torch.float32)
+        z = torch.arange(zdim, dtype=torch.float32)
+        speed_of_sound_map = SpeedOfSoundMap(np.full((30, 5, 30), self.speed_of_sound_in_m_per_s), self.spacing_in_mm,
+                                             np.array([3, 0.5, 0]))
+        # A memory budget of a few sensor elements solves the travel times in several chunks
+        travel_time_maps = TravelTimeMaps(speed_of_sound_map, self.sensor_positions, x, y, z, self.spacing_in_mm,
+                                          self.time_spacing_in_ms / 20, 200000)
+        xx, yy = torch.meshgrid(x.double() * self.spacing_in_mm, y.double() * self.spacing_in_mm, indexing="ij")
+        distances = torch.sqrt((xx.reshape(-1, 1) - self.sensor_positions[:, 0][None, :]) ** 2 +
+                               (yy.reshape(-1, 1) - self.sensor_positions[:, 2][None, :]) ** 2)
+        errors = travel_time_maps.get_travel_times() - distances / self.speed_of_sound_in_m_per_s
+        self.assertLess(torch.max(torch.abs(errors)) / self.time_spacing_in_ms, 0.05)
+
+        # The delay tables of the travel times are cached per medium
+        terms = (DELAY_AND_SUM_TERM_SUM, DELAY_AND_SUM_TERM_COUNT)
+        delay_table_cache.clear()
+        sums = self.compute_sums(Settings(), terms, speed_of_sound_map=speed_of_sound_map)
+        self.assertEqual(len(delay_table_cache.tables), 1)
+        self.compute_sums(Settings(), terms)
+        self.assertEqual(len(delay_table_cache.tables), 2)
+        delay_table_cache.clear()
+        tiled_sums = self.compute_sums(Settings({Tags.RECONSTRUCTION_DELAY_TABLE_CACHE_SIZE_BYTES: 0,
+                                                 Tags.RECONSTRUCTION_MEMORY_BUDGET_BYTES: 50000}), terms,
+                                       speed_of_sound_map=speed_of_sound_map)
+        for term in terms:
+            torch.testing.assert_close(tiled_sums[term], sums[term])
+
+    def test_heterogeneous_speed_of_sound_focuses_point_source_below_layer(self):
+        # a slow layer below 1.9 mm, which is between the voxels at 1.8 and 2.0 mm
+        interface_depth_in_mm = 1.9
+        layer_speed_of_sound_in_m_per_s = 1300
+        speed_of_sound = np.full((30, 5, 30), self.speed_of_sound_in_m_per_s, dtype=np.float64)
+        speed_of_sound[:, :, 10:] = layer_speed_of_sound_in_m_per_s
+        speed_of_sound_map = SpeedOfSoundMap(speed_of_sound, self.spacing_in_mm, np.array([3, 0.5, 0]))
+
+        # the travel times of the refracted rays from the point source to the sensor elements by Fermat's principle
+        source_x_in_mm, source_depth_in_mm = 0.1, 3.6
+        interface_x_in_mm = np.linspace(-5, 5, 100001)[None, :]
+        sensor_x_in_mm = self.sensor_positions[:, 0].numpy()[:, None]
+        travel_times_in_ms = np.min(np.hypot(interface_x_in_mm - sensor_x_in_mm, interface_depth_in_mm) /
+                                    self.speed_of_sound_in_m_per_s +
+                                    np.hypot(source_x_in_mm - interface_x_in_mm,
+                                             source_depth_in_mm - interface_depth_in_mm) /
+                                    layer_speed_of_sound_in_m_per_s, axis=1)
+        time_steps = np.arange(300)[None, :]
+        self.time_series_sensor_data = torch.from_numpy(np.exp(-0.5 * ((time_steps - travel_times_in_ms[:, None] /
+                                                                         self.time_spacing_in_ms) / 3) ** 2))
+
+        terms = (DELAY_AND_SUM_TERM_SUM,)
+        image = self.compute_sums(Settings(), terms, speed_of_sound_map=speed_of_sound_map)[DELAY_AND_SUM_TERM_SUM]
+        self.assertEqual(np.unravel_index(torch.argmax(image).item(), image.shape), (12, 18, 0))
+        # assuming the speed of sound of the upper layer, the point source appears deeper
+        image = self.compute_sums(Settings(), terms)[DELAY_AND_SUM_TERM_SUM]
+        self.assertGreater(np.unravel_index(torch.argmax(image).item(), image.shape)[1], 18)
+
+    def test_time_gate_is_bounded_by_pixel_distances(self):
+        pixel_bounds_in_mm = np.array([[-1, 0, 3], [1, 0, 4]])
+        sensor_positions = np.array([[0, 0, 0], [-3, 0, 0]])
+        time_gate = compute_time_gate(sensor_positions, pixel_bounds_in_mm, 1500, 1500, 1e-4, 1000, 0)
+        # the closest pixel is 3 mm below the first and the farthest is 4 mm right of and 4 mm below the second sensor
+        self.assertEqual(time_gate, slice(20, int(np.ceil(np.hypot(4, 4) / 0.15)) + 2))
+        time_gate = compute_time_gate(sensor_positions, pixel_bounds_in_mm, 1000, 1500, 1e-4, 30, 5)
+        self.assertEqual(time_gate, slice(15, 30))
+        time_gate = compute_time_gate(sensor_positions + np.array([0, 0, 100]), pixel_bounds_in_mm, 1500, 1500,
+                                      1e-4, 30, 0)
+        self.assertEqual(time_gate, slice(29, 30))
+
+    def test_time_gated_reconstruction_matches_reconstruction_of_all_time_steps(self):
+        detection_geometry = LinearArrayDetectionGeometry(
+            pitch_mm=0.3, number_detector_elements=16, device_position_mm=np.array([0, 0, 0]),
+            field_of_view_extent_mm=np.array([-2.4, 2.4, 0, 0, 3, 5]), sampling_frequency_mhz=40)
+        for mode in [Tags.RECONSTRUCTION_MODE_PRESSURE, Tags.RECONSTRUCTION_MODE_DIFFERENTIAL]:
+            settings = create_reconstruction_settings(self.speed_of_sound_in_m_per_s, 2.5e-8, self.spacing_in_mm,
+                                                      mode)
+            adapter = DelayAndSumAdapter(settings)
+            time_gate = adapter.get_time_gate(300, detection_geometry)
+            self.assertGreater(time_gate.start, 0)
+            self.assertLess(time_gate.stop, 300)
+            image = adapter.reconstruction_algorithm(self.time_series_sensor_data.numpy(), detection_geometry)
+            gated_image = adapter.reconstruction_algorithm(self.time_series_sensor_data[:, time_gate].numpy(),
+                                                           detection_geometry, first_time_step=time_gate.start)
+            np.testing.assert_allclose(gated_image, image, rtol=1e-5, atol=1e-6)
+
+        # The speed of sound is only loaded once for the time gate and the reconstruction
+        with mock.patch("simpa.core.simulation_modules.reconstruction_module.reconstruction_utils."
+                        "get_reconstruction_speed_of_sound",
+                        return_value=self.speed_of_sound_in_m_per_s) as load_speed_of_sound:
+            adapter.speed_of_sound = None
+            time_gate = adapter.get_time_gate(300, detection_geometry)
+            adapter.reconstruction_algorithm(self.time_series_sensor_data[:, time_gate].numpy(), detection_geometry,
+                                             first_time_step=time_gate.start)
+        self.assertEqual(load_speed_of_sound.call_count, 1)
+
+        settings.get_reconstruction_settings()[Tags.RECONSTRUCTION_TIME_GATING] = False
+        self.assertIsNone(compute_delay_and_sum_time_gate(300, settings.get_reconstruction_settings(), settings,
+                                                          detection_geometry, Logger(),
+                                                          self.speed_of_sound_in_m_per_s))
+
+    def test_time_gated_reconstruction_with_bandpass_filtering_matches_reconstruction_of_all_time_steps(self):
+        detection_geometry = LinearArrayDetectionGeometry(
+            pitch_mm=0.3, number_detector_elements=16, device_position_mm=np.array([0, 0, 0]),
+            field_of_view_extent_mm=np.array([-2.4, 2.4, 0, 0, 3, 5]), sampling_frequency_mhz=40)
+        # Bipolar pulses of two point sources within the field of view on top of noise
+        n_time_steps = 1500
+        sensor_positions = detection_geometry.get_detector_element_positions_base_mm()[:, [0, 2]]
+        time_steps = np.arange(n_time_steps)
+        time_series_sensor_data = 0.05 * np.random.default_rng(4711).normal(size=(16, n_time_steps))
+        for source_position in [np.array([0.5, 4.0]), np.array([-1.0, 3.5])]:
+            arrival_time_steps = np.linalg.norm(sensor_positions - source_position, axis=1) / 1.54 / 2.5e-2
+            pulse_time = (time_steps[None, :] - arrival_time_steps[:, None]) / 3
+            time_series_sensor_data -= pulse_time * np.exp(-pulse_time ** 2 / 2)
+
+        # The Butterworth filter is causal and the margin of the time gate covers its transient response. The Tukey
+        # filter is applied in the Fourier domain, where the cutoff frequencies are rounded to the frequency
+        # resolution of the cropped time series data, such that its result deviates by a few percent.
+        relative_tolerances = {Tags.BUTTERWORTH_BANDPASS_FILTER: 1e-5, Tags.TUKEY_BANDPASS_FILTER: 0.1}
+        simulation_path = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(simulation_path, "time_gating.hdf5")
+            for bandpass_filter, relative_tolerance in relative_tolerances.items():
+                images = []
+                for time_gating in [False, True]:
+                    save_data_field(time_series_sensor_data, file_path, Tags.DATA_FIELD_TIME_SERIES_DATA, 800)
+                    settings = create_reconstruction_settings(self.speed_of_sound_in_m_per_s, 2.5e-8,
+                                                              self.spacing_in_mm)
+                    settings[Tags.SIMPA_OUTPUT_PATH] = file_path
+                    settings[Tags.WAVELENGTH] = 800
+                    settings.get_reconstruction_settings().update({
+                        Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING: True,
+                        Tags.BANDPASS_FILTER_METHOD: bandpass_filter,
+                        Tags.BANDPASS_CUTOFF_HIGHPASS_IN_HZ: int(1e6),
+                        Tags.BANDPASS_CUTOFF_LOWPASS_IN_HZ: int(8e6),
+                        Tags.RECONSTRUCTION_TIME_GATING: time_gating
+                    })
+                    adapter = DelayAndSumAdapter(settings)
+                    if time_gating:
+                        self.assertLess(adapter.get_time_gate(n_time_steps, detection_geometry).stop,
+                                        n_time_steps / 4)
+                    adapter.run(detection_geometry)
+                    images.append(load_data_field(file_path, Tags.DATA_FIELD_RECONSTRUCTED_DATA, 800))
+                image, gated_image = images
+                self.assertLess(np.linalg.norm(gated_image - image) / np.linalg.norm(image), relative_tolerance,
+                                msg=bandpass_filter)
+                self.assertEqual(np.argmax(gated_image), np.argmax(image), msg=bandpass_filter)
+        finally:
+            shutil.rmtree(simulation_path)
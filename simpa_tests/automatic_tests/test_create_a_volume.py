@@ -10,6 +10,7 @@ import os
 from simpa_tests.test_utils import create_test_structure_parameters
 from simpa import ModelBasedVolumeCreationAdapter
 from simpa.core.device_digital_twins import RSOMExplorerP50
+import numpy as np
 
 
 class TestCreateVolume(unittest.TestCase):
@@ -40,3 +41,39 @@ class TestCreateVolume(unittest.TestCase):
         if (os.path.exists(settings[Tags.SIMPA_OUTPUT_PATH]) and
            os.path.isfile(settings[Tags.SIMPA_OUTPUT_PATH])):
             os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+    def test_geometry_of_the_structures_is_reused_for_all_wavelengths(self):
+        settings = Settings({
+            Tags.WAVELENGTHS: [700, 800],
+            Tags.RANDOM_SEED: 4711,
+            Tags.SPACING_MM: 0.3,
+            Tags.DIM_VOLUME_Z_MM: 5,
+            Tags.DIM_VOLUME_X_MM: 4,
+            Tags.DIM_VOLUME_Y_MM: 3
+        })
+        settings.set_volume_creation_settings({Tags.STRUCTURES: create_test_structure_parameters()})
+        adapter = ModelBasedVolumeCreationAdapter(settings)
+        volumes = dict()
+        structure_fractions = dict()
+        for wavelength in settings[Tags.WAVELENGTHS]:
+            settings[Tags.WAVELENGTH] = wavelength
+            np.random.seed(settings[Tags.RANDOM_SEED])
+            volumes[wavelength] = adapter.create_simulation_volume()
+            structure_fractions[wavelength] = adapter.structure_fractions
+        self.assertIs(structure_fractions[800], structure_fractions[700])
+        self.assertEqual(len(structure_fractions[700].property_table), 2)
+
+        # a new geometry pass for the second wavelength yields the same volumes
+        adapter = ModelBasedVolumeCreationAdapter(settings)
+        np.random.seed(settings[Tags.RANDOM_SEED])
+        expected_volumes = adapter.create_simulation_volume()
+        self.assertEqual(volumes[800].keys(), expected_volumes.keys())
+        for key in expected_volumes.keys():
+            np.testing.assert_array_equal(volumes[800][key], expected_volumes[key])
+        self.assertFalse(np.array_equal(volumes[800][Tags.DATA_FIELD_ABSORPTION_PER_CM],
+                                        volumes[700][Tags.DATA_FIELD_ABSORPTION_PER_CM]))
+
+        # the geometry pass is repeated if the structures change
+        settings.get_volume_creation_settings()[Tags.STRUCTURES]["vessel"][Tags.STRUCTURE_RADIUS_MM] = 0.4
+        adapter.create_simulation_volume()
+        self.assertIsNot(adapter.structure_fractions, structure_fractions[800])
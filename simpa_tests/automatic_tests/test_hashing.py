@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import functools
+import threading
+import types
+import unittest
+
+import numpy as np
+
+from simpa.utils.hashing import compute_hash, UnhashableItemError
+
+
+class Configuration:
+    def __init__(self, value, array):
+        self.value = value
+        self.array = array
+
+
+class TestHashing(unittest.TestCase):
+
+    def test_hash_depends_on_content_only(self):
+        self.assertEqual(compute_hash({"a": 1, "b": [2.0, "c"]}), compute_hash({"b": [2.0, "c"], "a": np.int64(1)}))
+        self.assertNotEqual(compute_hash({"a": 1}), compute_hash({"a": 2}))
+
+    def test_objects_are_hashed_by_their_attributes(self):
+        first = Configuration(1, np.zeros(3))
+        self.assertEqual(compute_hash(first), compute_hash(Configuration(1, np.zeros(3))))
+        self.assertNotEqual(compute_hash(first), compute_hash(Configuration(2, np.zeros(3))))
+        self.assertNotEqual(compute_hash(first), compute_hash(Configuration(1, np.ones(3))))
+
+    def test_functions_are_hashed_by_their_code(self):
+        def scale(factor):
+            return lambda x: factor * x
+
+        self.assertEqual(compute_hash(scale(2)), compute_hash(scale(2)))
+        self.assertNotEqual(compute_hash(scale(2)), compute_hash(scale(3)))
+        self.assertNotEqual(compute_hash(lambda x: np.sin(x)), compute_hash(lambda x: np.cos(x)))
+        self.assertNotEqual(compute_hash(lambda x: x + 1), compute_hash(lambda x: x + 2))
+        self.assertNotEqual(compute_hash(functools.partial(np.add, 1)), compute_hash(functools.partial(np.add, 2)))
+
+        def offset(x, value=1):
+            return x + value
+
+        other_offset = types.FunctionType(offset.__code__, offset.__globals__, offset.__name__, (2,))
+        self.assertNotEqual(compute_hash(offset), compute_hash(other_offset))
+
+    def test_bytes_and_strings_have_different_hashes(self):
+        self.assertNotEqual(compute_hash(b"abc"), compute_hash("abc"))
+        self.assertNotEqual(compute_hash(["ab", "c"]), compute_hash(["a", "bc"]))
+
+    def test_objects_that_cannot_be_hashed_raise_type_error(self):
+        configuration = Configuration(1, None)
+        configuration.array = configuration
+        self.assertRaises(UnhashableItemError, compute_hash, configuration)
+        self.assertRaises(TypeError, compute_hash, threading.Lock())
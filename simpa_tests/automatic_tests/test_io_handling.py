@@ -3,14 +3,24 @@
 # SPDX-License-Identifier: MIT
 
 import unittest
+import contextlib
+from unittest import mock
 from simpa.io_handling import load_hdf5
 from simpa.io_handling import save_hdf5
+from simpa.io_handling import load_data_field, save_data_field
+from simpa.io_handling import in_memory_data_store
+from simpa.io_handling import delete_hdf5_item, repack_hdf5
+from simpa.io_handling.io_hdf5 import get_unused_bytes
+from simpa.io_handling import LazyHDF5Dataset, SimpaOutputFile
+from simpa.io_handling.simpa_output_file import get_open_simpa_output_file
+from simpa.utils.dict_path_manager import generate_dict_path, get_data_field_from_simpa_output
 from simpa.utils import Tags
 from simpa.utils.settings import Settings
 from simpa.utils.libraries.tissue_library import TISSUE_LIBRARY, AbsorptionSpectrumLibrary
 from simpa_tests.test_utils import assert_equals_recursive
 from simpa.core.device_digital_twins import *
 import os
+import h5py
 import numpy as np
 
 
@@ -109,3 +119,193 @@ class TestIOHandling(unittest.TestCase):
         save_dictionary = Settings()
         save_dictionary[Tags.DIGITAL_DEVICE] = device
         self.assert_save_and_read_dictionaries_equal(save_dictionary)
+
+    def test_in_memory_data_store(self):
+        save_string = "test_in_memory.hdf5"
+        save_hdf5({Tags.SETTINGS: Settings({Tags.WAVELENGTHS: [700, 800]})}, save_string)
+        data = np.random.random((4, 5, 6))
+        try:
+            with in_memory_data_store(save_string) as data_store:
+                save_data_field(data, save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 700)
+                save_data_field(data * 2, save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)
+                np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 700),
+                                              data)
+                with h5py.File(save_string, "r") as h5file:
+                    self.assertNotIn(Tags.SIMULATIONS, h5file)
+
+                data_store.flush(asynchronous=True, evict_wavelength=700)
+                data_store.wait()
+                found, _ = data_store.get("/" + Tags.SIMULATIONS + "/" + Tags.SIMULATION_PROPERTIES + "/" +
+                                          Tags.DATA_FIELD_ABSORPTION_PER_CM + "/700")
+                self.assertFalse(found)
+                np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 700),
+                                              data)
+
+                save_data_field(data * 3, save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)
+
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800),
+                                          data * 3)
+            self.assertEqual([700, 800], list(load_hdf5(save_string)[Tags.SETTINGS][Tags.WAVELENGTHS]))
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_in_memory_data_store_waits_for_pending_flush_and_evicts_only_wavelength_fields(self):
+        save_string = "test_in_memory_queries.hdf5"
+        save_hdf5({Tags.SETTINGS: Settings({Tags.WAVELENGTHS: [700, 800]})}, save_string)
+        data = np.random.random((4, 5, 6))
+        data_path = generate_dict_path(Tags.DATA_FIELD_ABSORPTION_PER_CM, 700)
+        other_path = "/" + Tags.SIMULATIONS + "/700/" + Tags.DATA_FIELD_SEGMENTATION
+        try:
+            with SimpaOutputFile(save_string) as output_file, in_memory_data_store(save_string) as data_store:
+                output_file.save(data, data_path)
+                output_file.save(data, other_path)
+                data_store.flush(asynchronous=True, evict_wavelength=700)
+                with mock.patch.object(data_store, "wait", wraps=data_store.wait) as wait:
+                    self.assertFalse(output_file.contains("/" + Tags.SIMULATIONS + "/missing"))
+                    self.assertEqual(wait.call_count, 1)
+                    self.assertEqual(output_file.get_unused_bytes(), 0)
+                    self.assertEqual(wait.call_count, 2)
+                self.assertTrue(output_file.contains(data_path))
+                # Only the data fields of the wavelength are evicted, not every path that contains the wavelength
+                self.assertFalse(data_store.get(data_path)[0])
+                self.assertTrue(data_store.get(other_path)[0])
+                np.testing.assert_array_equal(output_file.load(data_path), data)
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_compressed_file_is_repacked_after_resized_overwrite(self):
+        save_string = "test_compression.hdf5"
+        settings = Settings({Tags.VOLUME_CREATION_MODEL_SETTINGS: Settings({
+            Tags.INPUT_SEGMENTATION_VOLUME: np.zeros((10, 10, 10))})})
+        save_hdf5({Tags.SETTINGS: settings}, save_string, file_compression="gzip")
+        try:
+            save_data_field(np.random.random((50, 50, 50)), save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)
+            with h5py.File(save_string, "r") as h5file:
+                dataset = h5file[generate_dict_path(Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)]
+                self.assertEqual(dataset.compression, "gzip")
+                self.assertIsNotNone(dataset.chunks)
+            self.assertEqual(get_unused_bytes(save_string), 0)
+
+            # Overwriting a compressed dataset frees its storage, even if the shape is the same
+            with h5py.File(save_string, "r") as h5file:
+                storage_size = h5file[generate_dict_path(Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)].id.get_storage_size()
+            save_data_field(np.random.random((50, 50, 50)), save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)
+            self.assertEqual(get_unused_bytes(save_string), storage_size)
+
+            data = np.random.random((20, 20, 20))
+            save_data_field(data, save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)
+            self.assertTrue(delete_hdf5_item(save_string, "/" + Tags.SETTINGS + "/" +
+                                             Tags.VOLUME_CREATION_MODEL_SETTINGS[0] + "/" +
+                                             Tags.INPUT_SEGMENTATION_VOLUME[0]))
+            self.assertGreater(get_unused_bytes(save_string), 0)
+
+            file_size = os.path.getsize(save_string)
+            repack_hdf5(save_string)
+            self.assertLess(os.path.getsize(save_string), file_size)
+            self.assertEqual(get_unused_bytes(save_string), 0)
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800), data)
+            self.assertNotIn(Tags.INPUT_SEGMENTATION_VOLUME,
+                             load_hdf5(save_string)[Tags.SETTINGS][Tags.VOLUME_CREATION_MODEL_SETTINGS])
+            with h5py.File(save_string, "r") as h5file:
+                self.assertEqual(h5file[generate_dict_path(Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)].compression,
+                                 "gzip")
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_uncompressed_overwrite_reuses_storage(self):
+        save_string = "test_uncompressed_overwrite.hdf5"
+        save_hdf5({Tags.SETTINGS: Settings({Tags.VOLUME_NAME: "overwrite"})}, save_string)
+        try:
+            save_data_field(np.random.random((50, 50, 50)), save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)
+            file_size = os.path.getsize(save_string)
+            data = np.random.random((50, 50, 50))
+            save_data_field(data, save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800)
+            self.assertEqual(get_unused_bytes(save_string), 0)
+            self.assertEqual(os.path.getsize(save_string), file_size)
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800), data)
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_lazy_loading(self):
+        save_string = "test_lazy_loading.hdf5"
+        settings = Settings({Tags.VOLUME_NAME: "lazy", Tags.SPACING_MM: 0.5})
+        save_hdf5({Tags.SETTINGS: settings}, save_string)
+        data = np.random.random((10, 20, 30))
+        save_data_field(data, save_string, Tags.DATA_FIELD_RECONSTRUCTED_DATA, 800)
+        save_data_field(5.0, save_string, Tags.DATA_FIELD_GRUNEISEN_PARAMETER)
+        try:
+            file = load_hdf5(save_string, lazy=True)
+            assert_equals_recursive(settings, file[Tags.SETTINGS])
+            self.assertEqual(get_data_field_from_simpa_output(file, Tags.DATA_FIELD_GRUNEISEN_PARAMETER), 5.0)
+
+            reconstruction = get_data_field_from_simpa_output(file, Tags.DATA_FIELD_RECONSTRUCTED_DATA, 800)
+            self.assertIsInstance(reconstruction, LazyHDF5Dataset)
+            self.assertEqual(np.shape(reconstruction), data.shape)
+            self.assertEqual(reconstruction.dtype, data.dtype)
+            np.testing.assert_array_equal(reconstruction[:, 10, :], data[:, 10, :])
+            np.testing.assert_array_equal(np.asarray(reconstruction), data)
+            np.testing.assert_array_equal(load_hdf5(save_string, generate_dict_path(
+                Tags.DATA_FIELD_RECONSTRUCTED_DATA, 800), lazy=True)[5], data[5])
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_load_and_save_data_field_with_index(self):
+        save_string = "test_index.hdf5"
+        save_hdf5({Tags.SETTINGS: Settings({Tags.VOLUME_NAME: "index"})}, save_string)
+        data = np.random.random((10, 20, 30))
+        try:
+            for use_data_store in [False, True]:
+                save_data_field(data, save_string, Tags.DATA_FIELD_SPEED_OF_SOUND)
+                with in_memory_data_store(save_string) if use_data_store else contextlib.nullcontext():
+                    np.testing.assert_array_equal(
+                        load_data_field(save_string, Tags.DATA_FIELD_SPEED_OF_SOUND, index=np.s_[:, 5, :]),
+                        data[:, 5, :])
+                    np.testing.assert_array_equal(
+                        load_data_field(save_string, Tags.DATA_FIELD_SPEED_OF_SOUND, index=np.s_[2:4, :, 10:20]),
+                        data[2:4, :, 10:20])
+
+                    save_data_field(np.zeros((10, 30)), save_string, Tags.DATA_FIELD_SPEED_OF_SOUND,
+                                    index=np.s_[:, 5, :])
+                    expected_data = np.copy(data)
+                    expected_data[:, 5, :] = 0
+                    np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_SPEED_OF_SOUND),
+                                                  expected_data)
+                np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_SPEED_OF_SOUND),
+                                              expected_data)
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_simpa_output_file_session(self):
+        save_string = "test_session.hdf5"
+        data = np.random.random((10, 20, 30))
+        try:
+            with SimpaOutputFile(save_string, "w", chunk_cache_size_bytes=16 * 1024 ** 2) as output_file:
+                output_file.save({Tags.SETTINGS: Settings({Tags.VOLUME_NAME: "session"})}, file_compression="gzip")
+                self.assertIs(get_open_simpa_output_file(save_string), output_file)
+                with self.assertRaises(RuntimeError):
+                    SimpaOutputFile(save_string).open()
+
+                # The functional API uses the open session instead of opening the file again
+                with mock.patch("h5py.File", side_effect=AssertionError("The file was opened again")):
+                    save_data_field(data, save_string, Tags.DATA_FIELD_SPEED_OF_SOUND)
+                    np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_SPEED_OF_SOUND,
+                                                                  index=np.s_[:, 3, :]), data[:, 3, :])
+                    np.testing.assert_array_equal(output_file.load_data_field(Tags.DATA_FIELD_SPEED_OF_SOUND), data)
+                    self.assertEqual(load_hdf5(save_string)[Tags.SETTINGS][Tags.VOLUME_NAME], "session")
+            self.assertIsNone(get_open_simpa_output_file(save_string))
+
+            with self.assertRaises(ValueError):
+                SimpaOutputFile(save_string, "a", swmr=True)
+            with h5py.File(save_string, "r") as h5file:
+                self.assertEqual(h5file[generate_dict_path(Tags.DATA_FIELD_SPEED_OF_SOUND)].compression, "gzip")
+            with SimpaOutputFile(save_string, "r", swmr=True) as output_file:
+                np.testing.assert_array_equal(output_file.load_data_field(Tags.DATA_FIELD_SPEED_OF_SOUND), data)
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
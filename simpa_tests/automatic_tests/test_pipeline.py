@@ -7,14 +7,74 @@ from simpa.utils import Tags
 from simpa.utils.settings import Settings
 from simpa.core.simulation import simulate
 import numpy as np
-from simpa_tests.test_utils import create_test_structure_parameters
+from simpa_tests.test_utils import create_test_structure_parameters, create_vessel_tree
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 from simpa import ModelBasedVolumeCreationAdapter
 from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_test_adapter import \
     OpticalForwardModelTestAdapter
 from simpa.core.simulation_modules.acoustic_forward_module.acoustic_forward_model_test_adapter import \
     AcousticForwardModelTestAdapter
 from simpa.core.device_digital_twins import RSOMExplorerP50
+from simpa.io_handling import load_data_field, load_hdf5
+from simpa.core.module_output_cache import ModuleOutputCache
+from simpa.core.pipeline_instrumentation import INSTRUMENTATION_GROUP
+from simpa.core.pipeline_checkpoints import CHECKPOINTS_GROUP
+
+
+class InterruptibleAcousticForwardModelTestAdapter(AcousticForwardModelTestAdapter):
+    """
+    Counts its runs and fails at the given wavelength to simulate an interrupted simulation.
+    """
+
+    def __init__(self, global_settings, interrupt_at_wavelength=None):
+        super(InterruptibleAcousticForwardModelTestAdapter, self).__init__(global_settings)
+        self.interrupt_at_wavelength = interrupt_at_wavelength
+        self.number_of_runs = 0
+
+    def run(self, digital_device_twin):
+        if self.global_settings[Tags.WAVELENGTH] == self.interrupt_at_wavelength:
+            raise RuntimeError("Simulation interrupted")
+        self.number_of_runs += 1
+        super(InterruptibleAcousticForwardModelTestAdapter, self).run(digital_device_twin)
+
+
+class UnhashablePipelineElement:
+    """
+    Pipeline element whose component settings cannot be hashed.
+    """
+
+    def __init__(self, global_settings):
+        self.global_settings = global_settings
+        self.component_settings = {"lock": threading.Lock()}
+        self.number_of_runs = 0
+
+    def run(self, digital_device_twin):
+        self.number_of_runs += 1
+
+
+class OutputFileReader:
+    """
+    Reads the output file in a separate process while the simulation is running.
+    """
+
+    def __init__(self, global_settings):
+        self.global_settings = global_settings
+        self.file_keys = []
+
+    def run(self, digital_device_twin):
+        script = ("import sys, h5py\n"
+                  "with h5py.File(sys.argv[1], 'r') as h5file:\n"
+                  "    print(list(h5file.keys()))\n")
+        result = subprocess.run([sys.executable, "-c", script, self.global_settings[Tags.SIMPA_OUTPUT_PATH]],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr)
+        self.file_keys.append(result.stdout.strip())
 
 
 class TestPipeline(unittest.TestCase):
@@ -83,3 +143,259 @@ class TestPipeline(unittest.TestCase):
                 os.path.isfile(settings[Tags.SIMPA_OUTPUT_PATH])):
             # Delete the created file
             os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+    def create_multi_wavelength_settings(self, volume_name: str, wavelengths: list, additional_settings: dict,
+                                         random_structures: bool = False) -> Settings:
+        np.random.seed(self.RANDOM_SEED)
+        settings = Settings({
+            Tags.RANDOM_SEED: self.RANDOM_SEED,
+            Tags.VOLUME_NAME: volume_name,
+            Tags.SIMULATION_PATH: ".",
+            Tags.SPACING_MM: self.SPACING,
+            Tags.DIM_VOLUME_Z_MM: self.VOLUME_HEIGHT_IN_MM,
+            Tags.DIM_VOLUME_X_MM: self.VOLUME_WIDTH_IN_MM,
+            Tags.DIM_VOLUME_Y_MM: self.VOLUME_WIDTH_IN_MM,
+            Tags.WAVELENGTHS: wavelengths
+        })
+        for key, value in additional_settings.items():
+            settings[key] = value
+        structures = create_test_structure_parameters()
+        if random_structures:
+            structures["vessel_tree"] = create_vessel_tree()
+        settings.set_volume_creation_settings({
+            Tags.STRUCTURES: structures
+        })
+        settings.set_optical_settings({
+            Tags.OPTICAL_MODEL: Tags.OPTICAL_MODEL_TEST,
+            Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE: 50
+        })
+        settings.set_acoustic_settings({})
+        return settings
+
+    def load_multi_wavelength_results(self, settings: Settings, wavelengths: list) -> dict:
+        file_path = settings[Tags.SIMPA_OUTPUT_PATH]
+        results = {
+            Tags.DATA_FIELD_SPEED_OF_SOUND: load_data_field(file_path, Tags.DATA_FIELD_SPEED_OF_SOUND),
+            Tags.DATA_FIELD_SEGMENTATION: load_data_field(file_path, Tags.DATA_FIELD_SEGMENTATION)
+        }
+        for wavelength in wavelengths:
+            for data_field in [Tags.DATA_FIELD_ABSORPTION_PER_CM, Tags.DATA_FIELD_INITIAL_PRESSURE,
+                               Tags.DATA_FIELD_TIME_SERIES_DATA]:
+                results[(data_field, wavelength)] = load_data_field(file_path, data_field, wavelength)
+        self.assertEqual(settings[Tags.WAVELENGTH], wavelengths[-1])
+        os.remove(file_path)
+        return results
+
+    def run_multi_wavelength_pipeline(self, volume_name: str, wavelengths: list, additional_settings: dict,
+                                      random_structures: bool = False) -> dict:
+        settings = self.create_multi_wavelength_settings(volume_name, wavelengths, additional_settings,
+                                                         random_structures)
+        simulation_pipeline = [
+            ModelBasedVolumeCreationAdapter(settings),
+            OpticalForwardModelTestAdapter(settings),
+            AcousticForwardModelTestAdapter(settings),
+        ]
+        simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+        return self.load_multi_wavelength_results(settings, wavelengths)
+
+    def assert_results_equal(self, expected_results: dict, results: dict):
+        self.assertEqual(expected_results.keys(), results.keys())
+        for key in expected_results:
+            np.testing.assert_array_equal(expected_results[key], results[key], err_msg=str(key))
+
+    def test_parallel_pipeline_yields_same_results_as_serial_pipeline(self):
+        wavelengths = [700, 800, 900]
+        serial_results = self.run_multi_wavelength_pipeline("TestSerial", wavelengths, {})
+        parallel_results = self.run_multi_wavelength_pipeline("TestParallel", wavelengths, {
+            Tags.PARALLEL_WAVELENGTH_EXECUTION: True,
+            Tags.NUMBER_OF_PARALLEL_WORKERS: 2
+        })
+        for wavelength in wavelengths:
+            self.assertFalse(os.path.exists(f"TestParallel_wavelength_{wavelength}.hdf5"))
+        self.assert_results_equal(serial_results, parallel_results)
+
+    def test_reused_random_geometry_yields_same_results_as_new_geometry_pass(self):
+        # The vessel tree draws from the global random state, which the acoustic test adapter draws from as well
+        wavelengths = [700, 800]
+        serial_results = self.run_multi_wavelength_pipeline("TestSerialVesselTree", wavelengths, {},
+                                                            random_structures=True)
+        parallel_results = self.run_multi_wavelength_pipeline("TestParallelVesselTree", wavelengths, {
+            Tags.PARALLEL_WAVELENGTH_EXECUTION: True,
+            Tags.NUMBER_OF_PARALLEL_WORKERS: 2
+        }, random_structures=True)
+        self.assert_results_equal(serial_results, parallel_results)
+
+        # A simulation of the second wavelength only runs the geometry pass for it
+        single_wavelength_results = self.run_multi_wavelength_pipeline("TestSingleVesselTree", wavelengths[1:], {},
+                                                                       random_structures=True)
+        for key, value in single_wavelength_results.items():
+            np.testing.assert_array_equal(serial_results[key], value, err_msg=str(key))
+
+    def test_in_memory_data_store_yields_same_results_as_file_based_pipeline(self):
+        wavelengths = [700, 800, 900]
+        file_based_results = self.run_multi_wavelength_pipeline("TestFileBased", wavelengths, {})
+        in_memory_results = self.run_multi_wavelength_pipeline("TestInMemory", wavelengths, {
+            Tags.IN_MEMORY_DATA_STORE: True
+        })
+        self.assert_results_equal(file_based_results, in_memory_results)
+
+    def test_resumed_pipeline_skips_completed_modules(self):
+        wavelengths = [700, 800, 900]
+        expected_results = self.run_multi_wavelength_pipeline("TestNotResumed", wavelengths, {})
+
+        settings = self.create_multi_wavelength_settings("TestResumed", wavelengths, {
+            Tags.RESUME_SIMULATION: True
+        })
+        interrupted_pipeline = [
+            ModelBasedVolumeCreationAdapter(settings),
+            OpticalForwardModelTestAdapter(settings),
+            InterruptibleAcousticForwardModelTestAdapter(settings, interrupt_at_wavelength=800),
+        ]
+        with self.assertRaises(RuntimeError):
+            simulate(interrupted_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+        self.assertEqual(interrupted_pipeline[2].number_of_runs, 1)
+
+        settings = self.create_multi_wavelength_settings("TestResumed", wavelengths, {
+            Tags.RESUME_SIMULATION: True
+        })
+        resumed_pipeline = [
+            ModelBasedVolumeCreationAdapter(settings),
+            OpticalForwardModelTestAdapter(settings),
+            InterruptibleAcousticForwardModelTestAdapter(settings),
+        ]
+        simulate(resumed_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+        # Only the wavelengths that were not completed before the interruption are simulated again
+        self.assertEqual(resumed_pipeline[2].number_of_runs, 2)
+        self.assert_results_equal(expected_results, self.load_multi_wavelength_results(settings, wavelengths))
+
+    def test_unhashable_configuration_disables_checkpoints(self):
+        wavelengths = [700, 800]
+        expected_results = self.run_multi_wavelength_pipeline("TestHashable", wavelengths, {})
+        cache_directory = tempfile.mkdtemp()
+        try:
+            settings = self.create_multi_wavelength_settings("TestUnhashable", wavelengths, {
+                Tags.RESUME_SIMULATION: True,
+                Tags.MODULE_OUTPUT_CACHE_PATH: cache_directory
+            })
+            simulation_pipeline = [
+                ModelBasedVolumeCreationAdapter(settings),
+                UnhashablePipelineElement(settings),
+                OpticalForwardModelTestAdapter(settings),
+                AcousticForwardModelTestAdapter(settings),
+            ]
+            simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+            self.assertEqual(simulation_pipeline[1].number_of_runs, 2)
+            self.assertNotIn(CHECKPOINTS_GROUP, load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH]))
+            self.assert_results_equal(expected_results, self.load_multi_wavelength_results(settings, wavelengths))
+        finally:
+            shutil.rmtree(cache_directory)
+
+    def test_module_output_cache_is_used_across_simulations(self):
+        wavelengths = [700, 800]
+        cache_directory = tempfile.mkdtemp()
+        try:
+            results = []
+            numbers_of_runs = []
+            for volume_name, acoustic_settings in [("TestCacheFirst", {}), ("TestCacheSecond", {}),
+                                                   ("TestCacheThird", {Tags.ACOUSTIC_SIMULATION_3D: False})]:
+                settings = self.create_multi_wavelength_settings(volume_name, wavelengths, {
+                    Tags.MODULE_OUTPUT_CACHE_PATH: cache_directory
+                })
+                settings.set_acoustic_settings(acoustic_settings)
+                simulation_pipeline = [
+                    ModelBasedVolumeCreationAdapter(settings),
+                    OpticalForwardModelTestAdapter(settings),
+                    InterruptibleAcousticForwardModelTestAdapter(settings),
+                ]
+                simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+                numbers_of_runs.append(simulation_pipeline[2].number_of_runs)
+                results.append(self.load_multi_wavelength_results(settings, wavelengths))
+
+            # The second simulation is identical to the first one, the third one only changes the acoustic settings
+            self.assertEqual(numbers_of_runs, [2, 0, 2])
+            self.assert_results_equal(results[0], results[1])
+            self.assert_results_equal(results[0], results[2])
+
+            # Only the most recently used entries are kept once the maximum size is exceeded
+            entry_paths = [os.path.join(cache_directory, file_name) for file_name in os.listdir(cache_directory)
+                           if file_name.endswith(".hdf5")]
+            self.assertEqual(len(entry_paths), 8)
+            most_recent_entry_path = max(entry_paths, key=os.path.getmtime)
+            ModuleOutputCache(cache_directory, os.path.getsize(most_recent_entry_path))._evict()
+            self.assertEqual(os.listdir(cache_directory).count(os.path.basename(most_recent_entry_path)), 1)
+            self.assertEqual(len([file_name for file_name in os.listdir(cache_directory)
+                                  if file_name.endswith(".hdf5")]), 1)
+        finally:
+            shutil.rmtree(cache_directory)
+
+    def test_pipeline_instrumentation(self):
+        wavelengths = [700, 800]
+        settings = self.create_multi_wavelength_settings("TestInstrumentation", wavelengths, {})
+        simulation_pipeline = [
+            ModelBasedVolumeCreationAdapter(settings),
+            OpticalForwardModelTestAdapter(settings),
+            AcousticForwardModelTestAdapter(settings),
+        ]
+        instrumentation = simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+
+        self.assertEqual([(record["module"], record["wavelength"]) for record in instrumentation.records],
+                         [(type(pipeline_element).__name__, wavelength) for wavelength in wavelengths
+                          for pipeline_element in simulation_pipeline])
+        for record in instrumentation.records:
+            self.assertFalse(record["skipped"])
+            self.assertFalse(record["failed"])
+            self.assertGreater(record["wall_time_seconds"], 0)
+            self.assertGreater(record["peak_rss_bytes"], 0)
+            self.assertGreater(record["logical_bytes_written"], 0)
+        # The optical forward model reads the absorption coefficient of the volume
+        self.assertGreater(instrumentation.records[1]["logical_bytes_read"], 0)
+        self.assertEqual(set(instrumentation.get_stage_times().keys()),
+                         {type(pipeline_element).__name__ for pipeline_element in simulation_pipeline})
+
+        stored_records = load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH], "/" + INSTRUMENTATION_GROUP + "/")
+        self.assertEqual(set(stored_records.keys()), {str(wavelength) for wavelength in wavelengths})
+        self.assertEqual(stored_records["800"]["2_AcousticForwardModelTestAdapter"]["wall_time_seconds"],
+                         instrumentation.records[-1]["wall_time_seconds"])
+        os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+    def test_pipeline_instrumentation_records_failed_modules(self):
+        wavelengths = [700, 800]
+        settings = self.create_multi_wavelength_settings("TestFailedInstrumentation", wavelengths, {})
+        simulation_pipeline = [
+            ModelBasedVolumeCreationAdapter(settings),
+            OpticalForwardModelTestAdapter(settings),
+            InterruptibleAcousticForwardModelTestAdapter(settings, interrupt_at_wavelength=800),
+        ]
+        with self.assertRaises(RuntimeError):
+            simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+
+        stored_records = load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH], "/" + INSTRUMENTATION_GROUP + "/")
+        self.assertFalse(stored_records["700"]["2_InterruptibleAcousticForwardModelTestAdapter"]["failed"])
+        self.assertFalse(stored_records["800"]["1_OpticalForwardModelTestAdapter"]["failed"])
+        failed_record = stored_records["800"]["2_InterruptibleAcousticForwardModelTestAdapter"]
+        self.assertTrue(failed_record["failed"])
+        self.assertGreater(failed_record["wall_time_seconds"], 0)
+        os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+    def test_output_file_can_be_read_by_other_processes_during_the_simulation(self):
+        wavelengths = [700, 800]
+        settings = self.create_multi_wavelength_settings("TestConcurrentReader", wavelengths, {
+            Tags.IN_MEMORY_DATA_STORE: True
+        })
+        reader = OutputFileReader(settings)
+        simulation_pipeline = [
+            ModelBasedVolumeCreationAdapter(settings),
+            OpticalForwardModelTestAdapter(settings),
+            reader,
+            AcousticForwardModelTestAdapter(settings),
+        ]
+        try:
+            simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+            self.assertEqual(len(reader.file_keys), len(wavelengths))
+            for file_keys in reader.file_keys:
+                self.assertIn(Tags.SETTINGS, file_keys)
+            # the simulation continues to write into the file after it has been read
+            self.assertIsNotNone(load_data_field(settings[Tags.SIMPA_OUTPUT_PATH], Tags.DATA_FIELD_TIME_SERIES_DATA,
+                                                 800))
+        finally:
+            os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
@@ -61,6 +61,22 @@ def create_vessel():
     return tubular_structure_dictionary
 
 
+def create_vessel_tree():
+    vessel_structure_dictionary = dict()
+    vessel_structure_dictionary[Tags.PRIORITY] = 3
+    vessel_structure_dictionary[Tags.MOLECULE_COMPOSITION] = TISSUE_LIBRARY.blood()
+    vessel_structure_dictionary[Tags.STRUCTURE_START_MM] = [2, 0, 1.5]
+    vessel_structure_dictionary[Tags.STRUCTURE_DIRECTION] = [0, 1, 0]
+    vessel_structure_dictionary[Tags.STRUCTURE_RADIUS_MM] = 0.5
+    vessel_structure_dictionary[Tags.STRUCTURE_BIFURCATION_LENGTH_MM] = 2
+    vessel_structure_dictionary[Tags.STRUCTURE_CURVATURE_FACTOR] = 0.5
+    vessel_structure_dictionary[Tags.STRUCTURE_RADIUS_VARIATION_FACTOR] = 0.5
+    vessel_structure_dictionary[Tags.ADHERE_TO_DEFORMATION] = False
+    vessel_structure_dictionary[Tags.CONSIDER_PARTIAL_VOLUME] = True
+    vessel_structure_dictionary[Tags.STRUCTURE_TYPE] = Tags.VESSEL_STRUCTURE
+    return vessel_structure_dictionary
+
+
 def create_test_structure_parameters():
     structures_dict = dict()
     structures_dict["background"] = create_background()